@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+集群模式压测：在本机启动多个服务端进程，请求轮流发给各节点（模拟负载均衡），
+对比各节点互相独立与集群模式（PIPAI_CLUSTER_PEERS）下的上游调用数、回答层级与延迟。
+
+指定 --fail-node 时，集群模式在发送一半请求后停止最后一个节点，剩余请求只发给其他节点，
+检查该节点的指纹改由环上的下一个节点负责、请求仍然成功。
+
+    python bench/cluster.py --nodes 3 --requests 300 --repeat-rate 0.6
+    python bench/cluster.py --nodes 4 --fail-node --label failover
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from loadtest import BENCH_DIR, SERVERS, ServerProcess, free_port, git_revision, send, summarize
+from mock_llm import add_mock_arguments, mock_from_args
+from workload import DEFAULT_SIZE_MIX, Workload, parse_size_mix
+
+from pip_aide_server.cluster import HashRing
+from pip_aide_server.fingerprint import error_fingerprint
+
+MODES = ('independent', 'cluster')
+
+
+def moved_share(items, nodes, vnodes):
+    """去掉最后一个节点后所有者改变的指纹比例（一致性哈希下只有该节点的指纹移动）"""
+    fingerprints = {error_fingerprint(payload['error_context']) for payload, _ in items}
+    before, after = HashRing(nodes, vnodes), HashRing(nodes[:-1], vnodes)
+    moved = sum(1 for fp in fingerprints if before.owner(fp) != after.owner(fp))
+    return round(moved / len(fingerprints), 3) if fingerprints else 0.0
+
+
+def run_round_robin(urls, items, offset, concurrency, timeout):
+    """第 i 个请求发给 urls[(offset + i) % len(urls)]，返回 (逐请求记录, 总耗时)"""
+    records = [None] * len(items)
+    next_index = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            payload, repeated = items[i]
+            url = urls[(offset + i) % len(urls)]
+            records[i] = dict(send(session, url, payload, timeout), repeated=repeated)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return records, time.monotonic() - started
+
+
+def run_mode(mode, args, mock, items, extra_env):
+    ports = [free_port() for _ in range(args.nodes)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    token = uuid.uuid4().hex
+    nodes = []
+    try:
+        for port, url in zip(ports, urls):
+            env = dict(extra_env)
+            if mode == 'cluster':
+                env.update({'PIPAI_CLUSTER_PEERS': ','.join(urls), 'PIPAI_CLUSTER_SELF': url,
+                            'PIPAI_CLUSTER_VNODES': str(args.vnodes), 'PIPAI_CLUSTER_PEER_COOLDOWN': '30',
+                            'PIPAI_CLUSTER_TOKEN': token})
+            nodes.append(ServerProcess(SERVERS[args.server], mock.base_url, upstream_timeout=args.upstream_timeout,
+                                       extra_env=env, port=port))
+        time_to_ready = max(node.wait_ready() for node in nodes)
+        before = mock.snapshot()
+        if args.fail_node and mode == 'cluster':
+            half = len(items) // 2
+            first, elapsed_first = run_round_robin(urls, items[:half], 0, args.concurrency, args.timeout)
+            nodes[-1].stop(args.keep_workdir)
+            rest, elapsed_rest = run_round_robin(urls[:-1], items[half:], half, args.concurrency, args.timeout)
+            records, elapsed = first + rest, elapsed_first + elapsed_rest
+        else:
+            records, elapsed = run_round_robin(urls, items, 0, args.concurrency, args.timeout)
+        summary = summarize(records, elapsed, args.concurrency, before, mock.snapshot(), time_to_ready)
+        summary['mode'] = mode
+        if mode == 'cluster':
+            # 各节点负责的哈希空间比例，以及第一个仍在运行的节点向其他节点转发的次数
+            live = next(url for url, node in zip(urls, nodes) if node.proc.poll() is None)
+            summary['nodes'] = requests.get(f"{live}/cluster/status", timeout=5).json()['nodes']
+            if args.fail_node:
+                summary['failed_node'] = urls[-1]
+                summary['failed_node_share'] = moved_share(items, urls, args.vnodes)
+        return summary
+    finally:
+        for node in nodes:
+            if node.proc.poll() is None:
+                node.stop(args.keep_workdir)
+
+
+def print_summary(s):
+    latency = s['latency']
+    print(f"  {s['mode']:>11}: {s['throughput']:>8} req/s, p50 {latency['p50']}s p99 {latency['p99']}s, "
+          f"status {s['status']}")
+    print(f"               tiers {s['tiers']}, upstream calls {s['upstream']['calls']} "
+          f"({s['upstream_calls_per_request']}/request)")
+    if 'failed_node' in s:
+        print(f"               stopped {s['failed_node']} halfway; "
+              f"{s['failed_node_share'] * 100:.1f}% of fingerprints moved to other nodes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pip-aide 集群模式压测")
+    parser.add_argument('--server', choices=sorted(SERVERS), default='pipai', help="压测的服务端脚本")
+    parser.add_argument('--nodes', type=int, default=3, help="节点数")
+    parser.add_argument('--vnodes', type=int, default=160, help="每个节点在哈希环上的虚拟节点数")
+    parser.add_argument('--modes', default=','.join(MODES), help="逗号分隔：independent、cluster")
+    parser.add_argument('--concurrency', type=int, default=8, help="并发度")
+    parser.add_argument('--requests', type=int, default=200, help="请求数")
+    parser.add_argument('--repeat-rate', type=float, default=0.5, help="复用之前错误日志的比例")
+    parser.add_argument('--size-mix', default=None, help="错误日志大小分布，格式同 loadtest.py")
+    parser.add_argument('--fail-node', action='store_true', help="集群模式下发送一半请求后停止最后一个节点")
+    parser.add_argument('--timeout', type=float, default=60.0, help="客户端请求超时（秒）")
+    parser.add_argument('--upstream-timeout', type=float, default=5.0, help="服务端的上游超时（PIPAI_UPSTREAM_TIMEOUT）")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="传给服务端的额外环境变量")
+    parser.add_argument('--workload-seed', type=int, default=0, help="负载生成的随机种子")
+    parser.add_argument('--label', default='cluster', help="结果的名称")
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results'), help="结果保存目录，留空不保存")
+    parser.add_argument('--keep-workdir', action='store_true', help="保留各节点的缓存、日志与输出")
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    size_mix = parse_size_mix(args.size_mix) if args.size_mix else DEFAULT_SIZE_MIX
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    result = {
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'config': {'server': args.server, 'nodes': args.nodes, 'vnodes': args.vnodes, 'concurrency': args.concurrency,
+                   'requests': args.requests, 'repeat_rate': args.repeat_rate, 'size_mix': size_mix,
+                   'fail_node': args.fail_node, 'env': extra_env,
+                   'mock': {'latency': args.latency, 'jitter': args.jitter, 'seed': args.seed}},
+        'modes': [],
+    }
+
+    mock = mock_from_args(args).start()
+    try:
+        print(f"Benchmarking {args.nodes} {args.server} node(s) against mock upstream {mock.base_url}")
+        for mode in modes:
+            # 各模式使用相同的负载序列
+            items = Workload(size_mix, args.repeat_rate, seed=args.workload_seed).batch(args.requests)
+            summary = run_mode(mode, args, mock, items, extra_env)
+            result['modes'].append(summary)
+            print_summary(summary)
+    finally:
+        mock.close()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        path = os.path.join(args.output, datetime.now().strftime('%Y%m%d-%H%M%S') + f"-{args.label}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResults saved to {path}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+分析服务端压测：对接本地模拟上游（mock_llm.py）启动服务端，按配置的并发度发送 /analyze_error 请求，
+报告吞吐、延迟分位数与上游调用次数，并把结果保存为 JSON 供之后的运行对比。
+
+每个并发度使用一个全新的服务端进程（独立的缓存与日志目录），结果互不影响。
+指定 --cassette 时服务端回放录制的上游流量（见 pip_aide_server/cassette.py），不使用模拟上游；
+配合 --from-logs 用录制期间服务端记录的错误日志作为负载，离线复现生产流量。
+
+    python bench/loadtest.py --concurrency 1,8,32 --requests 300 --latency 0.8 --jitter 0.3
+    python bench/loadtest.py --stream --label streaming --compare bench/results/<之前的结果>.json
+    python bench/loadtest.py --cassette prod.jsonl.gz --from-logs pipai_logs --cassette-speed 0.5
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from mock_llm import add_mock_arguments, mock_from_args, upstream_cost
+from workload import DEFAULT_SIZE_MIX, Workload, log_items, parse_size_mix
+
+from pip_aide.safety import CommandStreamParser, is_safe_command
+from pip_aide_server.similarity import recent_log_records
+
+SERVERS = {
+    'pipai': os.path.join(REPO_ROOT, 'pipai_server.py'),
+    'pip-aide': os.path.join(REPO_ROOT, 'server', 'pip-aide_server.py'),
+}
+PERCENTILES = (50, 90, 95, 99)
+# 服务端中可能指向真实上游的配置，压测时一律清除
+UPSTREAM_ENV = ('PIPAI_UPSTREAMS', 'PIPAI_CASCADE')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, p):
+    """最近秩法的分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    summary = {f'p{p}': _round(percentile(values, p)) for p in PERCENTILES}
+    summary['mean'] = _round(sum(values) / len(values)) if values else None
+    summary['max'] = _round(values[-1]) if values else None
+    return summary
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+class ServerProcess:
+    """在子进程中用 uvicorn 启动服务端脚本，上游指向模拟服务"""
+
+    def __init__(self, script, upstream_url, workers=1, upstream_timeout=5.0, extra_env=None, cassette=None,
+                 cassette_speed=1.0, port=None):
+        # 集群压测需要在启动之前知道所有节点的端口
+        self.port = port or free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.workdir = tempfile.mkdtemp(prefix='pipai-bench-')
+        env = {k: v for k, v in os.environ.items() if k not in UPSTREAM_ENV}
+        env.update({
+            'OPENAI_API_BASE': upstream_url,
+            'OPENAI_MODEL': 'mock-llm',
+            'DEEPSEEK_API_KEY': 'bench',
+            'PIPAI_UPSTREAM_TIMEOUT': str(upstream_timeout),
+            'PIPAI_CACHE_PATH': os.path.join(self.workdir, 'cache', 'suggestions.sqlite3'),
+            'PIPAI_LOG_DIR': os.path.join(self.workdir, 'logs'),
+            'PIPAI_SERVER_LOG_LEVEL': 'WARNING',
+            'PIPAI_WORKERS': str(workers),
+        })
+        if cassette:
+            # 回放时模型名必须与录制时相同（属于请求摘要的一部分），沿用当前环境的配置
+            env.pop('OPENAI_MODEL')
+            if 'OPENAI_MODEL' in os.environ:
+                env['OPENAI_MODEL'] = os.environ['OPENAI_MODEL']
+            env.update({'PIPAI_CASSETTE': os.path.abspath(cassette), 'PIPAI_CASSETTE_MODE': 'replay',
+                        'PIPAI_CASSETTE_SPEED': str(cassette_speed)})
+        env.update(extra_env or {})
+        module = os.path.splitext(os.path.basename(script))[0]
+        self.command = [
+            sys.executable, '-m', 'uvicorn', f'{module}:app', '--host', '127.0.0.1', '--port', str(self.port),
+            '--app-dir', os.path.dirname(script), '--workers', str(workers), '--log-level', 'warning',
+        ]
+        self.started = time.monotonic()
+        self.log = open(os.path.join(self.workdir, 'server.log'), 'wb')
+        self.proc = subprocess.Popen(self.command, cwd=self.workdir, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def upstream_counts(self):
+        """回放时由服务端的 cassette 统计上游调用数（未录制的请求计为错误）"""
+        stats = requests.get(f"{self.base_url}/cassette/stats", timeout=5).json()
+        return {'calls': stats['replayed'] + stats['misses'], 'streamed': 0, 'errors': stats['misses'],
+                'timeouts': 0, 'probes': 0}
+
+    def wait_ready(self, timeout=60):
+        """等待 /readyz 返回 200（上游已连通、缓存已预热），返回启动到就绪的秒数"""
+        deadline = self.started + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"server exited with {self.proc.returncode}, see {self.log.name}")
+            try:
+                if requests.get(f"{self.base_url}/readyz", timeout=1).status_code == 200:
+                    return time.monotonic() - self.started
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.05)
+        raise RuntimeError(f"server not ready after {timeout}s, see {self.log.name}")
+
+    def stop(self, keep_workdir=False):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.log.close()
+        if not keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def send(session, base_url, payload, timeout, stream=False):
+    """发送一个请求，返回该请求的测量结果"""
+    started = time.monotonic()
+    record = {'status': None, 'latency': None, 'tier': None}
+    try:
+        if not stream:
+            response = session.post(f"{base_url}/analyze_error", json=payload, timeout=timeout)
+            record['status'] = response.status_code
+            if response.status_code == 200:
+                record['tier'] = response.json().get('tier')
+        else:
+            record.update(first_token=None, first_command=None)
+            parser = CommandStreamParser()
+            with session.post(f"{base_url}/analyze_error/stream", json=payload, timeout=timeout, stream=True) as response:
+                record['status'] = response.status_code
+                event = None
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if line.startswith('event:'):
+                        event = line[6:].strip()
+                    elif line.startswith('data:'):
+                        data = json.loads(line[5:])
+                        now = time.monotonic() - started
+                        if event == 'delta':
+                            if record['first_token'] is None:
+                                record['first_token'] = now
+                            if record['first_command'] is None and any(
+                                    is_safe_command(cmd) for cmd in parser.feed(data['text'])):
+                                record['first_command'] = now
+                        elif event == 'reset':
+                            parser.reset()
+                        elif event == 'error':
+                            record['status'] = data.get('status')
+                        elif event == 'done':
+                            record['tier'] = data.get('tier')
+                            if record['first_command'] is None and any(
+                                    is_safe_command(cmd) for cmd in parser.close()):
+                                record['first_command'] = now
+                            if record['tier'] != 'llm' and record['first_token'] is None:
+                                # 缓存与相似检索的回答一次性到达
+                                record['first_token'] = record['first_command'] = now
+    except requests.exceptions.Timeout:
+        record['status'] = 'timeout'
+    except requests.exceptions.RequestException:
+        record['status'] = 'connection_error'
+    record['latency'] = time.monotonic() - started
+    return record
+
+
+def run_level(base_url, items, concurrency, timeout, stream=False):
+    """闭环压测：concurrency 个线程依次取出请求发送，返回 (逐请求记录, 总耗时)"""
+    records = [None] * len(items)
+    next_index = iter(range(len(items)))
+    lock = threading.Lock()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            payload, repeated = items[i]
+            records[i] = dict(send(session, base_url, payload, timeout, stream), repeated=repeated)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return records, time.monotonic() - started
+
+
+def summarize(records, elapsed, concurrency, upstream_before, upstream_after, time_to_ready, prices=None):
+    ok = [r for r in records if r['status'] == 200]
+    upstream = {k: upstream_after[k] - upstream_before.get(k, 0) for k in upstream_after}
+    summary = {
+        'concurrency': concurrency,
+        'requests': len(records),
+        'repeated': sum(1 for r in records if r['repeated']),
+        'elapsed': round(elapsed, 3),
+        'throughput': round(len(records) / elapsed, 2) if elapsed else None,
+        'ok_throughput': round(len(ok) / elapsed, 2) if elapsed else None,
+        'time_to_ready': round(time_to_ready, 3),
+        'status': {str(k): v for k, v in Counter(r['status'] for r in records).items()},
+        'tiers': dict(Counter(r['tier'] for r in ok)),
+        'latency': latency_summary([r['latency'] for r in ok]),
+        'upstream': upstream,
+        'upstream_calls_per_request': round(upstream['calls'] / len(records), 3) if records else None,
+    }
+    if 'prompt_tokens' in upstream and records:
+        # 模拟上游按前缀缓存命中情况计费（回放 cassette 时没有 token 数）
+        summary['prompt_cache_hit_rate'] = (round(upstream['cached_tokens'] / upstream['prompt_tokens'], 3)
+                                            if upstream['prompt_tokens'] else None)
+        summary['cost_per_request'] = round(upstream_cost(upstream, prices) / len(records), 8)
+    streamed = [r for r in ok if r.get('first_token') is not None]
+    if streamed:
+        summary['time_to_first_token'] = latency_summary([r['first_token'] for r in streamed])
+        summary['time_to_first_command'] = latency_summary(
+            [r['first_command'] for r in streamed if r['first_command'] is not None])
+    return summary
+
+
+def print_summary(s):
+    latency = s['latency']
+    print(f"  concurrency {s['concurrency']:>4}: {s['throughput']:>8} req/s ({s['ok_throughput']} ok/s), "
+          f"p50 {latency['p50']}s p90 {latency['p90']}s p99 {latency['p99']}s max {latency['max']}s")
+    print(f"    status {s['status']}  tiers {s['tiers']}")
+    print(f"    upstream calls {s['upstream']['calls']} ({s['upstream_calls_per_request']}/request), "
+          f"errors {s['upstream']['errors']}, timeouts {s['upstream']['timeouts']}; ready in {s['time_to_ready']}s")
+    if 'cost_per_request' in s:
+        print(f"    prompt cache hit rate {s['prompt_cache_hit_rate']}, "
+              f"cost ${s['cost_per_request'] * 1000:.4f} per 1000 requests")
+    if 'time_to_first_token' in s:
+        print(f"    first token p50 {s['time_to_first_token']['p50']}s p99 {s['time_to_first_token']['p99']}s, "
+              f"first command p50 {s['time_to_first_command']['p50']}s p99 {s['time_to_first_command']['p99']}s")
+
+
+def compare(current, previous):
+    """按并发度对比吞吐、延迟分位数与每请求上游调用数"""
+    print(f"\nCompared with {previous.get('label') or previous.get('started_at')}:")
+    before = {level['concurrency']: level for level in previous.get('levels', [])}
+    for level in current['levels']:
+        old = before.get(level['concurrency'])
+        if old is None:
+            continue
+        changes = [
+            ('req/s', old['throughput'], level['throughput']),
+            ('p50', old['latency']['p50'], level['latency']['p50']),
+            ('p99', old['latency']['p99'], level['latency']['p99']),
+            ('upstream/req', old['upstream_calls_per_request'], level['upstream_calls_per_request']),
+        ]
+        if old.get('cost_per_request') is not None and level.get('cost_per_request') is not None:
+            changes.append(('cost/req', old['cost_per_request'], level['cost_per_request']))
+        parts = []
+        for name, a, b in changes:
+            delta = f" ({(b - a) / a * 100:+.1f}%)" if a and b is not None else ''
+            parts.append(f"{name} {a} -> {b}{delta}")
+        print(f"  concurrency {level['concurrency']:>4}: " + ', '.join(parts))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pip-aide 分析服务端压测")
+    parser.add_argument('--server', choices=sorted(SERVERS), default='pipai', help="压测的服务端脚本")
+    parser.add_argument('--workers', type=int, default=1, help="服务端 worker 数")
+    parser.add_argument('--concurrency', default='1,8,32', help="逗号分隔的并发度")
+    parser.add_argument('--requests', type=int, default=200, help="每个并发度发送的请求数")
+    parser.add_argument('--repeat-rate', type=float, default=0.3, help="复用之前错误日志的比例")
+    parser.add_argument('--size-mix', default=None,
+                        help="错误日志大小分布，如 small=0.6:1024,medium=0.3:8192,large=0.1:65536")
+    parser.add_argument('--stream', action='store_true', help="使用 /analyze_error/stream 并测量首个片段与首条命令的时间")
+    parser.add_argument('--timeout', type=float, default=60.0, help="客户端请求超时（秒）")
+    parser.add_argument('--upstream-timeout', type=float, default=5.0, help="服务端的上游超时（PIPAI_UPSTREAM_TIMEOUT）")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="传给服务端的额外环境变量")
+    parser.add_argument('--workload-seed', type=int, default=0, help="负载生成的随机种子")
+    parser.add_argument('--from-logs', metavar='LOG_DIR',
+                        help="用服务端错误日志（PIPAI_LOG_DIR）中最近的 --requests 条记录作为负载")
+    parser.add_argument('--cassette', help="服务端回放此 cassette 文件，而不是调用模拟上游")
+    parser.add_argument('--cassette-speed', type=float, default=1.0, help="回放耗时的倍数，0 为不等待")
+    parser.add_argument('--label', default='', help="结果的名称")
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results'), help="结果保存目录，留空不保存")
+    parser.add_argument('--compare', help="与之前保存的结果文件对比")
+    parser.add_argument('--keep-workdir', action='store_true', help="保留服务端的缓存、日志与输出")
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    size_mix = parse_size_mix(args.size_mix) if args.size_mix else DEFAULT_SIZE_MIX
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    result = {
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {
+            'server': args.server, 'workers': args.workers, 'requests': args.requests, 'repeat_rate': args.repeat_rate,
+            'size_mix': size_mix, 'stream': args.stream, 'upstream_timeout': args.upstream_timeout, 'env': extra_env,
+            'from_logs': args.from_logs, 'cassette': args.cassette, 'cassette_speed': args.cassette_speed,
+            'mock': {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                     'error_status': args.error_status, 'timeout_rate': args.timeout_rate, 'hang': args.hang,
+                     'uncertain_rate': args.uncertain_rate, 'prefill': args.prefill, 'cache_unit': args.cache_unit,
+                     'prices': dict(zip(('input', 'cached_input', 'output'), args.price)), 'seed': args.seed},
+        },
+        'levels': [],
+    }
+
+    mock = mock_from_args(args).start()
+    try:
+        upstream = f"cassette {args.cassette}" if args.cassette else f"mock upstream {mock.base_url}"
+        print(f"Benchmarking {args.server} ({args.workers} worker(s)) against {upstream}")
+        for concurrency in levels:
+            # 每个并发度使用相同的负载序列，便于对比
+            if args.from_logs:
+                items = log_items(reversed(recent_log_records(args.from_logs, args.requests)))
+            else:
+                items = Workload(size_mix, args.repeat_rate, seed=args.workload_seed).batch(args.requests)
+            server = ServerProcess(SERVERS[args.server], mock.base_url, args.workers, args.upstream_timeout, extra_env,
+                                   args.cassette, args.cassette_speed)
+            counts = server.upstream_counts if args.cassette else mock.snapshot
+            try:
+                time_to_ready = server.wait_ready()
+                before = counts()
+                records, elapsed = run_level(server.base_url, items, concurrency, args.timeout, args.stream)
+                summary = summarize(records, elapsed, concurrency, before, counts(), time_to_ready, mock.prices)
+            finally:
+                server.stop(args.keep_workdir)
+            result['levels'].append(summary)
+            print_summary(summary)
+    finally:
+        mock.close()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        name = datetime.now().strftime('%Y%m%d-%H%M%S') + (f"-{args.label}" if args.label else '') + '.json'
+        path = os.path.join(args.output, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResults saved to {path}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
+    return result
+
+
+if __name__ == "__main__":
+    main()
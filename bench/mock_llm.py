@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""
+本地模拟的 chat completions 上游，用于压测：可配置延迟、抖动、错误与超时注入。
+
+相同的提示词总是得到相同的回答；健康探测（max_tokens=1）不计入调用数，也不注入故障。
+按 DeepSeek 的方式模拟提示词前缀缓存：与之前某个提示词相同的前缀按 cache_unit 个 token 为单位计为命中，
+未命中的部分按 prefill 增加首个 token 的延迟；响应中的 usage 与 counts 记录命中与未命中的 token 数，用于估算成本。
+也可以单独运行，供手动启动的服务端使用:
+
+    python bench/mock_llm.py --port 9000 --latency 0.8 --jitter 0.3 --error-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:9000/v1 DEEPSEEK_API_KEY=bench python pipai_server.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWERS = [
+    "The build needs newer packaging tools:\n```\npip install --upgrade pip setuptools wheel\n```",
+    "Install a prebuilt wheel instead of compiling from source:\n```\npip install --only-binary=:all: {package}\n```",
+    "The pinned version has no wheel for this Python, relax the pin:\n```\npip install \"{package}>=1.0\"\n```",
+    "Clear the cached build and retry:\n```\npip cache purge\npip install --no-cache-dir {package}\n```",
+]
+UNCERTAIN = "UNCERTAIN"
+# 每百万 token 的价格（美元），默认取 deepseek-chat 的标价：输入（未命中缓存）、输入（命中缓存）、输出
+DEFAULT_PRICES = {'input': 0.27, 'cached_input': 0.07, 'output': 1.10}
+# 前缀缓存最多记录的前缀数，超过后清空（相当于服务商的缓存过期）
+MAX_CACHED_PREFIXES = 1000000
+
+
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+def upstream_cost(counts, prices=None):
+    """按 counts 中的 token 数估算费用（美元）"""
+    prices = prices or DEFAULT_PRICES
+    cached = counts.get('cached_tokens', 0)
+    missed = counts.get('prompt_tokens', 0) - cached
+    return (missed * prices['input'] + cached * prices['cached_input']
+            + counts.get('completion_tokens', 0) * prices['output']) / 1e6
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 服务端进程退出时断开的保持连接不算错误
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockLLM:
+    """
+    latency/jitter: 每次调用的延迟为 latency ± jitter（秒，均匀分布）
+    error_rate: 按此比例返回 error_status
+    timeout_rate: 按此比例挂起 hang 秒不回应，用于触发服务端的上游超时
+    uncertain_rate: 按此比例（按提示词确定）回答 UNCERTAIN
+    流式请求按 chunk_size 个字符分段，每段间隔 chunk_delay 秒
+    prefill: 每 1000 个未命中前缀缓存的提示词 token 增加的延迟（秒）；cache_unit: 前缀缓存的粒度（token）
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, error_rate=0.0, timeout_rate=0.0, uncertain_rate=0.0,
+                 error_status=500, hang=30.0, chunk_size=8, chunk_delay=0.02, prefill=0.0, cache_unit=64,
+                 prices=None, seed=None, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.uncertain_rate = uncertain_rate
+        self.error_status = error_status
+        self.hang = hang
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.prefill = prefill
+        self.cache_unit = cache_unit
+        self.prices = dict(prices or DEFAULT_PRICES)
+        self._prefixes = set()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.counts = {'calls': 0, 'streamed': 0, 'errors': 0, 'timeouts': 0, 'probes': 0,
+                       'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+        self.server = _QuietServer((host, port), self._handler())
+        self.base_url = f"http://{host}:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_prefix_cache(self):
+        with self._lock:
+            self._prefixes.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def answer(self, messages):
+        """按提示词确定的回答，同一提示词每次相同"""
+        prompt = json.dumps(messages, sort_keys=True)
+        digest = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16)
+        if (digest % 10000) / 10000 < self.uncertain_rate:
+            return UNCERTAIN
+        package = ('numpy', 'lxml', 'psycopg2', 'cryptography', 'pillow')[digest % 5]
+        return ANSWERS[(digest // 5) % len(ANSWERS)].format(package=package)
+
+    def usage(self, messages, answer):
+        """本次调用的 usage：提示词中与之前的提示词相同的前缀按整单位计为命中缓存，再把本次的前缀加入缓存"""
+        text = ''.join(f"{m.get('role')}\n{m.get('content')}\n" for m in messages)
+        unit = self.cache_unit * 4  # 按 4 个字符一个 token 换算
+        digest = hashlib.sha256()
+        prefixes = []
+        for end in range(unit, len(text) + 1, unit):
+            digest.update(text[end - unit:end].encode('utf-8'))
+            prefixes.append(digest.copy().digest())
+        with self._lock:
+            hits = next((i for i, prefix in enumerate(prefixes) if prefix not in self._prefixes), len(prefixes))
+            if len(self._prefixes) + len(prefixes) > MAX_CACHED_PREFIXES:
+                self._prefixes.clear()
+            self._prefixes.update(prefixes)
+        prompt_tokens = estimate_tokens(text)
+        cached = min(hits * self.cache_unit, prompt_tokens)
+        completion_tokens = estimate_tokens(answer)
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_cache_hit_tokens': cached, 'prompt_cache_miss_tokens': prompt_tokens - cached}
+
+    def _plan(self):
+        """决定一次调用的结果：('ok'|'error'|'timeout', 延迟)"""
+        with self._lock:
+            roll = self._random.random()
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+        if roll < self.timeout_rate:
+            return 'timeout', self.hang
+        if roll < self.timeout_rate + self.error_rate:
+            return 'error', delay
+        return 'ok', delay
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    def _bill(self, usage):
+        self._count('prompt_tokens', usage['prompt_tokens'])
+        self._count('cached_tokens', usage['prompt_cache_hit_tokens'])
+        self._count('completion_tokens', usage['completion_tokens'])
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if request.get('max_tokens') == 1:
+                    mock._count('probes')
+                    return self._json(200, {"choices": [{"message": {"content": "pong"}}]})
+
+                mock._count('calls')
+                outcome, delay = mock._plan()
+                if outcome == 'timeout':
+                    mock._count('timeouts')
+                    mock._stopped.wait(delay)
+                    self.close_connection = True
+                    return
+                if outcome == 'error':
+                    mock._stopped.wait(delay)
+                    mock._count('errors')
+                    return self._json(mock.error_status, {"error": {"message": "injected failure"}})
+
+                messages = request.get('messages', [])
+                answer = mock.answer(messages)
+                usage = mock.usage(messages, answer)
+                mock._bill(usage)
+                # 未命中前缀缓存的提示词越长，首个 token 越晚
+                mock._stopped.wait(delay + mock.prefill * usage['prompt_cache_miss_tokens'] / 1000)
+                if not request.get('stream'):
+                    return self._json(200, {"choices": [{"message": {"content": answer}}], "usage": usage})
+                mock._count('streamed')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i in range(0, len(answer), mock.chunk_size):
+                    if i:
+                        mock._stopped.wait(mock.chunk_delay)
+                    chunk = {"choices": [{"delta": {"content": answer[i:i + mock.chunk_size]}}]}
+                    if i + mock.chunk_size >= len(answer):
+                        chunk['usage'] = usage  # 与 DeepSeek 相同，usage 随最后一个片段返回
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def add_mock_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.5, help="上游平均延迟（秒）")
+    parser.add_argument('--jitter', type=float, default=0.2, help="延迟抖动（秒，均匀分布）")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回错误的比例")
+    parser.add_argument('--error-status', type=int, default=500, help="注入错误时的状态码")
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help="挂起不回应的比例")
+    parser.add_argument('--hang', type=float, default=30.0, help="注入超时时挂起的秒数")
+    parser.add_argument('--uncertain-rate', type=float, default=0.05, help="回答 UNCERTAIN 的比例")
+    parser.add_argument('--prefill', type=float, default=0.0,
+                        help="每 1000 个未命中前缀缓存的提示词 token 增加的首 token 延迟（秒）")
+    parser.add_argument('--cache-unit', type=int, default=64, help="前缀缓存的粒度（token）")
+    parser.add_argument('--price', nargs=3, type=float, metavar=('INPUT', 'CACHED_INPUT', 'OUTPUT'),
+                        default=[DEFAULT_PRICES['input'], DEFAULT_PRICES['cached_input'], DEFAULT_PRICES['output']],
+                        help="每百万 token 的价格（美元）：输入、命中缓存的输入、输出")
+    parser.add_argument('--seed', type=int, default=None, help="故障注入的随机种子")
+
+
+def mock_from_args(args, port=0):
+    return MockLLM(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                   timeout_rate=args.timeout_rate, uncertain_rate=args.uncertain_rate,
+                   error_status=args.error_status, hang=args.hang, prefill=args.prefill, cache_unit=args.cache_unit,
+                   prices=dict(zip(('input', 'cached_input', 'output'), args.price)), seed=args.seed, port=port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 chat completions 上游")
+    parser.add_argument('--port', type=int, default=9000)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    mock = mock_from_args(args, port=args.port).start()
+    print(f"Mock LLM listening on {mock.base_url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(mock.snapshot()))
+    except KeyboardInterrupt:
+        mock.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+请求体压缩基准：按压测负载的大小分布生成错误日志，比较不压缩、gzip 与 zstd（已安装 zstandard 时）的
+传输字节数、客户端压缩耗时与服务端接收耗时（BodySizeLimitMiddleware 解压 + JSON 解析 + 模型校验）。
+
+不启动服务端，在进程内直接调用 ASGI 中间件，请求体按 64KB 分块送入（与 uvicorn 相同），只测接收本身的开销。
+
+    python bench/payload_compression.py --samples 300
+    python bench/payload_compression.py --size-mix small=0.5:2048,large=0.5:262144 --label big-logs
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from pydantic import BaseModel
+
+from loadtest import git_revision, percentile
+from workload import DEFAULT_SIZE_MIX, error_log, parse_size_mix
+
+from pip_aide import cli
+from pip_aide.compression import IDENTITY, available_encodings, compress
+from pip_aide_server.config import MAX_REQUEST_BYTES
+from pip_aide_server.ingest import BodySizeLimitMiddleware
+
+RECEIVE_CHUNK = 64 * 1024
+
+
+class AnalyzeErrorRequest(BaseModel):
+    machine_id: str
+    error_context: str
+
+
+async def _parse(scope, receive, send):
+    # 与 FastAPI 相同：读完请求体后解析 JSON 并校验
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    AnalyzeErrorRequest(**json.loads(b''.join(chunks)))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def ingest_seconds(app, body, encoding):
+    """服务端接收一个请求体的耗时；请求被拒绝时抛出 RuntimeError"""
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    if encoding != IDENTITY:
+        headers.append((b'content-encoding', encoding.encode()))
+    scope = {'type': 'http', 'method': 'POST', 'path': '/analyze_error', 'headers': headers}
+    pieces = [body[i:i + RECEIVE_CHUNK] for i in range(0, len(body), RECEIVE_CHUNK)] or [b'']
+    statuses = []
+
+    async def receive():
+        piece = pieces.pop(0)
+        return {'type': 'http.request', 'body': piece, 'more_body': bool(pieces)}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    async def run():
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        return time.perf_counter() - started
+
+    elapsed = asyncio.run(run())
+    if statuses != [200]:
+        raise RuntimeError(f"request rejected with status {statuses}")
+    return elapsed
+
+
+def measure(items, encodings, max_body_bytes):
+    """返回 {大小分类: {编码: 统计}}，以及 'all' 汇总"""
+    app = BodySizeLimitMiddleware(_parse, max_body_bytes=max_body_bytes)
+    samples = {}
+    for name, payload in items:
+        raw = json.dumps(payload).encode('utf-8')
+        for encoding in encodings:
+            started = time.perf_counter()
+            body = raw if encoding == IDENTITY else compress(raw, encoding)
+            compress_time = time.perf_counter() - started
+            ingest_time = ingest_seconds(app, body, encoding)
+            for group in (name, 'all'):
+                sample = samples.setdefault(group, {}).setdefault(encoding, {
+                    'requests': 0, 'raw_bytes': 0, 'wire_bytes': 0, 'compress': [], 'ingest': []})
+                sample['requests'] += 1
+                sample['raw_bytes'] += len(raw)
+                sample['wire_bytes'] += len(body)
+                sample['compress'].append(compress_time)
+                sample['ingest'].append(ingest_time)
+    return {group: {encoding: summarize(s) for encoding, s in by_encoding.items()}
+            for group, by_encoding in samples.items()}
+
+
+def summarize(sample):
+    def ms(values, p):
+        return round(percentile(sorted(values), p) * 1000, 3)
+
+    return {
+        'requests': sample['requests'],
+        'raw_bytes': sample['raw_bytes'],
+        'wire_bytes': sample['wire_bytes'],
+        'ratio': round(sample['raw_bytes'] / max(sample['wire_bytes'], 1), 2),
+        'compress_ms': {'p50': ms(sample['compress'], 50), 'p99': ms(sample['compress'], 99)},
+        'ingest_ms': {'p50': ms(sample['ingest'], 50), 'p99': ms(sample['ingest'], 99)},
+    }
+
+
+def print_results(results, encodings):
+    for group in sorted(results, key=lambda g: (g == 'all', g)):
+        print(f"  {group}:")
+        for encoding in encodings:
+            s = results[group][encoding]
+            print(f"    {encoding:>8}: {s['wire_bytes'] / s['requests'] / 1024:>8.1f} KB/request on the wire "
+                  f"(ratio {s['ratio']}), compress p50 {s['compress_ms']['p50']}ms, "
+                  f"ingest p50 {s['ingest_ms']['p50']}ms p99 {s['ingest_ms']['p99']}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="请求体压缩的传输字节数与接收耗时")
+    parser.add_argument('--samples', type=int, default=200, help="生成的错误日志数")
+    parser.add_argument('--size-mix', default=None,
+                        help="错误日志大小分布，例如 small=0.6:1024,large=0.4:65536（名称=权重:字节数）")
+    parser.add_argument('--encodings', default=','.join([IDENTITY] + available_encodings()),
+                        help="逗号分隔的编码，identity 表示不压缩")
+    parser.add_argument('--max-body-bytes', type=int, default=MAX_REQUEST_BYTES, help="服务端的请求体上限")
+    parser.add_argument('--seed', type=int, default=0, help="负载生成的随机种子")
+    parser.add_argument('--label', default='', help="结果的名称")
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results'), help="结果保存目录，留空不保存")
+    args = parser.parse_args(argv)
+
+    size_mix = parse_size_mix(args.size_mix) if args.size_mix else DEFAULT_SIZE_MIX
+    encodings = [e.strip() for e in args.encodings.split(',') if e.strip()]
+    # 与压测负载相同的大小分布，每条附带大小分类名
+    rng = random.Random(args.seed)
+    names = list(size_mix)
+    items = []
+    for _ in range(args.samples):
+        name = rng.choices(names, weights=[size_mix[n][0] for n in names])[0]
+        items.append((name, {'machine_id': 'bench', 'error_context': error_log(rng, size_mix[name][1])}))
+
+    print(f"Measuring {len(items)} request bodies with {', '.join(encodings)} "
+          f"(client threshold {cli.COMPRESS_MIN_BYTES} bytes)")
+    results = measure(items, encodings, args.max_body_bytes)
+    print_results(results, encodings)
+
+    result = {
+        'label': args.label,
+        'benchmark': 'compression',
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {'samples': args.samples, 'size_mix': size_mix, 'encodings': encodings,
+                   'max_body_bytes': args.max_body_bytes, 'seed': args.seed},
+        'results': results,
+    }
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        name = datetime.now().strftime('%Y%m%d-%H%M%S') + '-compression' + (f"-{args.label}" if args.label else '')
+        path = os.path.join(args.output, name + '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResults saved to {path}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
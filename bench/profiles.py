@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+提示词配置压测：对每个提示词配置（PIPAI_PROMPT_PROFILE）启动一个服务端进程，发送相同的流式请求序列，
+报告首个 token 的延迟、每个请求的上游成本与提示词前缀缓存的命中率。
+
+模拟上游按 DeepSeek 的方式计算前缀缓存（见 mock_llm.py），--prefill 让未命中缓存的提示词 token 增加首个 token 的延迟；
+默认不复用错误日志（--repeat-rate 0），每个请求都调用上游，只比较提示词本身的差异。
+
+    python bench/profiles.py --requests 200 --concurrency 8 --prefill 0.3
+    python bench/profiles.py --profiles concise --size-mix small=1:1024 --label concise-small
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+from loadtest import BENCH_DIR, SERVERS, ServerProcess, git_revision, run_level, summarize
+from mock_llm import add_mock_arguments, mock_from_args
+from workload import DEFAULT_SIZE_MIX, Workload, parse_size_mix
+
+from pip_aide_server.profiles import PROFILES
+
+
+def run_profile(profile, args, mock, items, extra_env):
+    env = dict(extra_env, PIPAI_PROMPT_PROFILE=profile)
+    server = ServerProcess(SERVERS[args.server], mock.base_url, upstream_timeout=args.upstream_timeout, extra_env=env)
+    try:
+        time_to_ready = server.wait_ready()
+        before = mock.snapshot()
+        records, elapsed = run_level(server.base_url, items, args.concurrency, args.timeout, stream=True)
+        summary = summarize(records, elapsed, args.concurrency, before, mock.snapshot(), time_to_ready, mock.prices)
+    finally:
+        server.stop(args.keep_workdir)
+    summary['profile'] = PROFILES[profile].describe()
+    return summary
+
+
+def mock_prices(args):
+    return dict(zip(('input', 'cached_input', 'output'), args.price))
+
+
+def print_summary(s):
+    ttft = s.get('time_to_first_token') or {}
+    print(f"  {s['profile']['name']:>12}: first token p50 {ttft.get('p50')}s p99 {ttft.get('p99')}s, "
+          f"latency p50 {s['latency']['p50']}s, status {s['status']}")
+    print(f"               prefix {s['profile']['prefix_tokens']} tokens, "
+          f"prompt cache hit rate {s.get('prompt_cache_hit_rate')}, "
+          f"cost ${s.get('cost_per_request', 0) * 1000:.4f} per 1000 requests "
+          f"({s['upstream']['prompt_tokens'] / max(s['upstream']['calls'], 1):.0f} prompt tokens/call)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pip-aide 提示词配置压测")
+    parser.add_argument('--server', choices=sorted(SERVERS), default='pipai', help="启动服务端的入口脚本")
+    parser.add_argument('--profiles', default=','.join(sorted(PROFILES)), help="逗号分隔的提示词配置")
+    parser.add_argument('--concurrency', type=int, default=8, help="并发度")
+    parser.add_argument('--requests', type=int, default=200, help="每个配置发送的请求数")
+    parser.add_argument('--repeat-rate', type=float, default=0.0, help="复用之前错误日志的比例")
+    parser.add_argument('--size-mix', default=None, help="错误日志大小分布，格式同 loadtest.py")
+    parser.add_argument('--timeout', type=float, default=60.0, help="客户端请求超时（秒）")
+    parser.add_argument('--upstream-timeout', type=float, default=10.0, help="服务端的上游超时（PIPAI_UPSTREAM_TIMEOUT）")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help="传给服务端的额外环境变量")
+    parser.add_argument('--workload-seed', type=int, default=0, help="负载生成的随机种子")
+    parser.add_argument('--label', default='profiles', help="结果的名称")
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results'), help="结果保存目录，留空不保存")
+    parser.add_argument('--keep-workdir', action='store_true', help="保留服务端的缓存、日志与输出")
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    unknown = [p for p in profiles if p not in PROFILES]
+    if unknown:
+        parser.error(f"unknown profile(s): {', '.join(unknown)}; available: {', '.join(sorted(PROFILES))}")
+    size_mix = parse_size_mix(args.size_mix) if args.size_mix else DEFAULT_SIZE_MIX
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    result = {
+        'label': args.label,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'config': {'server': args.server, 'concurrency': args.concurrency, 'requests': args.requests,
+                   'repeat_rate': args.repeat_rate, 'size_mix': size_mix, 'env': extra_env,
+                   'mock': {'latency': args.latency, 'jitter': args.jitter, 'prefill': args.prefill,
+                            'cache_unit': args.cache_unit, 'prices': mock_prices(args), 'seed': args.seed}},
+        'profiles': [],
+    }
+
+    mock = mock_from_args(args).start()
+    try:
+        print(f"Benchmarking prompt profiles {', '.join(profiles)} against mock upstream {mock.base_url}")
+        for profile in profiles:
+            # 各配置使用相同的负载序列；每个配置开始前清空模拟上游的前缀缓存，互不影响
+            items = Workload(size_mix, args.repeat_rate, seed=args.workload_seed).batch(args.requests)
+            mock.reset_prefix_cache()
+            summary = run_profile(profile, args, mock, items, extra_env)
+            result['profiles'].append(summary)
+            print_summary(summary)
+    finally:
+        mock.close()
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        path = os.path.join(args.output, datetime.now().strftime('%Y%m%d-%H%M%S') + f"-{args.label}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nResults saved to {path}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
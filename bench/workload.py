@@ -0,0 +1,106 @@
+"""
+压测负载：按大小分布生成接近真实的 pip 错误日志，并按重复率复用之前出现过的日志
+"""
+import random
+
+PACKAGES = ['numpy', 'scipy', 'lxml', 'psycopg2', 'cryptography', 'pillow', 'pyyaml', 'grpcio', 'pandas', 'torch']
+PYTHON_VERSIONS = ['3.8.18', '3.9.19', '3.10.14', '3.11.9', '3.12.4']
+OS_SYSTEMS = ['Linux', 'Darwin', 'Windows']
+
+# 名称 -> (权重, 大约的字节数)：大多数错误日志较短，少数编译失败的日志很长
+DEFAULT_SIZE_MIX = {'small': (0.6, 1024), 'medium': (0.3, 8 * 1024), 'large': (0.1, 64 * 1024)}
+
+
+def parse_size_mix(spec):
+    """'small=0.6:1024,large=0.4:65536' -> {'small': (0.6, 1024), 'large': (0.4, 65536)}"""
+    mix = {}
+    for part in spec.split(','):
+        name, value = part.split('=')
+        weight, size = value.split(':')
+        mix[name.strip()] = (float(weight), int(size))
+    return mix
+
+
+def error_log(rng, size):
+    """生成一段约 size 字节的 pip 安装失败日志（附带客户端会追加的系统信息）"""
+    package = rng.choice(PACKAGES)
+    version = f"{rng.randint(0, 3)}.{rng.randint(0, 30)}.{rng.randint(0, 9)}"
+    tmp = f"/tmp/pip-install-{rng.getrandbits(32):08x}"
+    head = [
+        f"Command: pip install {package}=={version}",
+        "Exit Code: 1",
+        "",
+        "--- stdout ---",
+        f"Collecting {package}=={version}",
+        f"  Downloading {package}-{version}.tar.gz ({rng.randint(1, 90)}.{rng.randint(0, 9)} MB)",
+        "  Installing build dependencies: started",
+        "--- stderr ---",
+        "error: subprocess-exited-with-error",
+    ]
+    tail = [
+        f"error: command '/usr/bin/gcc' failed with exit code {rng.choice([1, 2, 4])}",
+        f"ERROR: Failed building wheel for {package}",
+        f"ERROR: Could not build wheels for {package}, which is required to install pyproject.toml-based projects",
+        "",
+        "--- SYSTEM INFO ---",
+        f"python_version: {rng.choice(PYTHON_VERSIONS)}",
+        f"os_system: {rng.choice(OS_SYSTEMS)}",
+        "architecture: x86_64",
+    ]
+    lines = list(head)
+    used = sum(len(line) + 1 for line in head + tail)
+    i = 0
+    while used < size:
+        line = (f"  gcc -pthread -fPIC -O{i % 3} -I{tmp}/{package}/include -c {tmp}/{package}/src/module{i}.c "
+                f"-o build/temp/module{i}.o")
+        if i % 7 == 6:
+            line = f"  {tmp}/{package}/src/module{i}.c:{rng.randint(1, 900)}:10: warning: unused variable 'tmp{i}'"
+        lines.append(line)
+        used += len(line) + 1
+        i += 1
+    return '\n'.join(lines + tail)
+
+
+def log_items(records):
+    """把服务端错误日志中的记录（按时间顺序）转换为压测请求，返回 [(请求体, 是否重复)]"""
+    seen = set()
+    items = []
+    for record in records:
+        context = record.get('error_context')
+        if not context:
+            continue
+        items.append(({'machine_id': record.get('machine_id') or 'bench', 'error_context': context}, context in seen))
+        seen.add(context)
+    return items
+
+
+class Workload:
+    """
+    按 size_mix 生成新的错误日志；repeat_rate 的比例复用之前的日志（模拟许多用户遇到同一个错误），
+    新日志保存在最多 pool_size 条的池中供复用。
+    """
+
+    def __init__(self, size_mix=None, repeat_rate=0.3, pool_size=500, machines=200, seed=0):
+        self.size_mix = size_mix or DEFAULT_SIZE_MIX
+        self.repeat_rate = repeat_rate
+        self.pool_size = pool_size
+        self.machines = [f"bench-{i:04d}" for i in range(machines)]
+        self.rng = random.Random(seed)
+        self.pool = []
+
+    def next(self):
+        """返回 (请求体, 是否重复)"""
+        machine_id = self.rng.choice(self.machines)
+        if self.pool and self.rng.random() < self.repeat_rate:
+            return {'machine_id': machine_id, 'error_context': self.rng.choice(self.pool)}, True
+        names = list(self.size_mix)
+        name = self.rng.choices(names, weights=[self.size_mix[n][0] for n in names])[0]
+        context = error_log(self.rng, self.size_mix[name][1])
+        if len(self.pool) < self.pool_size:
+            self.pool.append(context)
+        else:
+            self.pool[self.rng.randrange(self.pool_size)] = context
+        return {'machine_id': machine_id, 'error_context': context}, False
+
+    def batch(self, count):
+        return [self.next() for _ in range(count)]
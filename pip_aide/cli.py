@@ -6,17 +6,30 @@ import time
 import threading
 import locale
 import uuid
+import hashlib
+import hmac
+import json
 import requests
+import urllib3
 import argparse
 import configparser
 import subprocess
 import shlex
 import logging
 import platform
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse, urlunparse
 from urllib.error import URLError
 from http.client import HTTPException
 
+from .compression import choose_encoding, compress
+from .safety import (
+    ALLOWED_COMMAND_PATTERNS, DISALLOWED_SUBSTRINGS, CommandStreamParser,
+    extract_code_block_lines, find_disallowed_substrings, matches_allowed_pattern,
+)
+
 default_messages = {
     'en': {
         'usage': "Usage: pip-aide install <package_name> [other pip options]",
@@ -31,6 +44,10 @@ default_messages = {
         'install_success': "\n[pip-aide] Installation successful!",
         'install_fail': "\n[pip-aide] Installation failed.",
         'ai_suggestion_is': "[pip-aide] AI Suggestion:\n{suggestion}",
+        'ai_suggestion_streaming': "[pip-aide] AI Suggestion (streaming):",
+        'ai_suggestion_reset': "\n[pip-aide] Discarding the partial answer, a stronger model is answering...",
+        'streaming_unavailable': "[pip-aide] Streaming unavailable ({reason}), falling back to a regular request.",
+        'command_started_early': "[pip-aide] Command was already started while the suggestion was streaming, waiting for it...",
         'ai_uncertain': "[pip-aide] AI is uncertain or provided no suitable pip command fix.",
         'ai_call_fail': "[pip-aide Error] Failed to call AI API: {e}",
         'get_ai_suggestion_fail': "[pip-aide] Could not get valid suggestion from AI.",
@@ -61,6 +78,10 @@ default_messages = {
         'json_error': "[pip-aide Error] Failed to parse AI service response: {error}",
         'invalid_server_url': "[pip-aide Error] Invalid server URL: {url}",
         'retrying_ai_connection': "[pip-aide] Retrying AI connection attempt {attempt}/{max_retries}...",
+        'server_busy': "[pip-aide] AI service is busy, retrying in {seconds} seconds...",
+        'batch_results': "[pip-aide] Got AI suggestions for {count} of {total} errors.",
+        'ai_job_waiting': "[pip-aide] Analysis queued on the AI server, waiting for the result...",
+        'ai_job_timeout': "[pip-aide Error] No result from the AI server after {seconds} seconds.",
         'ai_service_unavailable': "[pip-aide Error] AI service unavailable at {url}. Please check the server URL and try again.",
         'missing_package_name': "[pip-aide Error] No package name or options provided. Please specify a package to install.",
     },
@@ -77,6 +98,10 @@ default_messages = {
         'install_success': '[pip-aide] 安装成功。',
         'install_fail': '[pip-aide] 安装失败。',
         'proposing_command': '[pip-aide] 建议的修复命令：{cmd}',
+        'ai_suggestion_streaming': '[pip-aide] AI 建议（流式）：',
+        'ai_suggestion_reset': '\n[pip-aide] 已作废部分回答，正在由更强的模型作答...',
+        'streaming_unavailable': '[pip-aide] 流式接口不可用（{reason}），改用普通请求。',
+        'command_started_early': '[pip-aide] 该命令已在建议流式返回时开始执行，正在等待其完成...',
         'confirm_prompt': '执行此命令? [y/N]: ',
         'skipping_execution_user': '[pip-aide] 用户选择跳过执行。',
         'executing_command': '[pip-aide 信息] 正在执行命令...',
@@ -103,6 +128,10 @@ default_messages = {
         'json_error': "[pip-aide 错误] 无法解析 AI 服务响应: {error}",
         'invalid_server_url': "[pip-aide 错误] 无效的服务器 URL: {url}",
         'retrying_ai_connection': "[pip-aide] 正在重试 AI 连接，第 {attempt}/{max_retries} 次...",
+        'server_busy': "[pip-aide] AI 服务繁忙，{seconds} 秒后重试...",
+        'batch_results': "[pip-aide] 已获得 {total} 个错误中 {count} 个的 AI 建议。",
+        'ai_job_waiting': "[pip-aide] 分析任务已在 AI 服务端排队，等待结果...",
+        'ai_job_timeout': "[pip-aide 错误] 等待 {seconds} 秒后仍未从 AI 服务端得到结果。",
         'ai_service_unavailable': "[pip-aide 错误] AI 服务不可用：{url}。请检查服务器 URL 并重试。",
         'missing_package_name': "[pip-aide 错误] 未提供包名或选项。请指定一个包来安装。",
     }
@@ -122,15 +151,10 @@ DEFAULT_CONFIG = {
     'lang': '',
     'loglevel': 'INFO',
     'timeout': '30',
+    'stream': 'false',
+    'job_timeout': '300',
 }
 
-ALLOWED_COMMAND_PATTERNS = [
-    r"^pip\s+install($|\s+.*)",
-    r"^pip\s+uninstall($|\s+.*)",
-    r"^python\s+-m\s+pip\s+install($|\s+.*)",
-]
-DISALLOWED_SUBSTRINGS = ["sudo", "rm ", "mv ", "dd ", "|", ";", "&&", ">", "<"]
-
 def setup_logger(level_name):
     """设置日志记录器，根据给定的级别名称配置日志级别"""
     log_level = getattr(logging, level_name.upper(), logging.INFO)
@@ -205,21 +229,70 @@ def get_message(key, lang=None, **kwargs):
         logger.warning(f"Missing key in format string: {e}")
         return message_template
 
-def get_machine_id():
+# 本次安装的随机标识，首次运行时生成并保存；之后的运行都读取同一个
+INSTALL_ID_PATH = os.path.expanduser('~/.config/pip-aide/install-id')
+# 上报的 machine_id 是以安装标识为密钥的摘要，不包含也推算不出安装标识、MAC 地址等机器信息
+MACHINE_ID_CONTEXT = b'pip-aide machine-id v1'
+
+_machine_id = None
+
+def load_install_id(path=None):
     """
-    获取唯一的机器标识
+    读取保存的安装标识，不存在时生成并保存。
+    先写临时文件再用硬链接放到目标位置，同时首次运行的多个进程最终都读到同一个标识；无法保存时返回 None
     """
+    path = path or INSTALL_ID_PATH
     try:
-        # 尝试使用uuid1，但这可能在一些系统上不可用
-        machine_id = str(uuid.getnode())
-    except:
-        # 如果无法获取mac地址，生成一个随机ID
-        machine_id = str(uuid.uuid4())
-    
-    # 简单的哈希标识，避免直接发送机器信息
-    hashed_id = "0x" + hex(abs(hash(machine_id)))[2:10]
-    
-    return hashed_id
+        with open(path, encoding='utf-8') as f:
+            install_id = f.read().strip()
+        if re.fullmatch(r'[0-9a-f]{32}', install_id):
+            return install_id
+        logger.debug(f"Ignoring malformed install id in {path}")
+    except FileNotFoundError:
+        install_id = None
+    except OSError as e:
+        logger.debug(f"Cannot read install id {path}: {e}")
+        return None
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(uuid.uuid4().hex + '\n')
+        if install_id is None:
+            try:
+                os.link(temp_path, path)
+            except FileExistsError:
+                pass  # 另一个进程先保存了
+        else:
+            os.replace(temp_path, path)  # 替换内容损坏的文件
+        with open(path, encoding='utf-8') as f:
+            install_id = f.read().strip()
+    except OSError as e:
+        logger.debug(f"Cannot save install id {path}: {e}")
+        return None
+    finally:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    return install_id if re.fullmatch(r'[0-9a-f]{32}', install_id) else None
+
+def get_machine_id():
+    """
+    获取稳定的匿名机器标识：同一次安装的每次运行都相同，服务端据此做按机器的限流与统计。
+    可用 PIP_AIDE_MACHINE_ID 或配置项 machine_id 指定（例如让 CI 中的多个容器共用一个标识）；
+    安装标识无法保存时（只读的家目录等）退化为本进程内的随机标识
+    """
+    global _machine_id
+    if _machine_id is None:
+        configured = get_setting('machine_id', 'PIP_AIDE_MACHINE_ID')
+        if configured:
+            _machine_id = configured
+        else:
+            key = load_install_id() or uuid.uuid4().hex
+            _machine_id = hmac.new(key.encode('ascii'), MACHINE_ID_CONTEXT, hashlib.sha256).hexdigest()[:16]
+    return _machine_id
 
 def get_system_info():
     """
@@ -303,6 +376,40 @@ def extract_commands_from_markdown(markdown_text):
         extracted_commands.extend(lines)
     return extracted_commands
 
+def check_command(cmd_str, is_requirements_file=False, original_req_file=None, verbose=True):
+    """单条命令的安全检查；verbose=False 时不打印被拒绝的原因（流式回答中的提前检查）"""
+    def reject(message):
+        if verbose:
+            print(message, file=sys.stderr)
+        return False
+
+    try:
+        shlex.split(cmd_str)
+    except ValueError as e:
+        logger.warning(f"Failed to parse command: {cmd_str}: {e}")
+        return False
+
+    # 检查禁止的子串
+    disallowed_found = find_disallowed_substrings(cmd_str)
+    if disallowed_found:
+        logger.warning(f"Command contains disallowed substrings: {disallowed_found}")
+        return reject(f"  Skipping unsafe: Contains disallowed substring - {cmd_str}")
+
+    # 检查允许的模式
+    if not matches_allowed_pattern(cmd_str):
+        logger.warning(f"Command does not match allowed patterns: {cmd_str}")
+        return reject(f"  Skipping unsafe: Doesn't match allowed patterns - {cmd_str}")
+
+    # *** 如果原始命令是 -r，则进行特定检查 ***
+    if is_requirements_file and original_req_file:
+        # 检查命令是否尝试重新运行可能已损坏的原始文件
+        req_pattern_pip = rf"^pip\s+install\s+(-[a-zA-Z]+\s+)*-r\s+{re.escape(original_req_file)}(\s+.*)?$"
+        req_pattern_python = rf"^python\s+-m\s+pip\s+install\s+(-[a-zA-Z]+\s+)*-r\s+{re.escape(original_req_file)}(\s+.*)?$"
+        if re.match(req_pattern_pip, cmd_str, re.IGNORECASE) or re.match(req_pattern_python, cmd_str, re.IGNORECASE):
+            logger.info(f"Skipping command that re-runs the original requirements file: {cmd_str}")
+            return reject(f"  Skipping redundant: Attempting to re-run original requirements file - {cmd_str}")
+    return True
+
 def parse_and_filter_commands(suggestion, lang, is_requirements_file=False, original_req_file=None):
     """
     解析 AI 建议并过滤出安全的命令。
@@ -312,58 +419,17 @@ def parse_and_filter_commands(suggestion, lang, is_requirements_file=False, orig
     print(f"[{get_message('info', lang=lang)}] {get_message('filter_start', lang=lang)}")
     
     # 基于允许的模式和禁止的子串进行基本过滤
-    lines = suggestion.strip().split('\n')
-    potential_commands = []
-    in_code_block = False
-    for line in lines:
-        if line.startswith('```'):
-            in_code_block = not in_code_block
-        elif in_code_block:
-            potential_commands.append(line)
+    potential_commands = extract_code_block_lines(suggestion)
     
     logger.debug(f"Found {len(potential_commands)} potential commands in suggestion")
     
     safe_commands = []
     for cmd_str in potential_commands:
-        try:
-            command_args = shlex.split(cmd_str)
-        except ValueError as e:
-            logger.warning(f"Failed to parse command: {cmd_str}: {e}")
-            continue
-            
-        # 检查禁止的子串
-        disallowed_found = [sub for sub in DISALLOWED_SUBSTRINGS if sub in cmd_str]
-        if disallowed_found:
-            logger.warning(f"Command contains disallowed substrings: {disallowed_found}")
-            print(f"  Skipping unsafe: Contains disallowed substring - {cmd_str}", file=sys.stderr)
-            continue
-
-        # 检查允许的模式
-        is_allowed = False
-        for pattern in ALLOWED_COMMAND_PATTERNS:
-            if re.match(pattern, cmd_str, re.IGNORECASE):
-                is_allowed = True
-                break
-        
-        if not is_allowed:
-            logger.warning(f"Command does not match allowed patterns: {cmd_str}")
-            print(f"  Skipping unsafe: Doesn't match allowed patterns - {cmd_str}", file=sys.stderr)
-            continue
-
-        # *** 如果原始命令是 -r，则进行特定检查 ***
-        if is_requirements_file and original_req_file:
-            # 检查命令是否尝试重新运行可能已损坏的原始文件
-            req_pattern_pip = rf"^pip\s+install\s+(-[a-zA-Z]+\s+)*-r\s+{re.escape(original_req_file)}(\s+.*)?$"
-            req_pattern_python = rf"^python\s+-m\s+pip\s+install\s+(-[a-zA-Z]+\s+)*-r\s+{re.escape(original_req_file)}(\s+.*)?$"
-            if re.match(req_pattern_pip, cmd_str, re.IGNORECASE) or re.match(req_pattern_python, cmd_str, re.IGNORECASE):
-                logger.info(f"Skipping command that re-runs the original requirements file: {cmd_str}")
-                print(f"  Skipping redundant: Attempting to re-run original requirements file - {cmd_str}", file=sys.stderr)
-                continue
-
-        # 如果所有检查都通过
-        logger.info(f"Command accepted as safe: {cmd_str}")
-        print(f"  Accepted: {cmd_str}")
-        safe_commands.append(cmd_str)
+        if check_command(cmd_str, is_requirements_file, original_req_file):
+            # 如果所有检查都通过
+            logger.info(f"Command accepted as safe: {cmd_str}")
+            print(f"  Accepted: {cmd_str}")
+            safe_commands.append(cmd_str)
 
     if not safe_commands:
         logger.warning("No safe commands found in the suggestion")
@@ -371,8 +437,19 @@ def parse_and_filter_commands(suggestion, lang, is_requirements_file=False, orig
         
     return safe_commands
 
-def attempt_auto_fix(commands_to_try, auto_confirm, lang):
-    """尝试执行安全命令，根据需要进行确认。返回 (fix_applied, [installed_specs])"""
+def run_command_timed(cmd_str):
+    """执行命令并返回 (退出码, 标准输出, 标准错误, 耗时秒数)"""
+    started = time.monotonic()
+    retcode, stdout, stderr = run_command(shlex.split(cmd_str))
+    return retcode, stdout, stderr, time.monotonic() - started
+
+def attempt_auto_fix(commands_to_try, auto_confirm, lang, outcomes=None, started_commands=None):
+    """
+    尝试执行安全命令，根据需要进行确认。返回 (fix_applied, [installed_specs])
+    传入 outcomes 列表时，每条命令的退出码（未执行为 None）与耗时会追加到其中，用于向服务端反馈
+    started_commands: 流式回答期间已提前开始执行的命令 -> Future（run_command_timed 的结果），
+    这些命令不再确认或重复执行，只等待其结果；已取用的条目会从中移除
+    """
     fix_applied_successfully = False
     successfully_installed_specs = []
     
@@ -381,7 +458,12 @@ def attempt_auto_fix(commands_to_try, auto_confirm, lang):
         print(f"[{get_message('info', lang=lang)}] {get_message('proposing_command', lang=lang, cmd=cmd_str)}")
         
         execute_command = False
-        if auto_confirm:
+        early_run = started_commands.pop(cmd_str, None) if started_commands else None
+        if early_run is not None:
+            logger.debug("Command was started early while streaming, waiting for its result")
+            print(get_message('command_started_early', lang=lang))
+            execute_command = True
+        elif auto_confirm:
             logger.debug("Auto-confirm enabled, executing command")
             print(get_message('executing_command', lang=lang))
             execute_command = True
@@ -398,10 +480,19 @@ def attempt_auto_fix(commands_to_try, auto_confirm, lang):
                 logger.warning("Input stream closed, skipping command execution")
                 print(get_message('skipping_execution_user', lang=lang))
                 
+        outcome = {'command': cmd_str, 'exit_code': None, 'duration': 0.0}
+        if outcomes is not None:
+            outcomes.append(outcome)
+
         if execute_command:
             try:
                 cmd_args = shlex.split(cmd_str)
-                retcode, stdout, stderr = run_command(cmd_args)
+                if early_run is not None:
+                    retcode, stdout, stderr, duration = early_run.result()
+                else:
+                    retcode, stdout, stderr, duration = run_command_timed(cmd_str)
+                outcome['exit_code'] = retcode
+                outcome['duration'] = round(duration, 3)
                 
                 if retcode == 0:
                     logger.info(f"Command executed successfully: {cmd_str}")
@@ -423,29 +514,44 @@ def attempt_auto_fix(commands_to_try, auto_confirm, lang):
                         logger.debug(f"Command stderr: {stderr}")
                         
             except Exception as e:
+                outcome['exit_code'] = 1
                 logger.error(f"Exception executing command '{cmd_str}': {e}")
                 print(f"[pip-aide 错误] 命令 '{cmd_str}' 执行异常: {e}")
                 
     return fix_applied_successfully, successfully_installed_specs
 
-def get_ai_suggestion(error_context, server_url, timeout=30, retries=2, lang='en'):
-    """
-    请求 AI 服务器分析错误并提供修复建议
-    
-    Args:
-        error_context: 错误信息和上下文
-        server_url: AI 服务器的 URL
-        timeout: 请求超时时间（秒）
-        retries: 重试次数
-        lang: 错误消息的语言
-    
-    Returns:
-        str: AI 的建议，如果无法获取则返回 None
-    """
+# 一次 pip-aide 运行中的所有请求共用一个关联 ID，服务端日志中以 correlation_id 字段出现；
+# CI 等场景可以通过 PIP_AIDE_CORRELATION_ID 传入自己的任务 ID
+CORRELATION_ID = os.environ.get('PIP_AIDE_CORRELATION_ID') or uuid.uuid4().hex
+
+# 服务端返回的 Retry-After 最多等待这么久，避免客户端长时间挂起
+MAX_RETRY_AFTER = 30
+
+# 请求体（JSON）不小于这么多字节、且服务端声明支持压缩时压缩后发送；错误日志重复内容多，压缩率通常很高
+COMPRESS_MIN_BYTES = 1024
+# 接受服务端压缩的响应：只列出本机 requests/urllib3 能解压的编码
+ACCEPT_ENCODING = urllib3.util.make_headers(accept_encoding=True)['accept-encoding']
+
+def parse_retry_after(value, default=1):
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return default
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return default
+    return min(max(delay, 0), MAX_RETRY_AFTER)
+
+def build_payload(error_context, system_info=None):
+    """附加系统信息后构造请求体，返回 (machine_id, payload)；system_info 可以传入已收集的结果"""
     machine_id = get_machine_id()
     
     # 收集系统和Python版本信息
-    system_info = get_system_info()
+    if system_info is None:
+        system_info = get_system_info()
     
     # 将系统信息格式化为可读文本
     system_info_text = "\n".join([f"{k}: {v}" for k, v in system_info.items()])
@@ -453,43 +559,227 @@ def get_ai_suggestion(error_context, server_url, timeout=30, retries=2, lang='en
     # 合并错误上下文和系统信息
     enhanced_context = f"{error_context}\n\n--- SYSTEM INFO ---\n{system_info_text}"
     
-    payload = {
+    return machine_id, {
         "machine_id": machine_id,
         "error_context": enhanced_context
     }
+
+def encode_request(payload, encodings=None):
+    """
+    把请求体序列化为 JSON；服务端支持的编码（encodings，来自 /capabilities）中有本机也支持的，
+    且请求体不小于 COMPRESS_MIN_BYTES 时压缩。返回 (请求体, 需要附加的请求头)
+    """
+    body = json.dumps(payload).encode('utf-8')
+    encoding = choose_encoding(encodings or ()) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return body, {}
+    compressed = compress(body, encoding)
+    logger.debug(f"Request body compressed with {encoding}: {len(body)} -> {len(compressed)} bytes")
+    return compressed, {"Content-Encoding": encoding}
+
+def normalize_server_url(server_url):
+    """确保 URL 指向 /analyze_error 端点；URL 无效时抛出 ValueError"""
+    parsed_url = urlparse(server_url)
+    if not all([parsed_url.scheme, parsed_url.netloc]):
+        raise ValueError("missing scheme or host")
+        
+    # 确保URL包含/analyze_error端点
+    path = parsed_url.path
+    if not path or not path.endswith('/analyze_error'):
+        # 构建新的URL，确保包含/analyze_error端点
+        parts = list(parsed_url)
+        if not parts[2]:  # 路径为空
+            parts[2] = '/analyze_error'
+        elif parts[2].endswith('/'):  # 路径以/结尾
+            parts[2] = parts[2] + 'analyze_error'
+        elif '/analyze_error' not in parts[2]:  # 路径不包含/analyze_error
+            parts[2] = parts[2] + '/analyze_error'
+        server_url = urlunparse(parts)
+        logger.debug(f"Modified server URL to ensure endpoint: {server_url}")
+    return server_url
+
+def fill_feedback_ref(feedback_ref, server_url, machine_id, data):
+    """从服务端响应中取出回报修复结果所需的信息（旧版服务端不返回这些字段）"""
+    if feedback_ref is not None and all(data.get(k) for k in ('request_id', 'fingerprint', 'suggestion_id')):
+        feedback_ref.update(
+            url=re.sub(r'/analyze_error(/stream)?$', '/feedback', server_url),
+            machine_id=machine_id,
+            request_id=data['request_id'],
+            fingerprint=data['fingerprint'],
+            suggestion_id=data['suggestion_id'],
+        )
+
+def accept_suggestion(data, server_url, machine_id, lang, feedback_ref=None):
+    """处理服务端返回的分析结果，返回建议；缺少建议或模型不确定时返回 None"""
+    suggestion = data.get('suggestion')
+    if not suggestion:
+        logger.warning("Server response missing 'suggestion' field")
+        print(get_message('get_ai_suggestion_fail', lang=lang))
+        return None
+    if "UNCERTAIN" in suggestion:
+        logger.info("AI response indicates uncertainty")
+        print(get_message('ai_uncertain', lang=lang))
+        return None
+    print(get_message('ai_suggestion_is', lang=lang, suggestion=suggestion))
+    fill_feedback_ref(feedback_ref, server_url, machine_id, data)
+    return suggestion
+
+# 服务根地址 -> GET /capabilities 的结果（旧版服务端为 {}），每个进程只查询一次
+_server_capabilities = {}
+
+def discover_capabilities(server_url, timeout=5):
+    """查询服务端支持的可选接口；旧版服务端没有 /capabilities，返回 {}"""
+    root = re.sub(r'/analyze_error$', '', server_url)
+    if root not in _server_capabilities:
+        try:
+            response = requests.get(root + '/capabilities', headers={"X-Correlation-ID": CORRELATION_ID},
+                                    timeout=timeout)
+            data = response.json() if response.status_code == 200 else {}
+        except requests.exceptions.RequestException as e:
+            # 网络错误不缓存，由之后的分析请求报告
+            logger.debug(f"Capability discovery failed: {e}")
+            return {}
+        except ValueError:
+            data = {}
+        _server_capabilities[root] = data if isinstance(data, dict) else {}
+        logger.debug(f"Server capabilities: {sorted(_server_capabilities[root])}")
+    return _server_capabilities[root]
+
+class JobsUnavailable(Exception):
+    """任务接口不可用，调用方改用同步的 /analyze_error 请求"""
+
+def get_ai_suggestion_job(body, headers, server_url, jobs, machine_id, timeout=30, retries=2, lang='en',
+                          feedback_ref=None, job_timeout=300):
+    """
+    通过任务接口获取建议：提交（POST /jobs）后长轮询 GET /jobs/{job_id}，直到任务结束或超过 job_timeout 秒。
+    任务保存在服务端，轮询请求的超时或断线只需重新轮询，不会重新分析；
+    任务过期或不存在（404）时重新提交，服务端返回 429/503 时按 Retry-After 等待。
     
+    Raises:
+        JobsUnavailable: 服务端没有任务接口
+    """
+    jobs_url = re.sub(r'/analyze_error$', '', server_url) + '/' + str(jobs.get('path', 'jobs')).strip('/')
+    # 单次长轮询的等待时间不超过服务端上限，并给 HTTP 超时留出余量
+    poll_wait = max(0.0, min(float(jobs.get('max_wait', 25)), timeout - 2))
+    deadline = time.monotonic() + job_timeout
+    job_id = None
+    errors = 0
+    waiting_shown = False
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.error(f"Analysis job {job_id} not finished after {job_timeout} seconds")
+            print(get_message('ai_job_timeout', lang=lang, seconds=job_timeout))
+            return None
+        wait = min(poll_wait, remaining)
+        try:
+            if job_id is None:
+                response = requests.post(jobs_url, params={'wait': wait}, data=body, headers=headers,
+                                         timeout=timeout + wait)
+                if response.status_code in (404, 405):
+                    raise JobsUnavailable(f"HTTP {response.status_code}")
+            else:
+                response = requests.get(f"{jobs_url}/{job_id}", params={'wait': wait}, headers=headers,
+                                        timeout=timeout + wait)
+                if response.status_code == 404:
+                    logger.info(f"Analysis job {job_id} expired or unknown, resubmitting")
+                    job_id = None
+                    continue
+            errors = 0
+            if response.status_code in (429, 503):
+                delay = min(parse_retry_after(response.headers.get('Retry-After')), remaining)
+                print(get_message('server_busy', lang=lang, seconds=int(round(delay))))
+                time.sleep(delay)
+                continue
+            if response.status_code not in (200, 202):
+                logger.error(f"Server returned unexpected status code: {response.status_code}")
+                print(get_message('server_error', lang=lang, status_code=response.status_code))
+                return None
+            data = response.json()
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            errors += 1
+            logger.error(f"Error while waiting for analysis job {job_id}: {e}")
+            print(get_message('network_error', lang=lang, error="timeout" if isinstance(e, requests.exceptions.Timeout)
+                              else "connection failed"))
+            if errors > retries:
+                print(get_message('ai_service_unavailable', lang=lang, url=server_url))
+                return None
+            time.sleep(1)
+            continue
+        except ValueError as e:
+            logger.error(f"Server returned invalid JSON: {e}")
+            print(get_message('json_error', lang=lang, error=str(e)))
+            return None
+
+        status = data.get('status')
+        if status == 'done':
+            return accept_suggestion(data.get('result') or {}, server_url, machine_id, lang, feedback_ref)
+        if status == 'failed':
+            error = data.get('error') or {}
+            if error.get('status') in (429, 503):
+                # 任务因服务端过载失败：等待后重新提交
+                delay = min(parse_retry_after(str(error.get('retry_after') or '')), max(deadline - time.monotonic(), 0))
+                print(get_message('server_busy', lang=lang, seconds=int(round(delay))))
+                time.sleep(delay)
+                job_id = None
+                continue
+            logger.error(f"Analysis job failed: {error.get('detail')}")
+            print(get_message('server_error', lang=lang, status_code=error.get('status')))
+            return None
+        job_id = data.get('job_id')
+        logger.debug(f"Analysis job {job_id} is {status}")
+        if not waiting_shown:
+            print(get_message('ai_job_waiting', lang=lang))
+            waiting_shown = True
+
+def get_ai_suggestion(error_context, server_url, timeout=30, retries=2, lang='en', feedback_ref=None, job_timeout=300):
+    """
+    请求 AI 服务器分析错误并提供修复建议。
+    服务端在 /capabilities 中声明了任务接口时提交任务并长轮询结果，否则发送同步的 /analyze_error 请求。
+    
+    Args:
+        error_context: 错误信息和上下文
+        server_url: AI 服务器的 URL
+        timeout: 请求超时时间（秒）
+        retries: 重试次数
+        lang: 错误消息的语言
+        feedback_ref: 传入 dict 时，填入之后回报修复结果所需的信息（见 send_fix_feedback）
+        job_timeout: 使用任务接口时最多等待结果的秒数
+    
+    Returns:
+        str: AI 的建议，如果无法获取则返回 None
+    """
+    machine_id, payload = build_payload(error_context)
+    
+    # 同一次分析的所有重试共用一个幂等键，服务端据此把重试挂到原始计算上
     headers = {
-        "Content-Type": "application/json"
+        "Content-Type": "application/json",
+        "Accept-Encoding": ACCEPT_ENCODING,
+        "Idempotency-Key": str(uuid.uuid4()),
+        "X-Correlation-ID": CORRELATION_ID
     }
     
     # 检查服务器 URL 是否有效
     try:
-        parsed_url = urlparse(server_url)
-        if not all([parsed_url.scheme, parsed_url.netloc]):
-            logger.error(f"Invalid server URL: {server_url}")
-            print(get_message('invalid_server_url', lang=lang, url=server_url))
-            return None
-            
-        # 确保URL包含/analyze_error端点
-        path = parsed_url.path
-        if not path or not path.endswith('/analyze_error'):
-            # 构建新的URL，确保包含/analyze_error端点
-            parts = list(parsed_url)
-            if not parts[2]:  # 路径为空
-                parts[2] = '/analyze_error'
-            elif parts[2].endswith('/'):  # 路径以/结尾
-                parts[2] = parts[2] + 'analyze_error'
-            elif '/analyze_error' not in parts[2]:  # 路径不包含/analyze_error
-                parts[2] = parts[2] + '/analyze_error'
-            server_url = urlunparse(parts)
-            logger.debug(f"Modified server URL to ensure endpoint: {server_url}")
-            
-    except Exception as e:
-        logger.error(f"Failed to parse server URL: {e}")
+        server_url = normalize_server_url(server_url)
+    except ValueError as e:
+        logger.error(f"Invalid server URL: {server_url}: {e}")
         print(get_message('invalid_server_url', lang=lang, url=server_url))
         return None
     
-    logger.debug(f"Requesting AI suggestion from: {server_url}")
+    capabilities = discover_capabilities(server_url, timeout=min(timeout, 5))
+    body, encoding_headers = encode_request(payload, capabilities.get('encodings'))
+    headers.update(encoding_headers)
+    jobs = capabilities.get('jobs')
+    if isinstance(jobs, dict):
+        logger.debug(f"Submitting analysis job to: {server_url} (correlation id {CORRELATION_ID})")
+        try:
+            return get_ai_suggestion_job(body, headers, server_url, jobs, machine_id, timeout, retries, lang=lang,
+                                         feedback_ref=feedback_ref, job_timeout=job_timeout)
+        except JobsUnavailable as e:
+            logger.warning(f"Job API unavailable, falling back: {e}")
+    
+    logger.debug(f"Requesting AI suggestion from: {server_url} (correlation id {CORRELATION_ID})")
     
     connection_error_occurred = False
     for attempt in range(retries + 1):
@@ -498,23 +788,11 @@ def get_ai_suggestion(error_context, server_url, timeout=30, retries=2, lang='en
                 logger.info(f"Retry attempt {attempt}/{retries}...")
                 print(get_message('retrying_ai_connection', lang=lang, attempt=attempt, max_retries=retries))
                 
-            response = requests.post(server_url, json=payload, headers=headers, timeout=timeout)
+            response = requests.post(server_url, data=body, headers=headers, timeout=timeout)
             
             if response.status_code == 200:
                 try:
-                    data = response.json()
-                    suggestion = data.get('suggestion')
-                    if suggestion:
-                        if "UNCERTAIN" in suggestion:
-                            logger.info("AI response indicates uncertainty")
-                            print(get_message('ai_uncertain', lang=lang))
-                            return None
-                        print(get_message('ai_suggestion_is', lang=lang, suggestion=suggestion))
-                        return suggestion
-                    else:
-                        logger.warning("Server response missing 'suggestion' field")
-                        print(get_message('get_ai_suggestion_fail', lang=lang))
-                        return None
+                    return accept_suggestion(response.json(), server_url, machine_id, lang, feedback_ref)
                 except ValueError as e:
                     logger.error(f"Server returned invalid JSON: {e}")
                     print(get_message('json_error', lang=lang, error=str(e)))
@@ -523,6 +801,11 @@ def get_ai_suggestion(error_context, server_url, timeout=30, retries=2, lang='en
                 logger.error(f"Server returned non-200 status code: {response.status_code}")
                 print(get_message('server_error', lang=lang, status_code=response.status_code))
                 if attempt < retries:
+                    # 服务端过载（429/503）时按 Retry-After 等待后再重试
+                    if response.status_code in (429, 503) and response.headers.get('Retry-After'):
+                        delay = parse_retry_after(response.headers['Retry-After'])
+                        print(get_message('server_busy', lang=lang, seconds=int(round(delay))))
+                        time.sleep(delay)
                     continue  # 仍有重试次数，继续循环
                 return None
                 
@@ -550,6 +833,276 @@ def get_ai_suggestion(error_context, server_url, timeout=30, retries=2, lang='en
             
     return None
 
+def split_batches(items, max_items, max_bytes):
+    """把批量条目按条数与（估算的）请求体大小分成多批；单个条目超过上限时单独成批，由服务端拒绝"""
+    batches, current, size = [], [], 0
+    for item in items:
+        item_size = len(json.dumps(item)) + 2
+        if current and (len(current) >= max_items or size + item_size > max_bytes):
+            batches.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += item_size
+    if current:
+        batches.append(current)
+    return batches
+
+def get_ai_suggestions(error_contexts, server_url, timeout=30, retries=2, lang='en'):
+    """
+    一次请求分析多个互不相关的错误（例如同一次 CI 任务中多个项目的安装失败）
+    
+    Args:
+        error_contexts: {id: 错误日志}，id 由调用方指定
+        server_url: AI 服务器的 URL
+        timeout: 请求超时时间（秒）
+        retries: 被限速或服务端过载的条目的重试次数
+        lang: 错误消息的语言
+    
+    Returns:
+        dict: {id: AI 的建议}，无法获取或模型不确定的条目为 None。
+        服务端没有批量接口（/analyze_errors）时逐个调用 get_ai_suggestion
+    """
+    if not error_contexts:
+        return {}
+    try:
+        server_url = normalize_server_url(server_url)
+    except ValueError as e:
+        logger.error(f"Invalid server URL: {server_url}: {e}")
+        print(get_message('invalid_server_url', lang=lang, url=server_url))
+        return {key: None for key in error_contexts}
+    
+    capabilities = discover_capabilities(server_url, timeout=min(timeout, 5))
+    batch = capabilities.get('batch')
+    if not isinstance(batch, dict):
+        logger.debug("Server has no batch endpoint, analyzing errors one by one")
+        return {key: get_ai_suggestion(context, server_url, timeout, retries, lang=lang)
+                for key, context in error_contexts.items()}
+    
+    batch_url = re.sub(r'/analyze_error$', '', server_url) + '/' + str(batch.get('path', 'analyze_errors')).strip('/')
+    max_items = max(int(batch.get('max_items', 20)), 1)
+    # 给 JSON 外层与 machine_id 留出余量
+    max_bytes = int(batch.get('max_bytes', 1024 * 1024) * 0.9)
+    headers = {
+        "Content-Type": "application/json",
+        "Accept-Encoding": ACCEPT_ENCODING,
+        "X-Correlation-ID": CORRELATION_ID
+    }
+    # 系统信息只收集一次
+    system_info = get_system_info()
+    keys = {str(key): key for key in error_contexts}
+    machine_id = None
+    pending = []
+    for wire_id, key in keys.items():
+        machine_id, payload = build_payload(error_contexts[key], system_info)
+        pending.append({'id': wire_id, 'error_context': payload['error_context']})
+    
+    results = {}
+    for attempt in range(retries + 1):
+        retry, delay = [], 0
+        for items in split_batches(pending, max_items, max_bytes):
+            body, encoding_headers = encode_request({'machine_id': machine_id, 'items': items},
+                                                    capabilities.get('encodings'))
+            try:
+                response = requests.post(batch_url, data=body, headers=dict(headers, **encoding_headers),
+                                         timeout=timeout)
+                if response.status_code != 200:
+                    logger.error(f"Server returned non-200 status code for batch: {response.status_code}")
+                    print(get_message('server_error', lang=lang, status_code=response.status_code))
+                    if response.status_code in (429, 503):
+                        retry.extend(items)
+                        delay = max(delay, parse_retry_after(response.headers.get('Retry-After')))
+                    continue
+                by_id = {item['id']: item for item in items}
+                for result in response.json().get('results', []):
+                    item = by_id.get(str(result.get('id')))
+                    if item is None:
+                        continue
+                    if result.get('status') in (429, 503):
+                        # 单个条目被限速或遇到降级模式：只重试这些条目
+                        retry.append(item)
+                        delay = max(delay, parse_retry_after(str(result.get('retry_after', ''))))
+                    else:
+                        if result.get('status') != 200:
+                            logger.warning(f"Batch item {item['id']} failed: {result.get('detail')}")
+                        results[item['id']] = result
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"Batch request failed: {e}")
+                print(get_message('network_error', lang=lang, error=str(e)))
+                retry.extend(items)
+                delay = max(delay, 1)
+        pending = retry
+        if not pending or attempt == retries:
+            break
+        print(get_message('server_busy', lang=lang, seconds=int(round(delay))))
+        time.sleep(delay)
+    
+    suggestions = {}
+    for wire_id, key in keys.items():
+        result = results.get(wire_id) or {}
+        suggestion = result.get('suggestion') if result.get('status') == 200 else None
+        suggestions[key] = suggestion if suggestion and "UNCERTAIN" not in suggestion else None
+    print(get_message('batch_results', lang=lang, count=sum(1 for v in suggestions.values() if v),
+                      total=len(suggestions)))
+    return suggestions
+
+class StreamingUnavailable(Exception):
+    """流式接口不可用（旧版服务端、网络错误、服务端过载等），调用方改用 get_ai_suggestion"""
+
+def iter_sse_events(lines):
+    """把 server-sent events 的文本行解析为 (event, data)，data 按 JSON 解析"""
+    event, data = 'message', []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.rstrip('\r')
+        if not line:
+            if data:
+                yield event, json.loads('\n'.join(data))
+            event, data = 'message', []
+        elif line.startswith(':'):
+            continue  # 注释（心跳）
+        elif line.startswith('event:'):
+            event = line[len('event:'):].strip()
+        elif line.startswith('data:'):
+            value = line[len('data:'):]
+            data.append(value[1:] if value.startswith(' ') else value)
+    if data:
+        yield event, json.loads('\n'.join(data))
+
+def get_ai_suggestion_stream(error_context, server_url, timeout=30, lang='en', feedback_ref=None, on_command=None):
+    """
+    通过 /analyze_error/stream 获取建议，模型生成的片段实时打印。
+    
+    Args:
+        on_command: 回答中每出现一条新的完整命令（代码块中的一行，原样保留）时以该命令调用，
+                    此时模型可能仍在生成后续内容。只在服务端标明当前回答来自级联的最后一级
+                    （tier 事件的 final 为 true）时调用，可能被 reset 作废的部分回答中的命令不会交出
+    
+    Returns:
+        str: 最终建议（以 done 事件为准），UNCERTAIN 时返回 None
+    
+    Raises:
+        StreamingUnavailable: 无法通过流式接口得到结果，调用方应回退到 get_ai_suggestion
+    """
+    machine_id, payload = build_payload(error_context)
+    try:
+        server_url = normalize_server_url(server_url)
+    except ValueError as e:
+        raise StreamingUnavailable(f"invalid server URL: {e}")
+    stream_url = server_url + '/stream'
+    body, encoding_headers = encode_request(payload, discover_capabilities(server_url, timeout=min(timeout, 5))
+                                            .get('encodings'))
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+        "X-Correlation-ID": CORRELATION_ID,
+        **encoding_headers
+    }
+    logger.debug(f"Requesting streamed AI suggestion from: {stream_url} (correlation id {CORRELATION_ID})")
+    
+    parser = CommandStreamParser()
+    seen_commands = set()
+    final_tier = False
+    started = time.monotonic()
+    first_token = first_command = None
+    try:
+        with requests.post(stream_url, data=body, headers=headers, timeout=timeout, stream=True) as response:
+            content_type = response.headers.get('Content-Type', '')
+            if response.status_code != 200 or not content_type.startswith('text/event-stream'):
+                raise StreamingUnavailable(f"HTTP {response.status_code}")
+            for event, data in iter_sse_events(response.iter_lines(chunk_size=None, decode_unicode=True)):
+                if event == 'delta':
+                    if first_token is None:
+                        first_token = time.monotonic() - started
+                        logger.info(f"First token after {first_token:.2f}s")
+                        print(get_message('ai_suggestion_streaming', lang=lang))
+                    print(data['text'], end='', flush=True)
+                    for line in parser.feed(data['text']):
+                        # 命令原样交出：安全检查与之后按最终建议取用提前执行的结果都以原始行为准
+                        if not line.strip() or line in seen_commands:
+                            continue
+                        seen_commands.add(line)
+                        if first_command is None:
+                            first_command = time.monotonic() - started
+                            logger.info(f"First complete command after {first_command:.2f}s: {line.strip()}")
+                        if on_command is not None and final_tier:
+                            on_command(line)
+                elif event == 'tier':
+                    # 级联开始由某一级作答；不是最后一级时回答之后可能被 reset 作废
+                    final_tier = bool(data.get('final'))
+                    seen_commands.clear()
+                elif event == 'reset':
+                    # 级联升级到更强的模型，之前的片段作废
+                    logger.info(f"Partial answer discarded: {data.get('reason')}")
+                    print(get_message('ai_suggestion_reset', lang=lang))
+                    parser.reset()
+                    seen_commands.clear()
+                elif event == 'error':
+                    raise StreamingUnavailable(data.get('detail') or f"status {data.get('status')}")
+                elif event == 'done':
+                    if first_token is not None:
+                        print()
+                    suggestion = data.get('suggestion')
+                    if not suggestion:
+                        raise StreamingUnavailable("response missing 'suggestion' field")
+                    if "UNCERTAIN" in suggestion:
+                        logger.info("AI response indicates uncertainty")
+                        print(get_message('ai_uncertain', lang=lang))
+                        return None
+                    if first_token is None:
+                        # 缓存命中等情况没有片段，整体打印
+                        print(get_message('ai_suggestion_is', lang=lang, suggestion=suggestion))
+                    fill_feedback_ref(feedback_ref, stream_url, machine_id, data)
+                    return suggestion
+    except requests.exceptions.RequestException as e:
+        raise StreamingUnavailable(str(e))
+    except (ValueError, KeyError) as e:
+        raise StreamingUnavailable(f"malformed event: {e}")
+    raise StreamingUnavailable("stream ended without a result")
+
+def request_suggestion(error_context, server_url, timeout, lang, feedback_ref=None, stream=False, on_command=None,
+                       job_timeout=300):
+    """stream=True 时先尝试流式接口，不可用时回退到普通的 /analyze_error 请求"""
+    if stream:
+        try:
+            return get_ai_suggestion_stream(error_context, server_url, timeout, lang=lang,
+                                            feedback_ref=feedback_ref, on_command=on_command)
+        except StreamingUnavailable as e:
+            logger.warning(f"Streaming unavailable, falling back: {e}")
+            print(get_message('streaming_unavailable', lang=lang, reason=e))
+    return get_ai_suggestion(error_context, server_url, timeout, lang=lang, feedback_ref=feedback_ref,
+                             job_timeout=job_timeout)
+
+# 反馈请求的超时；进程退出前最多等待这么久
+FEEDBACK_TIMEOUT = 3
+
+def send_fix_feedback(feedback_ref, outcomes):
+    """
+    在后台线程中向服务端回报修复命令的执行结果，不等待、不重试，失败时忽略。
+    线程不是守护线程，进程退出前会等它结束（最多 FEEDBACK_TIMEOUT 秒）。
+    """
+    if not feedback_ref or not outcomes:
+        return None
+    payload = {
+        "machine_id": feedback_ref['machine_id'],
+        "request_id": feedback_ref['request_id'],
+        "fingerprint": feedback_ref['fingerprint'],
+        "suggestion_id": feedback_ref['suggestion_id'],
+        "outcomes": outcomes,
+    }
+
+    def post():
+        try:
+            response = requests.post(feedback_ref['url'], json=payload, timeout=FEEDBACK_TIMEOUT,
+                                     headers={"X-Correlation-ID": CORRELATION_ID})
+            logger.debug(f"Fix feedback sent: {response.status_code}")
+        except Exception as e:
+            logger.debug(f"Failed to send fix feedback: {e}")
+
+    thread = threading.Thread(target=post, name='pip-aide-feedback')
+    thread.start()
+    return thread
+
 def print_help_and_exit():
     """打印帮助信息并退出"""
     print("""
@@ -564,6 +1117,8 @@ Options:
   --lang en/zh           Set display language
   --loglevel LEVEL       Set logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
   --timeout SECONDS      Set AI request timeout in seconds
+  --stream               Stream the suggestion as it is generated; with --auto-confirm
+                         the first safe command starts before the answer is complete
   --help, -h             Show this help message
 
 Example:
@@ -582,6 +1137,7 @@ def main():
     parser.add_argument('--loglevel', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'], 
                       help="Logging level")
     parser.add_argument('--timeout', help="API request timeout (seconds)")
+    parser.add_argument('--stream', action='store_true', help="Stream the AI suggestion")
     parser.add_argument('--help', '-h', action='store_true', help="Show help")
     
     parser.add_argument('command', nargs='?', choices=['install'], help="Currently only 'install' is supported.")
@@ -601,6 +1157,8 @@ def main():
     final_lang = get_setting('lang', 'PIP_AIDE_LANG', args.lang).lower()
     final_loglevel = get_setting('loglevel', 'PIP_AIDE_LOGLEVEL', args.loglevel).upper()
     final_timeout_str = get_setting('timeout', 'PIP_AIDE_TIMEOUT', args.timeout)
+    final_stream = get_setting('stream', 'PIP_AIDE_STREAM', args.stream or None).lower() == 'true'
+    final_job_timeout_str = get_setting('job_timeout', 'PIP_AIDE_JOB_TIMEOUT')
 
     # --- Validate and finalize settings --- 
     # 设置日志级别
@@ -637,6 +1195,13 @@ def main():
         logger.warning(get_message('invalid_timeout_warning', lang=final_lang).format(specified=final_timeout_str))
         final_timeout_seconds = 30 # Default
     logger.info(f"{get_message('timeout_info', lang=final_lang)}: {final_timeout_seconds}s")
+    try:
+        final_job_timeout = int(final_job_timeout_str)
+        if final_job_timeout <= 0:
+            raise ValueError("Job timeout must be positive")
+    except ValueError:
+        logger.warning(f"Invalid job timeout: {final_job_timeout_str}, using 300 seconds")
+        final_job_timeout = 300
 
     # Auto-confirm info
     auto_confirm_msg = get_message('autoconfirm_enabled', lang=final_lang) if final_auto_confirm else get_message('autoconfirm_disabled', lang=final_lang)
@@ -656,7 +1221,7 @@ def main():
         pip_args = []
         
         # 从所有参数中过滤出pip-aide特有参数
-        pip_aide_params = ['--server-url', '--auto-confirm', '--analytics', '--lang', '--loglevel', '--timeout']
+        pip_aide_params = ['--server-url', '--auto-confirm', '--analytics', '--lang', '--loglevel', '--timeout', '--stream']
         
         # 处理args.args中的参数，过滤掉pip-aide特有参数
         i = 0
@@ -700,29 +1265,49 @@ def main():
                 error_output = f"Command: {original_command_str}\nExit Code: {retcode}\n\n--- stdout ---\n{stdout}\n--- stderr ---\n{stderr}"
                 print(error_output)
 
+                # Check if the original command used -r
+                original_req_file = None
+                is_requirements_file = False
+                try:
+                    req_idx = pip_args.index('-r')
+                    if req_idx + 1 < len(pip_args):
+                        original_req_file = pip_args[req_idx + 1]
+                        is_requirements_file = True
+                        logger.debug(f"Requirements file detected: {original_req_file}")
+                except ValueError:
+                    logger.debug("No requirements file (-r) flag found in command")
+                    pass # -r not found
+
+                # 流式回答且自动确认时，第一条完整且安全的命令在模型仍在生成时就开始执行（只限级联最后一级的回答，
+                # 检查与记录都用原始行，与 parse_and_filter_commands 一致）；之后的命令可能依赖它的结果，仍在回答完整后按顺序执行
+                early_runs = {}
+                early_executor = ThreadPoolExecutor(max_workers=1)
+
+                def start_early(cmd):
+                    if early_runs or not check_command(cmd, is_requirements_file, original_req_file, verbose=False):
+                        return
+                    logger.info(f"Starting command before the suggestion is complete: {cmd}")
+                    early_runs[cmd] = early_executor.submit(run_command_timed, cmd)
+
                 # Attempt AI fix
                 print(f"\n[pip-aide] Attempting AI fix...")
-                suggestion = get_ai_suggestion(error_output, final_server_url, final_timeout_seconds, lang=final_lang)
+                feedback_ref = {}
+                suggestion = request_suggestion(error_output, final_server_url, final_timeout_seconds, final_lang,
+                                                feedback_ref=feedback_ref, stream=final_stream,
+                                                on_command=start_early if final_auto_confirm else None,
+                                                job_timeout=final_job_timeout)
 
                 if suggestion:
-                    # Check if the original command used -r
-                    original_req_file = None
-                    is_requirements_file = False
-                    try:
-                        req_idx = pip_args.index('-r')
-                        if req_idx + 1 < len(pip_args):
-                            original_req_file = pip_args[req_idx + 1]
-                            is_requirements_file = True
-                            logger.debug(f"Requirements file detected: {original_req_file}")
-                    except ValueError:
-                        logger.debug("No requirements file (-r) flag found in command")
-                        pass # -r not found
-                    
                     # Pass the flag and filename to the parser
                     safe_commands_to_try = parse_and_filter_commands(suggestion, final_lang, is_requirements_file, original_req_file)
                     
                     if safe_commands_to_try:
-                        fix_applied, installed_specs = attempt_auto_fix(safe_commands_to_try, final_auto_confirm, final_lang)
+                        outcomes = []
+                        fix_applied, installed_specs = attempt_auto_fix(safe_commands_to_try, final_auto_confirm, final_lang,
+                                                                        outcomes=outcomes, started_commands=early_runs)
+                        # 修复结果匿名回报给服务端，用于淘汰实际无效的建议；--analytics off 时不发送
+                        if final_analytics != 'off':
+                            send_fix_feedback(feedback_ref, outcomes)
                         
                         if fix_applied:
                             print(get_message('fix_attempted', lang=final_lang))
@@ -756,6 +1341,10 @@ def main():
                 else:
                     # 无AI建议时显示更明确的错误
                     print(get_message('no_suggestion', lang=final_lang))
+                # 提前执行的命令不在最终建议中（回答被作废或改为 UNCERTAIN）时，仍等待其结束
+                for cmd in early_runs:
+                    logger.warning(f"Command started early is not part of the final suggestion: {cmd}")
+                early_executor.shutdown(wait=True)
                 sys.exit(retcode)
 
         except KeyboardInterrupt:
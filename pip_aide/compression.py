@@ -0,0 +1,158 @@
+"""
+请求体与响应体的压缩编码：gzip，以及安装了可选依赖 zstandard 时的 zstd
+
+客户端用它压缩较大的请求体；服务端用它按块解压请求体，解压后的大小超过上限时立即停止（防止解压炸弹）。
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖：pip install zstandard
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+IDENTITY = 'identity'
+
+# 解压时每次最多产出的字节数
+_DECODE_CHUNK = 64 * 1024
+
+
+class UnsupportedEncoding(ValueError):
+    """本机不支持的 Content-Encoding"""
+
+
+class InvalidEncodedBody(ValueError):
+    """压缩数据损坏或不完整"""
+
+
+class DecodedTooLarge(Exception):
+    """解压后的大小超过上限"""
+
+
+def available_encodings():
+    """本机可以压缩与解压的编码，按优先顺序"""
+    return [ZSTD, GZIP] if zstandard is not None else [GZIP]
+
+
+def parse_accept_encoding(header):
+    """Accept-Encoding 头中接受的编码（小写；q=0 的不算）"""
+    accepted = set()
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    return accepted
+
+
+def choose_encoding(accepted, offered=None):
+    """
+    从对方接受的编码（集合/列表，或 Accept-Encoding 头）中选出 offered（默认为本机支持的编码）里最靠前的一个；
+    没有共同的编码时返回 None
+    """
+    if isinstance(accepted, str):
+        accepted = parse_accept_encoding(accepted)
+    for encoding in offered or available_encodings():
+        if encoding in accepted or '*' in accepted:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    if encoding == GZIP:
+        # 与 gzip.compress 相同的格式，但不写入时间戳，相同内容的压缩结果相同
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if encoding == ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise UnsupportedEncoding(encoding)
+
+
+class Decoder:
+    """
+    按块解压；feed() 返回本块解出的数据，累计超过 limit 字节时抛出 DecodedTooLarge，
+    内存占用不超过 limit 加一个解压块。identity 只计数。
+    """
+
+    def __init__(self, encoding, limit):
+        self.encoding = (encoding or IDENTITY).lower()
+        self.limit = limit
+        self.size = 0
+        if self.encoding == GZIP:
+            self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == ZSTD and zstandard is not None:
+            self._sink = _Sink(self._count)
+            self._writer = zstandard.ZstdDecompressor().stream_writer(self._sink, write_size=_DECODE_CHUNK,
+                                                                      write_return_read=True)
+        elif self.encoding != IDENTITY:
+            raise UnsupportedEncoding(self.encoding)
+
+    def feed(self, data):
+        if not data:
+            return b''
+        if self.encoding == IDENTITY:
+            self._count(data)
+            return data
+        if self.encoding == GZIP:
+            return self._feed_gzip(data)
+        try:
+            self._writer.write(data)
+        except zstandard.ZstdError as e:
+            raise InvalidEncodedBody(str(e))
+        return self._sink.take()
+
+    def finish(self):
+        """输入结束；压缩数据不完整时抛出 InvalidEncodedBody"""
+        if self.encoding == GZIP:
+            if not self._zlib.eof:
+                raise InvalidEncodedBody("truncated gzip data")
+        elif self.encoding == ZSTD:
+            try:
+                self._writer.flush()
+            except zstandard.ZstdError as e:
+                raise InvalidEncodedBody(str(e))
+            return self._sink.take()
+        return b''
+
+    def _feed_gzip(self, data):
+        out = []
+        try:
+            while data and not self._zlib.eof:
+                chunk = self._zlib.decompress(data, _DECODE_CHUNK)
+                out.append(self._count(chunk))
+                data = self._zlib.unconsumed_tail
+        except zlib.error as e:
+            raise InvalidEncodedBody(str(e))
+        return b''.join(out)
+
+    def _count(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.limit:
+            raise DecodedTooLarge(self.size)
+        return chunk
+
+
+class _Sink:
+    """zstd 解压输出的接收端，每收到一块就检查累计大小"""
+
+    def __init__(self, count):
+        self._count = count
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(self._count(bytes(data)))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
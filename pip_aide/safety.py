@@ -0,0 +1,86 @@
+"""
+修复命令的安全策略
+
+客户端在执行 AI 建议前用它过滤命令；服务端用同一套规则判断回答是否可用。
+"""
+import re
+import shlex
+
+ALLOWED_COMMAND_PATTERNS = [
+    r"^pip\s+install($|\s+.*)",
+    r"^pip\s+uninstall($|\s+.*)",
+    r"^python\s+-m\s+pip\s+install($|\s+.*)",
+]
+DISALLOWED_SUBSTRINGS = ["sudo", "rm ", "mv ", "dd ", "|", ";", "&&", ">", "<"]
+
+
+def extract_code_block_lines(suggestion):
+    """返回 ``` 代码块中的每一行（原样保留）"""
+    lines = suggestion.strip().split('\n')
+    potential_commands = []
+    in_code_block = False
+    for line in lines:
+        if line.startswith('```'):
+            in_code_block = not in_code_block
+        elif in_code_block:
+            potential_commands.append(line)
+    return potential_commands
+
+
+def find_disallowed_substrings(cmd_str):
+    return [sub for sub in DISALLOWED_SUBSTRINGS if sub in cmd_str]
+
+
+def matches_allowed_pattern(cmd_str):
+    return any(re.match(pattern, cmd_str, re.IGNORECASE) for pattern in ALLOWED_COMMAND_PATTERNS)
+
+
+def is_safe_command(cmd_str):
+    """命令能被 shlex 解析、不含禁止的子串且匹配允许的模式"""
+    try:
+        shlex.split(cmd_str)
+    except ValueError:
+        return False
+    return not find_disallowed_substrings(cmd_str) and matches_allowed_pattern(cmd_str)
+
+
+class CommandStreamParser:
+    """
+    增量版的 extract_code_block_lines：流式回答逐段 feed 进来，
+    代码块中的一行在遇到换行时即返回，不必等整个回答结束。
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """回答作废（例如服务端升级到下一级模型）时从头开始"""
+        self._buffer = ''
+        self._in_code_block = False
+        self._started = False
+
+    def feed(self, text):
+        """加入一段文本，返回其中新完成的代码块行"""
+        if not self._started:
+            # 与 extract_code_block_lines 一致：忽略回答开头的空白
+            text = text.lstrip()
+            if not text:
+                return []
+            self._started = True
+        self._buffer += text
+        lines = []
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            lines.extend(self._line(line))
+        return lines
+
+    def close(self):
+        """回答结束，返回最后一行（没有以换行结尾时）中的命令"""
+        line, self._buffer = self._buffer.rstrip(), ''
+        return self._line(line) if line else []
+
+    def _line(self, line):
+        if line.startswith('```'):
+            self._in_code_block = not self._in_code_block
+            return []
+        return [line] if self._in_code_block else []
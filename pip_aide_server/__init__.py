@@ -0,0 +1,5 @@
+"""
+pip-aide 服务端
+
+应用本身见 server.py；pipai_server.py 与 server/pip-aide_server.py 两个入口只设置各自的默认提示词配置与监听地址。
+"""
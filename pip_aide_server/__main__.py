@@ -0,0 +1,26 @@
+"""
+python -m pip_aide_server [--profile 名称] [--host 地址] [--port 端口]
+"""
+import argparse
+import os
+
+from .profiles import PROFILES
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pip_aide_server', description="Run the pip-aide AI server")
+    parser.add_argument('--profile', choices=sorted(PROFILES), help="Prompt profile (default: $PIPAI_PROMPT_PROFILE)")
+    parser.add_argument('--host', help="Listen address (default: $PIPAI_HOST or 0.0.0.0)")
+    parser.add_argument('--port', type=int, help="Listen port (default: $PIPAI_PORT or 8000)")
+    args = parser.parse_args(argv)
+    # 命令行参数经环境变量传给 server 模块，多 worker 模式下的子进程同样继承
+    for name, value in (('PIPAI_PROMPT_PROFILE', args.profile), ('PIPAI_HOST', args.host), ('PIPAI_PORT', args.port)):
+        if value:
+            os.environ[name] = str(value)
+    # 按所选配置组装 app
+    from .server import run
+    run(host='0.0.0.0', port=8000)
+
+
+if __name__ == "__main__":
+    main()
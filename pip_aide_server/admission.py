@@ -0,0 +1,132 @@
+"""
+准入控制
+
+- 每个 machine_id 一个令牌桶，限制单个客户端的请求速率
+- 需要调用模型的请求还要经过全局令牌桶与并发上限；超过并发上限的请求进入有界等待队列，
+  队列已满或等待超时时立即拒绝（HTTP 429 + Retry-After）
+- 缓存命中不占用上游并发与队列，因此总是优先于需要调用模型的请求
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """请求被拒绝；retry_after 为建议客户端等待的秒数"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """取一个令牌；成功返回 0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else 60
+
+
+class AdmissionController:
+    def __init__(self, client_rate=1.0, client_burst=10, global_rate=20.0, global_burst=40,
+                 max_concurrent=16, max_queue=64, max_queue_time=10.0, max_clients=100000):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_clients = max_clients
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self._clients = OrderedDict()
+        self._global = TokenBucket(global_rate, global_burst)
+        self._active = 0
+        self._waiters = deque()
+        self._service_time = 5.0  # 上游调用耗时的滑动平均，用于估算 Retry-After
+        self.rejected = {}
+
+    def check_client(self, machine_id):
+        """单客户端限速，所有请求都要经过"""
+        bucket = self._clients.get(machine_id)
+        if bucket is None:
+            bucket = TokenBucket(self.client_rate, self.client_burst)
+            self._clients[machine_id] = bucket
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(machine_id)
+        wait = bucket.take()
+        if wait:
+            self._reject('client_rate', wait)
+
+    @asynccontextmanager
+    async def upstream_slot(self):
+        """占用一个上游并发名额，必要时在有界队列中等待"""
+        wait = self._global.take()
+        if wait:
+            self._reject('global_rate', wait)
+
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+        else:
+            if len(self._waiters) >= self.max_queue:
+                self._reject('queue_full', self._estimated_wait(len(self._waiters)))
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), self.max_queue_time)
+            except asyncio.TimeoutError:
+                if not waiter.done():
+                    waiter.cancel()
+                    self._reject('queue_timeout', self._estimated_wait(len(self._waiters)))
+                # 超时的同时恰好拿到了名额，照常继续
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                else:
+                    waiter.cancel()
+                raise
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time += 0.2 * ((time.monotonic() - started) - self._service_time)
+            self._release()
+
+    def _release(self):
+        # 名额直接交给队首仍在等待的请求
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    def _estimated_wait(self, queued):
+        return min(60, self._service_time * (queued + 1) / max(self.max_concurrent, 1))
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def stats(self):
+        return {
+            'active': self._active,
+            'queued': sum(1 for w in self._waiters if not w.done()),
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'clients_tracked': len(self._clients),
+            'rejected': dict(self.rejected),
+        }
@@ -0,0 +1,48 @@
+"""
+批量分析：同一批次中指纹相同的错误只分析一次，不同的并发分析；单个条目失败只体现在该条目的结果上
+"""
+import asyncio
+
+from fastapi import HTTPException
+
+from .admission import AdmissionRejected
+from .fingerprint import error_fingerprint
+from .jsonlog import get_logger
+
+log = get_logger('batch')
+
+
+def group_by_fingerprint(items):
+    """[(条目 id, 错误日志)] -> {fingerprint: (错误日志, [条目 id])}，保持首次出现的顺序"""
+    groups = {}
+    for item_id, error_context in items:
+        groups.setdefault(error_fingerprint(error_context), (error_context, []))[1].append(item_id)
+    return groups
+
+
+async def analyze_batch(groups, analyze):
+    """
+    groups 来自 group_by_fingerprint；analyze(fingerprint, error_context) 为返回结果 dict 的协程函数。
+    返回 {条目 id: 结果}，每个结果带 status：成功为 200，AdmissionRejected 为 429（带 retry_after），
+    HTTPException 为其状态码，其他异常为 500。
+    """
+    async def run(fingerprint, error_context):
+        try:
+            return dict(await analyze(fingerprint, error_context), status=200)
+        except AdmissionRejected as e:
+            return {'status': 429, 'detail': f"Server is busy ({e.reason}), retry later", 'retry_after': e.retry_after}
+        except HTTPException as e:
+            result = {'status': e.status_code, 'detail': e.detail}
+            if e.headers and e.headers.get('Retry-After'):
+                result['retry_after'] = int(e.headers['Retry-After'])
+            return result
+        except Exception as e:
+            log.error("Batch item failed", extra={'fingerprint': fingerprint[:12], 'error': str(e)})
+            return {'status': 500, 'detail': "Analysis failed"}
+
+    outcomes = await asyncio.gather(*(run(fingerprint, context) for fingerprint, (context, _) in groups.items()))
+    results = {}
+    for (_, ids), outcome in zip(groups.values(), outcomes):
+        for item_id in ids:
+            results[item_id] = outcome
+    return results
@@ -0,0 +1,330 @@
+"""
+建议缓存：进程内 LRU + SQLite 持久层，按错误指纹索引
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 内存层满时，在最久未使用的这么多条目中淘汰 rank 最低的一条
+EVICTION_SAMPLE = 8
+
+
+def is_negative_suggestion(suggestion):
+    """UNCERTAIN 与上游错误（形如 “UNCERTAIN (API error 500)”）都属于负结果"""
+    return suggestion.strip().startswith('UNCERTAIN')
+
+
+class SuggestionCache:
+    """
+    两级缓存。内存层是有上限的 LRU，持久层是 SQLite 文件，重启后依然有效。
+    正常建议与负结果使用不同的 TTL。过期的正常建议再保留 stale_ttl 秒，
+    上游不可用（降级模式）时仍可通过 get_stale 返回。
+
+    多个 worker 进程可以共用同一个 SQLite 文件（WAL 模式）。失效操作会递增文件中的代数，
+    其他进程最多 sync_interval 秒后发现并清空自己的内存层。
+
+    rank(fingerprint, suggestion) 给出时（如修复成功率），内存层淘汰时优先淘汰排序值低的条目。
+
+    事件循环中使用 aget/aput/aget_stale/ainvalidate：内存层直接查询，SQLite 层在缓存自己的线程中执行，
+    其他 worker 写入时的 busy_timeout 等待不会阻塞事件循环。同名的同步方法供线程与测试使用。
+    """
+
+    def __init__(self, path=None, max_entries=2048, ttl=7 * 24 * 3600, negative_ttl=300, stale_ttl=30 * 24 * 3600,
+                 sync_interval=1.0, rank=None):
+        self.max_entries = max_entries
+        self.rank = rank
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.warmed = False
+        self.sync_interval = sync_interval
+        self._generation = 0
+        self._generation_checked = 0.0
+        self._memory = OrderedDict()  # fingerprint -> (suggestion, expires_at)
+        # _lock 只保护内存层与计数，持有期间不访问 SQLite；_db_lock 保护连接。同时持有时先取 _db_lock
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._hits = 0
+        self._memory_hits = 0
+        self._misses = 0
+        self._stale_hits = 0
+        self._db = None
+        self._executor = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # timeout 即 busy_timeout：其他 worker 正在写入时等待而不是报错
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS suggestions ('
+                'fingerprint TEXT PRIMARY KEY, suggestion TEXT NOT NULL, '
+                'negative INTEGER NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            self._db.commit()
+            self._generation = self._read_generation()
+            self._generation_checked = time.monotonic()
+            # 连接同时只有一个线程使用，一个线程足够
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipai-cache')
+
+    def get(self, fingerprint, count=True):
+        """返回缓存的建议，未命中或已过期时返回 None；count=False 时不计入命中统计"""
+        if self._generation_due():
+            self._sync_generation()
+        suggestion = self._get_memory(fingerprint, count)
+        if suggestion is None:
+            suggestion = self._get_persistent(fingerprint, count)
+        return suggestion
+
+    async def aget(self, fingerprint, count=True):
+        """get 的协程版本"""
+        if self._db is None:
+            return self.get(fingerprint, count)
+        if self._generation_due():
+            await self._run(self._sync_generation)
+        suggestion = self._get_memory(fingerprint, count)
+        if suggestion is None:
+            suggestion = await self._run(self._get_persistent, fingerprint, count)
+        return suggestion
+
+    def get_stale(self, fingerprint):
+        """降级模式下使用：返回仍在 stale_ttl 内的过期正常建议"""
+        with self._lock:
+            entry = self._memory.get(fingerprint)
+        if entry is None:
+            entry = self._select(fingerprint)
+        return self._stale_result(entry)
+
+    async def aget_stale(self, fingerprint):
+        """get_stale 的协程版本"""
+        with self._lock:
+            entry = self._memory.get(fingerprint)
+        if entry is None and self._db is not None:
+            entry = await self._run(self._select, fingerprint)
+        return self._stale_result(entry)
+
+    def warm(self):
+        """启动时把最近写入的未过期条目载入内存层，返回载入的条目数"""
+        loaded = 0
+        if self._db is not None:
+            with self._db_lock:
+                rows = self._db.execute(
+                    'SELECT fingerprint, suggestion, expires_at FROM suggestions WHERE expires_at > ? '
+                    'ORDER BY created_at DESC LIMIT ?',
+                    (time.time(), self.max_entries)
+                ).fetchall()
+            with self._lock:
+                # 最新的条目最后放入，位于 LRU 的最近使用端
+                for fingerprint, suggestion, expires_at in reversed(rows):
+                    self._remember(fingerprint, suggestion, expires_at)
+            loaded = len(rows)
+        self.warmed = True
+        return loaded
+
+    def put(self, fingerprint, suggestion):
+        """写入缓存；负结果使用较短的 TTL"""
+        row = self._put_memory(fingerprint, suggestion)
+        if self._db is not None:
+            self._insert(row)
+
+    async def aput(self, fingerprint, suggestion):
+        """put 的协程版本；返回时 SQLite 也已写入，其他 worker 可以读到"""
+        row = self._put_memory(fingerprint, suggestion)
+        if self._db is not None:
+            await self._run(self._insert, row)
+
+    def invalidate(self, fingerprint=None):
+        """删除指定指纹的缓存；不传指纹时清空全部。返回删除的条目数"""
+        removed = self._invalidate_memory(fingerprint)
+        if self._db is not None:
+            removed = max(removed, self._delete(fingerprint))
+        return removed
+
+    async def ainvalidate(self, fingerprint=None):
+        """invalidate 的协程版本"""
+        removed = self._invalidate_memory(fingerprint)
+        if self._db is not None:
+            removed = max(removed, await self._run(self._delete, fingerprint))
+        return removed
+
+    def stats(self, persistent=True):
+        """persistent=False 时不统计 SQLite 中的条目数（指标采集使用，不访问数据库）"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            stats = {
+                'hits': self._hits,
+                'memory_hits': self._memory_hits,
+                'misses': self._misses,
+                'hit_ratio': round(self._hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'stale_hits': self._stale_hits,
+            }
+        if persistent and self._db is not None:
+            with self._db_lock:
+                stats['persistent_entries'] = self._db.execute('SELECT COUNT(*) FROM suggestions').fetchone()[0]
+        return stats
+
+    async def astats(self):
+        """stats 的协程版本"""
+        if self._db is None:
+            return self.stats()
+        return await self._run(self.stats)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get_memory(self, fingerprint, count):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(fingerprint)
+            if entry is None:
+                if self._db is None and count:
+                    self._misses += 1
+                return None
+            suggestion, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(fingerprint)
+                if count:
+                    self._hits += 1
+                    self._memory_hits += 1
+                return suggestion
+            if not self._keep_stale(suggestion, expires_at, now):
+                del self._memory[fingerprint]
+            if self._db is None and count:
+                self._misses += 1
+            return None
+
+    def _get_persistent(self, fingerprint, count):
+        if self._db is None:
+            return None
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT suggestion, expires_at FROM suggestions WHERE fingerprint = ?',
+                (fingerprint,)
+            ).fetchone()
+            if row is not None and row[1] <= now and not self._keep_stale(row[0], row[1], now):
+                self._db.execute('DELETE FROM suggestions WHERE fingerprint = ?', (fingerprint,))
+                self._db.commit()
+        with self._lock:
+            if row is not None and row[1] > now:
+                self._remember(fingerprint, row[0], row[1])
+                if count:
+                    self._hits += 1
+                return row[0]
+            if count:
+                self._misses += 1
+            return None
+
+    def _select(self, fingerprint):
+        with self._db_lock:
+            return self._db.execute(
+                'SELECT suggestion, expires_at FROM suggestions WHERE fingerprint = ?',
+                (fingerprint,)
+            ).fetchone()
+
+    def _stale_result(self, entry):
+        now = time.time()
+        if entry is not None and (entry[1] > now or self._keep_stale(entry[0], entry[1], now)):
+            with self._lock:
+                self._stale_hits += 1
+            return entry[0]
+        return None
+
+    def _put_memory(self, fingerprint, suggestion):
+        negative = is_negative_suggestion(suggestion)
+        now = time.time()
+        expires_at = now + (self.negative_ttl if negative else self.ttl)
+        with self._lock:
+            self._remember(fingerprint, suggestion, expires_at)
+        return fingerprint, suggestion, int(negative), now, expires_at
+
+    def _insert(self, row):
+        with self._db_lock:
+            self._db.execute('INSERT OR REPLACE INTO suggestions VALUES (?, ?, ?, ?, ?)', row)
+            self._db.commit()
+
+    def _invalidate_memory(self, fingerprint):
+        with self._lock:
+            if fingerprint is None:
+                removed = len(self._memory)
+                self._memory.clear()
+                return removed
+            return 1 if self._memory.pop(fingerprint, None) is not None else 0
+
+    def _delete(self, fingerprint):
+        with self._db_lock:
+            if fingerprint is None:
+                removed = self._db.execute('DELETE FROM suggestions').rowcount
+            else:
+                removed = self._db.execute('DELETE FROM suggestions WHERE fingerprint = ?', (fingerprint,)).rowcount
+            self._bump_generation()
+            return removed
+
+    def _read_generation(self):
+        row = self._db.execute("SELECT value FROM cache_meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def _bump_generation(self):
+        # 在删除所在的写事务中完成，其他进程看到新代数时删除也已生效
+        generation = self._read_generation()
+        if generation != self._generation:
+            with self._lock:
+                self._memory.clear()  # 期间其他进程也做过失效
+        self._db.execute(
+            "INSERT INTO cache_meta VALUES ('generation', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+        self._db.commit()
+        self._generation = generation + 1
+
+    def _generation_due(self):
+        return self._db is not None and time.monotonic() - self._generation_checked >= self.sync_interval
+
+    def _sync_generation(self):
+        """其他进程执行过失效操作时清空本进程的内存层"""
+        self._generation_checked = time.monotonic()
+        with self._db_lock:
+            if self._db is None:
+                return
+            generation = self._read_generation()
+            if generation != self._generation:
+                self._generation = generation
+                with self._lock:
+                    self._memory.clear()
+
+    def _keep_stale(self, suggestion, expires_at, now):
+        return expires_at + self.stale_ttl > now and not is_negative_suggestion(suggestion)
+
+    def _remember(self, fingerprint, suggestion, expires_at):
+        # 调用方持有 _lock
+        self._memory[fingerprint] = (suggestion, expires_at)
+        self._memory.move_to_end(fingerprint)
+        while len(self._memory) > self.max_entries:
+            if self.rank is None:
+                self._memory.popitem(last=False)
+                continue
+            # 最近写入的条目不参与比较，避免刚写入就被淘汰
+            sample = []
+            for key, (suggestion, _) in self._memory.items():
+                if key == fingerprint or len(sample) >= EVICTION_SAMPLE:
+                    break
+                sample.append((self.rank(key, suggestion), key))
+            if not sample:
+                self._memory.popitem(last=False)
+                continue
+            del self._memory[min(sample, key=lambda item: item[0])[1]]
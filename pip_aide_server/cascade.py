@@ -0,0 +1,233 @@
+"""
+模型级联：先用快速、便宜的模型在较短期限内作答，
+回答为 UNCERTAIN、没有代码块中的 pip 命令或不符合客户端的命令安全策略时，再升级到更强的模型。
+"""
+import asyncio
+import json
+import time
+
+from pip_aide.safety import extract_code_block_lines, is_safe_command
+
+from .router import CLOSED, UpstreamError, UpstreamRouter, load_backends
+
+ESCALATE_UNCERTAIN = 'uncertain'
+ESCALATE_NO_COMMAND = 'no_command'
+ESCALATE_UNSAFE = 'unsafe'
+ESCALATE_ERROR = 'error'
+
+
+def assess_suggestion(suggestion):
+    """回答可以直接返回时为 None，否则返回需要升级的原因"""
+    if 'UNCERTAIN' in suggestion:
+        return ESCALATE_UNCERTAIN
+    # 与客户端（parse_and_filter_commands）一样检查原始行：缩进或带 \r 的命令在客户端同样会被拒绝
+    commands = [line for line in extract_code_block_lines(suggestion) if line.strip()]
+    if not commands:
+        return ESCALATE_NO_COMMAND
+    if not all(is_safe_command(cmd) for cmd in commands):
+        return ESCALATE_UNSAFE
+    return None
+
+
+class CascadeTier:
+    """级联中的一级：一组上游 + 作答期限与采样参数"""
+
+    def __init__(self, name, router, deadline=None, temperature=0.6, max_tokens=150):
+        self.name = name
+        self.router = router
+        self.deadline = deadline
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.calls = 0
+        self.answered = 0
+        self.escalations = {}
+        self.total_latency = 0.0
+        self.total_tokens = 0
+
+    async def complete(self, messages):
+        """返回回答文本；超过期限或上游失败时抛出 UpstreamError"""
+        self.calls += 1
+        started = time.monotonic()
+        try:
+            call = self.router.complete(messages, temperature=self.temperature, max_tokens=self.max_tokens,
+                                        timeout=self.deadline)
+            if self.deadline:
+                ai_data, backend = await asyncio.wait_for(call, self.deadline)
+            else:
+                ai_data, backend = await call
+        except asyncio.TimeoutError:
+            raise UpstreamError(f"tier {self.name} exceeded its {self.deadline}s deadline")
+        finally:
+            self.total_latency += time.monotonic() - started
+        usage = ai_data.get('usage') or {}
+        self.total_tokens += usage.get('total_tokens', 0) or 0
+        try:
+            return ai_data['choices'][0]['message']['content'].strip(), backend
+        except (KeyError, IndexError, TypeError, AttributeError) as e:
+            raise UpstreamError(f"Unexpected upstream payload: {e}")
+
+    async def stream(self, messages):
+        """逐个产出回答片段；超过期限或上游失败时抛出 UpstreamError"""
+        self.calls += 1
+        started = time.monotonic()
+        chunks = self.router.stream(messages, temperature=self.temperature, max_tokens=self.max_tokens,
+                                    timeout=self.deadline)
+        try:
+            while True:
+                remaining = self.deadline - (time.monotonic() - started) if self.deadline else None
+                try:
+                    if remaining is not None:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(remaining, 0))
+                    else:
+                        chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise UpstreamError(f"tier {self.name} exceeded its {self.deadline}s deadline")
+                yield chunk
+        finally:
+            await chunks.aclose()
+            self.total_latency += time.monotonic() - started
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'deadline': self.deadline,
+            'calls': self.calls,
+            'answered': self.answered,
+            'escalations': dict(self.escalations),
+            'avg_latency': round(self.total_latency / self.calls, 4) if self.calls else None,
+            'total_tokens': self.total_tokens,
+            'upstreams': self.router.snapshot(),
+        }
+
+
+class CascadeResult:
+    def __init__(self, suggestion, tier, escalations):
+        self.suggestion = suggestion
+        self.tier = tier
+        self.escalations = escalations  # [(tier 名称, 原因)]
+
+
+class ModelCascade:
+    """按顺序尝试各级模型，返回第一个可用的回答"""
+
+    def __init__(self, tiers):
+        if not tiers:
+            raise ValueError("At least one cascade tier is required")
+        self.tiers = tiers
+
+    async def run(self, messages):
+        fallback = None
+        escalations = []
+        for i, tier in enumerate(self.tiers):
+            last = i == len(self.tiers) - 1
+            try:
+                suggestion, backend = await tier.complete(messages)
+            except UpstreamError as e:
+                reason = ESCALATE_ERROR
+                if fallback is None:
+                    fallback = CascadeResult(f"UNCERTAIN ({e})", tier.name, [])
+            else:
+                reason = assess_suggestion(suggestion)
+                if reason is None or last:
+                    tier.answered += 1
+                    return CascadeResult(suggestion, tier.name, escalations)
+                # 模型给出的回答（即使不理想）优先于上游错误
+                if fallback is None or fallback.suggestion.startswith('UNCERTAIN ('):
+                    fallback = CascadeResult(suggestion, tier.name, [])
+            escalations.append((tier.name, reason))
+            tier.escalations[reason] = tier.escalations.get(reason, 0) + 1
+        fallback.escalations = escalations
+        return fallback
+
+    async def stream(self, messages, on_event):
+        """
+        流式版本的 run。每一级开始作答时调用 on_event('tier', {'name': 名称, 'final': 是否最后一级})，
+        回答片段经 on_event('delta', 片段) 交出；某一级的回答需要升级时调用 on_event('reset', 原因)，
+        此前交出的片段作废。返回 CascadeResult。
+        """
+        fallback = None
+        escalations = []
+        for i, tier in enumerate(self.tiers):
+            last = i == len(self.tiers) - 1
+            parts = []
+            on_event('tier', {'name': tier.name, 'final': last})
+            try:
+                async for chunk in tier.stream(messages):
+                    parts.append(chunk)
+                    on_event('delta', chunk)
+                suggestion = ''.join(parts).strip()
+                if not suggestion:
+                    raise UpstreamError("Empty streamed answer")
+            except UpstreamError as e:
+                reason = ESCALATE_ERROR
+                if fallback is None:
+                    fallback = CascadeResult(f"UNCERTAIN ({e})", tier.name, [])
+            else:
+                reason = assess_suggestion(suggestion)
+                if reason is None or last:
+                    tier.answered += 1
+                    return CascadeResult(suggestion, tier.name, escalations)
+                if fallback is None or fallback.suggestion.startswith('UNCERTAIN ('):
+                    fallback = CascadeResult(suggestion, tier.name, [])
+            escalations.append((tier.name, reason))
+            tier.escalations[reason] = tier.escalations.get(reason, 0) + 1
+            if parts:
+                on_event('reset', reason)
+        fallback.escalations = escalations
+        return fallback
+
+    def reachable(self):
+        """任意一级有可用上游时即可作答"""
+        return any(tier.router.reachable() for tier in self.tiers)
+
+    def degraded(self):
+        """所有上游的熔断器都已打开（或半开试探中）"""
+        return all(backend.state != CLOSED for tier in self.tiers for backend in tier.router.backends)
+
+    def start_probing(self):
+        for tier in self.tiers:
+            tier.router.start_probing()
+
+    async def stop_probing(self):
+        for tier in self.tiers:
+            await tier.router.stop_probing()
+
+    def snapshot(self):
+        return {'tiers': [tier.snapshot() for tier in self.tiers]}
+
+
+def load_cascade(spec, default_router, default_base_url, default_key_env, timeout=20, max_tokens=150, router_options=None):
+    """
+    解析级联配置。spec 为 JSON 数组或 JSON 文件路径，按从便宜到昂贵的顺序排列，例如:
+    [{"name": "fast", "model": "deepseek-chat", "deadline": 6, "temperature": 0.3},
+     {"name": "strong", "model": "deepseek-reasoner", "deadline": 20, "max_tokens": 300}]
+    每级可用 "upstreams"（格式同 PIPAI_UPSTREAMS）指定自己的上游，否则使用默认上游地址与密钥。
+    spec 为空时只有一级，直接使用 default_router。
+    """
+    if not spec:
+        return ModelCascade([CascadeTier('default', default_router, max_tokens=max_tokens)])
+    if spec.lstrip().startswith('['):
+        entries = json.loads(spec)
+    else:
+        with open(spec, encoding='utf-8') as f:
+            entries = json.load(f)
+
+    tiers = []
+    for i, entry in enumerate(entries):
+        name = entry.get('name') or f"tier-{i}"
+        upstreams = entry.get('upstreams')
+        if upstreams is None:
+            upstreams = [{'name': name, 'base_url': entry.get('base_url', default_base_url),
+                          'model': entry['model'], 'api_key_env': entry.get('api_key_env', default_key_env)}]
+        backends = load_backends(json.dumps(upstreams), default_base_url, entry.get('model'), default_key_env,
+                                 timeout=entry.get('deadline') or timeout)
+        tiers.append(CascadeTier(
+            name,
+            UpstreamRouter(backends, **(router_options or {})),
+            deadline=entry.get('deadline'),
+            temperature=entry.get('temperature', 0.6),
+            max_tokens=entry.get('max_tokens', max_tokens),
+        ))
+    return ModelCascade(tiers)
@@ -0,0 +1,183 @@
+"""
+上游流量的录制与回放（cassette）
+
+record 模式下每次上游调用（包括流式调用与失败的调用）以一行 JSON 追加到 cassette 文件，
+按规范化请求（模型、消息、采样参数）的摘要索引，只保存回答、用量、耗时与流式片段的时间偏移，
+不保存提示词。文件名以 .gz 结尾时按 gzip 压缩。
+
+replay 模式下不访问上游，按相同的摘要取出录制的回答，并按录制时的耗时（乘以 speed）延迟返回；
+同一请求录制了多次时依次轮流返回，保留真实的回答分布。没有录制的请求按上游错误处理。
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .router import UpstreamError
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+
+def request_key(payload):
+    """规范化请求的摘要；stream 与否、上游地址和密钥不影响"""
+    canonical = {k: payload.get(k) for k in ('model', 'messages', 'temperature', 'max_tokens')}
+    text = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class Cassette:
+    """
+    mode: 'record' 或 'replay'
+    speed: 回放时耗时的倍数，1 为按录制时的耗时，0 为不等待
+    """
+
+    def __init__(self, path, mode=REPLAY, speed=1.0):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.speed = max(float(speed), 0.0)
+        self._entries = {}  # key -> [录制记录]
+        self._cursors = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        self._file = None
+        if mode == REPLAY:
+            self._load()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = _open(path, 'a')
+
+    # ---- 代替上游调用 ----
+
+    def post(self, backend, payload, timeout=None):
+        """代替 Backend.post：录制模式下调用真实上游并记录，回放模式下返回录制的响应"""
+        if self.mode == REPLAY:
+            entry = self._next(payload)
+            self._sleep(entry['latency'])
+            if 'error' in entry:
+                raise UpstreamError(entry['error'])
+            data = {"choices": [{"message": {"content": _content(entry)}}]}
+            if entry.get('usage'):
+                data['usage'] = entry['usage']
+            return data
+
+        started = time.monotonic()
+        try:
+            data = backend.live_post(payload, timeout)
+        except UpstreamError as e:
+            self._write(payload, latency=time.monotonic() - started, error=str(e))
+            raise
+        try:
+            content = data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            content = None  # 格式错误的响应由调用方报错，不录制
+        if content is not None:
+            self._write(payload, latency=time.monotonic() - started, content=content, usage=data.get('usage'))
+        return data
+
+    def stream(self, backend, payload, timeout=None):
+        """代替 Backend.stream：逐个产出回答片段"""
+        if self.mode == REPLAY:
+            entry = self._next(payload)
+            started = time.monotonic()
+            chunks = entry.get('chunks') or [[entry['latency'], _content(entry)]]
+            for offset, text in chunks:
+                self._sleep(offset - (time.monotonic() - started) / (self.speed or 1))
+                yield text
+            if 'error' in entry:
+                self._sleep(entry['latency'] - (time.monotonic() - started) / (self.speed or 1))
+                raise UpstreamError(entry['error'])
+            return
+
+        started = time.monotonic()
+        chunks = []
+        try:
+            for text in backend.live_stream(payload, timeout):
+                chunks.append([round(time.monotonic() - started, 3), text])
+                yield text
+        except UpstreamError as e:
+            self._write(payload, latency=time.monotonic() - started, error=str(e), chunks=chunks)
+            raise
+        # 调用方提前停止读取时（GeneratorExit）不录制不完整的回答
+        self._write(payload, latency=time.monotonic() - started, chunks=chunks)
+
+    def _write(self, payload, latency, **fields):
+        entry = {'key': request_key(payload), 'model': payload.get('model'), 'latency': round(latency, 3)}
+        entry.update((k, v) for k, v in fields.items() if v not in (None, []))
+        line = json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            self.recorded += 1
+
+    # ---- 回放 ----
+
+    def _load(self):
+        with _open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # 录制进程被中断时最后一行可能不完整
+                self._entries.setdefault(entry['key'], []).append(entry)
+
+    def _next(self, payload):
+        key = request_key(payload)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.misses += 1
+                raise UpstreamError(f"No cassette recording for request {key[:12]}")
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self.replayed += 1
+            return entries[cursor % len(entries)]
+
+    def _sleep(self, seconds):
+        if self.speed and seconds > 0:
+            time.sleep(seconds * self.speed)
+
+    def stats(self):
+        with self._lock:
+            stats = {'mode': self.mode, 'path': self.path, 'recorded': self.recorded,
+                     'replayed': self.replayed, 'misses': self.misses}
+            if self.mode == REPLAY:
+                stats['requests'] = len(self._entries)
+                stats['recordings'] = sum(len(v) for v in self._entries.values())
+                stats['speed'] = self.speed
+            return stats
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _content(entry):
+    if 'content' in entry:
+        return entry['content']
+    return ''.join(text for _, text in entry.get('chunks', []))
+
+
+def attach_cassette(model_cascade, cassette):
+    """让级联中所有上游的调用经过 cassette"""
+    for tier in model_cascade.tiers:
+        for backend in tier.router.backends:
+            backend.cassette = cassette
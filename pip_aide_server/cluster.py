@@ -0,0 +1,239 @@
+"""
+集群模式：多个服务端节点按一致性哈希划分错误指纹
+
+每个指纹归环上的一个节点所有，只有所有者缓存它的建议、调用模型；其他节点收到请求后经连接池转发给所有者
+（内部接口 /cluster/...，不会再次转发，最多一跳）。节点列表是静态配置；增删节点或某个节点暂时不可达时，
+只有归该节点所有的那部分指纹（约 1/N）改由环上的下一个节点负责，其余指纹的所有者不变。
+"""
+import asyncio
+import bisect
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from fastapi import HTTPException
+from requests.adapters import HTTPAdapter
+
+from .admission import AdmissionRejected
+from .jsonlog import current_request, get_logger
+
+log = get_logger('cluster')
+
+TOKEN_HEADER = 'X-Cluster-Token'
+# 转发的请求带上发起节点的地址，接收方据此不再转发
+FORWARDED_HEADER = 'X-Cluster-Forwarded'
+
+
+class PeerUnavailable(Exception):
+    """所有者节点不可达或没有正常应答，调用方改为在本节点处理"""
+
+
+def normalize_node(url):
+    return url.strip().rstrip('/')
+
+
+def _position(key):
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes, vnodes=160):
+        self.nodes = sorted({normalize_node(n) for n in nodes if n.strip()})
+        if not self.nodes:
+            raise ValueError("A hash ring needs at least one node")
+        points = sorted((_position(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._positions = [p for p, _ in points]
+        self._owners = [n for _, n in points]
+
+    def owner(self, key, skip=()):
+        """key 顺时针方向第一个不在 skip 中的节点；全部被跳过时返回 None"""
+        start = bisect.bisect(self._positions, _position(key))
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in skip:
+                return node
+        return None
+
+    def shares(self):
+        """各节点负责的哈希空间比例"""
+        shares = dict.fromkeys(self.nodes, 0.0)
+        previous = self._positions[-1] - 2 ** 64
+        for position, node in zip(self._positions, self._owners):
+            shares[node] += (position - previous) / 2 ** 64
+            previous = position
+        return shares
+
+
+class Cluster:
+    """
+    本节点在集群中的视图：按指纹找所有者，并经连接池把请求转发给其他节点。
+    连接失败或连接超时的节点在 cooldown 秒内视为不可达，它的指纹暂由环上的下一个节点负责；
+    读超时（所有者正常但分析太慢）时返回 504，不改为本地处理。
+    内部接口与转交的请求以 token 认证，token 不能为空。
+    """
+
+    def __init__(self, self_url, peers, vnodes=160, timeout=60.0, connect_timeout=1.0, cooldown=10.0, token='',
+                 max_connections=32):
+        if not token:
+            raise ValueError("A cluster token is required")
+        self.self_url = normalize_node(self_url)
+        nodes = {normalize_node(p) for p in peers if p.strip()} | {self.self_url}
+        self.ring = HashRing(nodes, vnodes=vnodes)
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.cooldown = cooldown
+        self.token = token
+        self.peers = [n for n in self.ring.nodes if n != self.self_url]
+        self._sessions = {}
+        for peer in self.peers:
+            # 每个节点一个连接池，连接数与转发线程数相同
+            session = requests.Session()
+            session.mount(peer + '/', HTTPAdapter(pool_connections=1, pool_maxsize=max_connections))
+            self._sessions[peer] = session
+        self._executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='pipai-cluster')
+        self._down_until = {}
+        self._lock = threading.Lock()
+        self.forwards = {}  # (peer, result) -> 次数
+
+    def owner(self, fingerprint):
+        """指纹的所有者节点 URL；归本节点所有时返回 None"""
+        now = time.monotonic()
+        down = {peer for peer, until in self._down_until.items() if until > now}
+        node = self.ring.owner(fingerprint, skip=down)
+        return None if node == self.self_url else node
+
+    def check_token(self, token):
+        """内部接口只接受携带集群密钥的请求"""
+        if not hmac.compare_digest((token or '').encode('utf-8'), self.token.encode('utf-8')):
+            raise HTTPException(status_code=403, detail="Invalid cluster token")
+
+    async def post(self, peer, path, payload):
+        """POST 到所有者节点，返回响应 JSON"""
+        response = await self._submit(peer, path, payload, False)
+        try:
+            return response.json()
+        except ValueError as e:
+            self._count(peer, 'error')
+            raise PeerUnavailable(f"{peer}: invalid response: {e}") from e
+
+    async def stream(self, peer, path, payload):
+        """
+        POST 到所有者节点的流式接口，返回逐块转发响应体的异步迭代器。
+        连接失败或状态码不是 2xx 时在返回之前抛出异常，调用方仍可改为本地处理。
+        """
+        response = await self._submit(peer, path, payload, True)
+        return self._relay(response)
+
+    async def _submit(self, peer, path, payload, stream):
+        # 转发请求沿用本请求的 request_id 与 correlation_id，两个节点的日志可以关联
+        context = current_request()
+        headers = {'X-Request-ID': context.get('request_id', ''), FORWARDED_HEADER: self.self_url}
+        if context.get('correlation_id'):
+            headers['X-Correlation-ID'] = context['correlation_id']
+        headers[TOKEN_HEADER] = self.token
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._send, peer, path, payload, headers, stream)
+
+    def _send(self, peer, path, payload, headers, stream):
+        try:
+            response = self._sessions[peer].post(peer + path, json=payload, headers=headers, stream=stream,
+                                                 timeout=(self.connect_timeout, self.timeout))
+        except requests.exceptions.ReadTimeout as e:
+            # 所有者连得上但这次分析太慢：节点本身正常，不改由其他节点重复调用上游
+            self._count(peer, 'timeout')
+            log.warning("Cluster peer timed out", extra={'peer': peer, 'timeout': self.timeout, 'error': str(e)})
+            raise HTTPException(status_code=504, detail="Owner node timed out") from e
+        except requests.exceptions.ConnectionError as e:
+            # 连接失败（包括连接超时）：冷却期内它的指纹由环上的下一个节点负责
+            with self._lock:
+                self._down_until[peer] = time.monotonic() + self.cooldown
+            self._count(peer, 'unreachable')
+            log.warning("Cluster peer unreachable", extra={'peer': peer, 'cooldown': self.cooldown, 'error': str(e)})
+            raise PeerUnavailable(f"{peer}: {e}") from e
+        except requests.exceptions.RequestException as e:
+            self._count(peer, 'error')
+            log.warning("Cluster forward failed", extra={'peer': peer, 'error': str(e)})
+            raise PeerUnavailable(f"{peer}: {e}") from e
+        if 200 <= response.status_code < 300:
+            self._count(peer, 'ok')
+            return response
+
+        # 所有者过载或降级：与本节点过载一样返回给客户端，不改为本地调用模型
+        retry_after = response.headers.get('Retry-After')
+        try:
+            detail = response.json().get('detail')
+        except (ValueError, AttributeError):
+            detail = None
+        response.close()
+        if response.status_code == 429:
+            self._count(peer, 'busy')
+            raise AdmissionRejected('owner_busy', int(retry_after) if (retry_after or '').isdigit() else 1)
+        if response.status_code == 503:
+            self._count(peer, 'unavailable')
+            raise HTTPException(status_code=503, detail=detail or "AI service temporarily unavailable",
+                                headers={'Retry-After': retry_after} if retry_after else None)
+        self._count(peer, 'error')
+        raise PeerUnavailable(f"{peer} returned {response.status_code}: {detail}")
+
+    async def _relay(self, response):
+        """在线程池中读取所有者的响应流，经队列交给事件循环"""
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        finished = object()
+        abandoned = threading.Event()
+
+        def deliver(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                abandoned.set()  # 事件循环已关闭
+
+        def pump():
+            try:
+                for chunk in response.iter_content(chunk_size=None):
+                    if abandoned.is_set():
+                        break
+                    deliver(chunk)
+            except requests.exceptions.RequestException as e:
+                log.warning("Cluster stream interrupted", extra={'peer': response.url, 'error': str(e)})
+            finally:
+                response.close()
+                deliver(finished)
+
+        loop.run_in_executor(self._executor, pump)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is finished:
+                    return
+                yield item
+        finally:
+            abandoned.set()
+
+    def _count(self, peer, result):
+        with self._lock:
+            self.forwards[(peer, result)] = self.forwards.get((peer, result), 0) + 1
+
+    def stats(self):
+        now = time.monotonic()
+        shares = self.ring.shares()
+        with self._lock:
+            forwards = dict(self.forwards)
+            down = {peer: round(until - now, 1) for peer, until in self._down_until.items() if until > now}
+        return {
+            'self': self.self_url,
+            'nodes': [{'node': node, 'share': round(shares[node], 4), 'self': node == self.self_url,
+                       'down_for': down.get(node, 0),
+                       'forwards': {result: n for (peer, result), n in forwards.items() if peer == node}}
+                      for node in self.ring.nodes],
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        for session in self._sessions.values():
+            session.close()
@@ -0,0 +1,158 @@
+"""
+服务端配置：统一从环境变量（以及 .env 文件）读取
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_str(name, default=''):
+    return os.getenv(name, default)
+
+
+def env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_bool(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# OpenAI/Deepseek API 配置
+# 请在.env文件中设置以下环境变量，而不是在代码中硬编码它们：
+# DEEPSEEK_API_KEY=your_api_key_here
+# OPENAI_API_BASE=https://api.openai.com/v1 (可选，默认使用Deepseek API)
+# OPENAI_MODEL=gpt-3.5-turbo (可选，默认使用deepseek-chat)
+OPENAI_API_KEY = env_str('DEEPSEEK_API_KEY')  # 不要在代码中硬编码API密钥
+OPENAI_API_BASE = env_str('OPENAI_API_BASE', 'https://api.deepseek.com/v1')
+OPENAI_MODEL = env_str('OPENAI_MODEL', 'deepseek-chat')
+UPSTREAM_TIMEOUT = env_float('PIPAI_UPSTREAM_TIMEOUT', 20)
+MAX_COMPLETION_TOKENS = env_int('PIPAI_MAX_COMPLETION_TOKENS', 150)
+# 提示词 token 预算；0 表示按模型使用 prompt.MODEL_PROMPT_BUDGETS 中的默认值
+PROMPT_TOKEN_BUDGET = env_int('PIPAI_PROMPT_TOKEN_BUDGET', 0)
+# 提示词配置（见 profiles.py）；两个入口脚本各自设置默认值
+PROMPT_PROFILE = env_str('PIPAI_PROMPT_PROFILE', 'concise')
+# 请求体大小上限（字节），在 JSON 解析之前检查；压缩的请求体按解压后的大小计
+MAX_REQUEST_BYTES = env_int('PIPAI_MAX_REQUEST_BYTES', 1024 * 1024)
+# 不小于这么多字节的响应按客户端的 Accept-Encoding 压缩（gzip，安装了 zstandard 时优先 zstd）；0 表示不压缩
+COMPRESS_MIN_BYTES = env_int('PIPAI_COMPRESS_MIN_BYTES', 1024)
+# 同时进行的上游调用数上限（调用在线程池中执行，不阻塞事件循环）
+UPSTREAM_MAX_WORKERS = env_int('PIPAI_UPSTREAM_MAX_WORKERS', 32)
+# 多上游配置：JSON 数组或 JSON 文件路径，留空时只使用上面的单个上游
+UPSTREAMS = env_str('PIPAI_UPSTREAMS')
+UPSTREAM_FAILURE_THRESHOLD = env_int('PIPAI_UPSTREAM_FAILURE_THRESHOLD', 3)
+UPSTREAM_COOLDOWN = env_float('PIPAI_UPSTREAM_COOLDOWN', 30)
+UPSTREAM_PROBE_INTERVAL = env_float('PIPAI_UPSTREAM_PROBE_INTERVAL', 15)
+# 主调用超过 “滑动平均延迟 × 倍数” 仍未返回时向次优上游发起对冲请求
+UPSTREAM_HEDGE_MULTIPLIER = env_float('PIPAI_UPSTREAM_HEDGE_MULTIPLIER', 2.0)
+UPSTREAM_MIN_HEDGE_DELAY = env_float('PIPAI_UPSTREAM_MIN_HEDGE_DELAY', 1.0)
+# 上游流量录制/回放：PIPAI_CASSETTE 为 cassette 文件路径（以 .gz 结尾时压缩），留空不启用；
+# 模式为 record（调用上游并录制）或 replay（不访问上游，按录制的回答与耗时返回）；
+# 回放耗时乘以 PIPAI_CASSETTE_SPEED，0 表示不等待
+CASSETTE = env_str('PIPAI_CASSETTE')
+CASSETTE_MODE = env_str('PIPAI_CASSETTE_MODE', 'replay')
+CASSETTE_SPEED = env_float('PIPAI_CASSETTE_SPEED', 1.0)
+# 模型级联：JSON 数组或 JSON 文件路径，按从便宜到昂贵的顺序排列；留空时不级联
+CASCADE = env_str('PIPAI_CASCADE')
+
+# 建议缓存
+CACHE_PATH = env_str('PIPAI_CACHE_PATH', os.path.join('pipai_cache', 'suggestions.sqlite3'))
+CACHE_MAX_ENTRIES = env_int('PIPAI_CACHE_MAX_ENTRIES', 2048)
+CACHE_TTL = env_float('PIPAI_CACHE_TTL', 7 * 24 * 3600)
+# UNCERTAIN 以及上游错误只做短期缓存，避免长时间“记住”一次偶发失败
+CACHE_NEGATIVE_TTL = env_float('PIPAI_CACHE_NEGATIVE_TTL', 300)
+# 过期的正常建议再保留这么久，上游全部不可用（降级模式）时仍可返回
+CACHE_STALE_TTL = env_float('PIPAI_CACHE_STALE_TTL', 30 * 24 * 3600)
+# 相似检索：精确缓存未命中时，与已有正常建议的历史请求比较 MinHash 估计的相似度，
+# 不低于阈值（0~1）时直接复用该建议；设为 0 关闭
+SIMILARITY_THRESHOLD = env_float('PIPAI_SIMILARITY_THRESHOLD', 0.8)
+SIMILARITY_MAX_ENTRIES = env_int('PIPAI_SIMILARITY_MAX_ENTRIES', 50000)
+# 启动时从错误日志回填索引的最近记录数
+SIMILARITY_BOOTSTRAP_RECORDS = env_int('PIPAI_SIMILARITY_BOOTSTRAP_RECORDS', 20000)
+# 修复结果反馈：同一建议至少有这么多台机器回报过执行结果、且成功率低于下限时，不再返回该建议
+FEEDBACK_MIN_REPORTS = env_int('PIPAI_FEEDBACK_MIN_REPORTS', 3)
+FEEDBACK_MIN_SUCCESS_RATE = env_float('PIPAI_FEEDBACK_MIN_SUCCESS_RATE', 0.3)
+# 回答发出后多久之内接受它的修复结果反馈（秒）
+FEEDBACK_TTL = env_float('PIPAI_FEEDBACK_TTL', 3600)
+# 设置后，缓存管理接口需要携带 X-Admin-Token 请求头
+ADMIN_TOKEN = env_str('PIPAI_ADMIN_TOKEN', '')
+
+# 准入控制：每个 machine_id 的令牌桶（每秒请求数 / 突发量），所有请求都要经过
+CLIENT_RATE = env_float('PIPAI_CLIENT_RATE', 1.0)
+CLIENT_BURST = env_int('PIPAI_CLIENT_BURST', 10)
+# 需要调用模型的请求：全局令牌桶、上游并发上限与有界等待队列；缓存命中不受这些限制
+GLOBAL_RATE = env_float('PIPAI_GLOBAL_RATE', 20.0)
+GLOBAL_BURST = env_int('PIPAI_GLOBAL_BURST', 40)
+MAX_CONCURRENT_UPSTREAM = env_int('PIPAI_MAX_CONCURRENT_UPSTREAM', 16)
+MAX_QUEUE = env_int('PIPAI_MAX_QUEUE', 64)
+MAX_QUEUE_TIME = env_float('PIPAI_MAX_QUEUE_TIME', 10.0)
+
+# 多进程部署：worker 数量；大于 1 时各 worker 通过 PIPAI_CACHE_PATH 指向的 SQLite 文件共享缓存，
+# 并在同一文件中用租约协调，同一指纹同时只有一个 worker 调用上游
+WORKERS = env_int('PIPAI_WORKERS', 1)
+# 监听地址与端口；留空（0）时使用入口脚本的默认值
+HOST = env_str('PIPAI_HOST', '')
+PORT = env_int('PIPAI_PORT', 0)
+# 租约有效期应大于一次完整的上游调用（含级联）；持有者崩溃时租约过期后由其他 worker 接手
+FLIGHT_LEASE_TTL = env_float('PIPAI_FLIGHT_LEASE_TTL', 60)
+FLIGHT_POLL_INTERVAL = env_float('PIPAI_FLIGHT_POLL_INTERVAL', 0.1)
+
+# 幂等键：客户端重试时携带相同的 Idempotency-Key，直接复用原始计算的结果
+IDEMPOTENCY_TTL = env_float('PIPAI_IDEMPOTENCY_TTL', 600)
+IDEMPOTENCY_MAX_KEYS = env_int('PIPAI_IDEMPOTENCY_MAX_KEYS', 10000)
+
+# 服务端运行日志（JSON 行，经队列由后台线程写到 stdout）
+SERVER_LOG_LEVEL = env_str('PIPAI_SERVER_LOG_LEVEL', 'INFO')
+# DEBUG 级别逐请求细节的采样比例，按 request_id 采样
+SERVER_LOG_SAMPLE_RATE = env_float('PIPAI_SERVER_LOG_SAMPLE_RATE', 1.0)
+SERVER_LOG_QUEUE_SIZE = env_int('PIPAI_SERVER_LOG_QUEUE_SIZE', 10000)
+
+# 错误日志：后台线程批量写入按日期与 machine_id 分片的轮转分段
+LOG_DIR = env_str('PIPAI_LOG_DIR', 'pipai_logs')
+LOG_QUEUE_SIZE = env_int('PIPAI_LOG_QUEUE_SIZE', 10000)
+LOG_BATCH_SIZE = env_int('PIPAI_LOG_BATCH_SIZE', 256)
+LOG_FLUSH_INTERVAL = env_float('PIPAI_LOG_FLUSH_INTERVAL', 1.0)
+LOG_SEGMENT_BYTES = env_int('PIPAI_LOG_SEGMENT_BYTES', 64 * 1024 * 1024)
+LOG_MAX_SEGMENTS = env_int('PIPAI_LOG_MAX_SEGMENTS', 0)
+LOG_COMPRESS = env_bool('PIPAI_LOG_COMPRESS', False)
+LOG_SHARDS = env_int('PIPAI_LOG_SHARDS', 8)
+
+# 异步任务接口（POST /jobs 提交、GET /jobs/{id} 长轮询）：执行分析的 worker 协程数、排队上限、
+# 结果保留秒数与单次长轮询最多等待的秒数
+JOB_WORKERS = env_int('PIPAI_JOB_WORKERS', 16)
+JOB_MAX_QUEUE = env_int('PIPAI_JOB_MAX_QUEUE', 256)
+JOB_TTL = env_float('PIPAI_JOB_TTL', 600)
+JOB_MAX_WAIT = env_float('PIPAI_JOB_MAX_WAIT', 25)
+
+# 批量分析接口（POST /analyze_errors）一次最多包含的错误数；整个批次同样受 PIPAI_MAX_REQUEST_BYTES 限制
+MAX_BATCH_ITEMS = env_int('PIPAI_MAX_BATCH_ITEMS', 20)
+
+# 集群模式：PIPAI_CLUSTER_PEERS 为所有节点的根地址（逗号分隔，各节点配置相同），PIPAI_CLUSTER_SELF 为本节点在其中的地址，
+# 留空不启用。错误指纹按一致性哈希归一个节点所有，其他节点把请求转发给所有者
+CLUSTER_PEERS = env_str('PIPAI_CLUSTER_PEERS')
+CLUSTER_SELF = env_str('PIPAI_CLUSTER_SELF')
+CLUSTER_VNODES = env_int('PIPAI_CLUSTER_VNODES', 160)
+# 转发的读超时应大于所有者一次完整的分析（排队、上游调用与级联）；连接超时要短，节点宕机时很快改为本地处理
+CLUSTER_TIMEOUT = env_float('PIPAI_CLUSTER_TIMEOUT', 60)
+CLUSTER_CONNECT_TIMEOUT = env_float('PIPAI_CLUSTER_CONNECT_TIMEOUT', 1.0)
+# 连接失败的节点在这么多秒内视为不可达，它的指纹暂由环上的下一个节点负责
+CLUSTER_PEER_COOLDOWN = env_float('PIPAI_CLUSTER_PEER_COOLDOWN', 10)
+# 转发到每个节点的连接池大小（也是转发线程数）
+CLUSTER_MAX_CONNECTIONS = env_int('PIPAI_CLUSTER_MAX_CONNECTIONS', 32)
+# 内部接口（/cluster/...）与转交反馈的共享密钥，节点间以 X-Cluster-Token 携带；设置了 PIPAI_CLUSTER_PEERS 时必须设置
+CLUSTER_TOKEN = env_str('PIPAI_CLUSTER_TOKEN')
@@ -0,0 +1,323 @@
+"""
+修复结果反馈
+
+客户端执行建议的命令后回报每条命令的退出码与耗时。服务端按 (指纹, 建议) 汇总成功率：
+成功率用于缓存淘汰与相似检索的排序，多次失败的建议不再返回。
+
+只接受服务端发出过的回答的反馈，每个回答只记录一次；每台机器对同一条建议只计最近一次结果，
+单个客户端反复回报不能屏蔽一条建议。
+
+建议以其中代码块命令的摘要（suggestion_id）标识，格式差异不影响统计。
+多个 worker 共用 PIPAI_CACHE_PATH 指向的 SQLite 文件时，统计在进程间共享。
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from pip_aide.safety import extract_code_block_lines
+
+from .jsonlog import get_logger
+
+log = get_logger('feedback')
+
+# 记录反馈的结果
+ACCEPTED = 'accepted'
+DUPLICATE = 'duplicate'  # 这个回答已经回报过
+UNKNOWN = 'unknown'  # 不是发给该客户端的回答，或已超过 issued_ttl
+
+
+def suggestion_id(suggestion):
+    """建议中命令的摘要；没有命令的建议（如 UNCERTAIN）按全文计算"""
+    commands = [' '.join(line.split()) for line in extract_code_block_lines(suggestion) if line.strip()]
+    text = '\n'.join(commands) if commands else suggestion.strip()
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def summarize_outcomes(outcomes):
+    """
+    把逐条命令的结果归纳为一次修复的结果：'success'、'failure' 或 'skipped'。
+    exit_code 为 None 表示该命令没有执行（用户跳过）。
+    """
+    executed = [o for o in outcomes if o.get('exit_code') is not None]
+    if not executed:
+        return 'skipped'
+    return 'success' if all(o['exit_code'] == 0 for o in executed) else 'failure'
+
+
+class FeedbackStore:
+    """
+    (fingerprint, suggestion_id) -> 成功与失败的机器数、命令总耗时。
+
+    返回给客户端的每个回答先用 issue() 记下 request_id 对应的 machine_id、指纹与 suggestion_id；
+    反馈的这四项必须与记录一致且在 issued_ttl 秒内，每个 request_id 只记录一次。
+    同一台机器对同一条建议的多次结果只保留最近一次，min_reports 因此是回报过结果的不同机器数。
+
+    读取经过内存层，最多 sync_interval 秒后重新从 SQLite 读取其他进程写入的结果；
+    在事件循环中读取时，重新读取交给自己的线程，本次只返回内存层的结果，不在事件循环中等待数据库。
+    有 SQLite 文件时，issue() 记下的回答在 flush_delay 秒内批量写入，多个 worker 都能接受对应的反馈；
+    record() 等写操作在自己的线程中执行（事件循环中使用 arecord/astats）。
+    """
+
+    def __init__(self, path=None, min_reports=3, min_success_rate=0.3, sync_interval=5.0, max_entries=100000,
+                 issued_ttl=3600, flush_delay=0.5):
+        self.min_reports = min_reports
+        self.min_success_rate = min_success_rate
+        self.sync_interval = sync_interval
+        self.max_entries = max_entries
+        self.issued_ttl = issued_ttl
+        self.flush_delay = flush_delay
+        self._memory = OrderedDict()  # (fingerprint, suggestion_id) -> (successes, failures, duration, loaded_at)
+        # 没有 SQLite 文件时：request_id -> [machine_id, fingerprint, suggestion_id, issued_at, reported]
+        self._issued = OrderedDict()
+        self._votes = OrderedDict()  # 没有 SQLite 文件时：(fingerprint, suggestion_id) -> {machine_id: (结果, 耗时)}
+        self._pending = []  # 尚未写入 SQLite 的回答
+        self._loading = set()  # 已安排在线程中重新读取的 (fingerprint, suggestion_id)
+        self._pruned_at = 0.0
+        # _lock 只保护内存状态，持有期间不访问 SQLite；_db_lock 保护连接。同时持有时先取 _db_lock
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self.reports = {'success': 0, 'failure': 0, 'skipped': 0}
+        self.rejected = {DUPLICATE: 0, UNKNOWN: 0}
+        self._db = None
+        self._executor = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS issued_answers ('
+                'request_id TEXT PRIMARY KEY, machine_id TEXT NOT NULL, fingerprint TEXT NOT NULL, '
+                'suggestion_id TEXT NOT NULL, issued_at REAL NOT NULL, reported INTEGER NOT NULL DEFAULT 0)'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS issued_answers_time ON issued_answers (issued_at)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS feedback_votes ('
+                'fingerprint TEXT NOT NULL, suggestion_id TEXT NOT NULL, machine_id TEXT NOT NULL, '
+                'outcome TEXT NOT NULL, duration REAL NOT NULL, updated_at REAL NOT NULL, '
+                'PRIMARY KEY (fingerprint, suggestion_id, machine_id))'
+            )
+            self._db.commit()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipai-feedback')
+
+    def issue(self, request_id, machine_id, fingerprint, suggestion_id):
+        """记下发给客户端的回答，之后只接受与之一致的反馈"""
+        now = time.time()
+        with self._lock:
+            if self._db is None:
+                self._issued[request_id] = [machine_id, fingerprint, suggestion_id, now, False]
+                self._issued.move_to_end(request_id)
+                while self._issued and (len(self._issued) > self.max_entries
+                                        or next(iter(self._issued.values()))[3] <= now - self.issued_ttl):
+                    self._issued.popitem(last=False)
+                return
+            self._pending.append((request_id, machine_id, fingerprint, suggestion_id, now))
+            if len(self._pending) > 1:
+                return  # 已经安排了写入
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush()
+            return
+        loop.call_later(self.flush_delay, self._schedule_flush)
+
+    def record(self, request_id, machine_id, fingerprint, suggestion_id, outcome, duration=0.0):
+        """
+        记录一次修复结果，返回 ACCEPTED、DUPLICATE 或 UNKNOWN；只有 ACCEPTED 的结果计入统计。
+        skipped 只计数，不影响成功率
+        """
+        key = (fingerprint, suggestion_id)
+        now = time.time()
+        if self._db is not None:
+            self._flush()
+            with self._db_lock:
+                match = (request_id, machine_id, fingerprint, suggestion_id, now - self.issued_ttl)
+                claimed = self._db.execute(
+                    'UPDATE issued_answers SET reported = 1 WHERE request_id = ? AND machine_id = ? '
+                    'AND fingerprint = ? AND suggestion_id = ? AND issued_at > ? AND reported = 0', match
+                ).rowcount == 1
+                if claimed:
+                    result = ACCEPTED
+                    if outcome != 'skipped':
+                        self._db.execute(
+                            'INSERT INTO feedback_votes VALUES (?, ?, ?, ?, ?, ?) '
+                            'ON CONFLICT(fingerprint, suggestion_id, machine_id) DO UPDATE SET '
+                            'outcome = excluded.outcome, duration = excluded.duration, updated_at = excluded.updated_at',
+                            (fingerprint, suggestion_id, machine_id, outcome, duration, now)
+                        )
+                else:
+                    result = DUPLICATE if self._db.execute(
+                        'SELECT 1 FROM issued_answers WHERE request_id = ? AND machine_id = ? '
+                        'AND fingerprint = ? AND suggestion_id = ? AND issued_at > ?', match
+                    ).fetchone() else UNKNOWN
+                self._db.commit()
+            if result == ACCEPTED and outcome != 'skipped':
+                self._load(key)
+        else:
+            with self._lock:
+                entry = self._issued.get(request_id)
+                if entry is None or entry[:3] != [machine_id, fingerprint, suggestion_id] \
+                        or entry[3] <= now - self.issued_ttl:
+                    result = UNKNOWN
+                elif entry[4]:
+                    result = DUPLICATE
+                else:
+                    result = ACCEPTED
+                    entry[4] = True
+                    if outcome != 'skipped':
+                        votes = self._votes.setdefault(key, {})
+                        votes[machine_id] = (outcome, duration)
+                        self._votes.move_to_end(key)
+                        while len(self._votes) > self.max_entries:
+                            self._votes.popitem(last=False)
+                        self._store(key, _tally(votes.values()))
+        with self._lock:
+            if result == ACCEPTED:
+                self.reports[outcome] += 1
+            else:
+                self.rejected[result] += 1
+        return result
+
+    async def arecord(self, *args, **kwargs):
+        """record 的协程版本"""
+        if self._db is None:
+            return self.record(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: self.record(*args, **kwargs))
+
+    def counts(self, fingerprint, suggestion_id, refresh=True):
+        """
+        返回 (成功的机器数, 失败的机器数)；refresh=False 时只读内存层。
+        内存层过期时：不在事件循环中则直接重新读取，否则安排在线程中读取，本次返回内存层的结果
+        """
+        key = (fingerprint, suggestion_id)
+        with self._lock:
+            entry = self._memory.get(key)
+        if refresh and self._db is not None and (entry is None or time.monotonic() - entry[3] >= self.sync_interval):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                entry = self._load(key)
+            else:
+                self._schedule_load(key)
+        if entry is None:
+            return 0, 0
+        return entry[0], entry[1]
+
+    def success_rate(self, fingerprint, suggestion_id, refresh=True):
+        """平滑后的成功率，没有反馈时为 0.5"""
+        successes, failures = self.counts(fingerprint, suggestion_id, refresh)
+        return (successes + 1) / (successes + failures + 2)
+
+    def failing(self, fingerprint, suggestion_id):
+        """至少 min_reports 台机器回报过且成功率低于 min_success_rate 的建议不应再返回"""
+        successes, failures = self.counts(fingerprint, suggestion_id)
+        reports = successes + failures
+        return reports >= self.min_reports and successes / reports < self.min_success_rate
+
+    def rank(self, fingerprint, suggestion):
+        """缓存淘汰使用的排序值，只读内存层，不访问 SQLite"""
+        return self.success_rate(fingerprint, suggestion_id(suggestion), refresh=False)
+
+    def stats(self, persistent=True):
+        """persistent=False 时不统计 SQLite 中的条目数（指标采集使用，不访问数据库）"""
+        with self._lock:
+            stats = {'reports': dict(self.reports), 'rejected': dict(self.rejected), 'tracked': len(self._memory)}
+        if persistent and self._db is not None:
+            with self._db_lock:
+                stats['persistent_entries'] = self._db.execute(
+                    'SELECT COUNT(*) FROM (SELECT 1 FROM feedback_votes GROUP BY fingerprint, suggestion_id)'
+                ).fetchone()[0]
+        return stats
+
+    async def astats(self):
+        """stats 的协程版本"""
+        if self._db is None:
+            return self.stats()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.stats)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._flush()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _schedule_flush(self):
+        try:
+            self._executor.submit(self._flush)
+        except RuntimeError:
+            pass  # 已关闭，close() 写入了剩余的回答
+
+    def _flush(self):
+        """把 issue() 记下的回答写入 SQLite，并删除超过 issued_ttl 的记录"""
+        with self._db_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if self._db is None or not pending:
+                return
+            now = time.time()
+            try:
+                self._db.executemany('INSERT OR IGNORE INTO issued_answers VALUES (?, ?, ?, ?, ?, 0)', pending)
+                if now - self._pruned_at >= 60:
+                    self._pruned_at = now
+                    self._db.execute('DELETE FROM issued_answers WHERE issued_at <= ?', (now - self.issued_ttl,))
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.rollback()
+                log.warning("Failed to record issued answers", extra={'answers': len(pending), 'error': str(e)})
+
+    def _schedule_load(self, key):
+        with self._lock:
+            if key in self._loading:
+                return
+            self._loading.add(key)
+        try:
+            self._executor.submit(self._load_scheduled, key)
+        except RuntimeError:
+            # 已关闭
+            with self._lock:
+                self._loading.discard(key)
+
+    def _load_scheduled(self, key):
+        try:
+            if self._db is not None:
+                self._load(key)
+        except sqlite3.Error as e:
+            log.warning("Failed to load feedback counts", extra={'error': str(e)})
+        finally:
+            with self._lock:
+                self._loading.discard(key)
+
+    def _load(self, key):
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(outcome = 'success'), 0), COALESCE(SUM(outcome = 'failure'), 0), "
+                'COALESCE(SUM(duration), 0.0) FROM feedback_votes WHERE fingerprint = ? AND suggestion_id = ?',
+                key
+            ).fetchone()
+        entry = (row[0], row[1], row[2], time.monotonic())
+        with self._lock:
+            self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        # 调用方持有 _lock
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+def _tally(votes):
+    successes = sum(1 for outcome, _ in votes if outcome == 'success')
+    failures = sum(1 for outcome, _ in votes if outcome == 'failure')
+    return successes, failures, sum(duration for _, duration in votes), 0.0
@@ -0,0 +1,80 @@
+"""
+错误指纹：去掉临时目录、哈希、时间戳、用户路径等易变内容后对错误日志做摘要，
+使不同机器上的同一类失败得到相同的指纹。
+"""
+import hashlib
+import re
+
+SYSTEM_INFO_MARKER = '--- SYSTEM INFO ---'
+
+# 参与指纹计算的系统信息字段；os_version、gcc 小版本等过于零散，不参与
+PROFILE_KEYS = ('python_version', 'python_implementation', 'os_system', 'machine_type', 'architecture')
+
+# 按顺序应用的替换规则：先替换整段路径，再替换其中残留的零散片段。
+# 第三项是快速预检的子串，文本中不包含它时跳过该规则
+_TOKEN_START = r'(?<![^\s\'"(=])'
+_VOLATILE_PATTERNS = [
+    # pip 的临时构建目录，如 /tmp/pip-install-abc123/、C:\Users\x\AppData\Local\Temp\pip-build-env-xyz
+    (re.compile(_TOKEN_START + r'(?:[A-Za-z]:)?[\\/][^\s\'"]*?[\\/](?:pip-[a-z-]+-[A-Za-z0-9_]+|tmp[A-Za-z0-9_]{6,})(?=[\\/\s\'"]|$)', re.MULTILINE), '<TMP>', None),
+    # pip 自身的缓存目录（wheels/3f/4b/... 这样的分片路径）
+    (re.compile(_TOKEN_START + r'[^\s\'"]*?[\\/]\.?cache[\\/]pip[\\/][^\s\'"]*', re.IGNORECASE), '<PIP_CACHE>', 'ache'),
+    # 用户主目录
+    (re.compile(r'/(?:home|Users)/[^/\s\'"]+'), '<HOME>', None),
+    (re.compile(r'[A-Za-z]:\\Users\\[^\\\s\'"]+', re.IGNORECASE), '<HOME>', '\\'),
+    (re.compile(r'/root(?=/)'), '<HOME>', None),
+    # 时间戳与日期
+    (re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'), '<TS>', None),
+    (re.compile(r'\b\d{2}:\d{2}:\d{2}(?:\.\d+)?\b'), '<TS>', ':'),
+    # 内存地址、哈希值
+    (re.compile(r'\b0x[0-9a-fA-F]{6,}\b'), '<ADDR>', '0x'),
+    (re.compile(r'\b(?:sha256|md5|sha1|sha384|sha512)[:=][0-9a-fA-F]+\b'), '<HASH>', None),
+    (re.compile(r'\b[0-9a-fA-F]{12,}\b'), '<HASH>', None),
+    # 下载大小、速度、耗时
+    (re.compile(r'\b\d+(?:\.\d+)?\s?(?:[kKMG]i?B(?:/s)?|bytes)\b'), '<SIZE>', None),
+    (re.compile(r'\b\d+(?:\.\d+)?\s?(?:ms|s|sec|seconds)\b'), '<DURATION>', None),
+]
+
+# 进度条、下载进度等对诊断无意义的行
+_NOISE_LINE = re.compile(r'^\s*(?:[━─█▌▍▎▏|#=\-\s]+|.*\beta \d+:\d{2}:\d{2}.*|Progress \S+)$')
+
+
+def split_error_context(error_context):
+    """把客户端上传的上下文拆为 (错误日志, 系统信息文本)"""
+    head, marker, tail = error_context.partition(SYSTEM_INFO_MARKER)
+    return head, tail if marker else ''
+
+
+def parse_system_profile(system_info_text):
+    """从 “key: value” 形式的系统信息中提取影响修复方案的字段"""
+    profile = {}
+    for line in system_info_text.splitlines():
+        key, sep, value = line.partition(':')
+        key = key.strip()
+        if not sep or key not in PROFILE_KEYS:
+            continue
+        value = value.strip()
+        if key == 'python_version':
+            # 补丁版本对 pip 的修复建议几乎没有影响
+            value = '.'.join(value.split('.')[:2])
+        profile[key] = value
+    return profile
+
+
+def normalize_error_log(error_log):
+    """去掉易变内容并规整空白"""
+    lines = [line for line in error_log.splitlines() if line.strip() and not _NOISE_LINE.match(line)]
+    # 整段文本一次性替换，比逐行替换快得多
+    text = '\n'.join(lines)
+    for pattern, replacement, needle in _VOLATILE_PATTERNS:
+        if needle is None or needle in text:
+            text = pattern.sub(replacement, text)
+    return '\n'.join(' '.join(line.split()) for line in text.split('\n'))
+
+
+def error_fingerprint(error_context):
+    """计算错误上下文的指纹（sha256 十六进制串）"""
+    error_log, system_info_text = split_error_context(error_context)
+    profile = parse_system_profile(system_info_text)
+    material = normalize_error_log(error_log)
+    material += '\n' + '\n'.join(f'{k}={profile[k]}' for k in sorted(profile))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
@@ -0,0 +1,150 @@
+"""
+请求体接收与响应压缩：在 JSON 解析和模型校验之前解压请求体并限制大小；按 Accept-Encoding 压缩响应
+"""
+import json
+
+from pip_aide.compression import (
+    IDENTITY, DecodedTooLarge, Decoder, InvalidEncodedBody, UnsupportedEncoding, available_encodings,
+    choose_encoding, compress,
+)
+
+from .metrics import REQUEST_BYTES, RESPONSE_BYTES
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI 中间件。Content-Length 超限时直接返回 413；
+    没有 Content-Length（分块传输）时边读边计数，超限即停止读取并返回 413。
+    带 Content-Encoding（gzip/zstd）的请求体边读边解压，解压后的大小同样受 max_body_bytes 限制，
+    超出时立即停止解压；交给应用的是解压后的请求体。不支持的编码返回 415，压缩数据损坏返回 400。
+    """
+
+    def __init__(self, app, max_body_bytes):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] not in ('POST', 'PUT', 'PATCH'):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope['headers'])
+        content_length = headers.get(b'content-length')
+        if content_length is not None:
+            try:
+                too_large = int(content_length) > self.max_body_bytes
+            except ValueError:
+                too_large = False
+            if too_large:
+                await self._reject(send, 413, f"Request body exceeds {self.max_body_bytes} bytes")
+                return
+
+        encoding = headers.get(b'content-encoding', b'').decode('latin-1').strip().lower() or IDENTITY
+        try:
+            decoder = Decoder(encoding, self.max_body_bytes)
+        except UnsupportedEncoding:
+            await self._reject(send, 415, f"Unsupported Content-Encoding: {encoding}")
+            return
+
+        # 先把请求体读入内存（FastAPI 本来也会这样做），读的同时解压并检查大小
+        chunks = []
+        size = 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                body = message.get('body', b'')
+                size += len(body)
+                if size > self.max_body_bytes:
+                    raise DecodedTooLarge(size)
+                chunks.append(decoder.feed(body))
+                more_body = message.get('more_body', False)
+            chunks.append(decoder.finish())
+        except DecodedTooLarge:
+            await self._reject(send, 413, f"Request body exceeds {self.max_body_bytes} bytes")
+            return
+        except InvalidEncodedBody as e:
+            await self._reject(send, 400, f"Invalid {encoding} request body: {e}")
+            return
+
+        body = b''.join(chunks)
+        REQUEST_BYTES.labels(encoding, 'wire').inc(size)
+        REQUEST_BYTES.labels(encoding, 'decoded').inc(len(body))
+        if encoding != IDENTITY:
+            # 应用看到的是未压缩的请求体
+            scope = dict(scope, headers=[(k, v) for k, v in scope['headers']
+                                         if k not in (b'content-encoding', b'content-length')]
+                         + [(b'content-length', str(len(body)).encode())])
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    async def _reject(self, send, status, detail):
+        payload = json.dumps({"detail": detail}).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+
+class ResponseCompressionMiddleware:
+    """
+    ASGI 中间件：客户端的 Accept-Encoding 接受时，压缩不小于 min_size 字节的响应（zstd 优先，其次 gzip）。
+    只压缩一次性发出的响应体；流式响应（server-sent events）原样转发，不影响片段的逐个送达。
+    """
+
+    def __init__(self, app, min_size=1024, encodings=None):
+        self.app = app
+        self.min_size = min_size
+        self.encodings = encodings or available_encodings()
+
+    async def __call__(self, scope, receive, send):
+        accept = dict(scope.get('headers', ())).get(b'accept-encoding') if scope['type'] == 'http' else None
+        encoding = choose_encoding(accept.decode('latin-1'), self.encodings) if accept else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                start = message  # 等看到响应体再决定是否压缩
+                return
+            if message['type'] != 'http.response.body' or start is None:
+                await send(message)
+                return
+            pending, start = start, None
+            body = message.get('body', b'')
+            headers = pending.get('headers', [])
+            names = {k.lower() for k, _ in headers}
+            content_type = dict((k.lower(), v) for k, v in headers).get(b'content-type', b'')
+            if (message.get('more_body') or len(body) < self.min_size or b'content-encoding' in names
+                    or content_type.startswith(b'text/event-stream')):
+                await send(pending)
+                await send(message)
+                return
+            compressed = compress(body, encoding)
+            RESPONSE_BYTES.labels(encoding, 'raw').inc(len(body))
+            RESPONSE_BYTES.labels(encoding, 'wire').inc(len(compressed))
+            headers = [(k, v) for k, v in headers if k.lower() != b'content-length'] + [
+                (b'content-encoding', encoding.encode()),
+                (b'content-length', str(len(compressed)).encode()),
+                (b'vary', b'Accept-Encoding'),
+            ]
+            await send(dict(pending, headers=headers))
+            await send({'type': 'http.response.body', 'body': compressed, 'more_body': False})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,177 @@
+"""
+异步分析任务
+
+提交后立即返回任务 ID，由固定数量的 worker 协程依次执行，客户端长轮询等待结果。
+同一错误指纹的任务还在排队或执行时再次提交会复用该任务；任务结束后结果按 ttl 保留，
+客户端按任务 ID 重试轮询、多个客户端等待同一任务都不会重新分析。
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from fastapi import HTTPException
+
+from .admission import AdmissionRejected
+from .jsonlog import get_logger
+
+log = get_logger('jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# 任务队列已满时建议客户端等待的秒数
+QUEUE_FULL_RETRY_AFTER = 5
+
+
+class Job:
+    def __init__(self, key, run):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.result = None
+        self.error = None  # {'status': HTTP 状态码, 'detail': ..., 'retry_after': ...}
+        self.created = time.monotonic()
+        self.finished = None
+        self._run = run
+        self._done = asyncio.Event()
+
+    def finish(self, result=None, error=None):
+        self.status = DONE if error is None else FAILED
+        self.result = result
+        self.error = error
+        self.finished = time.monotonic()
+        self._done.set()
+
+    def snapshot(self):
+        data = {'job_id': self.id, 'status': self.status}
+        if self.status == DONE:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class JobManager:
+    """
+    workers: 同时执行的任务数；max_queue: 等待执行的任务数上限，超出时拒绝提交
+    ttl: 任务结束后结果保留的秒数；max_wait: 单次长轮询最多等待的秒数
+    """
+
+    def __init__(self, workers=16, max_queue=256, ttl=600.0, max_wait=25.0, max_jobs=10000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.max_wait = max_wait
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()  # job_id -> Job，按创建顺序
+        self._by_key = {}
+        self._finished = deque()  # 按结束时间排列，用于过期清理
+        self._queue = None
+        self._tasks = []
+        self.submitted = 0
+        self.reused = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, key, run, ready=None):
+        """
+        提交任务并返回 Job；run 为返回结果的协程函数。
+        ready 不为 None 时（例如缓存命中）直接作为已完成任务的结果，不进入队列。
+        同一 key 的任务还没有结束时直接返回该任务；队列已满时抛出 AdmissionRejected。
+        """
+        self._expire()
+        job = Job(key, run)
+        if ready is not None:
+            self._jobs[job.id] = job
+            self.submitted += 1
+            self._finish(job, ready)
+        else:
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None and existing.finished is None:
+                self.reused += 1
+                return existing
+            if self._queue.qsize() >= self.max_queue:
+                raise AdmissionRejected('job_queue_full', QUEUE_FULL_RETRY_AFTER)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self.submitted += 1
+            self._queue.put_nowait(job)
+        while len(self._jobs) > self.max_jobs:
+            self._drop(next(iter(self._jobs.values())))
+        return job
+
+    def get(self, job_id):
+        self._expire()
+        return self._jobs.get(job_id)
+
+    async def wait(self, job, timeout):
+        """等待任务结束，最多 min(timeout, max_wait) 秒；返回任务当前状态"""
+        timeout = max(0.0, min(timeout, self.max_wait))
+        if job.finished is None and timeout > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(job._done.wait()), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job.snapshot()
+
+    def stats(self):
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {'jobs': counts, 'workers': self.workers, 'queue_limit': self.max_queue, 'ttl': self.ttl,
+                'submitted': self.submitted, 'reused': self.reused, 'completed': self.completed, 'failed': self.failed}
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            try:
+                result = await job._run()
+            except asyncio.CancelledError:
+                self._finish(job, error={'status': 503, 'detail': "Server is shutting down"})
+                raise
+            except AdmissionRejected as e:
+                self._finish(job, error={'status': 429, 'detail': f"Server is busy ({e.reason}), retry later",
+                                         'retry_after': e.retry_after})
+            except HTTPException as e:
+                # 例如集群所有者降级（503）或超时（504）
+                self._finish(job, error={'status': e.status_code, 'detail': e.detail})
+            except Exception as e:
+                log.error("Analysis job failed", extra={'job_id': job.id, 'error': str(e)})
+                self._finish(job, error={'status': 500, 'detail': "Analysis failed"})
+            else:
+                self._finish(job, result)
+
+    def _finish(self, job, result=None, error=None):
+        job._run = None
+        job.finish(result, error)
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+        self._finished.append(job)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._finished and now - self._finished[0].finished > self.ttl:
+            self._drop(self._finished.popleft())
+
+    def _drop(self, job):
+        self._jobs.pop(job.id, None)
+        if self._by_key.get(job.key) == job.id:
+            del self._by_key[job.key]
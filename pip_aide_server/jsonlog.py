@@ -0,0 +1,145 @@
+"""
+服务端结构化日志
+
+记录以 JSON 行输出。请求路径上的日志调用只把 LogRecord 放入有界队列（满时丢弃并计数），
+格式化与写 stdout 都在后台线程中完成，不阻塞事件循环。
+
+request_id 与客户端传来的 correlation_id 保存在 contextvars 中，由过滤器加到每条记录上；
+single-flight 创建的 task 会继承发起请求的上下文。DEBUG 级别的逐请求细节按 request_id 采样，
+同一请求的细节要么全部保留，要么全部丢弃。
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import zlib
+
+LOGGER_NAME = 'pipai'
+
+_request_context = contextvars.ContextVar('pipai_request_context', default=None)
+
+# LogRecord 自带的属性；其余属性（通过 extra 传入）作为 JSON 字段输出
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+_handler = None
+
+
+def get_logger(name=None):
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+
+def bind_request(request_id, correlation_id=None):
+    """在当前上下文中绑定请求标识，之后的日志都会带上这些字段"""
+    context = {'request_id': request_id}
+    if correlation_id:
+        context['correlation_id'] = correlation_id
+    _request_context.set(context)
+
+
+def current_request():
+    """当前上下文中绑定的请求标识（request_id、correlation_id），没有时为空 dict"""
+    return dict(_request_context.get() or {})
+
+
+def clean_correlation_id(value, max_length=128):
+    """只保留可打印的 ASCII 字符并限制长度，避免客户端写入任意内容"""
+    if not value:
+        return None
+    cleaned = ''.join(ch for ch in value if 33 <= ord(ch) < 127)[:max_length]
+    return cleaned or None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """加上请求上下文字段，并对 DEBUG 记录按 request_id 采样"""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        context = _request_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        if record.levelno <= logging.DEBUG and self.sample_rate < 1.0:
+            request_id = getattr(record, 'request_id', None)
+            if request_id is None:
+                return self.sample_rate > 0
+            return zlib.crc32(request_id.encode()) / 0xFFFFFFFF < self.sample_rate
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃记录，调用方永远不会阻塞；格式化留给后台线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level='INFO', sample_rate=1.0, queue_size=10000, stream=None):
+    """配置 pipai 日志器；重复调用时只更新级别与采样率"""
+    global _listener, _handler
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    logger.propagate = False
+    if _handler is not None:
+        for log_filter in _handler.filters:
+            log_filter.sample_rate = sample_rate
+        return logger
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    _handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _handler.addFilter(RequestContextFilter(sample_rate))
+    logger.addHandler(_handler)
+    _listener = logging.handlers.QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    return logger
+
+
+def shutdown_logging():
+    """写完队列中剩余的日志并停止后台线程"""
+    global _listener, _handler
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger(LOGGER_NAME).removeHandler(_handler)
+        _handler = None
+
+
+def stats():
+    if _handler is None:
+        return {'queue_depth': 0, 'dropped': 0}
+    return {'queue_depth': _handler.queue.qsize(), 'dropped': _handler.dropped}
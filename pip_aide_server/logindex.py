@@ -0,0 +1,333 @@
+"""
+pipai_logs 分析索引
+
+增量扫描日志目录（记住每个文件读到的位置，不重复读取），按错误指纹汇总出现次数、
+首次/最近出现时间与机器数，并按列存放到索引目录中，供 top / trend 查询使用。
+
+用法:
+    python -m pip_aide_server.logindex update
+    python -m pip_aide_server.logindex top -n 20 --since 7d
+    python -m pip_aide_server.logindex trend --signature 3fa1 --bucket day --since 30d
+"""
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import os
+import sys
+import time
+from array import array
+
+from .fingerprint import error_fingerprint, normalize_error_log, split_error_context
+
+INDEX_VERSION = 1
+# 每个指纹用一个 HyperLogLog 估算机器数：2^8 个寄存器，每个指纹 256 字节，误差约 6.5%
+HLL_BITS = 8
+HLL_REGISTERS = 1 << HLL_BITS
+_INT_COLUMNS = ('count', 'first_seen', 'last_seen')
+_BUCKET_COLUMNS = ('bucket_hour', 'bucket_row', 'bucket_count')
+_BUCKET_SECONDS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+
+
+def _hll_add(registers, offset, machine_id):
+    value = int.from_bytes(hashlib.blake2b(machine_id.encode('utf-8'), digest_size=8).digest(), 'big')
+    index = value >> (64 - HLL_BITS)
+    rest = value & ((1 << (64 - HLL_BITS)) - 1)
+    rank = (64 - HLL_BITS) - rest.bit_length() + 1
+    if registers[offset + index] < rank:
+        registers[offset + index] = rank
+
+
+def _hll_estimate(registers, offset):
+    m = HLL_REGISTERS
+    window = registers[offset:offset + m]
+    estimate = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in window)
+    zeros = window.count(0)
+    if estimate <= 2.5 * m and zeros:
+        # 小基数时用线性计数修正
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+
+def _label(error_context):
+    """挑一行最能说明问题的错误信息作为展示标签"""
+    error_log, _ = split_error_context(error_context)
+    lines = normalize_error_log(error_log).splitlines()
+    for line in reversed(lines):
+        lowered = line.lower()
+        if 'error' in lowered and not lowered.startswith('exit code'):
+            return line[:160]
+    return (lines[0] if lines else '')[:160]
+
+
+def _parse_timestamp(value):
+    try:
+        return int(time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S')))
+    except (TypeError, ValueError, OverflowError):
+        return int(time.time())
+
+
+class LogIndex:
+    """按列存放的指纹汇总索引"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.offsets = {}
+        self.records = 0
+        self.signatures = []
+        self.labels = []
+        self.rows = {}
+        self.columns = {name: array('q') for name in _INT_COLUMNS + _BUCKET_COLUMNS}
+        self.machines = bytearray()
+        self._buckets = None
+
+    # ---- 持久化 ----
+
+    @classmethod
+    def load(cls, index_dir):
+        index = cls(index_dir)
+        meta_path = os.path.join(index_dir, 'meta.json')
+        if not os.path.exists(meta_path):
+            return index
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Unsupported index version in {index_dir}: {meta.get('version')}")
+        index.offsets = meta['offsets']
+        index.records = meta['records']
+        with open(os.path.join(index_dir, 'signatures.txt'), encoding='utf-8') as f:
+            index.signatures = f.read().split()
+        with open(os.path.join(index_dir, 'labels.jsonl'), encoding='utf-8') as f:
+            index.labels = [json.loads(line) for line in f]
+        index.rows = {sig: row for row, sig in enumerate(index.signatures)}
+        for name in _INT_COLUMNS + _BUCKET_COLUMNS:
+            with open(os.path.join(index_dir, f'{name}.i64'), 'rb') as f:
+                index.columns[name].frombytes(f.read())
+        with open(os.path.join(index_dir, 'machines.hll'), 'rb') as f:
+            index.machines = bytearray(f.read())
+        return index
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._flush_buckets()
+        files = {
+            'signatures.txt': ''.join(sig + '\n' for sig in self.signatures).encode('utf-8'),
+            'labels.jsonl': ''.join(json.dumps(label, ensure_ascii=False) + '\n' for label in self.labels).encode('utf-8'),
+            'machines.hll': bytes(self.machines),
+        }
+        for name, column in self.columns.items():
+            files[f'{name}.i64'] = column.tobytes()
+        # meta.json 最后写入：中途失败时旧的偏移量依然与旧列数据一致
+        files['meta.json'] = json.dumps(
+            {'version': INDEX_VERSION, 'records': self.records, 'offsets': self.offsets}, indent=1
+        ).encode('utf-8')
+        for name, data in files.items():
+            path = os.path.join(self.index_dir, name)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+
+    # ---- 增量更新 ----
+
+    def update(self, log_dir):
+        """读取 log_dir 中新增的日志行，返回本次处理的记录数"""
+        added = 0
+        names = []
+        for root, dirs, files in os.walk(log_dir):
+            dirs.sort()
+            for file_name in files:
+                if file_name.endswith('.log') or file_name.endswith('.jsonl') or file_name.endswith('.jsonl.gz'):
+                    # 偏移量以相对路径为键，顶层文件与旧版本索引中的键相同
+                    names.append(os.path.relpath(os.path.join(root, file_name), log_dir).replace(os.sep, '/'))
+        for name in sorted(names):
+            path = os.path.join(log_dir, name)
+            offset = self.offsets.get(name, 0)
+            if not name.endswith('.gz') and os.path.getsize(path) < offset:
+                offset = 0  # 文件被截断或替换，从头读取
+            added += self._read_file(path, name, offset)
+        # 已被删除（轮转清理或迁移）的文件不再保留偏移量
+        self.offsets = {name: self.offsets[name] for name in names if name in self.offsets}
+        self.records += added
+        return added
+
+    def _read_file(self, path, name, offset):
+        added = 0
+        opener = gzip.open if name.endswith('.gz') else open
+        try:
+            with opener(path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # 写入器尚未写完的行，下次再读
+                    offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.add(entry)
+                    added += 1
+        except (EOFError, OSError):
+            pass  # 仍在写入的 gzip 分段末尾不完整，已读部分照常记录
+        self.offsets[name] = offset
+        return added
+
+    def add(self, entry):
+        error_context = entry.get('error_context') or ''
+        signature = error_fingerprint(error_context)[:16]
+        seen = _parse_timestamp(entry.get('timestamp'))
+        row = self.rows.get(signature)
+        if row is None:
+            row = len(self.signatures)
+            self.rows[signature] = row
+            self.signatures.append(signature)
+            self.labels.append(_label(error_context))
+            self.columns['count'].append(0)
+            self.columns['first_seen'].append(seen)
+            self.columns['last_seen'].append(seen)
+            self.machines.extend(bytes(HLL_REGISTERS))
+        self.columns['count'][row] += 1
+        if seen < self.columns['first_seen'][row]:
+            self.columns['first_seen'][row] = seen
+        if seen > self.columns['last_seen'][row]:
+            self.columns['last_seen'][row] = seen
+        _hll_add(self.machines, row * HLL_REGISTERS, str(entry.get('machine_id', '')))
+        key = (seen // 3600, row)
+        buckets = self._bucket_map()
+        buckets[key] = buckets.get(key, 0) + 1
+
+    def _bucket_map(self):
+        if self._buckets is None:
+            hours, rows, counts = (self.columns[name] for name in _BUCKET_COLUMNS)
+            self._buckets = {(h, r): c for h, r, c in zip(hours, rows, counts)}
+        return self._buckets
+
+    def _flush_buckets(self):
+        if self._buckets is None:
+            return
+        items = sorted(self._buckets.items())
+        self.columns['bucket_hour'] = array('q', (h for (h, _), _ in items))
+        self.columns['bucket_row'] = array('q', (r for (_, r), _ in items))
+        self.columns['bucket_count'] = array('q', (c for _, c in items))
+
+    # ---- 查询 ----
+
+    def machine_count(self, row):
+        return _hll_estimate(self.machines, row * HLL_REGISTERS)
+
+    def top(self, n=20, since=None):
+        """出现次数最多的 n 个指纹；指定 since（时间戳）时只统计该时间之后的记录"""
+        if since is None:
+            counts = self.columns['count']
+            rows = heapq.nlargest(n, range(len(counts)), key=counts.__getitem__)
+            return [self._describe(row, counts[row]) for row in rows]
+
+        self._flush_buckets()
+        since_hour = since // 3600
+        totals = {}
+        for hour, row, count in zip(*(self.columns[name] for name in _BUCKET_COLUMNS)):
+            if hour >= since_hour:
+                totals[row] = totals.get(row, 0) + count
+        rows = heapq.nlargest(n, totals, key=totals.__getitem__)
+        return [self._describe(row, totals[row]) for row in rows]
+
+    def trend(self, signature=None, bucket='day', since=None):
+        """按时间桶统计出现次数；signature 为指纹前缀，不传时统计全部"""
+        self._flush_buckets()
+        width = _BUCKET_SECONDS[bucket]
+        wanted = None
+        if signature:
+            wanted = {row for row, sig in enumerate(self.signatures) if sig.startswith(signature)}
+        since_hour = since // 3600 if since is not None else None
+        series = {}
+        for hour, row, count in zip(*(self.columns[name] for name in _BUCKET_COLUMNS)):
+            if wanted is not None and row not in wanted:
+                continue
+            if since_hour is not None and hour < since_hour:
+                continue
+            start = hour * 3600 // width * width
+            series[start] = series.get(start, 0) + count
+        return sorted(series.items())
+
+    def _describe(self, row, count):
+        return {
+            'signature': self.signatures[row],
+            'count': count,
+            'total': self.columns['count'][row],
+            'machines': self.machine_count(row),
+            'first_seen': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.columns['first_seen'][row])),
+            'last_seen': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.columns['last_seen'][row])),
+            'label': self.labels[row],
+        }
+
+
+def parse_since(value):
+    """把 “7d”、“12h”、“2w” 转换为起始时间戳"""
+    if not value:
+        return None
+    units = {'h': 3600, 'd': 86400, 'w': 7 * 86400}
+    unit = value[-1].lower()
+    if unit not in units:
+        raise argparse.ArgumentTypeError(f"Invalid duration: {value} (expected e.g. 12h, 7d, 2w)")
+    try:
+        amount = float(value[:-1])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid duration: {value} (expected e.g. 12h, 7d, 2w)")
+    return int(time.time() - amount * units[unit])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pip_aide_server.logindex', description="Index and query pipai_logs")
+    parser.add_argument('--log-dir', default=os.getenv('PIPAI_LOG_DIR', 'pipai_logs'))
+    parser.add_argument('--index-dir', default=os.getenv('PIPAI_INDEX_DIR', 'pipai_index'))
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('update', help="Index new log records")
+    top_parser = sub.add_parser('top', help="Most frequent failure signatures")
+    top_parser.add_argument('-n', type=int, default=20)
+    top_parser.add_argument('--since', type=parse_since, help="Only count records newer than e.g. 7d")
+    top_parser.add_argument('--no-update', action='store_true', help="Query the index without reading new logs")
+    trend_parser = sub.add_parser('trend', help="Occurrences per time bucket")
+    trend_parser.add_argument('--signature', help="Signature prefix (default: all failures)")
+    trend_parser.add_argument('--bucket', choices=sorted(_BUCKET_SECONDS), default='day')
+    trend_parser.add_argument('--since', type=parse_since)
+    trend_parser.add_argument('--no-update', action='store_true', help="Query the index without reading new logs")
+    args = parser.parse_args(argv)
+
+    index = LogIndex.load(args.index_dir)
+    if args.command == 'update' or not args.no_update:
+        if os.path.isdir(args.log_dir):
+            started = time.perf_counter()
+            added = index.update(args.log_dir)
+            if added:
+                index.save()
+            if args.command == 'update':
+                print(f"Indexed {added} new records in {time.perf_counter() - started:.2f}s "
+                      f"({index.records} records, {len(index.signatures)} signatures)")
+        elif args.command == 'update':
+            print(f"Log directory not found: {args.log_dir}", file=sys.stderr)
+            return 1
+    if args.command == 'update':
+        return 0
+
+    if args.command == 'top':
+        results = index.top(args.n, args.since)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            print(f"{'signature':<16}  {'count':>8}  {'machines':>8}  {'last seen':<19}  label")
+            for item in results:
+                print(f"{item['signature']:<16}  {item['count']:>8}  {item['machines']:>8}  {item['last_seen']:<19}  {item['label']}")
+    else:
+        series = index.trend(args.signature, args.bucket, args.since)
+        if args.json:
+            print(json.dumps([{'bucket': start, 'count': count} for start, count in series], indent=2))
+        else:
+            for start, count in series:
+                print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(start))}  {count:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
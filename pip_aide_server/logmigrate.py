@@ -0,0 +1,217 @@
+"""
+把旧版本按 machine_id 一台机器一个文件的日志（pipai_logs/<machine_id>.log）迁移为按日期与分片存放的分段
+
+记录按自身的时间戳归入日期目录、按 machine_id 归入分片，与 LogWriter 的布局相同，分段超过大小上限后轮转。
+迁移分两步，中途中断后重新运行即可：
+
+1. 新分段先写成同目录下的隐藏临时文件，此时旧文件不变；中断后残留的临时文件在下次运行时删除
+2. 全部写完后先把待替换的文件列表写入日志目录中的 .migrate-journal.json，再把临时文件改名为分段、
+   删除旧文件，最后删除 journal；中断后下次运行先按 journal 完成这一步
+
+索引目录存在时，迁移前先把旧文件中尚未索引的记录读入索引，迁移后把新分段标记为已读取，避免重复计数。
+迁移期间旧版本的服务端不能再写入旧文件。
+
+用法:
+    python -m pip_aide_server.logmigrate --dry-run
+    python -m pip_aide_server.logmigrate --log-dir pipai_logs --shards 8 --compress
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from .logindex import LogIndex
+from .logwriter import segment_path, shard_of
+
+JOURNAL_NAME = '.migrate-journal.json'
+# 同时打开的临时分段数上限，超过后关闭最久未写入的，需要时再以追加方式打开
+MAX_OPEN_FILES = 64
+
+
+def legacy_files(log_dir):
+    """日志目录顶层的旧版本日志文件"""
+    return sorted(glob.glob(os.path.join(log_dir, '*.log')))
+
+
+def _temp_path(path):
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+
+
+def _record_time(record, fallback):
+    try:
+        return time.strptime(record.get('timestamp'), '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return fallback
+
+
+def read_legacy(path):
+    """逐条返回旧文件中的 (记录, 时间)；无法解析的行返回 (None, None)"""
+    fallback = time.localtime(os.path.getmtime(path))
+    machine_id = os.path.splitext(os.path.basename(path))[0]
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                record = None
+            if not isinstance(record, dict):
+                yield None, None
+                continue
+            record.setdefault('machine_id', machine_id)
+            yield record, _record_time(record, fallback)
+
+
+class SegmentBuilder:
+    """把记录写入按 (日期, 分片) 划分的临时分段"""
+
+    def __init__(self, log_dir, shards, segment_bytes, compress):
+        self.log_dir = log_dir
+        self.shards = shards
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        self.outputs = []  # 每个分段：{'temp', 'path', 'bytes', 'latest'}
+        self._current = {}  # (日期, 分片) -> 分段
+        self._open = OrderedDict()  # 临时文件路径 -> 文件
+        self._sequence = 0
+
+    def add(self, record, when):
+        key = (time.strftime('%Y%m%d', when), shard_of(record.get('machine_id'), self.shards))
+        output = self._current.get(key)
+        if output is None or output['bytes'] >= self.segment_bytes:
+            self._sequence += 1
+            path = segment_path(self.log_dir, when, key[1], self._sequence, self.compress)
+            output = self._current[key] = {'temp': _temp_path(path), 'path': path, 'bytes': 0, 'latest': 0}
+            self.outputs.append(output)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        self._file(output['temp']).write(data)
+        output['bytes'] += len(data)
+        output['latest'] = max(output['latest'], time.mktime(when))
+
+    def _file(self, temp):
+        handle = self._open.pop(temp, None)
+        if handle is None:
+            if len(self._open) >= MAX_OPEN_FILES:
+                self._open.popitem(last=False)[1].close()
+            handle = gzip.open(temp, 'ab') if self.compress else open(temp, 'ab')
+        self._open[temp] = handle
+        return handle
+
+    def close(self):
+        for handle in self._open.values():
+            handle.close()
+        self._open.clear()
+
+
+def _write_journal(log_dir, journal):
+    path = os.path.join(log_dir, JOURNAL_NAME)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(journal, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def _commit(log_dir, journal, index):
+    """按 journal 把临时分段改名到位、更新索引偏移量并删除旧文件；可以重复执行"""
+    for output in journal['outputs']:
+        if os.path.exists(output['temp']):
+            os.replace(output['temp'], output['path'])
+            # 修改时间设为其中最新记录的时间，按修改时间排序的读取方（相似检索等）仍按时间先后读取
+            os.utime(output['path'], (output['latest'], output['latest']))
+    if index is not None:
+        for source in journal['sources']:
+            index.offsets.pop(os.path.basename(source), None)
+        for output in journal['outputs']:
+            index.offsets[os.path.relpath(output['path'], log_dir).replace(os.sep, '/')] = output['bytes']
+        index.save()
+    for source in journal['sources']:
+        if os.path.exists(source):
+            os.remove(source)
+    os.remove(os.path.join(log_dir, JOURNAL_NAME))
+
+
+def migrate(log_dir, shards=8, segment_bytes=64 * 1024 * 1024, compress=False, index_dir=None, dry_run=False):
+    """迁移 log_dir 中的旧文件，返回统计 dict"""
+    index = LogIndex.load(index_dir) if index_dir and os.path.exists(os.path.join(index_dir, 'meta.json')) else None
+    stats = {'files': 0, 'records': 0, 'skipped': 0, 'segments': 0, 'resumed': False}
+
+    journal_path = os.path.join(log_dir, JOURNAL_NAME)
+    if os.path.exists(journal_path):
+        stats['resumed'] = True
+        if not dry_run:
+            with open(journal_path, encoding='utf-8') as f:
+                _commit(log_dir, json.load(f), index)
+    if not dry_run:
+        for leftover in glob.glob(os.path.join(log_dir, '**', '.segment-*.tmp'), recursive=True):
+            os.remove(leftover)
+
+    sources = legacy_files(log_dir)
+    if not sources:
+        return stats
+    if index is not None and not dry_run:
+        # 先读入旧文件中尚未索引的记录，迁移后新分段整体标记为已读取
+        index.update(log_dir)
+
+    builder = SegmentBuilder(log_dir, shards, segment_bytes, compress)
+    days = set()
+    try:
+        for source in sources:
+            stats['files'] += 1
+            for record, when in read_legacy(source):
+                if record is None:
+                    stats['skipped'] += 1
+                    continue
+                stats['records'] += 1
+                if dry_run:
+                    days.add(time.strftime('%Y%m%d', when))
+                else:
+                    builder.add(record, when)
+    finally:
+        builder.close()
+    if dry_run:
+        stats['days'] = len(days)
+        return stats
+
+    journal = {'sources': sources, 'outputs': builder.outputs}
+    _write_journal(log_dir, journal)
+    _commit(log_dir, journal, index)
+    stats['segments'] = len(builder.outputs)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pip_aide_server.logmigrate',
+                                     description="Migrate per-machine pipai_logs/*.log files into sharded segments")
+    parser.add_argument('--log-dir', default=os.getenv('PIPAI_LOG_DIR', 'pipai_logs'))
+    parser.add_argument('--index-dir', default=os.getenv('PIPAI_INDEX_DIR', 'pipai_index'),
+                        help="Keep this logindex index consistent (ignored when it does not exist)")
+    parser.add_argument('--shards', type=int, default=int(os.getenv('PIPAI_LOG_SHARDS', '8')))
+    parser.add_argument('--segment-bytes', type=int,
+                        default=int(os.getenv('PIPAI_LOG_SEGMENT_BYTES', str(64 * 1024 * 1024))))
+    parser.add_argument('--compress', action='store_true', help="Write gzip segments")
+    parser.add_argument('--dry-run', action='store_true', help="Only count what would be migrated")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.log_dir):
+        print(f"Log directory not found: {args.log_dir}", file=sys.stderr)
+        return 1
+    started = time.perf_counter()
+    stats = migrate(args.log_dir, max(args.shards, 1), args.segment_bytes, args.compress, args.index_dir, args.dry_run)
+    if stats['resumed']:
+        print("Finished an interrupted migration" if not args.dry_run else "An interrupted migration will be finished")
+    if args.dry_run:
+        print(f"Would migrate {stats['records']} records from {stats['files']} files into segments for "
+              f"{stats.get('days', 0)} days ({stats['skipped']} unreadable lines would be skipped)")
+    else:
+        print(f"Migrated {stats['records']} records from {stats['files']} files into {stats['segments']} segments "
+              f"in {time.perf_counter() - started:.2f}s ({stats['skipped']} unreadable lines skipped)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+错误日志写入器：请求路径只把记录放入有界队列，由后台线程批量写入轮转的分段文件
+
+分段按日期与 machine_id 的哈希分片存放：<目录>/<YYYYMMDD>/segment-<时间>-s<分片>-<pid>-<序号>.jsonl，
+每个分片同时只有一个打开的分段，文件数只随天数、分片数与轮转次数增长，同一台机器的记录都在同一个分片中
+"""
+import glob
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+
+from .jsonlog import get_logger
+
+_STOP = object()
+_SEGMENT_PID = re.compile(r'segment-[^-]+-s\d+-(\d+)-\d+\.jsonl')
+log = get_logger('logwriter')
+
+
+def shard_of(machine_id, shards):
+    """machine_id 所在的分片（跨进程稳定）"""
+    return zlib.crc32(str(machine_id or '').encode('utf-8')) % max(shards, 1)
+
+
+def segment_path(directory, when, shard, sequence, compress=False):
+    """when 时刻（time.struct_time）写入 shard 分片的分段路径"""
+    suffix = '.jsonl.gz' if compress else '.jsonl'
+    name = f"segment-{time.strftime('%Y%m%dT%H%M%S', when)}-s{shard:02d}-{os.getpid()}-{sequence:04d}{suffix}"
+    return os.path.join(directory, time.strftime('%Y%m%d', when), name)
+
+
+def segment_pid(path):
+    """写入分段的进程号；旧版本的分段名中没有时返回 None"""
+    match = _SEGMENT_PID.match(os.path.basename(path))
+    return int(match.group(1)) if match else None
+
+
+def _process_alive(pid):
+    if os.name != 'posix':
+        # 无法可靠判断时当作仍在运行，不删除它的分段
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def sort_by_mtime(paths, reverse=False):
+    """按修改时间排序；列出之后已被删除（例如被其他 worker 清理）的文件直接跳过"""
+    found = []
+    for path in paths:
+        try:
+            found.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    return [path for _, path in sorted(found, reverse=reverse)]
+
+
+def list_segments(directory):
+    """目录中的全部分段（包括旧版本直接放在顶层的分段），按修改时间排序"""
+    return sort_by_mtime(glob.glob(os.path.join(directory, '**', 'segment-*.jsonl*'), recursive=True))
+
+
+class LogWriter:
+    """
+    后台批量写日志。
+
+    - 队列有上限，写满时直接丢弃新记录并计数，不阻塞事件循环
+    - 攒够 batch_size 条或距上次写入超过 flush_interval 秒时落盘
+    - 记录按 machine_id 分到 shards 个分片；单个分段超过 segment_bytes 或跨天后轮转；compress=True 时写 gzip 分段
+    - max_segments > 0 时只保留最新的若干个分段；多个 worker 共用目录时，只删除本进程、已退出的进程与旧版本写入的分段，
+      其他 worker 的分段由它们自己清理
+    """
+
+    def __init__(self, directory='pipai_logs', max_queue=10000, batch_size=256, flush_interval=1.0,
+                 segment_bytes=64 * 1024 * 1024, max_segments=0, compress=False, shards=8):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.compress = compress
+        self.shards = max(shards, 1)
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()  # dropped 由请求线程与写入线程共同累加
+        self._segments = {}  # 分片 -> [文件, 路径, 已写字节数, 日期]
+        self._path = None
+        self._sequence = 0
+        self.submitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+        self._thread = threading.Thread(target=self._run, name='pipai-log-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """非阻塞地提交一条记录；队列已满时丢弃并返回 False"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def close(self, timeout=10):
+        """停止接收新记录，写完队列中剩余的记录后关闭文件"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self._queue.maxsize,
+            'submitted': self.submitted,
+            'written': self.written,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'write_errors': self.write_errors,
+            'shards': self.shards,
+            'open_segments': len(self._segments),
+            'segment': self._path,
+        }
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write_batch(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+        # 关闭前把 _STOP 之后仍被放入队列的记录也写完
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+        if batch:
+            self._write_batch(batch)
+        for segment in self._segments.values():
+            segment[0].close()
+        self._segments = {}
+
+    def _write_batch(self, batch):
+        by_shard = {}
+        for record in batch:
+            by_shard.setdefault(shard_of(record.get('machine_id'), self.shards), []).append(record)
+        now = time.localtime()
+        for shard, records in sorted(by_shard.items()):
+            data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records).encode('utf-8')
+            try:
+                segment = self._segments.get(shard)
+                if segment is None or segment[2] >= self.segment_bytes or segment[3] != now[:3]:
+                    segment = self._rotate(shard, now)
+                segment[0].write(data)
+                segment[0].flush()
+            except OSError as e:
+                self.write_errors += 1
+                with self._lock:
+                    self.dropped += len(records)
+                log.error("Failed to write log records", extra={'records': len(records), 'shard': shard, 'error': str(e)})
+                continue
+            segment[2] += len(data)
+            self.written += len(records)
+        self.batches += 1
+
+    def _rotate(self, shard, now):
+        old = self._segments.pop(shard, None)
+        if old is not None:
+            old[0].close()
+        self._sequence += 1
+        self._path = segment_path(self.directory, now, shard, self._sequence, self.compress)
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        handle = gzip.open(self._path, 'ab') if self.compress else open(self._path, 'ab')
+        segment = self._segments[shard] = [handle, self._path, 0, now[:3]]
+        if self.max_segments > 0:
+            try:
+                self._prune()
+            except OSError as e:
+                # 清理失败不影响写入新分段
+                log.warning("Failed to prune log segments", extra={'error': str(e)})
+        return segment
+
+    def _prune(self):
+        """删除最旧的分段（正在写入的与其他运行中的 worker 写入的除外），以及因此变空的日期目录"""
+        open_paths = {segment[1] for segment in self._segments.values()}
+        alive = {}
+        for old in list_segments(self.directory)[:-self.max_segments]:
+            if old in open_paths:
+                continue
+            pid = segment_pid(old)
+            if pid is not None and pid != os.getpid():
+                if pid not in alive:
+                    alive[pid] = _process_alive(pid)
+                if alive[pid]:
+                    continue
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                # 已退出进程的分段可能同时被另一个 worker 删除
+                continue
+            parent = os.path.dirname(old)
+            try:
+                if os.path.abspath(parent) != os.path.abspath(self.directory) and not os.listdir(parent):
+                    os.rmdir(parent)
+            except OSError:
+                # 其他 worker 刚在这个日期目录中创建了分段，或已删除了该目录
+                continue
@@ -0,0 +1,326 @@
+"""
+Prometheus 文本格式的指标
+
+不依赖 prometheus_client。每个带标签的序列各有一把锁，只在更新自身时持有；
+标签组合数有上限（max_series），超出后新的组合都计入值为 "other" 的序列，避免基数失控。
+缓存、准入控制、日志写入器等组件已有的统计在抓取时通过回调读取，请求路径上没有额外开销。
+"""
+import bisect
+import math
+import threading
+import time
+
+from . import jsonlog
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+CHAR_BUCKETS = (50, 100, 200, 400, 800, 1600, 3200)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        # 同名指标重复注册时替换旧的（例如组件被重新创建）
+        self._metrics = [m for m in self._metrics if m.name != metric.name]
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), max_series=64, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._children = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                if key not in self._children and len(self._children) >= self.max_series:
+                    key = ('other',) * len(self.labelnames)
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def samples(self):
+        for key, child in sorted(self._children.items()):
+            yield from child.samples(self.name, self.labelnames, key)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self, name, names, values):
+        yield f"{name}{_format_labels(names, values)} {_format_value(self._value)}"
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def samples(self, name, names, values):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self._buckets + (math.inf,), counts):
+            cumulative += count
+            yield f"{name}_bucket{_format_labels(names, values, [('le', _format_value(float(bound)))])} {cumulative}"
+        yield f"{name}_sum{_format_labels(names, values)} {_format_value(total)}"
+        yield f"{name}_count{_format_labels(names, values)} {cumulative}"
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, **kwargs)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class CallbackMetric:
+    """
+    抓取时调用 fn() 取值。fn 返回一个数值，或 {标签值元组: 数值}。
+    用于把组件已有的 stats() 暴露出来。
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), type='gauge', registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.type = type
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if value is not None:
+                yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+# ---- 服务端指标 ----
+
+HTTP_REQUESTS = Counter('pipai_http_requests_total', 'HTTP requests by endpoint, method and status code',
+                        ('endpoint', 'method', 'status'), max_series=200)
+HTTP_LATENCY = Histogram('pipai_http_request_duration_seconds', 'HTTP request latency', ('endpoint',))
+HTTP_IN_PROGRESS = Gauge('pipai_http_requests_in_progress', 'HTTP requests currently being served')
+UPSTREAM_LATENCY = Histogram('pipai_upstream_duration_seconds', 'Upstream chat completion latency',
+                             ('backend', 'model', 'outcome'))
+PROMPT_TOKENS = Histogram('pipai_prompt_tokens', 'Estimated prompt size after fitting the token budget',
+                          buckets=TOKEN_BUCKETS)
+CONTEXT_TOKENS = Histogram('pipai_error_context_tokens', 'Estimated size of the error context as received',
+                           buckets=TOKEN_BUCKETS + (32000, 64000, 128000, 256000))
+RESPONSE_CHARS = Histogram('pipai_response_chars', 'Length of suggestions returned by the model', buckets=CHAR_BUCKETS)
+SUGGESTIONS = Counter('pipai_suggestions_total', 'Model suggestions by cascade tier and outcome (ok, uncertain, error)',
+                      ('tier', 'outcome'))
+ANSWERS = Counter('pipai_answers_total', 'Analyze responses by the tier that answered (cache, similar, stale, llm)',
+                  ('tier',))
+STREAM_FIRST_TOKEN = Histogram('pipai_stream_time_to_first_token_seconds',
+                               'Streaming requests: time from request to the first suggestion fragment')
+STREAM_FIRST_COMMAND = Histogram('pipai_stream_time_to_first_command_seconds',
+                                 'Streaming requests: time from request to the first complete safe command')
+SUPPRESSED_SUGGESTIONS = Counter('pipai_suppressed_suggestions_total',
+                                 'Suggestions withheld because fix feedback shows they keep failing', ('tier',))
+REQUEST_BYTES = Counter('pipai_request_body_bytes_total',
+                        'Request body bytes by Content-Encoding, as received (wire) and after decompression (decoded)',
+                        ('encoding', 'stage'))
+RESPONSE_BYTES = Counter('pipai_compressed_response_bytes_total',
+                         'Compressed responses: bytes before (raw) and after (wire) compression', ('encoding', 'stage'))
+
+CallbackMetric('pipai_server_log_dropped_total', 'Server log records dropped because the logging queue was full',
+               lambda: jsonlog.stats()['dropped'], type='counter')
+
+
+def suggestion_outcome(suggestion):
+    if suggestion.startswith('UNCERTAIN ('):
+        return 'error'
+    if 'UNCERTAIN' in suggestion:
+        return 'uncertain'
+    return 'ok'
+
+
+def register_component_metrics(cache=None, in_flight=None, admission=None, log_writer=None, similarity=None,
+                               feedback=None, jobs=None, cluster=None, registry=REGISTRY):
+    """把各组件 stats() 中的计数暴露为指标"""
+    if cache is not None:
+        def cache_lookups():
+            stats = cache.stats(persistent=False)
+            return {('hit',): stats['hits'], ('miss',): stats['misses'], ('stale',): stats['stale_hits']}
+
+        CallbackMetric('pipai_cache_lookups_total', 'Suggestion cache lookups by result', cache_lookups,
+                       ('result',), type='counter', registry=registry)
+        CallbackMetric('pipai_cache_memory_entries', 'Entries in the in-memory cache tier',
+                       lambda: cache.stats(persistent=False)['memory_entries'], registry=registry)
+    if in_flight is not None:
+        CallbackMetric('pipai_coalesced_in_flight', 'Distinct fingerprints with an upstream call in progress',
+                       lambda: in_flight.stats()['in_flight'], registry=registry)
+    if admission is not None:
+        CallbackMetric('pipai_admission_active', 'Upstream slots in use', lambda: admission.stats()['active'],
+                       registry=registry)
+        CallbackMetric('pipai_admission_queued', 'Requests waiting for an upstream slot',
+                       lambda: admission.stats()['queued'], registry=registry)
+        CallbackMetric('pipai_admission_rejected_total', 'Requests rejected by admission control',
+                       lambda: {(reason,): count for reason, count in admission.stats()['rejected'].items()},
+                       ('reason',), type='counter', registry=registry)
+    if similarity is not None:
+        CallbackMetric('pipai_similarity_entries', 'Past requests in the similarity index',
+                       lambda: len(similarity), registry=registry)
+    if feedback is not None:
+        CallbackMetric('pipai_fix_feedback_total', 'Fix outcome reports from clients (success, failure, skipped)',
+                       lambda: {(outcome,): count for outcome, count in feedback.stats(persistent=False)['reports'].items()},
+                       ('outcome',), type='counter', registry=registry)
+    if jobs is not None:
+        CallbackMetric('pipai_jobs', 'Analysis jobs kept by the job API, by status',
+                       lambda: {(status,): count for status, count in jobs.stats()['jobs'].items()},
+                       ('status',), registry=registry)
+    if cluster is not None:
+        CallbackMetric('pipai_cluster_forwards_total',
+                       'Requests forwarded to the owning cluster node, by peer and result',
+                       lambda: dict(cluster.forwards), ('peer', 'result'), type='counter', registry=registry)
+    if log_writer is not None:
+        CallbackMetric('pipai_log_queue_depth', 'Records waiting in the log writer queue',
+                       lambda: log_writer.stats()['queue_depth'], registry=registry)
+        CallbackMetric('pipai_log_dropped_total', 'Log records dropped because the queue was full',
+                       lambda: log_writer.stats()['dropped'], type='counter', registry=registry)
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件：记录每个请求的延迟、状态码与进行中的请求数。
+    endpoint 标签只取应用中注册过的路径（带参数的路径如 /jobs/{job_id} 按模板计），其余记为 other。
+    """
+
+    def __init__(self, app, routes=()):
+        self.app = app
+        self.routes = routes
+        self._paths = None
+
+    def _endpoint(self, path):
+        if self._paths is None:
+            self._paths = {getattr(route, 'path', None) for route in self.routes}
+            self._templates = [(route.path_regex, route.path) for route in self.routes
+                               if '{' in getattr(route, 'path', '') and hasattr(route, 'path_regex')]
+        if path in self._paths:
+            return path
+        for regex, template in self._templates:
+            if regex.match(path):
+                return template
+        return 'other'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope.get('path', ''))
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            HTTP_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(endpoint, scope.get('method', ''), status).inc()
@@ -0,0 +1,84 @@
+"""
+提示词配置
+
+每个配置由静态部分（system 消息与 user 消息开头的固定前言）和可变的错误日志组成，错误日志总是放在最后。
+静态部分在进程启动时编译一次，之后每个请求的消息都以完全相同的前缀开头，
+上游服务商的提示词前缀缓存（DeepSeek、OpenAI 等）可以命中这一部分，降低首个 token 的延迟与输入成本。
+"""
+import hashlib
+
+from .prompt import estimate_tokens
+
+_ROLE = "You are an expert Python package installation troubleshooter focused ONLY on pip command solutions."
+
+
+def _rules(*examples):
+    blocks = '\n'.join(f"```\n{example}\n```" for example in examples)
+    return f"""Do NOT suggest system package manager commands (apt, yum, brew, etc.) or commands requiring sudo.
+Do NOT suggest commands that modify files or environment variables.
+Format EACH suggested command clearly on its own line, enclosed in triple backticks. Example:
+{blocks}
+If you are absolutely certain no simple `pip` command can fix this (e.g., it's clearly a compiler issue needing system libraries, or a typo in a requirements file like `requirments.txt: misspelled-package==1.0`), respond ONLY with the word "UNCERTAIN"."""
+
+
+_PREAMBLE = "Here is the relevant error log:\n\n--- ERROR LOG ---\n"
+
+
+class PromptProfile:
+    """一组提示词；构造时编译静态前缀，messages() 只把错误日志接在前缀之后"""
+
+    def __init__(self, name, system, preamble=_PREAMBLE, description=''):
+        self.name = name
+        self.system = system
+        self.preamble = preamble
+        self.description = description
+        self.prefix_tokens = estimate_tokens(system) + estimate_tokens(preamble)
+        # 前缀的摘要，写入启动日志，便于确认各 worker、各节点发出的前缀一致
+        self.prefix_digest = hashlib.sha256(f"{system}\0{preamble}".encode('utf-8')).hexdigest()[:12]
+
+    def messages(self, error_context):
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.preamble + error_context},
+        ]
+
+    def describe(self):
+        return {'name': self.name, 'description': self.description, 'prefix_tokens': self.prefix_tokens,
+                'prefix_digest': self.prefix_digest}
+
+
+PROFILES = {profile.name: profile for profile in (
+    PromptProfile('concise', f"""{_ROLE}
+The user encountered an error trying to install a Python package using pip. The error log follows in the user message.
+
+Please analyze this error and suggest ONE or TWO specific, single-line command-line commands that might fix this issue.
+Focus ONLY on `pip install ...` commands or `python -m pip install ...` commands. For example, suggest upgrading pip/setuptools/wheel, installing missing build dependencies available on PyPI, or using flags like --no-cache-dir.
+{_rules('pip install --upgrade setuptools wheel', 'pip install some-build-dependency')}""",
+                  description="Short pip-only instructions (pipai_server.py)"),
+
+    PromptProfile('system-aware', f"""{_ROLE}
+The user encountered an error trying to install a Python package using pip. The user message includes both the error log AND system information.
+
+Please analyze this error carefully, considering the Python version, system information, and pip version.
+Pay special attention to:
+1. Version compatibility issues between the package and Python version
+2. Architecture compatibility issues (32-bit vs 64-bit)
+3. Operating system specific requirements
+4. Missing system dependencies that might be indicated by the error
+
+Focus ONLY on `pip install ...` commands or `python -m pip install ...` commands. For example, suggest:
+- Upgrading pip/setuptools/wheel
+- Installing specific versions compatible with the user's Python version
+- Using appropriate flags (--no-cache-dir, --no-binary, etc.)
+- Installing missing Python dependencies available on PyPI
+
+{_rules('pip install --upgrade setuptools wheel', 'pip install some-package==1.2.3')}""",
+                  description="Weighs Python version, architecture and OS (server/pip-aide_server.py)"),
+)}
+
+
+def get_profile(name):
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown prompt profile {name!r}; available: {', '.join(sorted(PROFILES))}") from None
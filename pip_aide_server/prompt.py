@@ -0,0 +1,194 @@
+"""
+按 token 预算构建提示词
+
+错误日志可能有几 MB，直接拼进提示词会让上游延迟不可控、超出上下文长度、成本也高。
+这里把日志切成若干片段并按相关性打分（traceback、error 行、失败包的构建输出、系统信息等），
+在预算内按分数贪心挑选，再按原顺序拼接，被省略的部分用一行说明代替。
+"""
+import re
+
+from .fingerprint import SYSTEM_INFO_MARKER, split_error_context
+from .metrics import CONTEXT_TOKENS, PROMPT_TOKENS
+
+# 各模型用于提示词的 token 预算（远小于上下文长度，主要用于控制延迟与成本）
+MODEL_PROMPT_BUDGETS = {
+    'deepseek-chat': 6000,
+    'deepseek-reasoner': 6000,
+    'gpt-3.5-turbo': 3000,
+    'gpt-4o-mini': 6000,
+    'gpt-4o': 6000,
+}
+DEFAULT_PROMPT_BUDGET = 4000
+
+SCORE_HEADER = 100
+SCORE_TRACEBACK = 80
+SCORE_ERROR = 70
+SCORE_PACKAGE = 50
+SCORE_OTHER = 10
+
+_ERROR_LINE = re.compile(
+    r'\berror\b|\bfatal\b|\bfailed\b|exception|no matching distribution|could not (?:find|build|install)|not found',
+    re.IGNORECASE
+)
+_FAILED_PACKAGE = re.compile(
+    r'(?:Failed building wheel for|Failed to build|Running setup\.py install for|Building wheel for|'
+    r'No matching distribution found for|Could not find a version that satisfies the requirement)\s+([A-Za-z0-9_.\-]+)'
+)
+_COMMAND_PACKAGE = re.compile(r'^Command:\s+pip\s+install\s+(.*)$', re.MULTILINE)
+_CHUNK_LINES = 20
+# 单行过长（例如被压成一行的日志）时只保留开头部分
+_MAX_LINE_CHARS = 1000
+
+
+def estimate_tokens(text):
+    """
+    粗略估算 token 数，不依赖分词器：英文约 4 个字符一个 token，
+    中文等多字节字符约一个字符一个 token
+    """
+    chars = len(text)
+    multibyte = (len(text.encode('utf-8')) - chars) // 2
+    return (chars - multibyte + 3) // 4 + multibyte
+
+
+def prompt_budget(model):
+    return MODEL_PROMPT_BUDGETS.get(model, DEFAULT_PROMPT_BUDGET)
+
+
+def _failing_packages(error_log):
+    packages = {m.group(1).lower() for m in _FAILED_PACKAGE.finditer(error_log)}
+    command = _COMMAND_PACKAGE.search(error_log)
+    if command:
+        for arg in command.group(1).split():
+            if not arg.startswith('-'):
+                packages.add(re.split(r'[<>=!~\[;]', arg, 1)[0].lower())
+    packages.discard('')
+    return packages
+
+
+def split_sections(error_log):
+    """把日志切成 (start, end, score) 片段，end 不含"""
+    lines = [line if len(line) <= _MAX_LINE_CHARS else line[:_MAX_LINE_CHARS] + ' ...' for line in error_log.splitlines()]
+    scores = [SCORE_OTHER] * len(lines)
+    packages = _failing_packages(error_log)
+
+    def mark(start, end, score):
+        for i in range(max(start, 0), min(end, len(lines))):
+            scores[i] = max(scores[i], score)
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        lowered = stripped.lower()
+        if stripped.startswith(('Command:', 'Exit Code:')):
+            mark(i, i + 1, SCORE_HEADER)
+        if stripped.startswith('Traceback (most recent call last)'):
+            end = i + 1
+            while end < len(lines) and (not lines[end].strip() or lines[end][:1].isspace()):
+                end += 1
+            mark(i, end + 1, SCORE_TRACEBACK)  # 包含最后一行异常信息
+            i = end
+            continue
+        if _ERROR_LINE.search(stripped):
+            mark(i - 2, i + 4, SCORE_ERROR + (5 if 'error:' in lowered else 0))
+        elif packages and any(pkg in lowered for pkg in packages):
+            mark(i - 1, i + 2, SCORE_PACKAGE)
+        i += 1
+
+    # 相邻且分数相同的行合并为一个片段；普通行按固定长度分块
+    sections = []
+    start = 0
+    for i in range(1, len(lines) + 1):
+        if i == len(lines) or scores[i] != scores[start] or (scores[start] == SCORE_OTHER and i - start >= _CHUNK_LINES):
+            sections.append((start, i, scores[start]))
+            start = i
+    return lines, sections
+
+
+class PromptBuilder:
+    """
+    按提示词配置（profiles.PromptProfile）构建 chat 消息。静态前缀的 token 数在配置编译时已经估算；
+    每次构建时按剩余预算挑选日志片段，接在前缀之后作为最后一条消息的结尾。
+    """
+
+    def __init__(self, profile, model, budget=None, completion_tokens=150):
+        self.profile = profile
+        self.model = model
+        self.budget = budget or prompt_budget(model)
+        self.completion_tokens = completion_tokens
+        self.template_tokens = profile.prefix_tokens
+
+    def context_budget(self):
+        return max(self.budget - self.template_tokens - self.completion_tokens, 200)
+
+    def build(self, error_context):
+        """返回 (messages, stats)"""
+        fitted, stats = fit_error_context(error_context, self.context_budget())
+        stats['prompt_tokens'] = self.template_tokens + stats['context_tokens']
+        stats['prefix_tokens'] = self.template_tokens
+        stats['budget'] = self.budget
+        CONTEXT_TOKENS.observe(stats['original_tokens'])
+        PROMPT_TOKENS.observe(stats['prompt_tokens'])
+        return self.profile.messages(fitted), stats
+
+
+def fit_error_context(error_context, budget):
+    """在 budget 个 token 内尽量保留最相关的日志片段"""
+    original_tokens = estimate_tokens(error_context)
+    stats = {
+        'original_chars': len(error_context),
+        'original_tokens': original_tokens,
+        'context_tokens': original_tokens,
+        'sections': 0,
+        'sections_kept': 0,
+        'truncated': False,
+    }
+    if original_tokens <= budget:
+        return error_context, stats
+
+    error_log, system_info = split_error_context(error_context)
+    system_block = f"{SYSTEM_INFO_MARKER}{system_info}".strip()[:2000] if system_info else ''
+    remaining = budget - (estimate_tokens(system_block) + 1 if system_block else 0)
+
+    lines, sections = split_sections(error_log)
+    stats['sections'] = len(sections) + (1 if system_block else 0)
+    # 分数高的优先；同分时越靠后的越相关（pip 的关键报错通常在末尾）
+    ranked = sorted(sections, key=lambda s: (s[2], s[0]), reverse=True)
+    chosen = []
+    for start, end, score in ranked:
+        cost = estimate_tokens('\n'.join(lines[start:end])) + 1
+        if cost <= remaining:
+            chosen.append((start, end))
+            remaining -= cost
+        elif score >= SCORE_ERROR and remaining > 50:
+            # 放不下的重要片段保留末尾部分
+            kept_end = end
+            kept_start = end
+            while kept_start > start:
+                line_cost = estimate_tokens(lines[kept_start - 1]) + 1
+                if line_cost > remaining:
+                    break
+                remaining -= line_cost
+                kept_start -= 1
+            if kept_start < kept_end:
+                chosen.append((kept_start, kept_end))
+        if remaining <= 0:
+            break
+
+    chosen.sort()
+    output = []
+    cursor = 0
+    for start, end in chosen:
+        if start > cursor:
+            output.append(f"... [{start - cursor} lines omitted] ...")
+        output.extend(lines[start:end])
+        cursor = end
+    if cursor < len(lines):
+        output.append(f"... [{len(lines) - cursor} lines omitted] ...")
+    if system_block:
+        output.append('')
+        output.append(system_block)
+
+    fitted = '\n'.join(output)
+    stats.update(context_tokens=estimate_tokens(fitted), sections_kept=len(chosen) + (1 if system_block else 0), truncated=True)
+    return fitted, stats
@@ -0,0 +1,438 @@
+"""
+多上游路由
+
+每个上游（base_url、密钥环境变量、模型、权重）维护滑动平均延迟与错误率，
+每次调用选择当前最优的健康上游；主调用迟迟不返回时向次优上游发起对冲请求，
+先返回的结果胜出。连续失败的上游会被熔断，由后台探测恢复。
+流式调用不做对冲，只在收到第一个片段之前失败时换下一个上游。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .metrics import UPSTREAM_LATENCY
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 滑动平均的平滑系数
+_EWMA_ALPHA = 0.2
+
+
+class UpstreamError(Exception):
+    """上游调用失败（网络错误、超时、非 200 响应或响应格式错误）"""
+
+
+class Backend:
+    """单个上游及其健康状态"""
+
+    def __init__(self, name, base_url, model, api_key='', weight=1.0, timeout=20):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.api_key = api_key
+        self.weight = max(float(weight), 0.01)
+        self.timeout = timeout
+        self.session = requests.Session()  # 复用连接
+        self.latency = None  # 成功调用的滑动平均延迟（秒）
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.inflight = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.last_ok = None  # 最近一次成功调用的时间（monotonic）
+        self.cassette = None  # 设置后调用经过录制/回放（见 cassette.py）
+        self._lock = threading.Lock()
+
+    def post(self, payload, timeout=None):
+        """同步调用 chat completions，返回完整的响应 JSON"""
+        if self.cassette is not None:
+            return self.cassette.post(self, payload, timeout)
+        return self.live_post(payload, timeout)
+
+    def stream(self, payload, timeout=None):
+        """同步调用流式 chat completions，逐个产出回答文本片段"""
+        if self.cassette is not None:
+            return self.cassette.stream(self, payload, timeout)
+        return self.live_stream(payload, timeout)
+
+    def live_post(self, payload, timeout=None):
+        """直接调用上游（不经过 cassette）"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        try:
+            resp = self.session.post(f"{self.base_url}/chat/completions", headers=headers, json=payload,
+                                     timeout=timeout or self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise UpstreamError(f"RequestException: {e}") from e
+        if resp.status_code != 200:
+            raise UpstreamError(f"API error {resp.status_code}")
+        try:
+            return resp.json()
+        except ValueError as e:
+            raise UpstreamError(f"Invalid JSON from upstream: {e}") from e
+
+    def live_stream(self, payload, timeout=None):
+        """读取上游的 SSE 流"""
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        }
+        try:
+            resp = self.session.post(f"{self.base_url}/chat/completions", headers=headers,
+                                     json=dict(payload, stream=True), timeout=timeout or self.timeout, stream=True)
+        except requests.exceptions.RequestException as e:
+            raise UpstreamError(f"RequestException: {e}") from e
+        with resp:
+            if resp.status_code != 200:
+                raise UpstreamError(f"API error {resp.status_code}")
+            resp.encoding = 'utf-8'
+            try:
+                # chunk_size=None: 每个传输分块到达即处理，不攒满缓冲区
+                for line in resp.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        return
+                    try:
+                        content = (json.loads(data)['choices'][0].get('delta') or {}).get('content')
+                    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+                        raise UpstreamError(f"Unexpected stream chunk: {e}") from e
+                    if content:
+                        yield content
+            except requests.exceptions.RequestException as e:
+                raise UpstreamError(f"Stream interrupted: {e}") from e
+
+    def record(self, ok, latency, failure_threshold):
+        """记录一次调用结果，必要时打开或关闭熔断器"""
+        with self._lock:
+            self.inflight = max(self.inflight - 1, 0)
+            self.calls += 1
+            self.error_rate += _EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+            if ok:
+                self.latency = latency if self.latency is None else self.latency + _EWMA_ALPHA * (latency - self.latency)
+                self.last_ok = time.monotonic()
+                self.consecutive_failures = 0
+                self.state = CLOSED
+            else:
+                self.failures += 1
+                self.consecutive_failures += 1
+                if self.state == HALF_OPEN or self.consecutive_failures >= failure_threshold:
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+
+    def reachable(self):
+        """至少成功过一次且熔断器关闭"""
+        return self.state == CLOSED and self.last_ok is not None
+
+    def available(self, cooldown):
+        """熔断器关闭时可用；打开超过 cooldown 后允许一个试探请求（半开）"""
+        if self.state == CLOSED:
+            return True
+        return self.state == OPEN and time.monotonic() - self.opened_at >= cooldown
+
+    def begin(self):
+        with self._lock:
+            self.inflight += 1
+            if self.state == OPEN:
+                self.state = HALF_OPEN
+
+    def score(self, default_latency):
+        """越小越好：延迟 × 错误惩罚 × 排队惩罚 / 权重"""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + 4 * self.error_rate) * (1 + 0.25 * self.inflight) / self.weight
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'base_url': self.base_url,
+            'model': self.model,
+            'weight': self.weight,
+            'state': self.state,
+            'latency_ewma': round(self.latency, 4) if self.latency is not None else None,
+            'error_rate_ewma': round(self.error_rate, 4),
+            'calls': self.calls,
+            'failures': self.failures,
+            'inflight': self.inflight,
+            'reachable': self.reachable(),
+        }
+
+
+def load_backends(spec, default_base_url, default_model, default_key_env, timeout=20):
+    """
+    解析上游配置。spec 为 JSON 数组或指向 JSON 文件的路径，例如:
+    [{"name": "deepseek", "base_url": "https://api.deepseek.com/v1", "model": "deepseek-chat",
+      "api_key_env": "DEEPSEEK_API_KEY", "weight": 2}]
+    spec 为空时使用 OPENAI_API_BASE / OPENAI_MODEL / DEEPSEEK_API_KEY 组成的单个上游。
+    """
+    if not spec:
+        entries = [{'name': 'default', 'base_url': default_base_url, 'model': default_model, 'api_key_env': default_key_env}]
+    elif spec.lstrip().startswith('['):
+        entries = json.loads(spec)
+    else:
+        with open(spec, encoding='utf-8') as f:
+            entries = json.load(f)
+
+    backends = []
+    for i, entry in enumerate(entries):
+        backends.append(Backend(
+            name=entry.get('name') or f"backend-{i}",
+            base_url=entry['base_url'],
+            model=entry.get('model', default_model),
+            api_key=os.getenv(entry.get('api_key_env', default_key_env), ''),
+            weight=entry.get('weight', 1.0),
+            timeout=entry.get('timeout', timeout),
+        ))
+    return backends
+
+
+class UpstreamRouter:
+    """
+    在多个上游之间路由 chat completions 调用。
+
+    - 选择 score 最小的可用上游
+    - 主调用超过 hedge 延迟仍未返回时，向次优上游发起对冲请求
+    - 调用失败时换下一个上游重试，最多 max_attempts 个上游
+    - 连续失败 failure_threshold 次后熔断，cooldown 秒后由后台探测或试探请求恢复
+    - 后台探测启动时立即探测所有上游，之后定期探测已熔断或尚未连通的上游
+    """
+
+    def __init__(self, backends, max_workers=32, failure_threshold=3, cooldown=30, probe_interval=15,
+                 hedge_multiplier=2.0, min_hedge_delay=1.0, default_hedge_delay=5.0, max_attempts=2):
+        if not backends:
+            raise ValueError("At least one upstream backend is required")
+        self.backends = backends
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.hedge_multiplier = hedge_multiplier
+        self.min_hedge_delay = min_hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.max_attempts = max_attempts
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pipai-upstream')
+        self._probe_task = None
+
+    def ranked(self):
+        """按 score 排序的可用上游"""
+        known = [b.latency for b in self.backends if b.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        available = [b for b in self.backends if b.available(self.cooldown)]
+        return sorted(available, key=lambda b: b.score(default_latency))
+
+    def reachable(self):
+        return any(b.reachable() for b in self.backends)
+
+    def hedge_delay(self, backend):
+        if backend.latency is None:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, backend.latency * self.hedge_multiplier)
+
+    async def complete(self, messages, temperature=0.6, max_tokens=150, timeout=None):
+        """返回 (响应 JSON, 实际应答的 Backend)；所有尝试都失败时抛出 UpstreamError"""
+        candidates = self.ranked()
+        if not candidates:
+            raise UpstreamError("All upstream backends are unavailable (circuit open)")
+
+        loop = asyncio.get_running_loop()
+        pending = {}
+        errors = []
+        launched = 0
+
+        def launch(backend):
+            nonlocal launched
+            launched += 1
+            payload = {
+                "model": backend.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            }
+            future = loop.run_in_executor(self._executor, self._call, backend, payload, timeout, True)
+            pending[future] = backend
+
+        launch(candidates[0])
+        hedged = False
+        while pending:
+            can_hedge = not hedged and launched < min(len(candidates), self.max_attempts)
+            wait_timeout = self.hedge_delay(candidates[0]) if can_hedge else None
+            done, _ = await asyncio.wait(pending, timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # 主调用太慢，向下一个上游发起对冲请求
+                hedged = True
+                self.hedges += 1
+                launch(candidates[launched])
+                continue
+
+            for future in done:
+                backend = pending.pop(future)
+                try:
+                    result = future.result()
+                except UpstreamError as e:
+                    errors.append(f"{backend.name}: {e}")
+                    continue
+                if hedged and backend is not candidates[0]:
+                    self.hedge_wins += 1
+                return result, backend
+
+            if not pending and launched < min(len(candidates), self.max_attempts):
+                self.failovers += 1
+                launch(candidates[launched])
+
+        raise UpstreamError('; '.join(errors))
+
+    async def stream(self, messages, temperature=0.6, max_tokens=150, timeout=None):
+        """
+        流式调用，逐个产出回答片段。已经产出片段后出错时直接抛出 UpstreamError，
+        调用方（级联）会作废已产出的内容。
+        """
+        candidates = self.ranked()
+        if not candidates:
+            raise UpstreamError("All upstream backends are unavailable (circuit open)")
+
+        errors = []
+        for attempt, backend in enumerate(candidates[:self.max_attempts]):
+            if attempt:
+                self.failovers += 1
+            payload = {
+                "model": backend.model,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+            }
+            received = False
+            try:
+                async for chunk in self._stream_call(backend, payload, timeout):
+                    received = True
+                    yield chunk
+                return
+            except UpstreamError as e:
+                if received:
+                    raise
+                errors.append(f"{backend.name}: {e}")
+        raise UpstreamError('; '.join(errors))
+
+    async def _stream_call(self, backend, payload, timeout):
+        """在线程池中读取上游的流，经队列把片段交给事件循环"""
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        finished = object()
+        abandoned = threading.Event()
+
+        def deliver(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                abandoned.set()  # 事件循环已关闭
+
+        def pump():
+            backend.begin()
+            started = time.monotonic()
+            ok = False
+            try:
+                for chunk in backend.stream(payload, timeout):
+                    if abandoned.is_set():
+                        break
+                    deliver(chunk)
+                ok = True
+            except UpstreamError as e:
+                deliver(e)
+            finally:
+                latency = time.monotonic() - started
+                backend.record(ok, latency, self.failure_threshold)
+                UPSTREAM_LATENCY.labels(backend.name, backend.model, 'ok' if ok else 'error').observe(latency)
+                deliver(finished)
+
+        loop.run_in_executor(self._executor, pump)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is finished:
+                    return
+                if isinstance(item, UpstreamError):
+                    raise item
+                yield item
+        finally:
+            # 调用方提前停止读取（超过期限、客户端断开）时让后台线程尽快结束
+            abandoned.set()
+
+    def _call(self, backend, payload, timeout, observe=False):
+        backend.begin()
+        started = time.monotonic()
+        try:
+            result = backend.post(payload, timeout)
+        except UpstreamError:
+            latency = time.monotonic() - started
+            backend.record(False, latency, self.failure_threshold)
+            if observe:
+                UPSTREAM_LATENCY.labels(backend.name, backend.model, 'error').observe(latency)
+            raise
+        latency = time.monotonic() - started
+        backend.record(True, latency, self.failure_threshold)
+        if observe:
+            UPSTREAM_LATENCY.labels(backend.name, backend.model, 'ok').observe(latency)
+        return result
+
+    # ---- 后台探测 ----
+
+    def start_probing(self):
+        if self._probe_task is None:
+            self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    async def stop_probing(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+
+    async def probe(self, backend):
+        """发一个最小请求检查上游是否恢复"""
+        payload = {
+            "model": backend.model,
+            "messages": [{"role": "user", "content": "ping"}],
+            "temperature": 0,
+            "max_tokens": 1,
+        }
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._call, backend, payload, min(backend.timeout, 10))
+            return True
+        except UpstreamError:
+            return False
+
+    async def _probe_loop(self):
+        await asyncio.gather(*(self.probe(b) for b in self.backends))
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            for backend in self.backends:
+                if backend.state == OPEN:
+                    if backend.available(self.cooldown):
+                        await self.probe(backend)
+                elif backend.last_ok is None:
+                    await self.probe(backend)
+
+    def snapshot(self):
+        return {
+            'backends': [b.snapshot() for b in self.backends],
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers,
+            'reachable': self.reachable(),
+        }
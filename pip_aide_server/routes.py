@@ -0,0 +1,282 @@
+"""
+两个服务入口共用的辅助接口
+"""
+import re
+from typing import List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Response
+from pydantic import BaseModel
+
+from .admission import AdmissionRejected
+from .cluster import PeerUnavailable
+from .config import ADMIN_TOKEN
+from .feedback import DUPLICATE, UNKNOWN, summarize_outcomes
+from .fingerprint import error_fingerprint
+from .jsonlog import bind_request, get_logger
+from .metrics import CONTENT_TYPE, REGISTRY
+
+# 一次反馈最多包含的命令数；建议通常只有一两条命令
+MAX_FEEDBACK_COMMANDS = 20
+
+_FINGERPRINT = re.compile(r'[0-9a-f]{64}')
+_SUGGESTION_ID = re.compile(r'[0-9a-f]{16}')
+
+
+class InvalidateCacheRequest(BaseModel):
+    fingerprint: Optional[str] = None
+    error_context: Optional[str] = None
+
+
+class CommandOutcome(BaseModel):
+    command: str
+    exit_code: Optional[int] = None  # None 表示没有执行
+    duration: float = 0.0
+
+
+class FeedbackRequest(BaseModel):
+    machine_id: str
+    request_id: str
+    fingerprint: str
+    suggestion_id: str
+    outcomes: List[CommandOutcome]
+
+
+def require_admin(token):
+    if ADMIN_TOKEN and token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+def cache_router(cache, in_flight=None, shared_flight=None):
+    """缓存统计与失效接口"""
+    router = APIRouter()
+
+    @router.get('/cache/stats')
+    async def cache_stats():
+        stats = await cache.astats()
+        if in_flight is not None:
+            stats['coalescing'] = in_flight.stats()
+        if shared_flight is not None:
+            stats['shared_coalescing'] = shared_flight.stats()
+        return stats
+
+    @router.post('/cache/invalidate')
+    async def invalidate_cache(data: InvalidateCacheRequest, x_admin_token: str = Header(default='')):
+        require_admin(x_admin_token)
+        fingerprint = data.fingerprint
+        if fingerprint is None and data.error_context is not None:
+            fingerprint = error_fingerprint(data.error_context)
+        removed = await cache.ainvalidate(fingerprint)
+        return {"fingerprint": fingerprint, "removed": removed}
+
+    return router
+
+
+def log_router(writer):
+    """日志写入器的队列深度、丢弃数等统计"""
+    router = APIRouter()
+
+    @router.get('/logs/stats')
+    async def log_stats():
+        return writer.stats()
+
+    return router
+
+
+def upstream_status_router(model_cascade):
+    """级联各级的作答/升级统计，以及各上游的延迟、错误率与熔断状态"""
+    router = APIRouter()
+
+    @router.get('/upstreams')
+    async def upstream_status():
+        return model_cascade.snapshot()
+
+    return router
+
+
+def health_router(model_cascade, cache):
+    """
+    /healthz：进程存活即返回 200。
+    /readyz：上游已连通且缓存已预热时返回 200；上游全部熔断时状态为 degraded，
+    此时仍能返回缓存的建议，带 ?degraded_ok=true 时也返回 200。
+    """
+    router = APIRouter()
+
+    @router.get('/healthz')
+    async def healthz():
+        return {'status': 'ok'}
+
+    @router.get('/readyz')
+    async def readyz(response: Response, degraded_ok: bool = False):
+        upstream = model_cascade.reachable()
+        if cache.warmed and upstream:
+            status = 'ready'
+        elif cache.warmed and model_cascade.degraded():
+            status = 'degraded'
+        else:
+            status = 'starting'
+        if not (status == 'ready' or (status == 'degraded' and degraded_ok)):
+            response.status_code = 503
+        return {'status': status, 'upstream': upstream, 'cache': cache.warmed}
+
+    return router
+
+
+def metrics_router(registry=REGISTRY):
+    """Prometheus 文本格式的指标"""
+    router = APIRouter()
+
+    @router.get('/metrics')
+    async def metrics():
+        return Response(registry.render(), media_type=CONTENT_TYPE)
+
+    return router
+
+
+def admission_router(admission):
+    """准入控制的并发、排队与拒绝统计"""
+    router = APIRouter()
+
+    @router.get('/admission/stats')
+    async def admission_stats():
+        return admission.stats()
+
+    return router
+
+
+def similarity_router(index):
+    """相似检索索引的条目数、阈值与命中统计"""
+    router = APIRouter()
+
+    @router.get('/similarity/stats')
+    async def similarity_stats():
+        return index.stats()
+
+    return router
+
+
+def cassette_router(cassette):
+    """上游流量录制/回放的模式与次数（回放时包括未录制的请求数）"""
+    router = APIRouter()
+
+    @router.get('/cassette/stats')
+    async def cassette_stats():
+        return cassette.stats()
+
+    return router
+
+
+def jobs_router(jobs):
+    """
+    GET /jobs/{job_id}?wait=N：查询任务状态，任务未结束时最多等待 N 秒（不超过服务端的 max_wait）；
+    任务不存在或结果已过期时返回 404，客户端重新提交即可。提交见各服务入口的 POST /jobs。
+    """
+    router = APIRouter()
+
+    @router.get('/jobs/stats')
+    async def job_stats():
+        return jobs.stats()
+
+    @router.get('/jobs/{job_id}')
+    async def job_status(job_id: str, wait: float = 0.0):
+        job = jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Unknown or expired job")
+        return await jobs.wait(job, wait)
+
+    return router
+
+
+def capabilities_router(capabilities):
+    """GET /capabilities：服务端支持的可选接口（路径相对于服务根地址），客户端据此选择调用方式"""
+    router = APIRouter()
+
+    @router.get('/capabilities')
+    async def server_capabilities():
+        return capabilities
+
+    return router
+
+
+def feedback_router(feedback, admission=None, cluster=None):
+    """
+    客户端回报修复命令的执行结果；统计见 /feedback/stats。
+    request_id、machine_id、fingerprint 与 suggestion_id 必须与服务端发出的回答一致（否则 404），
+    同一个回答再次回报返回 409。集群模式下反馈转交给指纹的所有者节点，成功率只在所有者上汇总。
+    """
+    router = APIRouter()
+    log = get_logger('feedback')
+
+    @router.post('/feedback', status_code=202)
+    async def fix_feedback(data: FeedbackRequest, x_cluster_forwarded: Optional[str] = Header(default=None),
+                           x_cluster_token: str = Header(default='')):
+        # 日志以原始分析请求的 request_id 关联
+        bind_request(data.request_id[:64])
+        forwarded = False
+        if cluster is not None and x_cluster_forwarded is not None:
+            # 密钥正确才视为其他节点转交的反馈，限速已由接收反馈的节点检查过
+            cluster.check_token(x_cluster_token)
+            forwarded = True
+        if not forwarded and admission is not None:
+            try:
+                admission.check_client(data.machine_id)
+            except AdmissionRejected as e:
+                raise too_many_requests(e)
+        if not _FINGERPRINT.fullmatch(data.fingerprint) or not _SUGGESTION_ID.fullmatch(data.suggestion_id):
+            raise HTTPException(status_code=422, detail="Invalid fingerprint or suggestion_id")
+        if len(data.outcomes) > MAX_FEEDBACK_COMMANDS:
+            raise HTTPException(status_code=422, detail="Too many commands")
+
+        owner = cluster.owner(data.fingerprint) if cluster is not None and not forwarded else None
+        if owner is not None:
+            payload = {'machine_id': data.machine_id, 'request_id': data.request_id, 'fingerprint': data.fingerprint,
+                       'suggestion_id': data.suggestion_id,
+                       'outcomes': [{'command': o.command, 'exit_code': o.exit_code, 'duration': o.duration}
+                                    for o in data.outcomes]}
+            try:
+                return await cluster.post(owner, '/feedback', payload)
+            except PeerUnavailable as e:
+                log.warning("Owner node unavailable, recording feedback locally", extra={'error': str(e)})
+
+        outcomes = [{'exit_code': o.exit_code, 'duration': max(o.duration, 0.0)} for o in data.outcomes]
+        outcome = summarize_outcomes(outcomes)
+        duration = sum(o['duration'] for o in outcomes if o['exit_code'] is not None)
+        result = await feedback.arecord(data.request_id, data.machine_id, data.fingerprint, data.suggestion_id,
+                                        outcome, duration)
+        log.info("Fix feedback", extra={'fingerprint': data.fingerprint[:12], 'suggestion_id': data.suggestion_id,
+                                        'outcome': outcome, 'commands': len(outcomes),
+                                        'duration': round(duration, 3), 'result': result})
+        # 只接受本服务端发给该客户端的回答，每个回答只记录一次
+        if result == UNKNOWN:
+            raise HTTPException(status_code=404, detail="Unknown or expired request")
+        if result == DUPLICATE:
+            raise HTTPException(status_code=409, detail="Feedback already recorded")
+        return {"accepted": True, "outcome": outcome}
+
+    @router.get('/feedback/stats')
+    async def feedback_stats():
+        return await feedback.astats()
+
+    return router
+
+
+def cluster_router(cluster):
+    """GET /cluster/status：各节点负责的哈希空间比例、不可达的节点与转发次数；带 ?fingerprint= 时给出其所有者"""
+    router = APIRouter()
+
+    @router.get('/cluster/status')
+    async def cluster_status(fingerprint: Optional[str] = None):
+        status = cluster.stats()
+        if fingerprint is not None:
+            status['owner'] = cluster.owner(fingerprint) or cluster.self_url
+        return status
+
+    return router
+
+
+def too_many_requests(rejected):
+    """把 AdmissionRejected 转成带 Retry-After 的 429"""
+    return HTTPException(
+        status_code=429,
+        detail=f"Server is busy ({rejected.reason}), retry later",
+        headers={'Retry-After': str(rejected.retry_after)},
+    )
@@ -0,0 +1,580 @@
+"""
+pip-aide AI 服务端（FastAPI 应用）
+
+导入时按环境变量（见 config.py）组装 app，提示词配置由 PIPAI_PROMPT_PROFILE 选择（见 profiles.py）。
+pipai_server.py 与 server/pip-aide_server.py 只设置各自的默认提示词配置与监听地址，再运行这里的 app；
+也可以直接运行：
+
+    python -m pip_aide_server --profile system-aware --port 8000
+    uvicorn pip_aide_server.server:app --workers 4
+"""
+import os
+import asyncio
+import uvicorn
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional
+import time
+import uuid
+import math
+from dotenv import load_dotenv
+
+from pip_aide.compression import available_encodings
+from .admission import AdmissionController, AdmissionRejected
+from .batch import analyze_batch, group_by_fingerprint
+from .cache import SuggestionCache
+from .cluster import Cluster, PeerUnavailable
+from .config import (
+    OPENAI_API_KEY, OPENAI_API_BASE, OPENAI_MODEL,
+    CACHE_PATH, CACHE_MAX_ENTRIES, CACHE_TTL, CACHE_NEGATIVE_TTL, CACHE_STALE_TTL, UPSTREAM_PROBE_INTERVAL,
+    IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, WORKERS, FLIGHT_LEASE_TTL, FLIGHT_POLL_INTERVAL,
+    CLIENT_RATE, CLIENT_BURST, GLOBAL_RATE, GLOBAL_BURST, MAX_CONCURRENT_UPSTREAM, MAX_QUEUE, MAX_QUEUE_TIME,
+    MAX_COMPLETION_TOKENS, PROMPT_TOKEN_BUDGET, MAX_REQUEST_BYTES, COMPRESS_MIN_BYTES, MAX_BATCH_ITEMS,
+    SIMILARITY_THRESHOLD, SIMILARITY_MAX_ENTRIES, SIMILARITY_BOOTSTRAP_RECORDS,
+    FEEDBACK_MIN_REPORTS, FEEDBACK_MIN_SUCCESS_RATE, FEEDBACK_TTL, JOB_WORKERS, JOB_MAX_QUEUE, JOB_TTL, JOB_MAX_WAIT,
+    CLUSTER_PEERS, CLUSTER_SELF, CLUSTER_VNODES, CLUSTER_TIMEOUT, CLUSTER_CONNECT_TIMEOUT, CLUSTER_PEER_COOLDOWN,
+    CLUSTER_MAX_CONNECTIONS, CLUSTER_TOKEN, SERVER_LOG_LEVEL, SERVER_LOG_SAMPLE_RATE, SERVER_LOG_QUEUE_SIZE,
+    LOG_DIR, LOG_QUEUE_SIZE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_SEGMENT_BYTES, LOG_MAX_SEGMENTS, LOG_COMPRESS,
+    LOG_SHARDS, PROMPT_PROFILE, HOST, PORT,
+)
+from .feedback import FeedbackStore, suggestion_id
+from .fingerprint import error_fingerprint
+from .ingest import BodySizeLimitMiddleware, ResponseCompressionMiddleware
+from .jobs import DONE, FAILED, JobManager
+from .jsonlog import bind_request, clean_correlation_id, setup_logging, shutdown_logging
+from .logwriter import LogWriter
+from .metrics import ANSWERS, SUPPRESSED_SUGGESTIONS, MetricsMiddleware, register_component_metrics
+from .profiles import get_profile
+from .prompt import PromptBuilder
+from .routes import (
+    admission_router, cache_router, capabilities_router, cassette_router, cluster_router, feedback_router,
+    health_router, jobs_router, log_router, metrics_router, similarity_router, too_many_requests,
+    upstream_status_router,
+)
+from .similarity import SimilarityIndex, is_known_good, recent_log_records
+from .singleflight import SingleFlight, SharedFlight, IdempotencyRegistry
+from .streaming import (
+    HEADERS as SSE_HEADERS, MEDIA_TYPE as SSE_MEDIA_TYPE, Broadcast, StreamTimer, sse_event,
+)
+from .upstream import fetch_suggestion, model_cascade, stream_suggestion, upstream_cassette
+
+# 环境变量加载（如有需要）
+load_dotenv()
+
+# 运行日志经队列由后台线程输出，请求路径上不做阻塞的 stdout 写入
+log = setup_logging(SERVER_LOG_LEVEL, sample_rate=SERVER_LOG_SAMPLE_RATE, queue_size=SERVER_LOG_QUEUE_SIZE)
+
+# 如果没有设置API密钥，给出警告
+if not OPENAI_API_KEY:
+    log.warning("警告: 未设置DEEPSEEK_API_KEY环境变量。AI功能将无法正常工作。请在.env文件中添加 DEEPSEEK_API_KEY=your_api_key_here")
+
+app = FastAPI()
+# 请求体在 JSON 解析之前解压并限制大小（按解压后的大小计）
+app.add_middleware(BodySizeLimitMiddleware, max_body_bytes=MAX_REQUEST_BYTES)
+# 较大的响应按 Accept-Encoding 压缩；流式响应不压缩
+if COMPRESS_MIN_BYTES > 0:
+    app.add_middleware(ResponseCompressionMiddleware, min_size=COMPRESS_MIN_BYTES)
+# 最外层：请求延迟与状态码（包括被拒绝的请求）
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+# 错误日志由后台线程批量写入 LOG_DIR 下按日期与 machine_id 分片的轮转分段
+log_writer = LogWriter(
+    LOG_DIR, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+    segment_bytes=LOG_SEGMENT_BYTES, max_segments=LOG_MAX_SEGMENTS, compress=LOG_COMPRESS,
+    shards=LOG_SHARDS,
+)
+app.include_router(log_router(log_writer))
+app.include_router(upstream_status_router(model_cascade))
+
+# 客户端回报的修复结果：按建议汇总成功率，用于缓存淘汰、相似检索排序与屏蔽多次失败的建议
+fix_feedback = FeedbackStore(CACHE_PATH, min_reports=FEEDBACK_MIN_REPORTS, min_success_rate=FEEDBACK_MIN_SUCCESS_RATE,
+                             issued_ttl=FEEDBACK_TTL)
+
+# 建议缓存：内存 LRU + SQLite 持久层；内存层满时优先淘汰修复成功率低的建议
+suggestion_cache = SuggestionCache(CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL,
+                                   stale_ttl=CACHE_STALE_TTL, rank=fix_feedback.rank)
+# 相同指纹的并发请求共享一次上游调用；客户端重试通过幂等键挂到原始计算上
+in_flight = SingleFlight()
+# 正在进行的流式计算：fingerprint -> Broadcast
+stream_broadcasts = {}
+idempotency_registry = IdempotencyRegistry(ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS)
+# 多个 worker（或共用同一缓存文件的多个进程）之间的去重
+shared_flight = SharedFlight(CACHE_PATH, lease_ttl=FLIGHT_LEASE_TTL, poll_interval=FLIGHT_POLL_INTERVAL)
+app.include_router(cache_router(suggestion_cache, in_flight, shared_flight))
+
+# 集群模式：多个节点按一致性哈希划分指纹，每个指纹只由它的所有者缓存与调用模型，其他节点把请求转发给所有者
+cluster = None
+if CLUSTER_PEERS:
+    if not CLUSTER_TOKEN:
+        # 没有密钥时任何人都能调用内部接口、冒充转发绕过限速
+        raise ValueError("PIPAI_CLUSTER_PEERS requires PIPAI_CLUSTER_TOKEN")
+    if CLUSTER_SELF:
+        cluster = Cluster(CLUSTER_SELF, CLUSTER_PEERS.split(','), vnodes=CLUSTER_VNODES, timeout=CLUSTER_TIMEOUT,
+                          connect_timeout=CLUSTER_CONNECT_TIMEOUT, cooldown=CLUSTER_PEER_COOLDOWN, token=CLUSTER_TOKEN,
+                          max_connections=CLUSTER_MAX_CONNECTIONS)
+        app.include_router(cluster_router(cluster))
+    else:
+        log.warning("警告: 设置了 PIPAI_CLUSTER_PEERS 但没有设置 PIPAI_CLUSTER_SELF，集群模式未启用。")
+app.include_router(health_router(model_cascade, suggestion_cache))
+
+# 相似检索：与已有正常建议的历史请求足够接近时直接复用，不调用模型；每个 worker 各自维护
+similarity_index = SimilarityIndex(threshold=SIMILARITY_THRESHOLD, max_entries=SIMILARITY_MAX_ENTRIES)
+app.include_router(similarity_router(similarity_index))
+if upstream_cassette is not None:
+    app.include_router(cassette_router(upstream_cassette))
+
+def known_good(fingerprint, suggestion):
+    if not is_known_good(suggestion) or fix_feedback.failing(fingerprint, suggestion_id(suggestion)):
+        return None
+    return suggestion
+
+async def best_similar_match(matches):
+    # 相似度乘以修复成功率，优先复用实际有效的建议
+    best = None
+    for score, similar_fingerprint in matches:
+        suggestion = known_good(similar_fingerprint, await suggestion_cache.aget(similar_fingerprint, count=False))
+        if suggestion is None:
+            continue
+        weight = score * fix_feedback.success_rate(similar_fingerprint, suggestion_id(suggestion))
+        if best is None or weight > best[0]:
+            best = (weight, score, similar_fingerprint, suggestion)
+    return best
+
+# 准入控制：过载时快速返回 429 + Retry-After，而不是让所有请求一起等到上游超时
+admission = AdmissionController(
+    client_rate=CLIENT_RATE, client_burst=CLIENT_BURST, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+    max_concurrent=MAX_CONCURRENT_UPSTREAM, max_queue=MAX_QUEUE, max_queue_time=MAX_QUEUE_TIME,
+)
+app.include_router(admission_router(admission))
+app.include_router(feedback_router(fix_feedback, admission, cluster))
+
+# 异步任务：提交后立即返回任务 ID，由固定数量的 worker 协程执行分析，客户端长轮询取回结果
+analysis_jobs = JobManager(workers=JOB_WORKERS, max_queue=JOB_MAX_QUEUE, ttl=JOB_TTL, max_wait=JOB_MAX_WAIT)
+app.include_router(jobs_router(analysis_jobs))
+# 客户端据此决定使用任务接口还是同步接口
+app.include_router(capabilities_router({
+    'jobs': {'path': 'jobs', 'max_wait': JOB_MAX_WAIT},
+    'stream': {'path': 'analyze_error/stream'},
+    'feedback': {'path': 'feedback'},
+    'batch': {'path': 'analyze_errors', 'max_items': MAX_BATCH_ITEMS, 'max_bytes': MAX_REQUEST_BYTES},
+    # 请求体可以使用的 Content-Encoding
+    'encodings': available_encodings(),
+}))
+
+# Prometheus 指标；多 worker 时每个 worker 各自统计
+register_component_metrics(cache=suggestion_cache, in_flight=in_flight, admission=admission, log_writer=log_writer,
+                           similarity=similarity_index, feedback=fix_feedback, jobs=analysis_jobs,
+                           cluster=cluster)
+app.include_router(metrics_router())
+
+class AnalyzeErrorRequest(BaseModel):
+    machine_id: str
+    error_context: str
+
+class ClusterAnalyzeRequest(BaseModel):
+    error_context: str
+    machine_id: str = ''  # 发起请求的客户端，反馈时据此核对
+
+class AnalyzeErrorItem(BaseModel):
+    id: str  # 客户端指定，在批次内唯一
+    error_context: str
+
+class AnalyzeErrorsRequest(BaseModel):
+    machine_id: str
+    items: List[AnalyzeErrorItem]
+
+# 提示词配置在启动时编译一次：静态指令在前、错误日志在后，每个请求的消息前缀完全相同，可命中上游的前缀缓存
+prompt_profile = get_profile(PROMPT_PROFILE)
+prompt_builder = PromptBuilder(prompt_profile, OPENAI_MODEL, budget=PROMPT_TOKEN_BUDGET or None,
+                               completion_tokens=MAX_COMPLETION_TOKENS)
+
+@app.on_event("startup")
+async def startup_event():
+    # 启动不等待上游：连通性由后台探测确认，缓存预热也在后台进行，就绪状态见 /readyz
+    log.info("Probing AI service in the background", extra={'api_base': OPENAI_API_BASE, 'model': OPENAI_MODEL})
+    log.info("Prompt profile compiled", extra={'profile': prompt_profile.name,
+                                               'prefix_tokens': prompt_profile.prefix_tokens,
+                                               'prefix_digest': prompt_profile.prefix_digest})
+    model_cascade.start_probing()
+    analysis_jobs.start()
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, suggestion_cache.warm)
+    if similarity_index.enabled:
+        loop.run_in_executor(None, bootstrap_similarity_index)
+
+def bootstrap_similarity_index():
+    # 用最近的错误日志回填相似索引，只收录缓存中仍有正常建议的请求
+    records = recent_log_records(LOG_DIR, SIMILARITY_BOOTSTRAP_RECORDS)
+    # 在线程中运行，直接使用同步的缓存查询
+    accept = lambda fp: known_good(fp, suggestion_cache.get(fp, count=False)) is not None
+    added = similarity_index.add_records(records, accept)
+    log.info("Similarity index loaded", extra={'records': len(records), 'entries': added})
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await model_cascade.stop_probing()
+    await analysis_jobs.stop()
+    # 写完队列中剩余的日志
+    log_writer.close()
+    shared_flight.close()
+    fix_feedback.close()
+    if cluster is not None:
+        cluster.close()
+    if upstream_cassette is not None:
+        upstream_cassette.close()
+    shutdown_logging()
+
+async def fetch_and_cache(fingerprint, error_context, broadcast=None):
+    async def compute():
+        messages, prompt_stats = prompt_builder.build(error_context)
+        # 每次调用模型都记录提示词大小（INFO 级别不受 DEBUG 采样影响）：原始与实际 token 数、保留的片段数、是否截断
+        log.info("Prompt built", extra=dict(prompt_stats, fingerprint=fingerprint[:12]))
+        # 只有需要调用模型的请求占用上游名额；排队超时或队列已满时抛出 AdmissionRejected
+        async with admission.upstream_slot():
+            if broadcast is None:
+                result = await fetch_suggestion(messages)
+            else:
+                result = await stream_suggestion(messages, broadcast.publish)
+        suggestion = result.suggestion
+        if fix_feedback.failing(fingerprint, suggestion_id(suggestion)):
+            # 模型再次给出多次执行失败的建议：按负结果缓存（较短的 TTL），不让客户端重复执行
+            log.warning("Model repeated a failing suggestion", extra={'fingerprint': fingerprint[:12]})
+            SUPPRESSED_SUGGESTIONS.labels('llm').inc()
+            suggestion = "UNCERTAIN"
+        await suggestion_cache.aput(fingerprint, suggestion)
+        if is_known_good(suggestion):
+            similarity_index.add(fingerprint, error_context)
+        return suggestion
+
+    try:
+        # 其他 worker 正在计算同一指纹时，等它把结果写入共享缓存
+        return await shared_flight.run(fingerprint, compute, lambda: suggestion_cache.aget(fingerprint, count=False))
+    finally:
+        if broadcast is not None:
+            broadcast.close()
+            if stream_broadcasts.get(fingerprint) is broadcast:
+                del stream_broadcasts[fingerprint]
+
+def answer(request_id, machine_id, fingerprint, suggestion, tier, **extra):
+    # 客户端执行修复命令后凭 request_id、fingerprint 与 suggestion_id 回报结果（POST /feedback），
+    # 服务端只接受与这里记下的回答一致的反馈
+    ANSWERS.labels(tier).inc()
+    fix_feedback.issue(request_id, machine_id, fingerprint, suggestion_id(suggestion))
+    return {"suggestion": suggestion, "tier": tier, "request_id": request_id, "fingerprint": fingerprint,
+            "suggestion_id": suggestion_id(suggestion), **extra}
+
+async def original_analysis(fingerprint, task, tier):
+    """幂等键登记的计算：返回原始请求的 (指纹, 建议, 层级)，重试按原始请求的指纹与层级回答"""
+    return fingerprint, await asyncio.shield(task), tier
+
+def admit_request(data, x_correlation_id):
+    """绑定日志上下文、单个客户端限速并记录错误日志，返回 (request_id, fingerprint)"""
+    request_id = str(uuid.uuid4()) # Generate a unique ID for this request
+    # 之后本请求（包括它发起的上游调用）的日志都带有 request_id 与客户端的 correlation_id
+    bind_request(request_id, clean_correlation_id(x_correlation_id))
+    log.debug("Received request", extra={'machine_id': data.machine_id, 'context_chars': len(data.error_context)})
+
+    # 单个客户端限速
+    try:
+        admission.check_client(data.machine_id)
+    except AdmissionRejected as e:
+        log.warning("Rejected by admission control", extra={'reason': e.reason, 'retry_after': e.retry_after})
+        raise too_many_requests(e)
+
+    # 1. 日志记录
+    log_entry = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine_id': data.machine_id,
+        'error_context': data.error_context
+    }
+    # 非阻塞提交；磁盘跟不上时记录会被丢弃并计入 /logs/stats
+    log_writer.submit(log_entry)
+    return request_id, error_fingerprint(data.error_context)
+
+def owner_node(fingerprint):
+    """集群模式下指纹的所有者节点；不是集群模式或归本节点所有时返回 None"""
+    return cluster.owner(fingerprint) if cluster is not None else None
+
+async def answer_from_owner(owner, machine_id, fingerprint, error_context):
+    """把请求转发给所有者节点并返回它的回答；所有者不可达时返回 None，由本节点处理"""
+    if owner is None:
+        return None
+    try:
+        found = await cluster.post(owner, '/cluster/analyze', {'error_context': error_context, 'machine_id': machine_id})
+    except PeerUnavailable as e:
+        log.warning("Owner node unavailable, analyzing locally", extra={'fingerprint': fingerprint[:12], 'error': str(e)})
+        return None
+    log.info("Answered by owner node", extra={'fingerprint': fingerprint[:12], 'owner': owner, 'tier': found.get('tier')})
+    return found
+
+async def answer_without_model(request_id, machine_id, fingerprint, error_context):
+    """缓存、相似检索与降级模式；需要调用模型时返回 None"""
+    # 2. 查询建议缓存（命中时不经过上游准入，直接返回）
+    cached_suggestion = await suggestion_cache.aget(fingerprint)
+    if cached_suggestion is not None and fix_feedback.failing(fingerprint, suggestion_id(cached_suggestion)):
+        # 客户端反馈这条建议多次执行失败：删除后重新询问模型
+        log.warning("Cached suggestion keeps failing, asking the model again", extra={'fingerprint': fingerprint[:12]})
+        SUPPRESSED_SUGGESTIONS.labels('cache').inc()
+        await suggestion_cache.ainvalidate(fingerprint)
+        similarity_index.discard(fingerprint)
+        cached_suggestion = None
+    if cached_suggestion is not None:
+        log.info("Cache hit", extra={'fingerprint': fingerprint[:12]})
+        return answer(request_id, machine_id, fingerprint, cached_suggestion, 'cache')
+
+    # 相似检索：找到足够接近且有正常建议的历史请求时直接复用
+    best = await best_similar_match(similarity_index.query(error_context, exclude=fingerprint))
+    if best is not None:
+        _, score, similar_fingerprint, similar_suggestion = best
+        log.info("Similar request hit", extra={'fingerprint': fingerprint[:12],
+                                               'similar_fingerprint': similar_fingerprint[:12], 'similarity': score})
+        # 反馈计入给出建议的那条历史请求
+        return answer(request_id, machine_id, similar_fingerprint, similar_suggestion, 'similar', similarity=score)
+
+    # 降级模式：所有上游都已熔断时不再排队等待上游，返回过期但仍保留的建议，没有时让客户端稍后重试
+    if model_cascade.degraded():
+        stale_suggestion = await suggestion_cache.aget_stale(fingerprint)
+        if stale_suggestion is not None and not fix_feedback.failing(fingerprint, suggestion_id(stale_suggestion)):
+            log.warning("Upstream unavailable, serving stale suggestion", extra={'fingerprint': fingerprint[:12]})
+            return answer(request_id, machine_id, fingerprint, stale_suggestion, 'stale', degraded=True)
+        log.warning("Upstream unavailable and no cached suggestion", extra={'fingerprint': fingerprint[:12]})
+        raise HTTPException(status_code=503, detail="AI service temporarily unavailable",
+                            headers={'Retry-After': str(int(math.ceil(UPSTREAM_PROBE_INTERVAL)))})
+    return None
+
+@app.post('/analyze_error')
+async def analyze_error(data: AnalyzeErrorRequest, idempotency_key: Optional[str] = Header(default=None),
+                        x_correlation_id: Optional[str] = Header(default=None)):
+    # 同一幂等键的重试直接等待（或取回）原始计算的结果
+    if idempotency_key:
+        original = idempotency_registry.get(idempotency_key)
+        if original is not None:
+            # 重试同样计入客户端限速与错误日志
+            request_id, _ = admit_request(data, x_correlation_id)
+            log.info("Attaching retry to original analysis", extra={'idempotency_key': idempotency_key})
+            try:
+                fingerprint, suggestion, tier = await asyncio.shield(original)
+            except AdmissionRejected as e:
+                raise too_many_requests(e)
+            return answer(request_id, data.machine_id, fingerprint, suggestion, tier)
+
+    request_id, fingerprint = admit_request(data, x_correlation_id)
+    # 集群模式下归其他节点所有的指纹由所有者回答
+    try:
+        found = await answer_from_owner(owner_node(fingerprint), data.machine_id, fingerprint, data.error_context)
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+    if found is not None:
+        return found
+    found = await answer_without_model(request_id, data.machine_id, fingerprint, data.error_context)
+    if found is not None:
+        return found
+
+    # 3. 生成 AI 提示并调用 OpenAI/Deepseek API（相同指纹的并发请求共享同一次调用）
+    task = in_flight.run(fingerprint, lambda: fetch_and_cache(fingerprint, data.error_context))
+    original = asyncio.ensure_future(original_analysis(fingerprint, task, 'llm'))
+    if idempotency_key:
+        idempotency_registry.register(idempotency_key, original)
+    try:
+        _, suggestion, _ = await asyncio.shield(original)
+    except AdmissionRejected as e:
+        log.warning("Rejected by admission control", extra={'reason': e.reason, 'retry_after': e.retry_after})
+        raise too_many_requests(e)
+
+    # 4. 返回建议
+    log.info("Returning suggestion", extra={'fingerprint': fingerprint[:12], 'suggestion_chars': len(suggestion)})
+    return answer(request_id, data.machine_id, fingerprint, suggestion, 'llm')
+
+@app.post('/cluster/analyze')
+async def cluster_analyze(data: ClusterAnalyzeRequest, x_cluster_token: str = Header(default=''),
+                          x_request_id: Optional[str] = Header(default=None),
+                          x_correlation_id: Optional[str] = Header(default=None)):
+    """
+    集群内部接口：其他节点转发来的、归本节点所有的请求。客户端限速与错误日志已由接收请求的节点处理，
+    这里只查缓存与相似检索、调用模型；不再转发，节点列表暂时不一致时也最多一跳。
+    """
+    if cluster is None:
+        raise HTTPException(status_code=404, detail="Cluster mode is not enabled")
+    cluster.check_token(x_cluster_token)
+    request_id = clean_correlation_id(x_request_id) or str(uuid.uuid4())
+    bind_request(request_id, clean_correlation_id(x_correlation_id))
+    fingerprint = error_fingerprint(data.error_context)
+    found = await answer_without_model(request_id, data.machine_id, fingerprint, data.error_context)
+    if found is not None:
+        return found
+    task = in_flight.run(fingerprint, lambda: fetch_and_cache(fingerprint, data.error_context))
+    try:
+        suggestion = await asyncio.shield(task)
+    except AdmissionRejected as e:
+        raise too_many_requests(e)
+    return answer(request_id, data.machine_id, fingerprint, suggestion, 'llm')
+
+@app.post('/analyze_errors')
+async def analyze_errors(data: AnalyzeErrorsRequest, x_correlation_id: Optional[str] = Header(default=None)):
+    """
+    批量版本：一次提交多个互不相关的错误日志，按客户端指定的 id 返回各自的结果。
+    指纹相同的条目只分析一次；缓存与相似检索命中的直接返回，其余并发调用模型（仍受上游准入控制）。
+    单个条目失败（限速、过载、上游错误）只体现在该条目的 status 上，不影响其他条目。
+    """
+    if len(data.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    if len({item.id for item in data.items}) != len(data.items):
+        raise HTTPException(status_code=422, detail="Duplicate item ids")
+    batch_id = str(uuid.uuid4())
+    correlation_id = clean_correlation_id(x_correlation_id)
+    bind_request(batch_id, correlation_id)
+
+    groups = group_by_fingerprint((item.id, item.error_context) for item in data.items)
+    for item in data.items:
+        log_writer.submit({
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'machine_id': data.machine_id,
+            'error_context': item.error_context
+        })
+    log.info("Received batch", extra={'machine_id': data.machine_id, 'items': len(data.items),
+                                      'distinct': len(groups)})
+
+    async def analyze(fingerprint, error_context):
+        request_id = str(uuid.uuid4())
+        bind_request(request_id, correlation_id)
+        # 每个不同的错误消耗一个客户端令牌，批量提交不能绕过单客户端限速
+        admission.check_client(data.machine_id)
+        found = await answer_from_owner(owner_node(fingerprint), data.machine_id, fingerprint, error_context)
+        if found is None:
+            found = await answer_without_model(request_id, data.machine_id, fingerprint, error_context)
+        if found is not None:
+            return found
+        task = in_flight.run(fingerprint, lambda: fetch_and_cache(fingerprint, error_context))
+        return answer(request_id, data.machine_id, fingerprint, await asyncio.shield(task), 'llm')
+
+    results = await analyze_batch(groups, analyze)
+    return {'batch_id': batch_id, 'results': [dict(results[item.id], id=item.id) for item in data.items]}
+
+@app.post('/jobs', status_code=202)
+async def submit_job(data: AnalyzeErrorRequest, response: Response, wait: float = 0.0,
+                     x_correlation_id: Optional[str] = Header(default=None)):
+    """
+    任务版本：立即返回任务 ID（202），结果经 GET /jobs/{job_id}?wait=N 长轮询取回。
+    带 ?wait=N 时先等待最多 N 秒，期间完成则直接返回结果（200）。
+    缓存与相似检索命中时任务直接完成；相同指纹的任务还没结束时复用该任务。
+    """
+    request_id, fingerprint = admit_request(data, x_correlation_id)
+    # 集群模式下归其他节点所有的指纹在任务中转发给所有者
+    owner = owner_node(fingerprint)
+    found = (await answer_without_model(request_id, data.machine_id, fingerprint, data.error_context)
+             if owner is None else None)
+    correlation_id = clean_correlation_id(x_correlation_id)
+
+    async def run():
+        # 在 worker 协程中执行，重新绑定日志上下文
+        bind_request(request_id, correlation_id)
+        forwarded = await answer_from_owner(owner, data.machine_id, fingerprint, data.error_context)
+        if forwarded is not None:
+            return forwarded
+        if owner is not None:
+            # 所有者不可达，改为本节点处理
+            local = await answer_without_model(request_id, data.machine_id, fingerprint, data.error_context)
+            if local is not None:
+                return local
+        task = in_flight.run(fingerprint, lambda: fetch_and_cache(fingerprint, data.error_context))
+        suggestion = await asyncio.shield(task)
+        log.info("Job finished", extra={'fingerprint': fingerprint[:12], 'suggestion_chars': len(suggestion)})
+        return answer(request_id, data.machine_id, fingerprint, suggestion, 'llm')
+
+    try:
+        job = analysis_jobs.submit(fingerprint, run, ready=found)
+    except AdmissionRejected as e:
+        log.warning("Rejected by admission control", extra={'reason': e.reason, 'retry_after': e.retry_after})
+        raise too_many_requests(e)
+    snapshot = await analysis_jobs.wait(job, wait)
+    if snapshot['status'] in (DONE, FAILED):
+        response.status_code = 200
+    return snapshot
+
+@app.post('/analyze_error/stream')
+async def analyze_error_stream(data: AnalyzeErrorRequest, x_correlation_id: Optional[str] = Header(default=None)):
+    """
+    流式版本：回答片段以 server-sent events 逐个返回（事件格式见 pip_aide_server/streaming.py）。
+    客户端断开不会取消上游调用，结果照常写入缓存。
+    """
+    request_id, fingerprint = admit_request(data, x_correlation_id)
+    owner = owner_node(fingerprint)
+    if owner is not None:
+        # 集群模式下转发所有者的事件流
+        try:
+            payload = {'error_context': data.error_context, 'machine_id': data.machine_id}
+            chunks = await cluster.stream(owner, '/cluster/analyze/stream', payload)
+            return StreamingResponse(chunks, media_type=SSE_MEDIA_TYPE, headers=SSE_HEADERS)
+        except AdmissionRejected as e:
+            raise too_many_requests(e)
+        except PeerUnavailable as e:
+            log.warning("Owner node unavailable, analyzing locally", extra={'fingerprint': fingerprint[:12],
+                                                                           'error': str(e)})
+    return await stream_analysis(request_id, data.machine_id, fingerprint, data.error_context)
+
+@app.post('/cluster/analyze/stream')
+async def cluster_analyze_stream(data: ClusterAnalyzeRequest, x_cluster_token: str = Header(default=''),
+                                 x_request_id: Optional[str] = Header(default=None),
+                                 x_correlation_id: Optional[str] = Header(default=None)):
+    """集群内部接口：/cluster/analyze 的流式版本"""
+    if cluster is None:
+        raise HTTPException(status_code=404, detail="Cluster mode is not enabled")
+    cluster.check_token(x_cluster_token)
+    request_id = clean_correlation_id(x_request_id) or str(uuid.uuid4())
+    bind_request(request_id, clean_correlation_id(x_correlation_id))
+    return await stream_analysis(request_id, data.machine_id, error_fingerprint(data.error_context), data.error_context)
+
+async def stream_analysis(request_id, machine_id, fingerprint, error_context):
+    """缓存与相似检索命中时直接返回 done 事件，否则订阅（或发起）本节点的流式模型调用"""
+    found = await answer_without_model(request_id, machine_id, fingerprint, error_context)
+    if found is not None:
+        return StreamingResponse(iter([sse_event('done', found)]), media_type=SSE_MEDIA_TYPE, headers=SSE_HEADERS)
+
+    # 相同指纹的流式请求订阅同一份输出；正在进行的是非流式计算时等它的完整结果
+    def start():
+        stream_broadcasts[fingerprint] = Broadcast()
+        return fetch_and_cache(fingerprint, error_context, stream_broadcasts[fingerprint])
+
+    task = in_flight.run(fingerprint, start)
+    broadcast = stream_broadcasts.get(fingerprint)
+
+    async def events():
+        yield sse_event('meta', {'request_id': request_id})
+        timer = StreamTimer()
+        if broadcast is not None:
+            async for kind, value in broadcast.subscribe():
+                if kind == 'delta':
+                    timer.delta(value)
+                    yield sse_event('delta', {'text': value})
+                elif kind == 'tier':
+                    yield sse_event('tier', value)
+                else:
+                    timer.reset()
+                    yield sse_event('reset', {'reason': value})
+        try:
+            suggestion = await asyncio.shield(task)
+        except AdmissionRejected as e:
+            log.warning("Rejected by admission control", extra={'reason': e.reason, 'retry_after': e.retry_after})
+            yield sse_event('error', {'status': 429, 'detail': f"Server is busy ({e.reason}), retry later",
+                                      'retry_after': e.retry_after})
+            return
+        log.info("Returning streamed suggestion", extra={'fingerprint': fingerprint[:12],
+                                                         'suggestion_chars': len(suggestion),
+                                                         'time_to_first_token': timer.first_token,
+                                                         'time_to_first_command': timer.first_command})
+        yield sse_event('done', answer(request_id, machine_id, fingerprint, suggestion, 'llm'))
+
+    return StreamingResponse(events(), media_type=SSE_MEDIA_TYPE, headers=SSE_HEADERS)
+
+def run(host='0.0.0.0', port=8000):
+    """用 uvicorn 运行 app；PIPAI_HOST / PIPAI_PORT 优先于参数"""
+    host, port = HOST or host, PORT or port
+    if WORKERS > 1:
+        if not CACHE_PATH:
+            log.warning("警告: PIPAI_CACHE_PATH 为空，各 worker 的缓存与去重互不共享。")
+        # 多进程模式下每个 worker 按模块名重新导入 app；入口设置的环境变量（提示词配置等）由子进程继承
+        uvicorn.run("pip_aide_server.server:app", host=host, port=port, workers=WORKERS,
+                    app_dir=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    else:
+        uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,242 @@
+"""
+相似错误检索
+
+精确指纹只能命中完全相同（规整后）的日志；编译器小版本、路径等不同的同类失败会错过。
+这里对规整后的错误日志取词级 shingle，计算 MinHash 草图，用 LSH 分段找出候选，
+再按草图估计的 Jaccard 相似度挑出最接近的历史请求，直接复用它的建议。
+
+草图使用单次排列 MinHash（one permutation hashing）：每个 shingle 只哈希一次，
+按哈希值分到 NUM_BINS 个桶中各取最小值，空桶从右侧相邻的非空桶借值（densification）。
+计算量与 shingle 数成正比，纯 Python 下几 KB 的日志也只需毫秒级。
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from .cascade import assess_suggestion
+from .fingerprint import error_fingerprint, normalize_error_log, parse_system_profile, split_error_context
+from .logwriter import sort_by_mtime
+
+NUM_BINS = 128
+ROWS_PER_BAND = 4
+SHINGLE_WORDS = 3
+# 只取错误日志末尾这么多字符（pip 的关键报错在末尾），限制超大日志的计算量
+MAX_CHARS = 32 * 1024
+
+_WORD = re.compile(r'[a-z_]+|\d+')
+# pip 报告失败的包名；只在失败的包相同的请求之间复用建议
+_FAILED_PACKAGE = re.compile(
+    r'(?:Failed building wheel for|Failed to build|Could not build wheels for|'
+    r'No matching distribution found for|satisfies the requirement)\s+([A-Za-z0-9][A-Za-z0-9._-]*)'
+)
+_BIN_RANGE = (1 << 64) // NUM_BINS
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def shingles(error_log):
+    """规整后的日志切成相邻 SHINGLE_WORDS 个词组成的 shingle 集合"""
+    words = _WORD.findall(normalize_error_log(error_log[-MAX_CHARS:]).lower())
+    if len(words) < SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def sketch(shingle_set):
+    """计算 NUM_BINS 个值的 MinHash 草图；空集合返回 None"""
+    if not shingle_set:
+        return None
+    bins = [None] * NUM_BINS
+    for shingle in shingle_set:
+        index, value = divmod(_hash64(shingle), _BIN_RANGE)
+        index %= NUM_BINS
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+    # densification：空桶取右侧第一个非空桶的值，再加上按距离区分的偏移，
+    # 使借来的值只会与同样距离借来的值相等
+    dense = list(bins)
+    for i in range(NUM_BINS):
+        if bins[i] is None:
+            for step in range(1, NUM_BINS):
+                value = bins[(i + step) % NUM_BINS]
+                if value is not None:
+                    dense[i] = value + step * _BIN_RANGE
+                    break
+    return tuple(dense)
+
+
+def similarity(a, b):
+    """两个草图估计的 Jaccard 相似度"""
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_BINS
+
+
+def is_known_good(suggestion):
+    """可以复用的建议：包含安全的 pip 命令，且不是 UNCERTAIN 或上游错误"""
+    return suggestion is not None and assess_suggestion(suggestion) is None
+
+
+def failed_packages(error_log):
+    """日志中 pip 报告失败的包名（规范化为小写、- 连接）"""
+    return sorted({re.sub(r'[-_.]+', '-', name).lower() for name in _FAILED_PACKAGE.findall(error_log)})
+
+
+def profile_key(error_context):
+    """
+    系统信息中影响修复方案的字段与失败的包名；只在二者都相同的请求之间复用建议，
+    避免日志相似但换了一个包或 Python 版本时给出针对另一个包的命令。
+    """
+    error_log, system_info = split_error_context(error_context)
+    profile = parse_system_profile(system_info)
+    lines = [f'{k}={profile[k]}' for k in sorted(profile)]
+    lines.append('packages=' + ','.join(failed_packages(error_log[-MAX_CHARS:])))
+    return '\n'.join(lines)
+
+
+class SimilarityIndex:
+    """
+    内存中的 LSH 索引：fingerprint -> 草图。
+    NUM_BINS 个值分为 NUM_BINS / ROWS_PER_BAND 段，任一段完全相同即成为候选。
+    条目数超过 max_entries 时淘汰最早加入的。threshold 不大于 0 时索引关闭。
+    """
+
+    def __init__(self, threshold=0.9, max_entries=50000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = NUM_BINS // ROWS_PER_BAND
+        self._entries = OrderedDict()  # fingerprint -> (sketch, profile)
+        self._buckets = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.matches = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _band_keys(self, values):
+        for band in range(self.bands):
+            start = band * ROWS_PER_BAND
+            yield band, hash(values[start:start + ROWS_PER_BAND])
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def add(self, fingerprint, error_context):
+        """加入一条历史请求；已存在或日志为空时忽略。返回是否加入"""
+        if not self.enabled or fingerprint in self._entries:
+            return False
+        error_log, _ = split_error_context(error_context)
+        values = sketch(shingles(error_log))
+        if values is None:
+            return False
+        profile = profile_key(error_context)
+        with self._lock:
+            if fingerprint in self._entries:
+                return False
+            self._entries[fingerprint] = (values, profile)
+            for band, key in self._band_keys(values):
+                self._buckets[band].setdefault(key, set()).add(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+        return True
+
+    def add_records(self, records, accept):
+        """批量加入日志记录（启动时从错误日志回填）；accept(fingerprint) 返回 False 的跳过。返回加入的条数"""
+        added = 0
+        for record in records:
+            error_context = record.get('error_context') if isinstance(record, dict) else None
+            if not isinstance(error_context, str):
+                continue
+            fingerprint = error_fingerprint(error_context)
+            if fingerprint not in self._entries and accept(fingerprint) and self.add(fingerprint, error_context):
+                added += 1
+        return added
+
+    def discard(self, fingerprint):
+        with self._lock:
+            if fingerprint in self._entries:
+                self._remove(fingerprint)
+
+    def _remove(self, fingerprint):
+        values, _ = self._entries.pop(fingerprint)
+        for band, key in self._band_keys(values):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def query(self, error_context, accept=None, exclude=None):
+        """
+        返回 [(相似度, fingerprint)]，按相似度从高到低，只包含不低于阈值且系统环境相同的条目。
+        accept(fingerprint) 返回 False 的候选会被跳过。
+        """
+        if not self.enabled:
+            return []
+        self.queries += 1
+        error_log, _ = split_error_context(error_context)
+        values = sketch(shingles(error_log))
+        if values is None:
+            return []
+        profile = profile_key(error_context)
+        with self._lock:
+            candidates = set()
+            for band, key in self._band_keys(values):
+                candidates.update(self._buckets[band].get(key, ()))
+            scored = []
+            for fingerprint in candidates:
+                if fingerprint == exclude:
+                    continue
+                other, other_profile = self._entries[fingerprint]
+                if other_profile != profile:
+                    continue
+                score = similarity(values, other)
+                if score >= self.threshold:
+                    scored.append((score, fingerprint))
+        scored.sort(reverse=True)
+        if accept is not None:
+            scored = [(score, fp) for score, fp in scored if accept(fp)]
+        if scored:
+            self.matches += 1
+        return scored
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'threshold': self.threshold,
+            'queries': self.queries,
+            'matches': self.matches,
+        }
+
+
+def recent_log_records(log_dir, limit):
+    """从最新的日志分段开始倒序读取，最多返回 limit 条记录"""
+    names = []
+    for pattern in ('*.jsonl', '*.jsonl.gz', '*.log'):
+        names.extend(glob.glob(os.path.join(log_dir, '**', pattern), recursive=True))
+    records = []
+    for path in sort_by_mtime(names, reverse=True):
+        opener = gzip.open if path.endswith('.gz') else open
+        file_records = []
+        try:
+            with opener(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        file_records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except (EOFError, OSError):
+            pass
+        records.extend(reversed(file_records))
+        if len(records) >= limit:
+            break
+    return records[:limit]
@@ -0,0 +1,214 @@
+"""
+并发去重：相同指纹的并发请求共享一次上游调用；
+幂等键：客户端重试挂到原始计算上，而不是重新发起一次；
+多个 worker 进程之间通过 SQLite 中的租约协调，同一指纹同时只有一个进程调用上游
+"""
+import asyncio
+import inspect
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SingleFlight:
+    """
+    按 key 合并正在进行的计算。计算以独立 task 运行，
+    发起它的请求断开也不会取消，其余等待者依然能拿到结果。
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def run(self, key, factory):
+        """返回 key 对应的 task；没有进行中的计算时用 factory() 创建一个"""
+        task = self._tasks.get(key)
+        if task is not None:
+            self.followers += 1
+            return task
+        self.leaders += 1
+        task = asyncio.ensure_future(factory())
+        self._tasks[key] = task
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return task
+
+    def stats(self):
+        return {'in_flight': len(self._tasks), 'leaders': self.leaders, 'followers': self.followers}
+
+
+class IdempotencyRegistry:
+    """记录幂等键对应的 task，完成后在 TTL 内继续保留结果"""
+
+    def __init__(self, ttl=600, max_keys=10000):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> (task, registered_at)
+        self.replays = 0
+
+    def get(self, key):
+        self._prune()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        task = entry[0]
+        if task.done() and (task.cancelled() or task.exception() is not None):
+            # 原始计算失败（例如被准入控制拒绝），重试应重新计算
+            del self._entries[key]
+            return None
+        self.replays += 1
+        return entry[0]
+
+    def register(self, key, task):
+        self._entries[key] = (task, time.monotonic())
+        self._entries.move_to_end(key)
+        self._prune()
+
+    def _prune(self):
+        deadline = time.monotonic() - self.ttl
+        while self._entries:
+            key, (task, registered_at) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_keys and (registered_at > deadline or not task.done()):
+                break
+            self._entries.popitem(last=False)
+
+
+class SharedFlight:
+    """
+    跨进程的并发去重。计算前先在 SQLite 文件中为 key 取得租约；
+    租约被其他进程持有时轮询 lookup()（通常是共享缓存），直到对方写入结果，
+    或者租约被释放/过期（对方失败或崩溃），此时再尝试自己取得租约。
+    path 为空时直接计算。
+
+    run() 中租约的取得、释放与轮询都在自己的线程中执行，其他 worker 持有写锁时的等待不会阻塞事件循环。
+    计算期间每 lease_ttl / 3 秒续租一次，排队、对冲与级联升级耗时超过 lease_ttl 时租约也不会过期。
+    """
+
+    def __init__(self, path=None, lease_ttl=60, poll_interval=0.1):
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.leases = 0
+        self.waits = 0
+        self.remote_hits = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._executor = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS flight_leases ('
+                'key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._db.commit()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pipai-flight')
+
+    def acquire(self, key):
+        """取得租约返回 True；其他进程持有未过期的租约时返回 False"""
+        now = time.time()
+        with self._lock:
+            self._db.execute('DELETE FROM flight_leases WHERE key = ? AND expires_at <= ?', (key, now))
+            acquired = self._db.execute(
+                'INSERT OR IGNORE INTO flight_leases VALUES (?, ?, ?)', (key, self.owner, now + self.lease_ttl)
+            ).rowcount == 1
+            self._db.commit()
+            return acquired
+
+    def renew(self, key):
+        """延长本进程持有的租约；租约已不属于本进程时返回 False"""
+        with self._lock:
+            renewed = self._db.execute(
+                'UPDATE flight_leases SET expires_at = ? WHERE key = ? AND owner = ?',
+                (time.time() + self.lease_ttl, key, self.owner)
+            ).rowcount == 1
+            self._db.commit()
+            return renewed
+
+    def release(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM flight_leases WHERE key = ? AND owner = ?', (key, self.owner))
+            self._db.commit()
+
+    def held(self, key):
+        """key 的租约是否仍被某个进程持有"""
+        with self._lock:
+            row = self._db.execute('SELECT expires_at FROM flight_leases WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    async def run(self, key, compute, lookup):
+        """
+        compute 为协程函数；lookup() 返回其他进程写入的结果，没有时返回 None。
+        lookup 也可以是协程函数（例如 SuggestionCache.aget）
+        """
+        if self._db is None:
+            return await compute()
+        waited = False
+        while True:
+            if await self._run(self.acquire, key):
+                self.leases += 1
+                heartbeat = asyncio.ensure_future(self._heartbeat(key))
+                try:
+                    # 上一个持有者可能刚写完结果
+                    result = await _call(lookup)
+                    if result is not None:
+                        self.remote_hits += 1
+                        return result
+                    return await compute()
+                finally:
+                    heartbeat.cancel()
+                    await self._run(self.release, key)
+            if not waited:
+                waited = True
+                self.waits += 1
+            delay = self.poll_interval
+            while await self._run(self.held, key):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+                result = await _call(lookup)
+                if result is not None:
+                    self.remote_hits += 1
+                    return result
+            # 对方没有留下结果就释放了租约（失败或被拒绝），先看一眼结果，再尝试自己计算
+            result = await _call(lookup)
+            if result is not None:
+                self.remote_hits += 1
+                return result
+
+    def stats(self):
+        return {'owner': self.owner, 'leases': self.leases, 'waits': self.waits, 'remote_hits': self.remote_hits}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    async def _heartbeat(self, key):
+        """计算结束（被取消）之前定期续租"""
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                renewed = await self._run(self.renew, key)
+            except sqlite3.Error:
+                # 数据库暂时忙，下一次再续
+                continue
+            if not renewed:
+                return
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+
+async def _call(lookup):
+    result = lookup()
+    return await result if inspect.isawaitable(result) else result
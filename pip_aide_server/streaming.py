@@ -0,0 +1,85 @@
+"""
+流式回答（server-sent events）
+
+一次流式上游调用产出的事件记录在 Broadcast 中，相同指纹的并发流式请求都从头订阅同一份，
+只调用一次上游。事件格式:
+
+    event: meta    {"request_id": ...}
+    event: tier    {"name": "fast", "final": false}   级联的某一级开始作答；final 为 false 时之后的片段可能被 reset 作废
+    event: delta   {"text": "回答片段"}
+    event: reset   {"reason": "uncertain"}     之前的片段作废（级联升级到下一级模型）
+    event: done    与 /analyze_error 的响应相同，suggestion 以此为准
+    event: error   {"status": 429, "detail": ..., "retry_after": 3}
+"""
+import asyncio
+import json
+import time
+
+from pip_aide.safety import CommandStreamParser, is_safe_command
+
+from .metrics import STREAM_FIRST_COMMAND, STREAM_FIRST_TOKEN
+
+MEDIA_TYPE = 'text/event-stream'
+# 反向代理（nginx）默认会缓冲响应，流式输出需要关闭
+HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Broadcast:
+    """一次流式计算的事件序列；订阅者从头读取，之后实时收到新事件"""
+
+    def __init__(self):
+        self.events = []
+        self.closed = False
+        self._changed = None
+
+    def publish(self, kind, value):
+        self.events.append((kind, value))
+        self._wake()
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    async def subscribe(self):
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.closed:
+                return
+            if self._changed is None:
+                self._changed = asyncio.get_running_loop().create_future()
+            # 多个订阅者等待同一个 future，某个订阅者断开不能取消它
+            await asyncio.shield(self._changed)
+
+    def _wake(self):
+        if self._changed is not None and not self._changed.done():
+            self._changed.set_result(None)
+        self._changed = None
+
+
+class StreamTimer:
+    """记录一个流式请求从开始到第一个片段、第一条完整安全命令的时间"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_token = None
+        self.first_command = None
+        self._parser = CommandStreamParser()
+
+    def delta(self, text):
+        now = time.monotonic() - self.started
+        if self.first_token is None:
+            self.first_token = now
+            STREAM_FIRST_TOKEN.observe(now)
+        if self.first_command is None and any(is_safe_command(line) for line in self._parser.feed(text)):
+            self.first_command = now
+            STREAM_FIRST_COMMAND.observe(now)
+
+    def reset(self):
+        self._parser.reset()
@@ -0,0 +1,70 @@
+"""
+上游 OpenAI/Deepseek chat completions 调用
+"""
+from .cascade import load_cascade
+from .cassette import Cassette, attach_cassette
+from .config import (
+    OPENAI_API_BASE, OPENAI_MODEL, UPSTREAM_TIMEOUT, UPSTREAM_MAX_WORKERS, MAX_COMPLETION_TOKENS,
+    UPSTREAMS, UPSTREAM_FAILURE_THRESHOLD, UPSTREAM_COOLDOWN, UPSTREAM_PROBE_INTERVAL,
+    UPSTREAM_HEDGE_MULTIPLIER, UPSTREAM_MIN_HEDGE_DELAY, CASCADE, CASSETTE, CASSETTE_MODE, CASSETTE_SPEED,
+)
+from .jsonlog import get_logger
+from .metrics import RESPONSE_CHARS, SUGGESTIONS, suggestion_outcome
+from .router import UpstreamRouter, load_backends
+
+log = get_logger('upstream')
+
+_ROUTER_OPTIONS = dict(
+    max_workers=UPSTREAM_MAX_WORKERS,
+    failure_threshold=UPSTREAM_FAILURE_THRESHOLD,
+    cooldown=UPSTREAM_COOLDOWN,
+    probe_interval=UPSTREAM_PROBE_INTERVAL,
+    hedge_multiplier=UPSTREAM_HEDGE_MULTIPLIER,
+    min_hedge_delay=UPSTREAM_MIN_HEDGE_DELAY,
+)
+
+upstream_router = UpstreamRouter(
+    load_backends(UPSTREAMS, OPENAI_API_BASE, OPENAI_MODEL, 'DEEPSEEK_API_KEY', timeout=UPSTREAM_TIMEOUT),
+    **_ROUTER_OPTIONS
+)
+model_cascade = load_cascade(
+    CASCADE, upstream_router, OPENAI_API_BASE, 'DEEPSEEK_API_KEY',
+    timeout=UPSTREAM_TIMEOUT, max_tokens=MAX_COMPLETION_TOKENS, router_options=_ROUTER_OPTIONS,
+)
+# 录制或回放上游流量（离线复现与压测）；未配置时为 None
+upstream_cassette = Cassette(CASSETTE, CASSETTE_MODE, CASSETTE_SPEED) if CASSETTE else None
+if upstream_cassette is not None:
+    attach_cassette(model_cascade, upstream_cassette)
+    log.info("Upstream cassette enabled", extra={'path': CASSETTE, 'mode': CASSETTE_MODE})
+
+
+async def fetch_suggestion(messages):
+    """
+    messages 来自 PromptBuilder.build。经模型级联获取建议，返回 CascadeResult（suggestion、作答的 tier、升级记录）。
+    全部失败时 suggestion 以 UNCERTAIN 开头。
+    """
+    result = await model_cascade.run(messages)
+    _observe(result)
+    return result
+
+
+async def stream_suggestion(messages, on_event):
+    """
+    流式获取建议：每一级开始作答时 on_event('tier', {'name', 'final'})，回答片段经 on_event('delta', 片段) 交出，
+    升级到下一级模型时 on_event('reset', 原因)。
+    返回值与 fetch_suggestion 相同。
+    """
+    result = await model_cascade.stream(messages, on_event)
+    _observe(result)
+    return result
+
+
+def _observe(result):
+    SUGGESTIONS.labels(result.tier, suggestion_outcome(result.suggestion)).inc()
+    RESPONSE_CHARS.observe(len(result.suggestion))
+    for tier, reason in result.escalations:
+        log.info("Escalated past cascade tier", extra={'tier': tier, 'reason': reason})
+    # 每次调用模型都在 INFO 级别记录作答的级联层级（不受 DEBUG 采样影响），用于统计各级的作答比例与节省的费用
+    log.info("Suggestion obtained", extra={'tier': result.tier, 'outcome': suggestion_outcome(result.suggestion),
+                                           'escalations': len(result.escalations),
+                                           'suggestion_chars': len(result.suggestion)})
@@ -6,10 +6,13 @@ setup(
     description="AI-powered pip install helper",
     author="不做了睡大觉",
     author_email="stakeswky@gmail.com",
-    packages=find_packages(),
+    packages=find_packages(exclude=["pip_aide_server", "pip_aide_server.*", "test"]),
     install_requires=[
         "requests",
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+    },
     python_requires=">=3.7",
     entry_points={
         "console_scripts": [
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+测试准入控制：令牌桶、有界等待队列与 Retry-After 解析
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide.cli import parse_retry_after
+from pip_aide_server.admission import AdmissionController, AdmissionRejected
+
+
+def test_client_bucket_limits_each_machine():
+    admission = AdmissionController(client_rate=0.5, client_burst=3)
+    for _ in range(3):
+        admission.check_client('machine-a')
+    try:
+        admission.check_client('machine-a')
+        assert False, "fourth request should be rejected"
+    except AdmissionRejected as e:
+        assert e.reason == 'client_rate'
+        assert 1 <= e.retry_after <= 2
+    # 其他客户端不受影响
+    admission.check_client('machine-b')
+    assert admission.stats()['rejected'] == {'client_rate': 1}
+
+
+async def _queue():
+    admission = AdmissionController(max_concurrent=2, max_queue=2, max_queue_time=0.2)
+    release = asyncio.Event()
+    outcomes = []
+
+    async def call(i):
+        try:
+            async with admission.upstream_slot():
+                await release.wait()
+            outcomes.append(('ok', i))
+        except AdmissionRejected as e:
+            outcomes.append((e.reason, i))
+
+    tasks = [asyncio.ensure_future(call(i)) for i in range(5)]
+    await asyncio.sleep(0.05)
+    # 2 个执行中、2 个排队，第 5 个立即被拒绝
+    assert admission.stats()['active'] == 2
+    assert admission.stats()['queued'] == 2
+    assert outcomes == [('queue_full', 4)]
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert sorted(outcomes) == [('ok', 0), ('ok', 1), ('ok', 2), ('ok', 3), ('queue_full', 4)]
+    assert admission.stats()['active'] == 0
+
+    # 名额一直不释放时，排队请求在 max_queue_time 后被拒绝
+    release.clear()
+    outcomes.clear()
+    tasks = [asyncio.ensure_future(call(i)) for i in range(3)]
+    await asyncio.sleep(0.3)
+    assert outcomes == [('queue_timeout', 2)]
+    release.set()
+    await asyncio.gather(*tasks)
+    assert admission.stats() == {
+        'active': 0, 'queued': 0, 'max_concurrent': 2, 'max_queue': 2, 'clients_tracked': 0,
+        'rejected': {'queue_full': 1, 'queue_timeout': 1},
+    }
+
+
+def test_bounded_queue_rejects_fast():
+    asyncio.run(_queue())
+
+
+async def _global_rate():
+    admission = AdmissionController(global_rate=1, global_burst=2)
+    for _ in range(2):
+        async with admission.upstream_slot():
+            pass
+    try:
+        async with admission.upstream_slot():
+            pass
+        assert False, "global bucket should be empty"
+    except AdmissionRejected as e:
+        assert e.reason == 'global_rate'
+
+
+def test_global_bucket():
+    asyncio.run(_global_rate())
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3
+    assert parse_retry_after('') == 1
+    assert parse_retry_after('garbage') == 1
+    assert parse_retry_after('3600') == 30
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+
+
+if __name__ == "__main__":
+    test_client_bucket_limits_each_machine()
+    test_bounded_queue_rejects_fast()
+    test_global_bucket()
+    test_parse_retry_after()
+    print("[成功] 准入控制测试通过")
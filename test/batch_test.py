@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+测试批量分析：按指纹去重、单个条目的失败映射、客户端分批与只重试被限速的条目，以及没有批量接口时的逐个回退
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+
+from pip_aide import cli
+from pip_aide_server.admission import AdmissionRejected
+from pip_aide_server.batch import analyze_batch, group_by_fingerprint
+from stub_server import StubServer
+
+GOOD = "```\npip install --upgrade setuptools wheel\n```"
+
+
+def test_duplicates_share_one_analysis_and_failures_stay_per_item():
+    items = [
+        ('a', "ERROR: Failed building wheel for lxml\n  at /tmp/pip-install-1/lxml"),
+        ('b', "ERROR: Failed building wheel for lxml\n  at /tmp/pip-install-2/lxml"),
+        ('c', "ERROR: rate me"),
+        ('d', "ERROR: degraded"),
+        ('e', "ERROR: boom"),
+    ]
+    groups = group_by_fingerprint(items)
+    # a 与 b 只有临时路径不同，指纹相同
+    assert len(groups) == 4 and list(groups.values())[0][1] == ['a', 'b']
+
+    calls = []
+
+    async def analyze(fingerprint, error_context):
+        calls.append(error_context)
+        await asyncio.sleep(0.01)
+        if 'rate' in error_context:
+            raise AdmissionRejected('client_rate', 2)
+        if 'degraded' in error_context:
+            raise HTTPException(status_code=503, detail="Degraded", headers={'Retry-After': '7'})
+        if 'boom' in error_context:
+            raise RuntimeError('upstream exploded')
+        return {'suggestion': GOOD, 'tier': 'llm'}
+
+    results = asyncio.run(analyze_batch(groups, analyze))
+    assert len(calls) == 4
+    assert results['a'] == results['b'] == {'suggestion': GOOD, 'tier': 'llm', 'status': 200}
+    assert results['c']['status'] == 429 and results['c']['retry_after'] == 2
+    assert results['d'] == {'status': 503, 'detail': "Degraded", 'retry_after': 7}
+    assert results['e'] == {'status': 500, 'detail': "Analysis failed"}
+
+
+def test_split_batches():
+    items = [{'id': str(i), 'error_context': 'x' * 100} for i in range(5)]
+    assert [len(b) for b in cli.split_batches(items, 2, 10 ** 6)] == [2, 2, 1]
+    assert [len(b) for b in cli.split_batches(items, 10, 300)] == [2, 2, 1]
+    # 单个超大条目单独成批
+    assert [len(b) for b in cli.split_batches(items, 10, 10)] == [1] * 5
+
+
+def batch_server(advertise=True):
+    """模拟带批量接口的服务端：第一次请求中 'busy' 条目被限速，'broken' 条目失败；收到的批次记入 server.batches"""
+    batches = []
+
+    def analyze_errors(request):
+        ids = [item['id'] for item in request.body['items']]
+        retried = ids == ['busy']
+        batches.append(ids)
+        results = []
+        for item_id in ids:
+            if item_id == 'busy' and not retried:
+                results.append({'id': item_id, 'status': 429, 'detail': 'busy', 'retry_after': 0})
+            elif item_id == 'broken':
+                results.append({'id': item_id, 'status': 500, 'detail': 'Analysis failed'})
+            elif item_id == 'unsure':
+                results.append({'id': item_id, 'status': 200, 'suggestion': 'UNCERTAIN'})
+            else:
+                results.append({'id': item_id, 'status': 200, 'suggestion': GOOD})
+        return 200, {'batch_id': 'b', 'results': results}
+
+    routes = {('POST', '/analyze_error'): lambda request: (200, {'suggestion': GOOD}),
+              ('POST', '/analyze_errors'): analyze_errors}
+    if advertise:
+        routes[('GET', '/capabilities')] = lambda request: (
+            200, {'batch': {'path': 'analyze_errors', 'max_items': 2, 'max_bytes': 1024 * 1024}})
+    server = StubServer(routes)
+    server.batches = batches
+    return server
+
+
+def test_client_batches_and_retries_only_rejected_items():
+    server = batch_server()
+    try:
+        contexts = {'ok': 'ERROR: one', 'busy': 'ERROR: two', 'broken': 'ERROR: three', 'unsure': 'ERROR: four'}
+        suggestions = cli.get_ai_suggestions(contexts, server.url, timeout=5)
+        assert suggestions == {'ok': GOOD, 'busy': GOOD, 'broken': None, 'unsure': None}
+        # 服务端每批最多 2 条；第二轮只重试被限速的条目
+        assert server.batches == [['ok', 'busy'], ['broken', 'unsure'], ['busy']]
+        assert '/analyze_error' not in server.paths()
+    finally:
+        server.close()
+
+
+def test_client_falls_back_without_batch_api():
+    server = batch_server(advertise=False)
+    try:
+        assert cli.get_ai_suggestions({1: 'ERROR: one', 2: 'ERROR: two'}, server.url, timeout=5) == {1: GOOD, 2: GOOD}
+        assert server.paths() == ['/capabilities', '/analyze_error', '/analyze_error']
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    test_duplicates_share_one_analysis_and_failures_stay_per_item()
+    test_split_batches()
+    test_client_batches_and_retries_only_rejected_items()
+    test_client_falls_back_without_batch_api()
+    print("[成功] 批量分析测试通过")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+测试压测工具：负载生成、模拟上游的故障注入与前缀缓存计费，以及小规模的完整压测
+"""
+import os
+import sys
+import tempfile
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bench')))
+
+import cluster
+import payload_compression
+import loadtest
+import profiles
+from mock_llm import MockLLM, UNCERTAIN, upstream_cost
+from workload import Workload, parse_size_mix
+
+
+def test_workload_sizes_and_repeats():
+    mix = parse_size_mix('small=0.5:1024,large=0.5:32768')
+    assert mix == {'small': (0.5, 1024), 'large': (0.5, 32768)}
+    items = Workload(mix, repeat_rate=0.5, seed=1).batch(200)
+    repeated = [payload for payload, is_repeat in items if is_repeat]
+    assert 60 < len(repeated) < 140
+    contexts = {payload['error_context'] for payload, _ in items}
+    assert len(contexts) == 200 - len(repeated)
+    sizes = sorted(len(c) for c in contexts)
+    assert sizes[0] >= 1000 and sizes[-1] >= 32000
+    assert all('--- SYSTEM INFO ---' in c for c in contexts)
+    # 相同种子生成相同的负载序列
+    assert Workload(mix, repeat_rate=0.5, seed=1).batch(20) == items[:20]
+
+
+def test_mock_injects_errors_and_timeouts():
+    mock = MockLLM(latency=0, error_rate=0.5, timeout_rate=0.2, hang=5, uncertain_rate=0, seed=3).start()
+    try:
+        statuses = []
+        for _ in range(30):
+            try:
+                statuses.append(requests.post(f"{mock.base_url}/chat/completions",
+                                              json={'messages': [{'role': 'user', 'content': 'x'}]}, timeout=0.3).status_code)
+            except requests.exceptions.Timeout:
+                statuses.append('timeout')
+        counts = mock.snapshot()
+        assert counts['calls'] == 30
+        assert statuses.count(500) == counts['errors'] and statuses.count('timeout') == counts['timeouts']
+        assert statuses.count(200) == 30 - counts['errors'] - counts['timeouts'] > 0
+        # 健康探测不计入调用数
+        requests.post(f"{mock.base_url}/chat/completions", json={'messages': [], 'max_tokens': 1}, timeout=1)
+        assert mock.snapshot()['calls'] == 30 and mock.snapshot()['probes'] == 1
+        assert mock.answer([{'content': 'a'}]) == mock.answer([{'content': 'a'}]) != UNCERTAIN
+    finally:
+        mock.close()
+
+
+def test_mock_prefix_cache_usage():
+    mock = MockLLM(latency=0, cache_unit=4)
+    static = {'role': 'system', 'content': 'x' * 200}
+    first = mock.usage([static, {'role': 'user', 'content': 'log one'}], 'answer')
+    second = mock.usage([static, {'role': 'user', 'content': 'log two'}], 'answer')
+    # 第一次全部未命中；第二次共同的前缀按 4 个 token 一个单位命中
+    assert first['prompt_cache_hit_tokens'] == 0
+    assert 48 <= second['prompt_cache_hit_tokens'] <= second['prompt_tokens'] - 2
+    # 静态部分放在日志之后时几乎没有共同前缀
+    late = mock.usage([{'role': 'user', 'content': 'log three' + 'x' * 200}], 'answer')
+    assert late['prompt_cache_hit_tokens'] == 0
+    counts = {'prompt_tokens': 1000000, 'cached_tokens': 500000, 'completion_tokens': 0}
+    assert abs(upstream_cost(counts, {'input': 2.0, 'cached_input': 0.5, 'output': 8.0}) - 1.25) < 1e-9
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [loadtest.percentile(values, p) for p in (50, 90, 99)] == [50, 90, 99]
+    assert loadtest.percentile([0.5], 99) == 0.5
+    assert loadtest.percentile([], 50) is None
+
+
+def test_small_run_saves_results():
+    with tempfile.TemporaryDirectory() as output:
+        result = loadtest.main(['--concurrency', '4', '--requests', '12', '--latency', '0.01', '--jitter', '0',
+                                '--repeat-rate', '0.5', '--output', output, '--label', 'smoke'])
+        level = result['levels'][0]
+        assert level['requests'] == 12 and level['status'] == {'200': 12}
+        # 重复的请求由缓存或合并的上游调用回答，上游调用数少于请求数
+        assert 0 < level['upstream']['calls'] < 12
+        assert level['latency']['p50'] <= level['latency']['p99'] and level['time_to_ready'] > 0
+        assert [name for name in os.listdir(output) if name.endswith('-smoke.json')]
+
+
+def test_compression_benchmark():
+    result = payload_compression.main(['--samples', '20', '--encodings', 'identity,gzip', '--output', ''])
+    overall = result['results']['all']
+    assert overall['identity']['requests'] == overall['gzip']['requests'] == 20
+    assert overall['identity']['ratio'] == 1.0 and overall['gzip']['ratio'] > 3
+    assert overall['gzip']['wire_bytes'] < overall['identity']['wire_bytes']
+    assert overall['gzip']['ingest_ms']['p50'] > 0
+
+
+def test_cluster_run_survives_node_failure():
+    result = cluster.main(['--nodes', '2', '--requests', '16', '--concurrency', '4', '--latency', '0.01',
+                           '--jitter', '0', '--repeat-rate', '0.5', '--modes', 'cluster', '--fail-node', '--output', ''])
+    run = result['modes'][0]
+    # 停止一个节点后它的指纹改由另一个节点负责，请求仍然全部成功
+    assert run['status'] == {'200': 16} and 0 <= run['failed_node_share'] <= 1
+    assert sum(node['share'] for node in run['nodes']) > 0.99
+
+
+def test_profiles_run_reports_ttft_and_cost():
+    result = profiles.main(['--requests', '6', '--concurrency', '2', '--latency', '0.01', '--jitter', '0',
+                            '--size-mix', 'small=1:1024', '--output', ''])
+    assert [run['profile']['name'] for run in result['profiles']] == ['concise', 'system-aware']
+    for run in result['profiles']:
+        assert run['status'] == {'200': 6} and run['time_to_first_token']['p50'] > 0
+        # 每个配置的静态前缀在第一个请求之后都命中缓存
+        assert run['prompt_cache_hit_rate'] > 0.2 and run['cost_per_request'] > 0
+
+
+if __name__ == "__main__":
+    test_workload_sizes_and_repeats()
+    test_mock_injects_errors_and_timeouts()
+    test_mock_prefix_cache_usage()
+    test_percentile()
+    test_small_run_saves_results()
+    test_compression_benchmark()
+    test_cluster_run_survives_node_failure()
+    test_profiles_run_reports_ttft_and_cost()
+    print("[成功] 压测工具测试通过")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+测试上游流量的录制与回放：请求摘要、普通与流式调用、失败调用、轮流回放与耗时缩放
+"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pip_aide_server.cassette import Cassette, request_key
+from pip_aide_server.router import Backend, UpstreamError
+from upstream_router_test import StubUpstream
+
+GOOD = "```\npip install --upgrade setuptools wheel\n```"
+
+
+def _payload(content, **extra):
+    return dict({'model': 'm', 'messages': [{'role': 'user', 'content': content}], 'temperature': 0.6,
+                 'max_tokens': 150}, **extra)
+
+
+def test_request_key_is_canonical():
+    assert request_key(_payload('a')) == request_key(_payload('a', stream=True))
+    assert request_key(_payload('a')) == request_key(dict(reversed(list(_payload('a').items()))))
+    assert request_key(_payload('a')) != request_key(_payload('b'))
+    assert request_key(_payload('a')) != request_key(dict(_payload('a'), model='other'))
+
+
+def test_record_then_replay():
+    stub = StubUpstream(GOOD, delay=0.2, chunk_size=10, chunk_delay=0.05)
+    broken = StubUpstream('x', status=500)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cassettes', 'upstream.jsonl.gz')
+        recorder = Cassette(path, 'record')
+        backend, failing = Backend('a', stub.base_url, 'm'), Backend('b', broken.base_url, 'm')
+        backend.cassette = failing.cassette = recorder
+        try:
+            assert backend.post(_payload('numpy'))['choices'][0]['message']['content'] == GOOD
+            assert ''.join(backend.stream(_payload('lxml'))) == GOOD
+            try:
+                failing.post(_payload('broken'))
+                raise AssertionError("expected UpstreamError")
+            except UpstreamError:
+                pass
+        finally:
+            recorder.close()
+            stub.close()
+            broken.close()
+        assert recorder.stats()['recorded'] == 3
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f]
+        # 只保存回答与耗时，不保存提示词
+        assert 'numpy' not in json.dumps(entries)
+        assert entries[1]['chunks'][0][1] == GOOD[:10] and entries[1]['chunks'][-1][0] >= 0.2
+        assert 'error' in entries[2]
+
+        # 回放时不访问上游（地址已关闭），按录制的耗时返回
+        player = Cassette(path, 'replay', speed=1.0)
+        offline = Backend('a', stub.base_url, 'm')
+        offline.cassette = player
+        started = time.monotonic()
+        assert offline.post(_payload('numpy'))['choices'][0]['message']['content'] == GOOD
+        assert time.monotonic() - started >= 0.15
+        # 普通调用录制的回答也可以按流式回放，反之亦然
+        assert ''.join(offline.stream(_payload('numpy'))) == GOOD
+        assert offline.post(_payload('lxml', stream=True))['choices'][0]['message']['content'] == GOOD
+        for call in (lambda: offline.post(_payload('broken')), lambda: offline.post(_payload('unknown'))):
+            try:
+                call()
+                raise AssertionError("expected UpstreamError")
+            except UpstreamError:
+                pass
+        assert player.stats()['misses'] == 1 and player.stats()['replayed'] == 4
+
+        # speed 缩放录制时的耗时
+        fast = Cassette(path, 'replay', speed=0.1)
+        offline.cassette = fast
+        started = time.monotonic()
+        assert ''.join(offline.stream(_payload('lxml'))) == GOOD
+        assert time.monotonic() - started < 0.15
+
+
+def test_replays_recordings_in_turn():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'upstream.jsonl')
+        key = request_key(_payload('numpy'))
+        with open(path, 'w', encoding='utf-8') as f:
+            for answer in ('first', 'second'):
+                f.write(json.dumps({'key': key, 'model': 'm', 'latency': 0.5, 'content': answer}) + '\n')
+            f.write('{"key": "trunc')
+        player = Cassette(path, 'replay', speed=0)
+        backend = Backend('a', 'http://127.0.0.1:9', 'm')
+        backend.cassette = player
+        answers = [backend.post(_payload('numpy'))['choices'][0]['message']['content'] for _ in range(3)]
+        assert answers == ['first', 'second', 'first']
+        assert player.stats()['recordings'] == 2
+
+
+if __name__ == "__main__":
+    test_request_key_is_canonical()
+    test_record_then_replay()
+    test_replays_recordings_in_turn()
+    print("[成功] 上游录制与回放测试通过")
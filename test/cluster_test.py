@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+测试集群模式：一致性哈希的均衡与有界的重新分配、不可达节点的跳过与恢复、转发（含流式）与反馈转交所有者
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from pip_aide_server.admission import AdmissionController, AdmissionRejected
+from pip_aide_server.cluster import Cluster, HashRing, PeerUnavailable
+from pip_aide_server.feedback import FeedbackStore, suggestion_id
+from pip_aide_server.jsonlog import bind_request
+from pip_aide_server.routes import feedback_router
+from stub_server import EventStream, StubServer
+
+GOOD = "```\npip install --upgrade setuptools wheel\n```"
+KEYS = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(4000)]
+
+
+def test_ring_balance_and_bounded_rehash():
+    nodes = [f"http://10.0.0.{i}:8000" for i in range(1, 5)]
+    ring = HashRing(nodes)
+    owners = {key: ring.owner(key) for key in KEYS}
+    for node in nodes:
+        assert 0.15 < sum(1 for o in owners.values() if o == node) / len(KEYS) < 0.35
+    assert abs(sum(ring.shares().values()) - 1) < 1e-9
+    # 节点列表的顺序与末尾的 / 不影响结果
+    assert HashRing([n + '/' for n in reversed(nodes)]).owner(KEYS[0]) == owners[KEYS[0]]
+
+    # 增加一个节点：只有移到新节点的指纹改变所有者，约占 1/5
+    grown = HashRing(nodes + ["http://10.0.0.5:8000"])
+    moved = [key for key in KEYS if grown.owner(key) != owners[key]]
+    assert all(grown.owner(key) == "http://10.0.0.5:8000" for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+    # 去掉（或跳过）一个节点：只有它的指纹改变所有者
+    shrunk = HashRing(nodes[:-1])
+    for key in KEYS:
+        if owners[key] != nodes[-1]:
+            assert shrunk.owner(key) == owners[key] == ring.owner(key, skip={nodes[-1]})
+        else:
+            assert ring.owner(key, skip={nodes[-1]}) == shrunk.owner(key)
+    assert ring.owner(KEYS[0], skip=set(nodes)) is None
+
+
+def peer_server():
+    """模拟所有者节点的内部接口，记录收到的请求头"""
+    def reply(request):
+        text = json.dumps(request.body)
+        if 'busy' in text:
+            return 429, {'detail': 'busy'}, {'Retry-After': '4'}
+        if 'degraded' in text:
+            return 503, {'detail': 'degraded'}, {'Retry-After': '15'}
+        if 'broken' in text:
+            return 500, {'detail': 'boom'}
+        if 'slow' in text:
+            time.sleep(0.5)
+        if request.path == '/cluster/analyze/stream':
+            return EventStream(['event: meta\ndata: {}\n\n', 'event: done\ndata: {"tier": "llm"}\n\n'])
+        if request.path == '/feedback':
+            return 202, {'accepted': True, 'outcome': 'success', 'owner': True}
+        return 200, {'suggestion': GOOD, 'tier': 'cache'}
+
+    return StubServer({}, default=reply)
+
+
+def owned_by(cluster, peer):
+    return next(key for key in KEYS if cluster.owner(key) == peer)
+
+
+def test_forwarding_and_error_mapping():
+    peer = peer_server()
+    cluster = Cluster('http://127.0.0.1:1', [peer.url], token='secret', timeout=0.2)
+    try:
+        async def scenario():
+            bind_request('req-1', 'ci-42')
+            found = await cluster.post(peer.url, '/cluster/analyze', {'error_context': 'ERROR: one'})
+            assert found == {'suggestion': GOOD, 'tier': 'cache'}
+            headers = peer.requests[-1].headers
+            assert headers['X-Cluster-Token'] == 'secret' and headers['X-Request-ID'] == 'req-1'
+            assert headers['X-Correlation-ID'] == 'ci-42' and headers['X-Cluster-Forwarded'] == 'http://127.0.0.1:1'
+
+            chunks = await cluster.stream(peer.url, '/cluster/analyze/stream', {'error_context': 'ERROR: two'})
+            body = b''.join([chunk async for chunk in chunks])
+            assert body.startswith(b'event: meta') and b'event: done' in body
+
+            # 所有者过载或降级时原样告诉客户端；其他错误让调用方改为本地处理
+            try:
+                await cluster.post(peer.url, '/cluster/analyze', {'error_context': 'busy'})
+                raise AssertionError("expected AdmissionRejected")
+            except AdmissionRejected as e:
+                assert e.retry_after == 4
+            try:
+                await cluster.post(peer.url, '/cluster/analyze', {'error_context': 'degraded'})
+                raise AssertionError("expected HTTPException")
+            except HTTPException as e:
+                assert e.status_code == 503 and e.headers['Retry-After'] == '15'
+            try:
+                await cluster.post(peer.url, '/cluster/analyze', {'error_context': 'broken'})
+                raise AssertionError("expected PeerUnavailable")
+            except PeerUnavailable:
+                pass
+            # 所有者正常但这次分析太慢：返回 504，不改为本地处理
+            try:
+                await cluster.post(peer.url, '/cluster/analyze', {'error_context': 'slow'})
+                raise AssertionError("expected HTTPException")
+            except HTTPException as e:
+                assert e.status_code == 504
+
+        asyncio.run(scenario())
+        forwards = cluster.stats()['nodes']
+        assert [n['forwards'] for n in forwards if n['node'] == peer.url] == [
+            {'ok': 2, 'busy': 1, 'unavailable': 1, 'error': 1, 'timeout': 1}]
+        # 以上都不是连接失败，节点仍然可用
+        assert cluster.owner(owned_by(cluster, peer.url)) == peer.url
+    finally:
+        cluster.close()
+        peer.close()
+
+
+def test_unreachable_peer_is_skipped_until_cooldown():
+    peer = peer_server()
+    dead = peer.url
+    peer.close()  # 端口已关闭，连接被拒绝
+    cluster = Cluster('http://127.0.0.1:1', [dead], cooldown=0.3, token='secret')
+    try:
+        key = owned_by(cluster, dead)
+        try:
+            asyncio.run(cluster.post(dead, '/cluster/analyze', {'error_context': 'x'}))
+            raise AssertionError("expected PeerUnavailable")
+        except PeerUnavailable:
+            pass
+        # 不可达期间它的指纹由本节点负责，冷却结束后恢复
+        assert cluster.owner(key) is None
+        assert [n['down_for'] > 0 for n in cluster.stats()['nodes'] if n['node'] == dead] == [True]
+        time.sleep(0.35)
+        assert cluster.owner(key) == dead
+    finally:
+        cluster.close()
+
+
+def test_feedback_goes_to_owner():
+    peer = peer_server()
+    cluster = Cluster('http://127.0.0.1:1', [peer.url], token='secret')
+    store = FeedbackStore()
+    app = FastAPI()
+    app.include_router(feedback_router(store, cluster=cluster))
+    remote = owned_by(cluster, peer.url)
+    local = next(key for key in KEYS if cluster.owner(key) is None)
+    report = {'machine_id': 'm', 'request_id': 'r', 'suggestion_id': suggestion_id(GOOD),
+              'outcomes': [{'command': 'pip install --upgrade setuptools wheel', 'exit_code': 0, 'duration': 1.5}]}
+    try:
+        with TestClient(app) as client:
+            response = client.post('/feedback', json=dict(report, fingerprint=remote))
+            assert response.json()['owner'] is True
+            path, body = peer.requests[-1].path, peer.requests[-1].body
+            assert path == '/feedback' and body['fingerprint'] == remote and body['outcomes'][0]['exit_code'] == 0
+            assert store.stats()['reports'].get('success', 0) == 0
+
+            store.issue('r', 'm', local, suggestion_id(GOOD))
+            assert client.post('/feedback', json=dict(report, fingerprint=local)).status_code == 202
+            # 其他节点转交来的反馈在本节点记录，不再转发；密钥不对时拒绝
+            forwarded = {'X-Cluster-Forwarded': peer.url, 'X-Cluster-Token': 'secret'}
+            store.issue('r-2', 'm', remote, suggestion_id(GOOD))
+            assert client.post('/feedback', json=dict(report, fingerprint=remote, request_id='r-2'),
+                               headers=forwarded).status_code == 202
+            assert store.stats()['reports']['success'] == 2 and len(peer.requests) == 1
+            wrong = dict(forwarded, **{'X-Cluster-Token': 'nope'})
+            assert client.post('/feedback', json=dict(report, fingerprint=remote), headers=wrong).status_code == 403
+    finally:
+        cluster.close()
+        peer.close()
+
+
+def test_cluster_token_is_required():
+    try:
+        Cluster('http://127.0.0.1:1', ['http://127.0.0.1:2'])
+        raise AssertionError("expected ValueError")
+    except ValueError:
+        pass
+    cluster = Cluster('http://127.0.0.1:1', ['http://127.0.0.1:2'], token='secret')
+    store = FeedbackStore()
+    app = FastAPI()
+    app.include_router(feedback_router(store, AdmissionController(client_rate=0.001, client_burst=1), cluster=cluster))
+    local = next(key for key in KEYS if cluster.owner(key) is None)
+    store.issue('r', 'm', local, suggestion_id(GOOD))
+    report = {'machine_id': 'm', 'request_id': 'r', 'fingerprint': local, 'suggestion_id': suggestion_id(GOOD),
+              'outcomes': [{'command': 'pip install --upgrade setuptools wheel', 'exit_code': 0, 'duration': 1.5}]}
+    try:
+        with TestClient(app) as client:
+            # 伪造的转交头：没有密钥或密钥不对时拒绝，不会跳过限速
+            for token in ('', 'nope'):
+                headers = {'X-Cluster-Forwarded': 'http://127.0.0.1:2', 'X-Cluster-Token': token}
+                assert client.post('/feedback', json=report, headers=headers).status_code == 403
+            assert client.post('/feedback', json=report, headers={'X-Cluster-Forwarded': 'x'}).status_code == 403
+            assert client.post('/feedback', json=report).status_code == 202
+            assert client.post('/feedback', json=report).status_code == 429
+            assert store.stats()['reports']['success'] == 1
+    finally:
+        cluster.close()
+
+
+if __name__ == "__main__":
+    test_ring_balance_and_bounded_rehash()
+    test_forwarding_and_error_mapping()
+    test_unreachable_peer_is_skipped_until_cooldown()
+    test_feedback_goes_to_owner()
+    test_cluster_token_is_required()
+    print("[成功] 集群模式测试通过")
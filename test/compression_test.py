@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+测试请求体与响应的压缩：编解码、解压大小上限（解压炸弹）、中间件的状态码与客户端的压缩阈值
+"""
+import json
+import os
+import sys
+import zlib
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from pip_aide import cli
+from pip_aide.compression import (
+    GZIP, ZSTD, DecodedTooLarge, Decoder, InvalidEncodedBody, UnsupportedEncoding, available_encodings,
+    choose_encoding, compress, zstandard,
+)
+from pip_aide_server.ingest import BodySizeLimitMiddleware, ResponseCompressionMiddleware
+
+ERROR_LOG = '\n'.join(f"  gcc -pthread -fPIC -I/tmp/pip-install-x/lxml/include -c src/module{i}.c" for i in range(400))
+
+
+def test_round_trip_and_negotiation():
+    data = ERROR_LOG.encode('utf-8')
+    for encoding in available_encodings():
+        encoded = compress(data, encoding)
+        assert len(encoded) < len(data) / 5
+        decoder = Decoder(encoding, limit=len(data))
+        # 逐字节喂入也能正确解压
+        out = b''.join(decoder.feed(encoded[i:i + 1]) for i in range(len(encoded))) + decoder.finish()
+        assert out == data
+    assert compress(data, GZIP) == compress(data, GZIP)  # 不含时间戳
+
+    assert choose_encoding('gzip, deflate') == GZIP
+    assert choose_encoding('gzip;q=0, deflate') is None
+    assert choose_encoding(['br']) is None
+    assert choose_encoding('zstd, gzip') == (ZSTD if zstandard is not None else GZIP)
+    for call in (lambda: Decoder('br', 10), lambda: compress(data, 'br')):
+        try:
+            call()
+            raise AssertionError("expected UnsupportedEncoding")
+        except UnsupportedEncoding:
+            pass
+
+
+def test_decompression_bomb_stops_early():
+    bomb = compress(b'\0' * (64 * 1024 * 1024), GZIP)
+    decoder = Decoder(GZIP, limit=1024 * 1024)
+    try:
+        decoder.feed(bomb)
+        raise AssertionError("expected DecodedTooLarge")
+    except DecodedTooLarge:
+        pass
+    # 超限即停止，不会先把 64MB 全部解出来
+    assert decoder.size <= 1024 * 1024 + 64 * 1024
+
+    truncated = Decoder(GZIP, limit=1024 * 1024)
+    truncated.feed(compress(b'{"a": 1}', GZIP)[:-4])
+    try:
+        truncated.finish()
+        raise AssertionError("expected InvalidEncodedBody")
+    except InvalidEncodedBody:
+        pass
+
+
+class Body(BaseModel):
+    machine_id: str
+    error_context: str
+
+
+def _app():
+    app = FastAPI()
+    app.add_middleware(BodySizeLimitMiddleware, max_body_bytes=64 * 1024)
+    app.add_middleware(ResponseCompressionMiddleware, min_size=1024, encodings=[GZIP])
+
+    @app.post('/echo')
+    async def echo(data: Body):
+        return {'chars': len(data.error_context), 'context': data.error_context}
+
+    @app.get('/stream')
+    async def stream():
+        return StreamingResponse(iter(['event: delta\ndata: {}\n\n'] * 200), media_type='text/event-stream')
+
+    return app
+
+
+def test_middleware_decodes_requests_and_compresses_responses():
+    body = json.dumps({'machine_id': 'm', 'error_context': ERROR_LOG}).encode('utf-8')
+    with TestClient(_app()) as client:
+        gzipped = compress(body, GZIP)
+        response = client.post('/echo', content=gzipped, headers={'Content-Type': 'application/json',
+                                                                  'Content-Encoding': 'gzip'})
+        assert response.status_code == 200 and response.json()['chars'] == len(ERROR_LOG)
+        # 响应按 Accept-Encoding 压缩（TestClient 自动解压）
+        assert response.headers['content-encoding'] == 'gzip'
+        plain = client.post('/echo', content=body, headers={'Content-Type': 'application/json',
+                                                            'Accept-Encoding': 'identity'})
+        assert plain.status_code == 200 and 'content-encoding' not in plain.headers
+        # 流式响应不压缩
+        assert 'content-encoding' not in client.get('/stream').headers
+
+        bomb = compress(json.dumps({'machine_id': 'm', 'error_context': 'x' * 1024 * 1024}).encode(), GZIP)
+        assert len(bomb) < 64 * 1024
+        assert client.post('/echo', content=bomb, headers={'Content-Encoding': 'gzip'}).status_code == 413
+        assert client.post('/echo', content=b'not gzip', headers={'Content-Encoding': 'gzip'}).status_code == 400
+        assert client.post('/echo', content=body, headers={'Content-Encoding': 'br'}).status_code == 415
+
+
+def test_client_compresses_above_threshold():
+    small = {'machine_id': 'm', 'error_context': 'ERROR: boom'}
+    large = {'machine_id': 'm', 'error_context': ERROR_LOG}
+    assert cli.encode_request(small, ['gzip'])[1] == {}
+    # 旧版服务端没有声明支持的编码时不压缩
+    body, headers = cli.encode_request(large, None)
+    assert headers == {} and json.loads(body) == large
+    body, headers = cli.encode_request(large, ['gzip'])
+    assert headers == {'Content-Encoding': 'gzip'}
+    assert json.loads(zlib.decompress(body, 16 + zlib.MAX_WBITS)) == large
+
+
+if __name__ == "__main__":
+    test_round_trip_and_negotiation()
+    test_decompression_bomb_stops_early()
+    test_middleware_decodes_requests_and_compresses_responses()
+    test_client_compresses_above_threshold()
+    print("[成功] 请求与响应压缩测试通过")
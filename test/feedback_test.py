@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+测试修复结果反馈：成功率汇总、跨进程共享、按成功率淘汰缓存、/feedback 接口与客户端回报
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from pip_aide import cli
+from pip_aide_server.admission import AdmissionController
+from pip_aide_server.cache import SuggestionCache
+from pip_aide_server.feedback import ACCEPTED, DUPLICATE, UNKNOWN, FeedbackStore, suggestion_id, summarize_outcomes
+from pip_aide_server.routes import feedback_router
+from stub_server import StubServer
+
+FINGERPRINT = 'a' * 64
+GOOD = "```\npip install --upgrade setuptools wheel\n```"
+BAD = "```\npip install --no-cache-dir numpy\n```"
+
+
+def test_suggestion_id_and_outcomes():
+    # 只看代码块中的命令，说明文字与空白不同不影响
+    assert suggestion_id(GOOD) == suggestion_id("Try this:\n```\npip  install --upgrade setuptools wheel\n```\n")
+    assert suggestion_id(GOOD) != suggestion_id(BAD)
+    assert len(suggestion_id('UNCERTAIN')) == 16
+
+    assert summarize_outcomes([{'exit_code': 0}, {'exit_code': None}]) == 'success'
+    assert summarize_outcomes([{'exit_code': 0}, {'exit_code': 1}]) == 'failure'
+    assert summarize_outcomes([{'exit_code': None}]) == 'skipped'
+
+
+def _report(store, machine_id, suggestion, outcome, duration=0.0, fingerprint=FINGERPRINT):
+    request_id = f'req-{machine_id}-{outcome}-{duration}'
+    store.issue(request_id, machine_id, fingerprint, suggestion_id(suggestion))
+    return store.record(request_id, machine_id, fingerprint, suggestion_id(suggestion), outcome, duration)
+
+
+def test_failing_threshold_and_shared_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        worker_a = FeedbackStore(path, min_reports=3, min_success_rate=0.3, sync_interval=0)
+        worker_b = FeedbackStore(path, min_reports=3, min_success_rate=0.3, sync_interval=0)
+        bad_id = suggestion_id(BAD)
+
+        assert worker_a.success_rate(FINGERPRINT, bad_id) == 0.5
+        assert _report(worker_a, 'm1', BAD, 'failure', 12.0) == ACCEPTED
+        assert _report(worker_b, 'm2', BAD, 'failure', 8.0) == ACCEPTED
+        assert _report(worker_a, 'm3', BAD, 'skipped') == ACCEPTED
+        # 同一台机器再次回报（另一个回答）只替换它之前的结果
+        assert _report(worker_b, 'm2', BAD, 'failure', 9.0) == ACCEPTED
+        # 回报过的机器不足 min_reports 台时不屏蔽
+        assert not worker_a.failing(FINGERPRINT, bad_id)
+        assert _report(worker_b, 'm4', BAD, 'failure', 9.0) == ACCEPTED
+        assert worker_a.failing(FINGERPRINT, bad_id) and worker_b.failing(FINGERPRINT, bad_id)
+        assert worker_a.counts(FINGERPRINT, bad_id) == (0, 3)
+
+        good_id = suggestion_id(GOOD)
+        for machine, outcome in (('m1', 'success'), ('m2', 'success'), ('m3', 'failure')):
+            _report(worker_a, machine, GOOD, outcome, 5.0)
+        assert not worker_b.failing(FINGERPRINT, good_id)
+        assert worker_b.success_rate(FINGERPRINT, good_id) == 0.6
+        assert worker_a.stats()['reports'] == {'success': 2, 'failure': 2, 'skipped': 1}
+        assert worker_a.stats()['persistent_entries'] == 2
+        worker_a.close()
+        worker_b.close()
+
+
+def test_only_issued_answers_count_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        for store, other in ((FeedbackStore(), None),
+                             (FeedbackStore(path, sync_interval=0), FeedbackStore(path, sync_interval=0))):
+            bad_id = suggestion_id(BAD)
+            store.issue('req-1', 'm1', FINGERPRINT, bad_id)
+            # 没有发出过的 request_id、别的客户端、别的指纹或建议都不接受
+            assert store.record('req-x', 'm1', FINGERPRINT, bad_id, 'failure') == UNKNOWN
+            assert store.record('req-1', 'm2', FINGERPRINT, bad_id, 'failure') == UNKNOWN
+            assert store.record('req-1', 'm1', 'b' * 64, bad_id, 'failure') == UNKNOWN
+            assert store.record('req-1', 'm1', FINGERPRINT, suggestion_id(GOOD), 'failure') == UNKNOWN
+            assert store.record('req-1', 'm1', FINGERPRINT, bad_id, 'failure') == ACCEPTED
+            # 同一个回答只记录一次：另一个 worker 收到重复的反馈同样拒绝
+            for _ in range(5):
+                assert (other or store).record('req-1', 'm1', FINGERPRINT, bad_id, 'failure') == DUPLICATE
+            assert store.counts(FINGERPRINT, bad_id) == (0, 1)
+            assert store.stats()['rejected'][UNKNOWN] == 4
+            # 超过 issued_ttl 的回答不再接受反馈
+            store.issued_ttl = 0
+            store.issue('req-2', 'm1', FINGERPRINT, bad_id)
+            assert store.record('req-2', 'm1', FINGERPRINT, bad_id, 'failure') == UNKNOWN
+            store.close()
+            if other is not None:
+                other.close()
+
+
+def test_counts_in_event_loop_do_not_wait_for_sqlite():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        writer, reader = FeedbackStore(path, sync_interval=0), FeedbackStore(path, sync_interval=0)
+        bad_id = suggestion_id(BAD)
+        _report(writer, 'm1', BAD, 'failure')
+
+        async def scenario():
+            # 连接被（例如正在写入的）线程占用时，事件循环中的读取只返回内存层的结果
+            with reader._db_lock:
+                started = time.monotonic()
+                assert reader.counts(FINGERPRINT, bad_id) == (0, 0)
+                assert not reader.failing(FINGERPRINT, bad_id)
+                assert time.monotonic() - started < 0.1
+            # 重新读取在线程中完成，之后的请求读到最新结果
+            for _ in range(100):
+                if reader.counts(FINGERPRINT, bad_id, refresh=False) == (0, 1):
+                    return True
+                await asyncio.sleep(0.01)
+            return False
+
+        assert asyncio.run(scenario())
+        writer.close()
+        reader.close()
+
+
+def test_cache_evicts_low_success_rate_first():
+    feedback = FeedbackStore()
+    cache = SuggestionCache(max_entries=3, rank=feedback.rank)
+    for name in ('bad', 'good-1', 'good-2'):
+        cache.put(name, BAD if name == 'bad' else GOOD)
+    for machine in ('m1', 'm2', 'm3'):
+        _report(feedback, machine, BAD, 'failure', fingerprint='bad')
+        _report(feedback, machine, GOOD, 'success', fingerprint='good-1')
+    # 最久未使用的是 good-1，但 bad 的成功率最低，先被淘汰
+    cache.get('bad')
+    cache.put('new', GOOD)
+    assert cache.get('bad') is None
+    assert cache.get('good-1') == GOOD and cache.get('new') == GOOD
+
+    # 没有 rank 时仍是普通 LRU
+    lru = SuggestionCache(max_entries=1)
+    lru.put('a', GOOD)
+    lru.put('b', GOOD)
+    assert lru.get('a') is None and lru.get('b') == GOOD
+
+
+def test_feedback_endpoint():
+    feedback = FeedbackStore(min_reports=2)
+    app = FastAPI()
+    app.include_router(feedback_router(feedback, AdmissionController(client_rate=1, client_burst=3)))
+    body = {
+        'machine_id': 'm1', 'request_id': 'req-1', 'fingerprint': FINGERPRINT, 'suggestion_id': suggestion_id(BAD),
+        'outcomes': [{'command': 'pip install --no-cache-dir numpy', 'exit_code': 1, 'duration': 30.5}],
+    }
+    feedback.issue('req-1', 'm1', FINGERPRINT, suggestion_id(BAD))
+    feedback.issue('req-2', 'm2', FINGERPRINT, suggestion_id(BAD))
+    with TestClient(app) as client:
+        response = client.post('/feedback', json=body)
+        assert response.status_code == 202 and response.json()['outcome'] == 'failure'
+        assert client.post('/feedback', json=dict(body, fingerprint='../etc')).status_code == 422
+        # 重复回报与不是发给该客户端的回答都不计入
+        assert client.post('/feedback', json=body).status_code == 409
+        assert client.post('/feedback', json=dict(body, machine_id='m2')).status_code == 404
+        assert not feedback.failing(FINGERPRINT, suggestion_id(BAD))
+        assert client.post('/feedback', json=dict(body, machine_id='m2', request_id='req-2')).status_code == 202
+        assert feedback.failing(FINGERPRINT, suggestion_id(BAD))
+        # 同一客户端的反馈同样受限速约束（格式错误与被拒绝的请求也消耗令牌）
+        assert client.post('/feedback', json=body).status_code == 429
+        stats = client.get('/feedback/stats').json()
+        assert stats['reports']['failure'] == 2 and stats['rejected'] == {'duplicate': 1, 'unknown': 1}
+
+
+def test_client_reports_outcomes_in_background():
+    server = StubServer({('POST', '/feedback'): lambda request: (202, {'accepted': True})})
+    try:
+        outcomes = []
+        python = sys.executable
+        fix_applied, _ = cli.attempt_auto_fix([f'{python} -c "import sys; sys.exit(3)"'], True, 'en', outcomes=outcomes)
+        assert not fix_applied
+        assert outcomes[0]['exit_code'] == 3 and outcomes[0]['duration'] >= 0
+
+        feedback_ref = {
+            'url': server.url + '/feedback', 'machine_id': 'm1', 'request_id': 'req-1',
+            'fingerprint': FINGERPRINT, 'suggestion_id': suggestion_id(BAD),
+        }
+        cli.send_fix_feedback(feedback_ref, outcomes).join(5)
+        path, payload = server.requests[0].path, server.requests[0].body
+        assert path == '/feedback' and payload['request_id'] == 'req-1'
+        assert payload['outcomes'][0]['exit_code'] == 3
+        # 没有拿到服务端的反馈信息（例如旧版服务端）时不发送
+        assert cli.send_fix_feedback({}, outcomes) is None
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    test_suggestion_id_and_outcomes()
+    test_failing_threshold_and_shared_store()
+    test_only_issued_answers_count_once()
+    test_counts_in_event_loop_do_not_wait_for_sqlite()
+    test_cache_evicts_low_success_rate_first()
+    test_feedback_endpoint()
+    test_client_reports_outcomes_in_background()
+    print("[成功] 修复结果反馈测试通过")
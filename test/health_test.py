@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+测试非阻塞启动：后台探测上游、/healthz 与 /readyz、降级模式下的过期缓存
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from pip_aide_server.cache import SuggestionCache
+from pip_aide_server.cascade import CascadeTier, ModelCascade
+from pip_aide_server.router import Backend, UpstreamRouter
+from pip_aide_server.routes import health_router
+from upstream_router_test import StubUpstream
+
+
+def _app(base_url, cache, failure_threshold=3):
+    router = UpstreamRouter([Backend('stub', base_url, 'm', timeout=2)], failure_threshold=failure_threshold,
+                            probe_interval=0.05, cooldown=0.05)
+    cascade = ModelCascade([CascadeTier('default', router)])
+    app = FastAPI()
+    app.include_router(health_router(cascade, cache))
+
+    @app.on_event("startup")
+    async def startup():
+        cascade.start_probing()
+        cache.warm()
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        await cascade.stop_probing()
+
+    return app, cascade
+
+
+def _wait_ready(client, timeout=5, **params):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get('/readyz', params=params)
+        if response.status_code == 200:
+            return response.json()
+        time.sleep(0.01)
+    raise AssertionError(f"not ready: {response.json()}")
+
+
+def test_startup_does_not_wait_for_upstream():
+    # 上游很慢：启动立即完成，探测成功后才就绪
+    slow = StubUpstream('pong', delay=0.3)
+    try:
+        app, _ = _app(slow.base_url, SuggestionCache())
+        started = time.monotonic()
+        with TestClient(app) as client:
+            startup_time = time.monotonic() - started
+            assert startup_time < 0.25
+            assert client.get('/healthz').json() == {'status': 'ok'}
+            assert client.get('/readyz').status_code == 503
+            assert _wait_ready(client) == {'status': 'ready', 'upstream': True, 'cache': True}
+            print(f"startup {startup_time * 1000:.1f} ms, ready after {(time.monotonic() - started) * 1000:.1f} ms")
+    finally:
+        slow.close()
+
+
+def test_unreachable_upstream_is_degraded_not_fatal():
+    broken = StubUpstream('x', status=500)
+    try:
+        app, cascade = _app(broken.base_url, SuggestionCache(), failure_threshold=1)
+        with TestClient(app) as client:
+            body = _wait_ready(client, degraded_ok='true')
+            assert body['status'] == 'degraded' and body['upstream'] is False
+            assert client.get('/readyz').status_code == 503
+            assert client.get('/healthz').status_code == 200
+            assert cascade.degraded()
+    finally:
+        broken.close()
+
+
+def test_stale_suggestions_and_warm_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        cache = SuggestionCache(path, ttl=0.05, negative_ttl=0.05, stale_ttl=60)
+        cache.put('good', "```\npip install --upgrade pip\n```")
+        cache.put('bad', 'UNCERTAIN')
+        time.sleep(0.1)
+        assert cache.get('good') is None
+        # 过期的正常建议在降级模式下仍可返回，负结果不会
+        assert cache.get_stale('good') == "```\npip install --upgrade pip\n```"
+        assert cache.get_stale('bad') is None
+        assert cache.stats()['stale_hits'] == 1
+        cache.close()
+
+        cache = SuggestionCache(path, ttl=60)
+        cache.put('fresh', 'pip install wheel')
+        cache.close()
+        reopened = SuggestionCache(path, ttl=60)
+        assert not reopened.warmed
+        assert reopened.warm() == 1
+        assert reopened.warmed and reopened.stats()['memory_entries'] == 1
+        reopened.close()
+
+
+if __name__ == "__main__":
+    test_startup_does_not_wait_for_upstream()
+    test_unreachable_upstream_is_degraded_not_fatal()
+    test_stale_suggestions_and_warm_cache()
+    print("[成功] 启动与就绪检查测试通过")
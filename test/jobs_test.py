@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+测试异步任务接口：任务复用、结果保留期、队列上限、长轮询与失败映射，以及客户端自动切换到任务模式
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from pip_aide import cli
+from pip_aide_server.admission import AdmissionRejected
+from pip_aide_server.jobs import DONE, FAILED, QUEUED, JobManager
+from pip_aide_server.routes import capabilities_router, jobs_router
+from stub_server import StubServer
+
+GOOD = "```\npip install --upgrade setuptools wheel\n```"
+
+
+def test_reuses_unfinished_jobs_and_expires_results():
+    async def scenario():
+        jobs = JobManager(workers=1, ttl=0.2, max_wait=1)
+        jobs.start()
+        calls = []
+        release = asyncio.Event()
+
+        async def run():
+            calls.append(1)
+            await release.wait()
+            return {'suggestion': GOOD}
+
+        first = jobs.submit('fp', run)
+        assert jobs.submit('fp', run) is first
+        # 长轮询在任务结束前超时，返回当前状态
+        assert (await jobs.wait(first, 0.05))['status'] in (QUEUED, 'running')
+        release.set()
+        snapshot = await jobs.wait(first, 1)
+        assert snapshot['status'] == DONE and snapshot['result'] == {'suggestion': GOOD}
+        assert calls == [1] and jobs.stats()['reused'] == 1
+        # 结束后的任务在保留期内仍可按 ID 取回
+        assert jobs.get(first.id) is first
+
+        # 直接完成的任务（缓存命中）不进入队列
+        ready = jobs.submit('fp', run, ready={'suggestion': 'cached'})
+        assert ready is not first and ready.snapshot()['result'] == {'suggestion': 'cached'}
+
+        await asyncio.sleep(0.25)
+        assert jobs.get(first.id) is None and jobs.get(ready.id) is None
+        await jobs.stop()
+
+    asyncio.run(scenario())
+
+
+def test_queue_limit_and_failures():
+    async def scenario():
+        jobs = JobManager(workers=1, max_queue=1, max_wait=1)
+        jobs.start()
+        block = asyncio.Event()
+
+        async def slow():
+            await block.wait()
+            return {}
+
+        async def busy():
+            raise AdmissionRejected('queue_full', 3)
+
+        async def broken():
+            raise RuntimeError('boom')
+
+        jobs.submit('a', slow)
+        await asyncio.sleep(0)  # worker 取走第一个任务
+        jobs.submit('b', busy)
+        try:
+            jobs.submit('c', broken)
+            raise AssertionError("expected AdmissionRejected")
+        except AdmissionRejected as e:
+            assert e.reason == 'job_queue_full'
+        block.set()
+        busy_job = jobs.get(jobs._by_key['b'])
+        snapshot = await jobs.wait(busy_job, 1)
+        assert snapshot['status'] == FAILED and snapshot['error']['status'] == 429
+        assert snapshot['error']['retry_after'] == 3
+
+        # 失败的任务不复用
+        broken_job = jobs.submit('b', broken)
+        assert broken_job is not busy_job
+        assert (await jobs.wait(broken_job, 1))['error']['status'] == 500
+        assert jobs.stats()['failed'] == 2 and jobs.stats()['completed'] == 1
+        await jobs.stop()
+
+    asyncio.run(scenario())
+
+
+def test_job_endpoints():
+    app = FastAPI()
+    jobs = JobManager(workers=2, max_wait=0.5)
+    app.include_router(jobs_router(jobs))
+    app.include_router(capabilities_router({'jobs': {'path': 'jobs', 'max_wait': 0.5}}))
+
+    @app.on_event("startup")
+    async def startup():
+        jobs.start()
+
+    @app.post('/jobs', status_code=202)
+    async def submit(delay: float = 0.0):
+        async def run():
+            await asyncio.sleep(delay)
+            return {'suggestion': GOOD}
+        return jobs.submit(f'fp-{delay}', run).snapshot()
+
+    with TestClient(app) as client:
+        assert client.get('/capabilities').json()['jobs']['path'] == 'jobs'
+        job_id = client.post('/jobs', params={'delay': 0.3}).json()['job_id']
+        # 不等待时立即返回当前状态；带 wait 时等到任务结束
+        assert client.get(f'/jobs/{job_id}').json()['status'] != DONE
+        assert client.get(f'/jobs/{job_id}', params={'wait': 5}).json()['result']['suggestion'] == GOOD
+        assert client.get('/jobs/unknown').status_code == 404
+        stats = client.get('/jobs/stats').json()
+        assert stats['jobs'][DONE] == 1 and stats['submitted'] == 1
+
+
+def job_server(advertise=True):
+    """模拟支持任务接口的服务端：提交后第一次轮询返回 404（例如任务已过期），客户端应重新提交"""
+    submits = []
+
+    def submit(request):
+        assert 'error_context' in request.body
+        submits.append(request.body)
+        return 202, {'job_id': f'job-{len(submits)}', 'status': QUEUED}
+
+    routes = {
+        ('POST', '/jobs'): submit,
+        ('POST', '/analyze_error'): lambda request: (200, {'suggestion': GOOD}),
+        ('GET', '/jobs/job-1'): lambda request: (404, {'detail': 'Unknown or expired job'}),
+        ('GET', '/jobs/job-2'): lambda request: (200, {'job_id': 'job-2', 'status': DONE, 'result': {
+            'suggestion': GOOD, 'request_id': 'r', 'fingerprint': 'f' * 64, 'suggestion_id': 's' * 16}}),
+    }
+    if advertise:
+        routes[('GET', '/capabilities')] = lambda request: (200, {'jobs': {'path': 'jobs', 'max_wait': 1}})
+    return StubServer(routes)
+
+
+def test_client_switches_to_job_mode():
+    server = job_server()
+    try:
+        feedback_ref = {}
+        started = time.monotonic()
+        assert cli.get_ai_suggestion('ERROR: boom', server.url, timeout=5, feedback_ref=feedback_ref) == GOOD
+        assert time.monotonic() - started < 5
+        paths = [(request.method, request.path) for request in server.requests]
+        assert paths == [('GET', '/capabilities'), ('POST', '/jobs'), ('GET', '/jobs/job-1'),
+                         ('POST', '/jobs'), ('GET', '/jobs/job-2')]
+        # 长轮询等待时间不超过服务端声明的上限
+        assert float(server.requests[2].query['wait'][0]) == 1
+        assert feedback_ref['url'] == server.url + '/feedback'
+    finally:
+        server.close()
+
+
+def test_client_falls_back_without_job_api():
+    server = job_server(advertise=False)
+    try:
+        assert cli.get_ai_suggestion('ERROR: boom', server.url, timeout=5) == GOOD
+        assert server.paths() == ['/capabilities', '/analyze_error']
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    test_reuses_unfinished_jobs_and_expires_results()
+    test_queue_limit_and_failures()
+    test_job_endpoints()
+    test_client_switches_to_job_mode()
+    test_client_falls_back_without_job_api()
+    print("[成功] 异步任务接口测试通过")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+测试结构化日志：JSON 字段、请求上下文、按 request_id 采样与队列满时丢弃
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import queue
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server import jsonlog
+
+
+def _records(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_context_fields_and_sampling():
+    stream = io.StringIO()
+    log = jsonlog.setup_logging('DEBUG', sample_rate=0.5, stream=stream)
+    try:
+        async def handle(request_id):
+            jsonlog.bind_request(request_id, jsonlog.clean_correlation_id('ci-job-42\n"'))
+            log.info("Cache hit", extra={'fingerprint': 'abc'})
+            # 在子 task 中记录的日志同样带有请求上下文
+            await asyncio.ensure_future(asyncio.sleep(0))
+            await asyncio.ensure_future(_detail())
+
+        async def _detail():
+            jsonlog.get_logger('upstream').debug("Prompt built", extra={'prompt_tokens': 10})
+
+        async def main():
+            await asyncio.gather(*(handle(f"req-{i}") for i in range(200)))
+
+        asyncio.run(main())
+    finally:
+        jsonlog.shutdown_logging()
+
+    records = _records(stream)
+    info = [r for r in records if r['level'] == 'INFO']
+    debug = [r for r in records if r['level'] == 'DEBUG']
+    assert len(info) == 200
+    assert info[0]['msg'] == 'Cache hit' and info[0]['fingerprint'] == 'abc'
+    assert info[0]['correlation_id'] == 'ci-job-42"'
+    assert {r['request_id'] for r in info} == {f"req-{i}" for i in range(200)}
+    # 约一半的请求保留了 DEBUG 细节，且细节与所属请求对应
+    assert 50 < len(debug) < 150
+    assert all(r['logger'] == 'pipai.upstream' and r['prompt_tokens'] == 10 for r in debug)
+
+
+def test_level_control_and_drops():
+    stream = io.StringIO()
+    log = jsonlog.setup_logging('WARNING', stream=stream)
+    try:
+        log.info("hidden")
+        log.warning("shown", extra={'reason': 'queue_full'})
+    finally:
+        jsonlog.shutdown_logging()
+    assert [(r['msg'], r['reason']) for r in _records(stream)] == [('shown', 'queue_full')]
+
+    handler = jsonlog.DroppingQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger('pipai.test.drops')
+    logger.propagate = False
+    logger.addHandler(handler)
+    for i in range(5):
+        logger.warning("record %d", i)
+    assert handler.dropped == 3 and handler.queue.qsize() == 2
+    logger.removeHandler(handler)
+
+
+if __name__ == "__main__":
+    test_context_fields_and_sampling()
+    test_level_control_and_drops()
+    print("[成功] 结构化日志测试通过")
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+测试 pipai_logs 分析索引
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.logindex import LogIndex, main
+
+NUMPY_ERROR = "Command: pip install numpy\nExit Code: 1\nerror: Microsoft Visual C++ 14.0 is required\n  /tmp/pip-install-{tmp}/numpy"
+TYPO_ERROR = "Command: pip install reqeusts\nExit Code: 1\nERROR: No matching distribution found for reqeusts"
+
+
+def _append(path, entries):
+    with open(path, 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def _entry(error_context, machine_id, days_ago=0):
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time() - days_ago * 86400))
+    return {'timestamp': timestamp, 'machine_id': machine_id, 'error_context': error_context}
+
+
+def test_incremental_index_and_queries():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = os.path.join(tmp, 'pipai_logs')
+        index_dir = os.path.join(tmp, 'pipai_index')
+        os.makedirs(log_dir)
+        segment = os.path.join(log_dir, 'segment-20240101T000000-1-0001.jsonl')
+        _append(segment, [_entry(NUMPY_ERROR.format(tmp=f'x{i}abc'), f'm{i % 3}') for i in range(5)])
+        _append(os.path.join(log_dir, '0x1234abcd.log'), [_entry(TYPO_ERROR, 'm9', days_ago=10)])
+
+        index = LogIndex.load(index_dir)
+        assert index.update(log_dir) == 6
+        index.save()
+
+        # 第二次只读取新增的行；写了一半的行留到下次
+        _append(segment, [_entry(TYPO_ERROR, 'm1')])
+        with open(segment, 'a', encoding='utf-8') as f:
+            f.write('{"timestamp": "2024-01-0')
+        index = LogIndex.load(index_dir)
+        assert index.update(log_dir) == 1
+        index.save()
+
+        index = LogIndex.load(index_dir)
+        top = index.top(2)
+        assert [item['count'] for item in top] == [5, 2]
+        assert top[0]['machines'] == 3
+        assert 'Visual C++' in top[0]['label']
+        recent = index.top(5, since=int(time.time()) - 7 * 86400)
+        assert [item['count'] for item in recent] == [5, 1]
+        assert sum(count for _, count in index.trend(bucket='day')) == 7
+
+        assert main(['--log-dir', log_dir, '--index-dir', index_dir, '--json', 'top', '-n', '1']) == 0
+
+
+if __name__ == "__main__":
+    test_incremental_index_and_queries()
+    print("[成功] 日志索引测试通过")
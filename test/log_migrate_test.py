@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+测试旧版本一台机器一个文件的日志迁移：按日期与分片重写、跳过损坏的行、索引不重复计数，以及中断后继续
+"""
+import glob
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server import logmigrate
+from pip_aide_server.logindex import LogIndex
+from pip_aide_server.logwriter import list_segments, shard_of
+from pip_aide_server.similarity import recent_log_records
+
+
+def _legacy_dir(tmp, machines=30):
+    log_dir = os.path.join(tmp, 'pipai_logs')
+    os.makedirs(log_dir)
+    for i in range(machines):
+        with open(os.path.join(log_dir, f'0x{i:08x}.log'), 'w', encoding='utf-8') as f:
+            for day in (1, 2):
+                f.write(json.dumps({'timestamp': f'2024-03-0{day} 12:00:{i % 60:02d}', 'machine_id': f'0x{i:08x}',
+                                    'error_context': f'ERROR: No matching distribution found for pkg{i % 3}'}) + '\n')
+            if i == 0:
+                f.write('not json\n{"timestamp": "2024-03-0')  # 损坏的行与写了一半的行
+    return log_dir
+
+
+def _read_all(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_migrate_rewrites_per_machine_files_into_sharded_segments():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = _legacy_dir(tmp)
+        index_dir = os.path.join(tmp, 'pipai_index')
+        index = LogIndex.load(index_dir)
+        assert index.update(log_dir) == 60
+        index.save()
+
+        dry = logmigrate.migrate(log_dir, shards=4, index_dir=index_dir, dry_run=True)
+        assert (dry['files'], dry['records'], dry['skipped'], dry['days']) == (30, 60, 2, 2)
+        assert len(glob.glob(os.path.join(log_dir, '*.log'))) == 30
+
+        stats = logmigrate.migrate(log_dir, shards=4, index_dir=index_dir)
+        assert (stats['files'], stats['records'], stats['skipped']) == (30, 60, 2)
+        assert glob.glob(os.path.join(log_dir, '*.log')) == []
+        segments = list_segments(log_dir)
+        assert stats['segments'] == len(segments) <= 2 * 4
+        assert sorted(os.listdir(log_dir)) == ['20240301', '20240302']
+        for path in segments:
+            shard = int(os.path.basename(path).split('-')[2][1:])
+            records = _read_all([path])
+            assert {r['timestamp'][:10].replace('-', '') for r in records} == {os.path.basename(os.path.dirname(path))}
+            assert all(shard_of(r['machine_id'], 4) == shard for r in records)
+        assert len(_read_all(segments)) == 60
+        assert recent_log_records(log_dir, 1)[0]['timestamp'].startswith('2024-03-02')
+
+        # 新分段已标记为读取过，再次更新索引不会重复计数
+        index = LogIndex.load(index_dir)
+        assert index.update(log_dir) == 0
+        assert sorted(item['count'] for item in index.top(5)) == [20, 20, 20]
+        assert logmigrate.main(['--log-dir', log_dir, '--index-dir', index_dir]) == 0
+
+
+def test_interrupted_commit_is_finished_on_next_run():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = _legacy_dir(tmp, machines=5)
+        commit = logmigrate._commit
+        remove = os.remove
+
+        def crash_while_deleting(log_dir, journal, index):
+            # 删除第一个旧文件之后中断
+            def failing_remove(path):
+                if path.endswith('.log') and len(glob.glob(os.path.join(log_dir, '*.log'))) < 5:
+                    raise KeyboardInterrupt
+                remove(path)
+            os.remove = failing_remove
+            try:
+                commit(log_dir, journal, index)
+            finally:
+                os.remove = remove
+
+        logmigrate._commit = crash_while_deleting
+        try:
+            logmigrate.migrate(log_dir, shards=2)
+            raise AssertionError("expected the migration to be interrupted")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logmigrate._commit = commit
+        assert os.path.exists(os.path.join(log_dir, logmigrate.JOURNAL_NAME))
+        assert len(glob.glob(os.path.join(log_dir, '*.log'))) == 4
+
+        # 重新运行先按 journal 删除剩余的旧文件，不会再迁移一次
+        stats = logmigrate.migrate(log_dir, shards=2)
+        assert stats['resumed'] and stats['files'] == 0
+        assert not os.path.exists(os.path.join(log_dir, logmigrate.JOURNAL_NAME))
+        assert len(_read_all(list_segments(log_dir))) == 10
+
+
+if __name__ == "__main__":
+    test_migrate_rewrites_per_machine_files_into_sharded_segments()
+    test_interrupted_commit_is_finished_on_next_run()
+    print("[成功] 日志迁移测试通过")
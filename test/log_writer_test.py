@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+测试后台批量日志写入器
+"""
+import glob
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.logwriter import LogWriter, list_segments, shard_of, sort_by_mtime
+
+
+def _read_segments(directory):
+    records = []
+    for path in sorted(glob.glob(os.path.join(directory, '*', 'segment-*'))):
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_close_drains_queue_into_rotated_segments():
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = LogWriter(tmp, batch_size=10, flush_interval=5, segment_bytes=200, compress=True)
+        for i in range(50):
+            assert writer.submit({'machine_id': 'm', 'error_context': f'错误 {i}'})
+        writer.close()
+        records = _read_segments(tmp)
+        assert [r['error_context'] for r in records] == [f'错误 {i}' for i in range(50)]
+        assert len(glob.glob(os.path.join(tmp, '*', 'segment-*.jsonl.gz'))) > 1
+        assert writer.stats()['written'] == 50
+
+
+def test_full_queue_drops_instead_of_blocking():
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = LogWriter(tmp, max_queue=1, batch_size=1, flush_interval=5)
+        entered, release = threading.Event(), threading.Event()
+        write_batch = writer._write_batch
+
+        def slow_disk(batch):
+            entered.set()
+            release.wait()
+            write_batch(batch)
+
+        writer._write_batch = slow_disk
+        assert writer.submit({'n': 1})
+        entered.wait(5)  # 后台线程卡在写盘上
+        assert writer.submit({'n': 2})  # 占满队列
+        assert not writer.submit({'n': 3})
+        assert writer.stats()['dropped'] == 1
+        release.set()
+        writer.close()
+        assert [r['n'] for r in _read_segments(tmp)] == [1, 2]
+
+
+def test_records_are_sharded_by_machine_and_pruned():
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = LogWriter(tmp, batch_size=50, flush_interval=5, shards=4)
+        for i in range(200):
+            writer.submit({'machine_id': f'm{i % 10}', 'n': i})
+        writer.close()
+        segments = list_segments(tmp)
+        # 每个批次的记录按分片写入各自的分段，同一台机器的记录只出现在它的分片中
+        assert 1 < len(segments) <= 4
+        for path in segments:
+            shard = int(os.path.basename(path).split('-')[2][1:])
+            with open(path, encoding='utf-8') as f:
+                machines = {json.loads(line)['machine_id'] for line in f}
+            assert all(shard_of(machine, 4) == shard for machine in machines)
+        assert sorted(r['n'] for r in _read_segments(tmp)) == list(range(200))
+
+    # 旧版本的顶层分段也计入 max_segments
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, 'segment-20240101T000000-1-0001.jsonl')
+        with open(legacy, 'w') as f:
+            f.write('{}\n')
+        os.utime(legacy, (0, 0))
+        writer = LogWriter(tmp, batch_size=1, flush_interval=5, shards=1, max_segments=1)
+        writer.submit({'machine_id': 'm0'})
+        writer.close()
+        assert list_segments(tmp) == [writer.stats()['segment']]
+
+
+def test_prune_keeps_segments_of_other_running_workers():
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    with tempfile.TemporaryDirectory() as tmp:
+        day = os.path.join(tmp, '20240101')
+        os.makedirs(day)
+        # 父进程（pytest 的启动者）仍在运行，视为另一个 worker；子进程已退出
+        running = os.path.join(day, f'segment-20240101T000000-s00-{os.getppid()}-0001.jsonl')
+        dead = os.path.join(day, f'segment-20240101T000000-s00-{exited.pid}-0001.jsonl')
+        for path in (running, dead):
+            with open(path, 'w') as f:
+                f.write('{}\n')
+            os.utime(path, (0, 0))
+        writer = LogWriter(tmp, batch_size=1, flush_interval=5, shards=1, max_segments=1)
+        writer.submit({'machine_id': 'm0'})
+        writer.close()
+        assert sorted(list_segments(tmp)) == sorted([running, writer.stats()['segment']])
+
+
+
+def test_vanished_segments_do_not_fail_writes():
+    with tempfile.TemporaryDirectory() as tmp:
+        kept = os.path.join(tmp, 'segment-20240101T000000-1-0001.jsonl')
+        with open(kept, 'w') as f:
+            f.write('{}\n')
+        # 列出之后被其他 worker 删除的文件直接跳过
+        assert sort_by_mtime([os.path.join(tmp, 'gone.jsonl'), kept]) == [kept]
+
+        def prune():
+            raise FileNotFoundError('segment removed by another worker')
+
+        writer = LogWriter(tmp, batch_size=1, flush_interval=5, shards=1, max_segments=1)
+        writer._prune = prune
+        writer.submit({'machine_id': 'm0', 'n': 1})
+        writer.close()
+        # 清理失败不影响已经打开的新分段，记录照常写入
+        stats = writer.stats()
+        assert (stats['written'], stats['dropped'], stats['write_errors']) == (1, 0, 0)
+
+
+if __name__ == "__main__":
+    test_close_drains_queue_into_rotated_segments()
+    test_full_queue_drops_instead_of_blocking()
+    test_records_are_sharded_by_machine_and_pruned()
+    test_prune_keeps_segments_of_other_running_workers()
+    test_vanished_segments_do_not_fail_writes()
+    print("[成功] 日志写入器测试通过")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+测试客户端的机器标识：跨进程稳定、不暴露安装标识，以及无法保存安装标识时的退化
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from pip_aide import cli
+
+PRINT_ID = "import sys; sys.path.insert(0, sys.argv[1]); from pip_aide import cli; print(cli.get_machine_id())"
+
+
+def _machine_id_in_new_process(home, **env):
+    env = dict({k: v for k, v in os.environ.items() if k != 'PIP_AIDE_MACHINE_ID'},
+               HOME=home, PYTHONHASHSEED='random', **env)
+    result = subprocess.run([sys.executable, '-c', PRINT_ID, ROOT], env=env, capture_output=True, text=True,
+                            timeout=60, check=True)
+    return result.stdout.strip().splitlines()[-1]
+
+
+def test_machine_id_is_stable_across_processes():
+    with tempfile.TemporaryDirectory() as home:
+        first = _machine_id_in_new_process(home)
+        assert first == _machine_id_in_new_process(home)
+        assert len(first) == 16 and int(first, 16) >= 0
+        with open(os.path.join(home, '.config', 'pip-aide', 'install-id'), encoding='utf-8') as f:
+            install_id = f.read().strip()
+        assert len(install_id) == 32 and install_id not in first
+
+        assert _machine_id_in_new_process(home, PIP_AIDE_MACHINE_ID='ci-pool-3') == 'ci-pool-3'
+        # 另一次安装得到不同的标识
+        with tempfile.TemporaryDirectory() as other:
+            assert _machine_id_in_new_process(other) != first
+
+
+def test_install_id_falls_back_when_it_cannot_be_saved():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'install-id')
+        assert cli.load_install_id(path) == cli.load_install_id(path)
+        with open(path, 'w') as f:
+            f.write('garbage')
+        replaced = cli.load_install_id(path)
+        assert replaced and len(replaced) == 32
+        # 父路径是普通文件，无法创建目录
+        assert cli.load_install_id(os.path.join(path, 'install-id')) is None
+        assert not [name for name in os.listdir(tmp) if name.endswith('.tmp')]
+
+
+if __name__ == "__main__":
+    test_machine_id_is_stable_across_processes()
+    test_install_id_falls_back_when_it_cannot_be_saved()
+    print("[成功] 机器标识测试通过")
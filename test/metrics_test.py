@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+测试 Prometheus 指标：文本格式、直方图累计、标签基数上限与回调指标
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.metrics import CallbackMetric, Counter, Gauge, Histogram, MetricsRegistry, suggestion_outcome
+
+
+def test_render_text_format():
+    registry = MetricsRegistry()
+    requests = Counter('test_requests_total', 'Requests', ('endpoint',), registry=registry)
+    in_progress = Gauge('test_in_progress', 'In progress', registry=registry)
+    latency = Histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1), registry=registry)
+
+    requests.labels('/analyze_error').inc()
+    requests.labels('/analyze_error').inc(2)
+    in_progress.inc()
+    in_progress.dec()
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE test_requests_total counter' in lines
+    assert 'test_requests_total{endpoint="/analyze_error"} 3' in lines
+    assert 'test_in_progress 0' in lines
+    # le 为闭区间上界，桶计数是累计的
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_latency_seconds_bucket{le="1"} 3' in lines
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_sum 3.65' in lines
+    assert 'test_latency_seconds_count 4' in lines
+
+
+def test_label_cardinality_is_bounded():
+    registry = MetricsRegistry()
+    counter = Counter('test_by_backend_total', 'By backend', ('backend',), max_series=3, registry=registry)
+    for i in range(10):
+        counter.labels(f'backend-{i}').inc()
+    samples = [line for line in registry.render().splitlines() if not line.startswith('#')]
+    assert len(samples) == 4
+    assert 'test_by_backend_total{backend="other"} 7' in samples
+
+
+def test_callback_metrics_and_escaping():
+    registry = MetricsRegistry()
+    stats = {'rejected': {'queue_full': 2, 'client "x"': 1}}
+    CallbackMetric('test_rejected_total', 'Rejected', lambda: {(k,): v for k, v in stats['rejected'].items()},
+                   ('reason',), type='counter', registry=registry)
+    CallbackMetric('test_broken', 'Raises', lambda: 1 / 0, registry=registry)
+    lines = registry.render().splitlines()
+    assert 'test_rejected_total{reason="queue_full"} 2' in lines
+    assert 'test_rejected_total{reason="client \\"x\\""} 1' in lines
+    assert '# TYPE test_broken gauge' in lines
+
+
+def test_suggestion_outcome():
+    assert suggestion_outcome("```\npip install wheel\n```") == 'ok'
+    assert suggestion_outcome('UNCERTAIN') == 'uncertain'
+    assert suggestion_outcome('UNCERTAIN (API error 500)') == 'error'
+
+
+if __name__ == "__main__":
+    test_render_text_format()
+    test_label_cardinality_is_bounded()
+    test_callback_metrics_and_escaping()
+    test_suggestion_outcome()
+    print("[成功] 指标测试通过")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+测试模型级联的升级条件
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pip_aide import cli
+from pip_aide.safety import extract_code_block_lines
+from pip_aide_server.cascade import assess_suggestion, load_cascade
+from upstream_router_test import StubUpstream
+
+GOOD = "```\npip install --upgrade setuptools wheel\n```"
+
+
+def test_assess_suggestion():
+    assert assess_suggestion(GOOD) is None
+    assert assess_suggestion("UNCERTAIN") == 'uncertain'
+    assert assess_suggestion("Try upgrading setuptools.") == 'no_command'
+    assert assess_suggestion("```\nsudo pip install foo\n```") == 'unsafe'
+    assert assess_suggestion("```\napt-get install libxml2-dev\n```") == 'unsafe'
+    # 与客户端执行前的过滤一致：按原始行检查，缩进的命令在客户端会被过滤掉，因此需要升级
+    for answer in ("```\n  pip install numpy\n```", "```\r\npip install numpy\r\n```", GOOD,
+                   "```\npip install numpy \n\npip install scipy\n```", "```\n\tpip install numpy\n```"):
+        commands = [line for line in extract_code_block_lines(answer) if line.strip()]
+        accepted = cli.parse_and_filter_commands(answer, 'en')
+        assert (assess_suggestion(answer) is None) == (accepted == commands), answer
+    assert assess_suggestion("```\n  pip install numpy\n```") == 'unsafe'
+
+
+def _cascade(fast, strong, fast_deadline=5):
+    spec = json.dumps([
+        {"name": "fast", "base_url": fast.base_url, "model": "cheap", "deadline": fast_deadline},
+        {"name": "strong", "base_url": strong.base_url, "model": "big"},
+    ])
+    return load_cascade(spec, None, 'http://unused', 'DEEPSEEK_API_KEY')
+
+
+def test_cheap_tier_answers_easy_cases():
+    fast, strong = StubUpstream(GOOD), StubUpstream("```\npip install other\n```")
+    try:
+        result = asyncio.run(_cascade(fast, strong).run([]))
+        assert (result.suggestion, result.tier, result.escalations) == (GOOD, 'fast', [])
+        assert strong.calls == 0
+    finally:
+        fast.close()
+        strong.close()
+
+
+def test_escalates_on_uncertain_unsafe_or_slow_answers():
+    strong = StubUpstream(GOOD)
+    for answer, delay, reason in [("UNCERTAIN", 0, 'uncertain'), ("```\nrm -rf build\n```", 0, 'unsafe'), (GOOD, 1.0, 'error')]:
+        fast = StubUpstream(answer, delay=delay)
+        try:
+            result = asyncio.run(_cascade(fast, strong, fast_deadline=0.3).run([]))
+            assert (result.suggestion, result.tier) == (GOOD, 'strong')
+            assert result.escalations == [('fast', reason)]
+        finally:
+            fast.close()
+    strong.close()
+
+
+if __name__ == "__main__":
+    test_assess_suggestion()
+    test_cheap_tier_answers_easy_cases()
+    test_escalates_on_uncertain_unsafe_or_slow_answers()
+    print("[成功] 模型级联测试通过")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+测试按 token 预算构建提示词
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.profiles import PROFILES, PromptProfile, get_profile
+from pip_aide_server.prompt import PromptBuilder, estimate_tokens, fit_error_context
+
+NOISE = "\n".join(f"  copying build/lib/pkg/module_{i}.py -> build/bdist/pkg" for i in range(20000))
+HUGE_CONTEXT = f"""Command: pip install lxml==4.6.3
+Exit Code: 1
+
+--- stdout ---
+Collecting lxml==4.6.3
+{NOISE}
+Building wheel for lxml (setup.py): finished with status 'error'
+  error: command 'gcc' failed: No such file or directory
+  ERROR: Failed building wheel for lxml
+Traceback (most recent call last):
+  File "setup.py", line 12, in <module>
+    import Cython
+ModuleNotFoundError: No module named 'Cython'
+--- stderr ---
+
+--- SYSTEM INFO ---
+python_version: 3.12.1
+os_system: Linux
+"""
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('a' * 400) == 100
+    assert estimate_tokens('中文错误') == 4
+
+
+def test_small_context_is_untouched():
+    context = "Command: pip install foo\nExit Code: 1\nERROR: No matching distribution found for foo"
+    fitted, stats = fit_error_context(context, 1000)
+    assert fitted == context and not stats['truncated']
+
+
+def test_huge_context_keeps_relevant_sections():
+    builder = PromptBuilder(PromptProfile('test', "Answer with pip commands.", "Log:\n"), 'deepseek-chat', budget=1500)
+    messages, stats = builder.build(HUGE_CONTEXT)
+    prompt = messages[-1]['content']
+    assert stats['truncated']
+    assert stats['prompt_tokens'] <= 1500
+    assert sum(estimate_tokens(m['content']) for m in messages) <= 1500
+    for expected in ("Command: pip install lxml==4.6.3", "Failed building wheel for lxml",
+                     "No module named 'Cython'", "python_version: 3.12.1", "lines omitted"):
+        assert expected in prompt, expected
+
+
+def test_profiles_share_a_static_prefix():
+    for profile in PROFILES.values():
+        builder = PromptBuilder(profile, 'deepseek-chat')
+        first, _ = builder.build("ERROR: No matching distribution found for foo")
+        second, stats = builder.build(HUGE_CONTEXT)
+        # 错误日志之前的内容（system 消息与固定前言）与日志无关，日志在最后
+        assert first[0] == second[0] and first[0]['role'] == 'system'
+        assert first[1]['content'].startswith(profile.preamble) and second[1]['content'].startswith(profile.preamble)
+        assert first[1]['content'].endswith("found for foo") and first[1]['content'] == first[-1]['content']
+        assert 'UNCERTAIN' in profile.system and stats['prefix_tokens'] == profile.prefix_tokens
+    try:
+        get_profile('nope')
+        raise AssertionError("expected ValueError")
+    except ValueError as e:
+        assert 'concise' in str(e)
+
+
+if __name__ == "__main__":
+    test_estimate_tokens()
+    test_small_context_is_untouched()
+    test_huge_context_keeps_relevant_sections()
+    test_profiles_share_a_static_prefix()
+    print("[成功] 提示词构建测试通过")
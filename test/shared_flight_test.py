@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+测试多 worker 共享：同一 SQLite 文件上的租约去重与跨进程缓存失效
+（每个 SharedFlight/SuggestionCache 实例各自持有连接，相当于一个 worker）
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.cache import SuggestionCache
+from pip_aide_server.singleflight import SharedFlight
+
+
+async def _workers(path):
+    calls = []
+    workers = [(SharedFlight(path, poll_interval=0.01), SuggestionCache(path)) for _ in range(4)]
+
+    async def handle(flight, cache):
+        async def compute():
+            calls.append(flight.owner)
+            await asyncio.sleep(0.1)
+            await cache.aput('fp', 'pip install --upgrade pip')
+            return 'pip install --upgrade pip'
+        return await flight.run('fp', compute, lambda: cache.aget('fp', count=False))
+
+    results = await asyncio.gather(*(handle(flight, cache) for flight, cache in workers))
+    assert results == ['pip install --upgrade pip'] * 4
+    assert len(calls) == 1
+    assert sum(flight.stats()['remote_hits'] for flight, _ in workers) == 3
+
+    # 持有者失败且没有写入结果时，等待者接手
+    failures = []
+
+    async def failing(flight):
+        async def compute():
+            failures.append(flight.owner)
+            await asyncio.sleep(0.05)
+            raise RuntimeError('upstream rejected')
+        return await flight.run('other', compute, lambda: None)
+
+    async def fallback(flight):
+        await asyncio.sleep(0.01)
+        return await flight.run('other', lambda: asyncio.sleep(0, 'computed'), lambda: None)
+
+    waits = workers[1][0].stats()['waits']
+    outcome = await asyncio.gather(failing(workers[0][0]), fallback(workers[1][0]), return_exceptions=True)
+    assert isinstance(outcome[0], RuntimeError)
+    assert outcome[1] == 'computed'
+    assert workers[1][0].stats()['waits'] == waits + 1
+    for flight, cache in workers:
+        flight.close()
+        cache.close()
+
+
+def test_one_upstream_call_across_workers():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_workers(os.path.join(tmp, 'cache.sqlite3')))
+
+
+def test_expired_lease_is_taken_over():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        crashed, alive = SharedFlight(path, lease_ttl=0.05), SharedFlight(path, lease_ttl=0.05)
+        assert crashed.acquire('fp')  # 持有者崩溃，租约不会被释放
+        assert not alive.acquire('fp')
+        assert asyncio.run(alive.run('fp', lambda: asyncio.sleep(0, 'mine'), lambda: None)) == 'mine'
+        crashed.close()
+        alive.close()
+
+
+def test_lease_is_renewed_while_computing():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        slow, other = SharedFlight(path, lease_ttl=0.1), SharedFlight(path, lease_ttl=0.1)
+        taken = []
+
+        async def compute():
+            # 计算耗时数倍于 lease_ttl，其他 worker 始终取不到租约
+            for _ in range(8):
+                await asyncio.sleep(0.05)
+                taken.append(await asyncio.get_running_loop().run_in_executor(None, other.acquire, 'fp'))
+            return 'slow'
+
+        assert asyncio.run(slow.run('fp', compute, lambda: None)) == 'slow'
+        assert taken == [False] * 8
+        # 计算结束后租约被释放
+        assert other.acquire('fp')
+        slow.close()
+        other.close()
+
+
+async def _acquire_while_locked(path):
+    flight = SharedFlight(path)
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')  # 另一个 worker 正持有写锁
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.ensure_future(ticker())
+    asyncio.get_running_loop().call_later(0.3, other.execute, 'COMMIT')
+    started = time.monotonic()
+    assert await flight.run('fp', lambda: asyncio.sleep(0, 'computed'), lambda: None) == 'computed'
+    # 取得租约需要等待写锁，期间事件循环照常运行
+    assert time.monotonic() - started >= 0.25 and ticks >= 10
+    ticking.cancel()
+    other.close()
+    flight.close()
+
+
+def test_lease_waits_do_not_block_the_event_loop():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_acquire_while_locked(os.path.join(tmp, 'cache.sqlite3')))
+
+
+def test_invalidation_reaches_other_workers():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        first, second = SuggestionCache(path, sync_interval=0), SuggestionCache(path, sync_interval=0)
+        first.put('fp', 'pip install wheel')
+        assert second.get('fp') == 'pip install wheel'  # 进入 second 的内存层
+        assert first.invalidate('fp') == 1
+        assert second.get('fp') is None
+        first.put('fp', 'pip install setuptools')
+        assert second.get('fp') == 'pip install setuptools'
+        first.close()
+        second.close()
+
+
+if __name__ == "__main__":
+    test_one_upstream_call_across_workers()
+    test_expired_lease_is_taken_over()
+    test_lease_is_renewed_while_computing()
+    test_lease_waits_do_not_block_the_event_loop()
+    test_invalidation_reaches_other_workers()
+    print("[成功] 多 worker 共享测试通过")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+测试相似检索：MinHash 相似度估计、LSH 候选、环境与失败包名的隔离、淘汰与日志回填
+"""
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.fingerprint import error_fingerprint
+from pip_aide_server.similarity import (
+    SimilarityIndex, failed_packages, is_known_good, recent_log_records, shingles, similarity, sketch,
+)
+
+SYSTEM_INFO = "\n--- SYSTEM INFO ---\npython_version: 3.11.4\nos_system: Linux\n"
+
+
+def build_log(package='numpy', compiler='gcc-11.2', tmp='/tmp/pip-install-abc123'):
+    lines = [f"Collecting {package}", "error: subprocess-exited-with-error"]
+    lines += [f"compiling {tmp}/{package}/src/module{i}.c with flags -O{i % 3} -DNPY_{i}" for i in range(40)]
+    lines += [f"{compiler} failed with exit code 1", f"ERROR: Failed building wheel for {package}"]
+    return '\n'.join(lines) + '\n'
+
+
+def test_sketch_estimates_jaccard():
+    a, b = shingles(build_log()), shingles(build_log(compiler='gcc-11.4'))
+    jaccard = len(a & b) / len(a | b)
+    estimate = similarity(sketch(a), sketch(b))
+    assert abs(estimate - jaccard) < 0.1
+    assert similarity(sketch(a), sketch(a)) == 1.0
+    unrelated = shingles("ERROR: No matching distribution found for pandas==9.9")
+    assert similarity(sketch(a), sketch(unrelated)) < 0.1
+    assert sketch(set()) is None
+    # 临时目录等易变内容先规整，不影响相似度
+    assert shingles(build_log(tmp='/tmp/pip-install-zzz999')) == a
+
+
+def test_query_matches_near_duplicates_only():
+    index = SimilarityIndex(threshold=0.8)
+    original = build_log() + SYSTEM_INFO
+    assert index.add('fp-numpy', original)
+    assert not index.add('fp-numpy', original)
+
+    matches = index.query(build_log(compiler='gcc-11.4') + SYSTEM_INFO)
+    assert [fp for _, fp in matches] == ['fp-numpy'] and matches[0][0] >= 0.8
+    # 失败的包或 Python 版本不同则不复用
+    assert index.query(build_log(package='scipy') + SYSTEM_INFO) == []
+    assert index.query(build_log(compiler='gcc-11.4') + SYSTEM_INFO.replace('3.11.4', '3.12.1')) == []
+    # accept 拒绝的候选（例如缓存已失效）被跳过
+    assert index.query(original, accept=lambda fp: False) == []
+    assert index.query(original, exclude='fp-numpy') == []
+    assert index.stats()['matches'] == 1
+
+    index.discard('fp-numpy')
+    assert len(index) == 0 and index.query(original) == []
+
+    disabled = SimilarityIndex(threshold=0)
+    assert not disabled.add('fp', original) and disabled.query(original) == []
+
+
+def test_eviction_keeps_buckets_consistent():
+    index = SimilarityIndex(threshold=0.8, max_entries=2)
+    for name in ('numpy', 'scipy', 'pandas'):
+        index.add(f'fp-{name}', build_log(package=name) + SYSTEM_INFO)
+    assert len(index) == 2
+    assert index.query(build_log(package='numpy') + SYSTEM_INFO) == []
+    assert index.query(build_log(package='pandas') + SYSTEM_INFO)[0][1] == 'fp-pandas'
+    assert all(fp != 'fp-numpy' for band in index._buckets for bucket in band.values() for fp in bucket)
+
+
+def test_bootstrap_from_log_segments():
+    good = build_log() + SYSTEM_INFO
+    bad = build_log(package='scipy') + SYSTEM_INFO
+    with tempfile.TemporaryDirectory() as log_dir:
+        with open(os.path.join(log_dir, 'segment-000001.jsonl'), 'w') as f:
+            for context in (good, bad, good):
+                f.write(json.dumps({'machine_id': 'm', 'error_context': context}) + '\n')
+            f.write('{"truncated"')
+        records = recent_log_records(log_dir, 10)
+        assert len(records) == 3
+
+        known = {error_fingerprint(good)}
+        index = SimilarityIndex(threshold=0.8)
+        assert index.add_records(records, lambda fp: fp in known) == 1
+        assert index.query(build_log(compiler='gcc-11.4') + SYSTEM_INFO)[0][1] == error_fingerprint(good)
+
+
+def test_helpers():
+    assert failed_packages("ERROR: Failed building wheel for PyYAML\nFailed to build pyyaml") == ['pyyaml']
+    assert failed_packages("Could not find a version that satisfies the requirement Foo_Bar==1.0") == ['foo-bar']
+    assert is_known_good("```\npip install --upgrade setuptools\n```")
+    assert not is_known_good('UNCERTAIN')
+    assert not is_known_good(None)
+
+
+if __name__ == "__main__":
+    test_sketch_estimates_jaccard()
+    test_query_matches_near_duplicates_only()
+    test_eviction_keeps_buckets_consistent()
+    test_bootstrap_from_log_segments()
+    test_helpers()
+    print("[成功] 相似检索测试通过")
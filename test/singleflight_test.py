@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+测试并发去重与幂等键
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.singleflight import SingleFlight, IdempotencyRegistry
+
+
+async def _coalesce():
+    flights = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "```\npip install --upgrade pip\n```"
+
+    tasks = [flights.run('same-fingerprint', upstream) for _ in range(20)]
+    results = await asyncio.gather(*(asyncio.shield(t) for t in tasks))
+    assert len(calls) == 1
+    assert len(set(results)) == 1
+    assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'followers': 19}
+
+
+async def _idempotent_retry():
+    flights = SingleFlight()
+    registry = IdempotencyRegistry(ttl=60)
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        return 'UNCERTAIN'
+
+    task = flights.run('fp', upstream)
+    registry.register('key-1', task)
+    # 第一个请求超时断开，不影响原始计算
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout=0.01)
+    except asyncio.TimeoutError:
+        pass
+    retry = registry.get('key-1')
+    assert retry is task
+    assert await asyncio.shield(retry) == 'UNCERTAIN'
+    assert registry.get('other-key') is None
+
+
+def test_concurrent_requests_share_one_call():
+    asyncio.run(_coalesce())
+
+
+def test_retry_attaches_to_original_computation():
+    asyncio.run(_idempotent_retry())
+
+
+if __name__ == "__main__":
+    test_concurrent_requests_share_one_call()
+    test_retry_attaches_to_original_computation()
+    print("[成功] 并发去重测试通过")
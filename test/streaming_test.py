@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+测试流式回答：增量解析代码块、上游与级联的流式调用、事件广播与客户端的 SSE 解析与回退
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pip_aide import cli
+from pip_aide.safety import CommandStreamParser, extract_code_block_lines
+from pip_aide_server.router import Backend, UpstreamError, UpstreamRouter
+from pip_aide_server.streaming import Broadcast, StreamTimer, sse_event
+from model_cascade_test import GOOD, _cascade
+from stub_server import EventStream, StubServer
+from upstream_router_test import StubUpstream
+
+ANSWER = "Upgrade the build tools first:\n```bash\npip install --upgrade setuptools wheel\npip install numpy\n```\nDone."
+
+
+def _feed_in_pieces(text, size):
+    parser = CommandStreamParser()
+    lines = []
+    for i in range(0, len(text), size):
+        lines += parser.feed(text[i:i + size])
+    return lines + parser.close()
+
+
+def test_parser_matches_batch_extraction():
+    samples = [ANSWER, GOOD, "UNCERTAIN", "```\npip install a\n", "  ```\npip install b\n```", "no fence\npip install c\n"]
+    for text in samples:
+        for size in (1, 3, 8, len(text)):
+            assert _feed_in_pieces(text, size) == extract_code_block_lines(text), (text, size)
+
+    # 命令行在换行到达时立即给出，不必等代码块结束
+    parser = CommandStreamParser()
+    assert parser.feed("```\npip install --upgrade setuptools") == []
+    assert parser.feed(" wheel\npip ins") == ['pip install --upgrade setuptools wheel']
+    parser.reset()
+    assert parser.feed("```\npip install numpy\n") == ['pip install numpy']
+
+
+def test_router_streams_and_fails_over_before_first_chunk():
+    broken, good = StubUpstream('x', status=500), StubUpstream(ANSWER, chunk_size=5)
+    try:
+        router = UpstreamRouter([Backend('broken', broken.base_url, 'm'), Backend('good', good.base_url, 'm')],
+                                probe_interval=0)
+
+        async def collect():
+            return [chunk async for chunk in router.stream([])]
+
+        chunks = asyncio.run(collect())
+        assert ''.join(chunks) == ANSWER and len(chunks) > 1
+        assert broken.calls == 1 and good.calls == 1
+
+        only_broken = UpstreamRouter([Backend('broken', broken.base_url, 'm')], probe_interval=0)
+        try:
+            asyncio.run(only_broken.stream([]).__anext__())
+            raise AssertionError("expected UpstreamError")
+        except UpstreamError:
+            pass
+    finally:
+        broken.close()
+        good.close()
+
+
+def test_cascade_stream_resets_on_escalation():
+    fast, strong = StubUpstream("UNCERTAIN", chunk_size=3), StubUpstream(GOOD, chunk_size=4)
+    try:
+        events = []
+        result = asyncio.run(_cascade(fast, strong).stream([], lambda kind, value: events.append((kind, value))))
+        assert (result.suggestion, result.tier, result.escalations) == (GOOD, 'strong', [('fast', 'uncertain')])
+        reset = events.index(('reset', 'uncertain'))
+        assert ''.join(value for kind, value in events[:reset] if kind == 'delta') == "UNCERTAIN"
+        assert ''.join(value for kind, value in events[reset + 1:] if kind == 'delta') == GOOD
+        # 每一级开始作答时标明是否为最后一级
+        assert [value for kind, value in events if kind == 'tier'] == [{'name': 'fast', 'final': False},
+                                                                       {'name': 'strong', 'final': True}]
+    finally:
+        fast.close()
+        strong.close()
+
+
+def test_broadcast_replays_to_late_subscribers():
+    async def scenario():
+        broadcast = Broadcast()
+
+        async def consume():
+            return [event async for event in broadcast.subscribe()]
+
+        early = asyncio.ensure_future(consume())
+        broadcast.publish('delta', 'pip ')
+        await asyncio.sleep(0)
+        late = asyncio.ensure_future(consume())
+        broadcast.publish('delta', 'install')
+        await asyncio.sleep(0.01)
+        broadcast.close()
+        return await early, await late
+
+    early, late = asyncio.run(scenario())
+    assert early == late == [('delta', 'pip '), ('delta', 'install')]
+
+    timer = StreamTimer()
+    timer.delta("```\nrm -rf /\n")
+    assert timer.first_token is not None and timer.first_command is None
+    timer.reset()
+    timer.delta("```\npip install numpy\n")
+    assert timer.first_command is not None
+    assert sse_event('delta', {'text': '安装'}) == 'event: delta\ndata: {"text": "安装"}\n\n'
+
+
+def _sse_server(events, chunk_delay=0.0):
+    """按预设事件回应 /analyze_error/stream 的本地服务；events 为 None 时返回 404（旧版服务端）"""
+    routes = {('POST', '/analyze_error'): lambda request: (200, {'suggestion': GOOD})}
+    if events is not None:
+        routes[('POST', '/analyze_error/stream')] = lambda request: EventStream(
+            [sse_event(event, data) for event, data in events], delay=chunk_delay)
+    server = StubServer(routes)
+    server.url += '/analyze_error'
+    return server
+
+
+def test_client_starts_first_command_before_done():
+    deltas = [ANSWER[i:i + 6] for i in range(0, len(ANSWER), 6)]
+    done = {'suggestion': ANSWER, 'request_id': 'req-1', 'fingerprint': 'f' * 64, 'suggestion_id': 'abc'}
+    # 较便宜的一级给出的命令之后被作废，不能提前执行
+    events = [('meta', {'request_id': 'req-1'}), ('tier', {'name': 'fast', 'final': False}),
+              ('delta', {'text': '```\npip install numpy==0.1\n'}), ('reset', {'reason': 'unsafe'}),
+              ('tier', {'name': 'strong', 'final': True})]
+    events += [('delta', {'text': d}) for d in deltas] + [('done', done)]
+    server = _sse_server(events, chunk_delay=0.01)
+    try:
+        commands, done_seen = [], []
+
+        def on_command(command):
+            # 命令出现时 done 事件尚未到达
+            commands.append(command)
+            done_seen.append(bool(feedback_ref))
+
+        feedback_ref = {}
+        suggestion = cli.get_ai_suggestion_stream('ERROR: boom', server.url, timeout=5,
+                                                  feedback_ref=feedback_ref, on_command=on_command)
+        assert suggestion == ANSWER
+        assert commands == ['pip install --upgrade setuptools wheel', 'pip install numpy']
+        assert done_seen == [False, False]
+        assert feedback_ref['url'].endswith('/feedback') and feedback_ref['request_id'] == 'req-1'
+        assert [r.path for r in server.requests if r.method == 'POST'] == ['/analyze_error/stream']
+    finally:
+        server.close()
+
+    # 命令原样交出（保留缩进与 \r），与 parse_and_filter_commands 检查、取用的是同一个字符串
+    raw = "```\r\n  pip install numpy\r\npip install scipy \r\n```\r\n"
+    done = {'suggestion': raw, 'request_id': 'req-2', 'fingerprint': 'f' * 64, 'suggestion_id': 'abc'}
+    server = _sse_server([('tier', {'name': 'default', 'final': True}), ('delta', {'text': raw}), ('done', done)])
+    try:
+        commands = []
+        assert cli.get_ai_suggestion_stream('ERROR: boom', server.url, timeout=5, on_command=commands.append) == raw
+        assert commands == extract_code_block_lines(raw) == ['  pip install numpy\r', 'pip install scipy \r']
+        assert not cli.check_command(commands[0], verbose=False)
+        assert cli.parse_and_filter_commands(raw, 'en') == [commands[1]]
+    finally:
+        server.close()
+
+
+def test_client_falls_back_without_streaming_endpoint():
+    for events in (None, [('error', {'status': 429, 'detail': 'busy', 'retry_after': 1})], [('delta', {'text': 'x'})]):
+        server = _sse_server(events)
+        try:
+            try:
+                cli.get_ai_suggestion_stream('ERROR: boom', server.url, timeout=5)
+                raise AssertionError("expected StreamingUnavailable")
+            except cli.StreamingUnavailable:
+                pass
+            assert cli.request_suggestion('ERROR: boom', server.url, 5, 'en', stream=True) == GOOD
+            assert server.requests[-1].path == '/analyze_error'
+        finally:
+            server.close()
+
+    lines = ['event: delta', 'data: {"text": "a"}', '', ': keep-alive', 'data: {"x":', 'data:  1}', '']
+    assert list(cli.iter_sse_events(lines)) == [('delta', {'text': 'a'}), ('message', {'x': 1})]
+
+
+if __name__ == "__main__":
+    test_parser_matches_batch_extraction()
+    test_router_streams_and_fails_over_before_first_chunk()
+    test_cascade_stream_resets_on_escalation()
+    test_broadcast_replays_to_late_subscribers()
+    test_client_starts_first_command_before_done()
+    test_client_falls_back_without_streaming_endpoint()
+    print("[成功] 流式回答测试通过")
@@ -0,0 +1,85 @@
+"""
+测试共用的本地 HTTP 桩服务：按 (方法, 路径) 查路由表，每个测试只需给出各路由的处理函数
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# query 为 parse_qs 的结果；body 为解析后的 JSON，没有请求体时为 None
+StubRequest = namedtuple('StubRequest', 'method path query headers body')
+
+
+class EventStream:
+    """处理函数返回它时，以 text/event-stream 逐段写出 chunks，每段之后等待 delay 秒"""
+
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+
+
+class StubServer:
+    """
+    routes: {('GET' 或 'POST', 路径): handler}；handler(request) 返回 (状态码, JSON)、
+    (状态码, JSON, 响应头) 或 EventStream。没有对应路由时交给 default，没有 default 时返回 404。
+    收到的请求按顺序记入 requests。
+    """
+
+    def __init__(self, routes, default=None):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                request = StubRequest(method, url.path, parse_qs(url.query), dict(self.headers), body)
+                stub.requests.append(request)
+                handler = routes.get((method, url.path), default)
+                reply = handler(request) if handler is not None else (404, {'detail': 'Not Found'})
+                if isinstance(reply, EventStream):
+                    self._stream(reply)
+                else:
+                    self._json(*reply)
+
+            def _json(self, status, data, headers=None):
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, reply):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for chunk in reply.chunks:
+                    self.wfile.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+                    self.wfile.flush()
+                    time.sleep(reply.delay)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def paths(self):
+        return [request.path for request in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
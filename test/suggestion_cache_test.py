@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+测试服务端错误指纹与建议缓存
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.cache import SuggestionCache
+from pip_aide_server.fingerprint import error_fingerprint, normalize_error_log
+
+ERROR_A = """Command: pip install numpy==1.19.5
+Exit Code: 1
+  Building wheel for numpy (pyproject.toml) ... error
+  error: subprocess-exited-with-error
+  File "/tmp/pip-install-k2j3h4g5/numpy_1a2b3c/setup.py", line 12
+  Created temporary directory: /home/alice/.cache/pip/wheels/3f/4b/8c1e2d9a7b6c5d4e3f2a1b0c9d8e7f6a
+  2024-05-01 12:30:45 compile failed
+
+--- SYSTEM INFO ---
+python_version: 3.11.7
+os_system: Linux
+os_version: #1 SMP PREEMPT_DYNAMIC Tue May 7
+machine_type: x86_64
+"""
+
+ERROR_B = ERROR_A.replace('k2j3h4g5', 'zz99yy88').replace('alice', 'bob') \
+    .replace('3f/4b/8c1e2d9a7b6c5d4e3f2a1b0c9d8e7f6a', '1a/2b/ffee00112233445566778899aabbccdd') \
+    .replace('2024-05-01 12:30:45', '2025-01-09 08:00:01').replace('3.11.7', '3.11.9') \
+    .replace('Tue May 7', 'Wed Jun 12')
+
+
+def test_fingerprint_ignores_volatile_data():
+    assert error_fingerprint(ERROR_A) == error_fingerprint(ERROR_B)
+    normalized = normalize_error_log(ERROR_A)
+    assert 'alice' not in normalized and 'k2j3h4g5' not in normalized
+
+
+def test_fingerprint_keeps_relevant_profile():
+    assert error_fingerprint(ERROR_A) != error_fingerprint(ERROR_A.replace('3.11.7', '3.8.10'))
+    assert error_fingerprint(ERROR_A) != error_fingerprint(ERROR_A.replace('numpy==1.19.5', 'scipy==1.5.0'))
+
+
+def test_cache_persists_and_expires():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'cache.sqlite3')
+        cache = SuggestionCache(path, max_entries=1, ttl=60, negative_ttl=0.05)
+        cache.put('good', '```\npip install --upgrade setuptools\n```')
+        cache.put('bad', 'UNCERTAIN (API error 500)')
+        time.sleep(0.1)
+        assert cache.get('bad') is None
+        cache.close()
+
+        reopened = SuggestionCache(path, max_entries=1)
+        assert reopened.get('good').startswith('```')
+        assert reopened.stats()['hits'] == 1
+        assert reopened.invalidate('good') == 1
+        assert reopened.get('good') is None
+        assert reopened.stats()['hit_ratio'] == 0.5
+        reopened.close()
+
+
+async def _write_while_locked(path):
+    cache = SuggestionCache(path)
+    await cache.aput('warm', 'pip install wheel')
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')  # 另一个 worker 正持有写锁
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticking = asyncio.ensure_future(ticker())
+    asyncio.get_running_loop().call_later(0.3, other.execute, 'COMMIT')
+    started = time.monotonic()
+    await cache.aput('fp', 'pip install --upgrade pip')
+    # SQLite 写入等待写锁期间事件循环照常运行，内存层的查询也不受影响
+    assert time.monotonic() - started >= 0.25 and ticks >= 10
+    assert await cache.aget('warm') == 'pip install wheel'
+    ticking.cancel()
+    other.close()
+    cache.close()
+
+    reopened = SuggestionCache(path)
+    assert await reopened.aget('fp') == 'pip install --upgrade pip'
+    assert await reopened.aget_stale('fp') == 'pip install --upgrade pip'
+    assert await reopened.ainvalidate('fp') == 1
+    assert await reopened.aget('fp') is None
+    assert (await reopened.astats())['persistent_entries'] == 1
+    reopened.close()
+
+
+def test_async_access_does_not_block_the_event_loop():
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(_write_while_locked(os.path.join(tmp, 'cache.sqlite3')))
+
+
+if __name__ == "__main__":
+    test_fingerprint_ignores_volatile_data()
+    test_fingerprint_keeps_relevant_profile()
+    test_cache_persists_and_expires()
+    test_async_access_does_not_block_the_event_loop()
+    print("[成功] 缓存测试通过")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+用本地桩上游测试多上游路由：选择、对冲、故障转移与熔断
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pip_aide_server.router import Backend, UpstreamError, UpstreamRouter, OPEN, CLOSED
+
+
+class StubUpstream:
+    """本地 chat completions 桩服务，可配置延迟与状态码；请求 stream=true 时按 chunk_size 个字符分段返回 SSE"""
+
+    def __init__(self, answer, delay=0.0, status=200, chunk_size=8, chunk_delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.status = status
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                stub.calls += 1
+                time.sleep(stub.delay)
+                if request.get('stream') and stub.status == 200:
+                    # 与真实上游一样使用分块传输，客户端才能逐段读取
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/event-stream')
+                    self.send_header('Transfer-Encoding', 'chunked')
+                    self.end_headers()
+                    events = [{"choices": [{"delta": {"content": stub.answer[i:i + stub.chunk_size]}}]}
+                              for i in range(0, len(stub.answer), stub.chunk_size)]
+                    for i, event in enumerate(events):
+                        if i:
+                            time.sleep(stub.chunk_delay)
+                        self._write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                    return
+                body = json.dumps({"choices": [{"message": {"content": stub.answer}}]}).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        Handler.protocol_version = 'HTTP/1.1'
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _content(result):
+    data, backend = result
+    return data['choices'][0]['message']['content'], backend.name
+
+
+def test_routes_to_fastest_and_hedges_slow_calls():
+    fast, slow = StubUpstream('fast', delay=0.01), StubUpstream('slow', delay=0.5)
+    try:
+        router = UpstreamRouter([Backend('slow', slow.base_url, 'm'), Backend('fast', fast.base_url, 'm')],
+                                min_hedge_delay=0.05, default_hedge_delay=0.05)
+        # 两个上游都还没有延迟数据时，先选到慢的那个也会被对冲
+        answers = [asyncio.run(router.complete([])) for _ in range(3)]
+        assert all(_content(a) == ('fast', 'fast') for a in answers)
+        assert router.ranked()[0].name == 'fast'
+    finally:
+        fast.close()
+        slow.close()
+
+
+def test_failover_and_circuit_breaker():
+    broken, healthy = StubUpstream('x', status=500), StubUpstream('ok')
+    try:
+        router = UpstreamRouter([Backend('broken', broken.base_url, 'm', weight=100), Backend('healthy', healthy.base_url, 'm')],
+                                failure_threshold=2, cooldown=0.2)
+        for _ in range(2):
+            assert _content(asyncio.run(router.complete([]))) == ('ok', 'healthy')
+        assert router.backends[0].state == OPEN
+        calls = broken.calls
+        asyncio.run(router.complete([]))
+        assert broken.calls == calls  # 熔断期间不再调用
+
+        broken.status = 200
+        time.sleep(0.25)
+        assert asyncio.run(router.probe(router.backends[0]))
+        assert router.backends[0].state == CLOSED
+    finally:
+        broken.close()
+        healthy.close()
+
+
+def test_all_backends_failing_raises():
+    broken = StubUpstream('x', status=503)
+    try:
+        router = UpstreamRouter([Backend('broken', broken.base_url, 'm')], failure_threshold=1, cooldown=60)
+        for _ in range(2):
+            try:
+                asyncio.run(router.complete([]))
+                assert False, "expected UpstreamError"
+            except UpstreamError as e:
+                assert 'API error 503' in str(e) or 'circuit open' in str(e)
+        assert broken.calls == 1
+    finally:
+        broken.close()
+
+
+if __name__ == "__main__":
+    test_routes_to_fastest_and_hedges_slow_calls()
+    test_failover_and_circuit_breaker()
+    test_all_backends_failing_raises()
+    print("[成功] 上游路由测试通过")